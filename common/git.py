@@ -0,0 +1,387 @@
+"""
+Read only git plumbing that doesn't fork git: refs, config, objects and the refs of a
+remote. Anything that writes to a repo still goes through git itself.
+"""
+import os
+import re
+import struct
+import subprocess
+import zlib
+from typing import Dict, List, Optional, Tuple
+
+import requests
+
+LS_REMOTE_TIMEOUT = 30
+
+OBJ_TYPES = {1: 'commit', 2: 'tree', 3: 'blob', 4: 'tag'}
+OBJ_OFS_DELTA = 6
+OBJ_REF_DELTA = 7
+
+
+class GitError(Exception):
+  pass
+
+
+def pkt_line(data: bytes) -> bytes:
+  return b"%04x" % (len(data) + 4) + data
+
+
+def read_pkt_lines(data: bytes) -> List[Optional[bytes]]:
+  """Payloads of the pkt-lines, None for flush and delimiter packets"""
+  lines: List[Optional[bytes]] = []
+  i = 0
+  while i + 4 <= len(data):
+    n = int(data[i:i + 4], 16)
+    if n < 4:
+      lines.append(None)
+      i += 4
+    else:
+      lines.append(data[i + 4:i + n])
+      i += n
+  return lines
+
+
+def read_varint(data: bytes, i: int) -> Tuple[int, int]:
+  n = shift = 0
+  while True:
+    c = data[i]
+    i += 1
+    n |= (c & 0x7f) << shift
+    shift += 7
+    if not c & 0x80:
+      return n, i
+
+
+def apply_delta(base: bytes, delta: bytes) -> bytes:
+  _, i = read_varint(delta, 0)
+  size, i = read_varint(delta, i)
+  out = bytearray()
+  while i < len(delta):
+    op = delta[i]
+    i += 1
+    if op & 0x80:
+      # copy from the base
+      offset = length = 0
+      for b in range(4):
+        if op & (1 << b):
+          offset |= delta[i] << (8 * b)
+          i += 1
+      for b in range(3):
+        if op & (1 << (4 + b)):
+          length |= delta[i] << (8 * b)
+          i += 1
+      out += base[offset:offset + (length or 0x10000)]
+    elif op:
+      # insert
+      out += delta[i:i + op]
+      i += op
+    else:
+      raise GitError("invalid delta")
+  if len(out) != size:
+    raise GitError("delta size mismatch")
+  return bytes(out)
+
+
+class Pack:
+  """A pack with a version 2 index"""
+  def __init__(self, idx_fn: str) -> None:
+    with open(idx_fn, 'rb') as f:
+      self.idx = f.read()
+    if self.idx[:8] != b"\377tOc\x00\x00\x00\x02":
+      raise GitError(f"unsupported pack index {idx_fn}")
+
+    self.fanout = struct.unpack(">256I", self.idx[8:8 + 1024])
+    n = self.fanout[255]
+    self.shas = 8 + 1024
+    self.offsets = self.shas + 24 * n
+    self.large_offsets = self.offsets + 4 * n
+    self.pack_fn = idx_fn[:-4] + ".pack"
+
+  def find(self, sha: bytes) -> Optional[int]:
+    lo, hi = self.fanout[sha[0] - 1] if sha[0] else 0, self.fanout[sha[0]]
+    while lo < hi:
+      mid = (lo + hi) // 2
+      cur = self.idx[self.shas + 20 * mid:self.shas + 20 * mid + 20]
+      if cur == sha:
+        offset: int = struct.unpack(">I", self.idx[self.offsets + 4 * mid:self.offsets + 4 * mid + 4])[0]
+        if offset & 0x80000000:
+          i = self.large_offsets + 8 * (offset & 0x7fffffff)
+          offset = struct.unpack(">Q", self.idx[i:i + 8])[0]
+        return offset
+      elif cur < sha:
+        lo = mid + 1
+      else:
+        hi = mid
+    return None
+
+  def read(self, offset: int, repo: 'GitRepo') -> Tuple[str, bytes]:
+    with open(self.pack_fn, 'rb') as f:
+      f.seek(offset)
+      header = f.read(32)
+
+      c = header[0]
+      obj_type, i = (c >> 4) & 7, 1
+      while c & 0x80:
+        c = header[i]
+        i += 1
+
+      base = None
+      if obj_type == OBJ_OFS_DELTA:
+        c = header[i]
+        i += 1
+        base_offset = c & 0x7f
+        while c & 0x80:
+          c = header[i]
+          i += 1
+          base_offset = ((base_offset + 1) << 7) | (c & 0x7f)
+        base = self.read(offset - base_offset, repo)
+      elif obj_type == OBJ_REF_DELTA:
+        base = repo.read_object(header[i:i + 20].hex())
+        i += 20
+
+      f.seek(offset + i)
+      d = zlib.decompressobj()
+      data = bytearray()
+      while not d.eof:
+        buf = f.read(64 * 1024)
+        if not buf:
+          raise GitError(f"truncated pack {self.pack_fn}")
+        data += d.decompress(buf)
+
+    if base is not None:
+      return base[0], apply_delta(base[1], bytes(data))
+    return OBJ_TYPES[obj_type], bytes(data)
+
+
+class GitRepo:
+  def __init__(self, path: str) -> None:
+    self.path = path
+    git_dir = os.path.join(path, ".git")
+    if os.path.isfile(git_dir):
+      # submodules and worktrees point to their git dir
+      with open(git_dir) as f:
+        git_dir = os.path.join(path, f.read().strip().split("gitdir:", 1)[1].strip())
+    elif not os.path.isdir(git_dir):
+      git_dir = path
+    self.git_dir = os.path.normpath(git_dir)
+
+    self.common_dir = self.git_dir
+    commondir_fn = os.path.join(self.git_dir, "commondir")
+    if os.path.isfile(commondir_fn):
+      with open(commondir_fn) as f:
+        self.common_dir = os.path.normpath(os.path.join(self.git_dir, f.read().strip()))
+
+    if not os.path.isfile(os.path.join(self.git_dir, "HEAD")):
+      raise GitError(f"not a git repository: {path}")
+
+    self._packs: Dict[str, Pack] = {}
+
+  def packed_refs(self) -> Dict[str, str]:
+    refs = {}
+    try:
+      with open(os.path.join(self.common_dir, "packed-refs")) as f:
+        for line in f:
+          if line.startswith(('#', '^')):
+            continue
+          sha, _, name = line.strip().partition(' ')
+          refs[name] = sha
+    except FileNotFoundError:
+      pass
+    return refs
+
+  def read_symbolic_ref(self, ref: str) -> Optional[str]:
+    """What a symbolic ref points to, None if it isn't one"""
+    try:
+      with open(os.path.join(self.git_dir, ref)) as f:
+        content = f.read().strip()
+    except (FileNotFoundError, IsADirectoryError):
+      return None
+    return content[5:] if content.startswith("ref: ") else None
+
+  def resolve(self, ref: str) -> Optional[str]:
+    # git's limit for nested symbolic refs
+    for _ in range(5):
+      base = self.git_dir if ref == "HEAD" else self.common_dir
+      try:
+        with open(os.path.join(base, ref)) as f:
+          content = f.read().strip()
+      except (FileNotFoundError, IsADirectoryError, NotADirectoryError):
+        return self.packed_refs().get(ref)
+      if not content.startswith("ref: "):
+        return content
+      ref = content[5:]
+    return None
+
+  def rev_parse(self, ref: str = "HEAD") -> str:
+    """Commit of HEAD, a full ref name or a branch"""
+    candidates = [ref] if ref == "HEAD" or ref.startswith("refs/") else [f"refs/heads/{ref}", f"refs/tags/{ref}", f"refs/remotes/{ref}"]
+    for r in candidates:
+      if (sha := self.resolve(r)) is not None:
+        return sha
+    if re.fullmatch(r"[0-9a-f]{40}", ref):
+      return ref
+    raise GitError(f"unknown revision {ref} in {self.path}")
+
+  def branch(self) -> str:
+    """Same as git rev-parse --abbrev-ref HEAD"""
+    head = self.read_symbolic_ref("HEAD")
+    if head is None:
+      return "HEAD"
+    return head[len("refs/heads/"):] if head.startswith("refs/heads/") else head
+
+  def refs(self, prefix: str = "refs/") -> Dict[str, str]:
+    refs = {name: sha for name, sha in self.packed_refs().items() if name.startswith(prefix)}
+    for root, _, files in os.walk(os.path.join(self.common_dir, "refs")):
+      for fn in files:
+        name = os.path.relpath(os.path.join(root, fn), self.common_dir).replace(os.sep, "/")
+        if name.startswith(prefix) and (sha := self.resolve(name)) is not None:
+          refs[name] = sha
+    return refs
+
+  def config(self) -> Dict[str, str]:
+    """Flat config as section[.subsection].key, section and key names lower case"""
+    config = {}
+    section = ""
+    try:
+      with open(os.path.join(self.common_dir, "config")) as f:
+        for line in f:
+          line = line.strip()
+          if not line or line[0] in "#;":
+            continue
+          m = re.fullmatch(r'\[\s*([\w.-]+)(?:\s+"(.*)")?\s*\]', line)
+          if m is not None:
+            section = m.group(1).lower() + ("" if m.group(2) is None else f".{m.group(2)}")
+            continue
+          key, eq, value = line.partition("=")
+          value = value.strip()
+          if len(value) >= 2 and value[0] == value[-1] == '"':
+            value = value[1:-1]
+          config[f"{section}.{key.strip().lower()}"] = value if eq else "true"
+    except FileNotFoundError:
+      pass
+    return config
+
+  def packs(self) -> List[Pack]:
+    pack_dir = os.path.join(self.common_dir, "objects", "pack")
+    try:
+      idx_fns = [fn for fn in os.listdir(pack_dir) if fn.endswith(".idx")]
+    except FileNotFoundError:
+      return []
+    for fn in idx_fns:
+      if fn not in self._packs:
+        self._packs[fn] = Pack(os.path.join(pack_dir, fn))
+    return [self._packs[fn] for fn in idx_fns]
+
+  def read_object(self, sha: str) -> Tuple[str, bytes]:
+    """Type and contents of an object"""
+    try:
+      with open(os.path.join(self.common_dir, "objects", sha[:2], sha[2:]), 'rb') as f:
+        raw = zlib.decompress(f.read())
+      header, _, data = raw.partition(b"\x00")
+      return header.split(b" ")[0].decode(), data
+    except FileNotFoundError:
+      pass
+
+    sha_bytes = bytes.fromhex(sha)
+    for pack in self.packs():
+      if (offset := pack.find(sha_bytes)) is not None:
+        return pack.read(offset, self)
+    raise GitError(f"object {sha} not found in {self.path}")
+
+  def commit_time(self, ref: str = "HEAD") -> int:
+    """Committer timestamp, same as git show -s --format=%ct"""
+    obj_type, data = self.read_object(self.rev_parse(ref))
+    if obj_type != 'commit':
+      raise GitError(f"{ref} is a {obj_type}, not a commit")
+    for line in data.split(b"\n"):
+      if line.startswith(b"committer "):
+        return int(line.split(b" ")[-2])
+    raise GitError(f"commit {ref} has no committer")
+
+  def remote_url(self, remote: str = "origin") -> str:
+    url = self.config().get(f"remote.{remote}.url")
+    if url is None:
+      raise GitError(f"no remote {remote} in {self.path}")
+    return url
+
+
+def ls_remote_http(url: str) -> Dict[str, str]:
+  """Smart HTTP, protocol version 2 if the server has it"""
+  headers = {'Git-Protocol': 'version=2', 'User-Agent': 'git/openpilot'}
+  with requests.Session() as s:
+    r = s.get(f"{url.rstrip('/')}/info/refs", params={'service': 'git-upload-pack'}, headers=headers, timeout=LS_REMOTE_TIMEOUT)
+    r.raise_for_status()
+    lines = read_pkt_lines(r.content)
+    if lines and lines[0] is not None and lines[0].startswith(b"# service="):
+      lines = lines[2:]
+
+    if lines and lines[0] == b"version 2\n":
+      body = pkt_line(b"command=ls-refs\n") + b"0001" + pkt_line(b"ref-prefix HEAD\n") + pkt_line(b"ref-prefix refs/heads/\n") + b"0000"
+      r = s.post(f"{url.rstrip('/')}/git-upload-pack", data=body, timeout=LS_REMOTE_TIMEOUT,
+                 headers={**headers, 'Content-Type': 'application/x-git-upload-pack-request'})
+      r.raise_for_status()
+      lines = read_pkt_lines(r.content)
+
+  refs = {}
+  for line in lines:
+    if not line:
+      continue
+    # version 0 has capabilities after the first ref, version 2 attributes after the name
+    sha, name = line.split(b"\x00")[0].rstrip(b"\n").split(b" ")[:2]
+    refs[name.decode()] = sha.decode()
+  return refs
+
+
+def ls_remote(repo: GitRepo, remote: str = "origin") -> Dict[str, str]:
+  """HEAD and branches of a remote, like git ls-remote. Raises GitError if it can't be reached"""
+  url = repo.remote_url(remote)
+  try:
+    if url.startswith(("http://", "https://")):
+      return ls_remote_http(url)
+
+    path = url[len("file://"):] if url.startswith("file://") else url
+    path = os.path.join(repo.path, path)
+    if os.path.isdir(path):
+      remote_repo = GitRepo(path)
+      refs = remote_repo.refs("refs/heads/")
+      head = remote_repo.resolve("HEAD")
+      if head is not None:
+        refs["HEAD"] = head
+      return refs
+
+    # ssh and anything else
+    out = subprocess.check_output(["git", "ls-remote", remote], cwd=repo.path, stderr=subprocess.STDOUT, encoding='utf8')
+    return {name: sha for sha, name in (line.split() for line in out.splitlines() if line.strip())}
+  except (requests.exceptions.RequestException, subprocess.CalledProcessError, OSError) as e:
+    raise GitError(f"ls-remote {remote} failed: {e}") from e
+
+
+class GitDirWatcher:
+  """
+  Whether anything in a git dir changed since a time, like find -newer. The first check
+  walks the whole tree, later ones only stat its directories and top level files, since git
+  replaces files by renaming them into place.
+  """
+  def __init__(self, path: str) -> None:
+    self.path = path
+    self.dirs: List[str] = []
+
+  def newer_than(self, t: float) -> bool:
+    if not self.dirs:
+      newer = False
+      for root, dirs, files in os.walk(self.path):
+        self.dirs.append(root)
+        if not newer:
+          newer = any(os.lstat(os.path.join(root, fn)).st_mtime > t for fn in [*dirs, *files])
+      newer = newer or os.lstat(self.path).st_mtime > t
+    else:
+      try:
+        newer = any(os.stat(d).st_mtime > t for d in self.dirs)
+        newer = newer or any(e.stat(follow_symlinks=False).st_mtime > t for e in os.scandir(self.path))
+      except FileNotFoundError:
+        newer = True
+
+    if newer:
+      # new directories only show up in a full walk
+      self.dirs = []
+    return newer
@@ -44,10 +44,15 @@ class SwagFormatter(logging.Formatter):
       except (ValueError, TypeError):
         record_dict['msg'] = [record.msg]+record.args
 
-    record_dict['ctx'] = self.swaglogger.get_ctx()
+    # records handed off to another thread carry a snapshot of the (thread local) context
+    ctx = getattr(record, 'swag_ctx', None)
+    record_dict['ctx'] = ctx if ctx is not None else self.swaglogger.get_ctx()
 
     if record.exc_info:
       record_dict['exc_info'] = self.formatException(record.exc_info)
+    elif record.exc_text:
+      # already formatted before the record was handed off
+      record_dict['exc_info'] = record.exc_text
 
     record_dict['level'] = record.levelname
     record_dict['levelnum'] = record.levelno
@@ -100,7 +105,10 @@ class SwagLogFileFormatter(SwagFormatter):
       v = json.loads(record)
     else:
       v = self.format_dict(record)
+    return self.format_from_dict(v)
 
+  def format_from_dict(self, v):
+    # NOTE: modifies v in place
     mk, mv = self.fix_kv('msg', v['msg'])
     del v['msg']
     v[mk] = mv
@@ -1,9 +1,261 @@
-from common.params_pyx import Params, ParamKeyType, UnknownKeyName, put_nonblocking, put_bool_nonblocking # pylint: disable=no-name-in-module, import-error
+import ctypes
+import os
+import struct
+import threading
+import traceback
+import weakref
+from collections import defaultdict
+from typing import Callable, Dict, List, Optional, Tuple, Union
+
+from common.params_pyx import Params, ParamKeyType, UnknownKeyName # pylint: disable=no-name-in-module, import-error
 assert Params
 assert ParamKeyType
 assert UnknownKeyName
-assert put_nonblocking
-assert put_bool_nonblocking
+
+IN_MODIFY = 0x2
+IN_CLOSE_WRITE = 0x8
+IN_MOVED_FROM = 0x40
+IN_MOVED_TO = 0x80
+IN_CREATE = 0x100
+IN_DELETE = 0x200
+IN_DELETE_SELF = 0x400
+IN_MOVE_SELF = 0x800
+IN_Q_OVERFLOW = 0x4000
+IN_IGNORED = 0x8000
+IN_CLOEXEC = 0o2000000
+IN_EVENT = struct.Struct('iIII')
+
+PARAMS_WATCH_MASK = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF
+
+
+class ParamsWatcher:
+  """
+  Watches a params directory with inotify and tells its listeners which keys changed.
+  A key of None means everything might have changed (queue overflow, directory removed).
+  """
+  def __init__(self, path: str):
+    self.path = path
+    self.listeners: List[weakref.WeakMethod] = []
+    self.lock = threading.Lock()
+    self.active = False
+
+    try:
+      libc = ctypes.CDLL(None, use_errno=True)
+      self.fd = libc.inotify_init1(IN_CLOEXEC)
+      if self.fd < 0 or libc.inotify_add_watch(self.fd, path.encode(), PARAMS_WATCH_MASK) < 0:
+        return
+    except AttributeError:
+      # no inotify on this platform
+      return
+
+    self.active = True
+    self.thread = threading.Thread(target=self.watcher_thread, name="params_watcher", daemon=True)
+    self.thread.start()
+
+  def add_listener(self, fn: Callable[[Optional[str]], None]) -> None:
+    with self.lock:
+      self.listeners.append(weakref.WeakMethod(fn))
+
+  def notify(self, key: Optional[str]) -> None:
+    with self.lock:
+      self.listeners = [l for l in self.listeners if l() is not None]
+      listeners = [l() for l in self.listeners]
+
+    for fn in listeners:
+      try:
+        fn(key)  # type: ignore
+      except Exception:
+        traceback.print_exc()
+
+  def watcher_thread(self) -> None:
+    while self.active:
+      buf = os.read(self.fd, 64 * 1024)
+      i = 0
+      while i < len(buf):
+        _, mask, _, name_len = IN_EVENT.unpack_from(buf, i)
+        name = buf[i + IN_EVENT.size:i + IN_EVENT.size + name_len].rstrip(b'\0').decode()
+        i += IN_EVENT.size + name_len
+
+        if mask & (IN_DELETE_SELF | IN_MOVE_SELF | IN_IGNORED):
+          # the directory itself went away, stop caching
+          self.active = False
+          self.notify(None)
+        elif mask & IN_Q_OVERFLOW:
+          self.notify(None)
+        elif name:
+          self.notify(name)
+
+    os.close(self.fd)
+
+
+_watchers: Dict[Tuple[int, str], ParamsWatcher] = {}
+_watchers_lock = threading.Lock()
+
+def get_watcher(path: str) -> ParamsWatcher:
+  # one watcher per directory and process, threads don't survive a fork
+  with _watchers_lock:
+    k = (os.getpid(), path)
+    if k not in _watchers or not _watchers[k].active:
+      _watchers[k] = ParamsWatcher(path)
+    return _watchers[k]
+
+
+class CachedParams(Params):
+  """
+  Params with an in-process read cache for daemons that poll params in their loop.
+  The cache is invalidated through inotify on the params directory, so writes from
+  other processes show up as soon as the watcher thread sees them. Without inotify
+  every read goes to disk like Params.
+  """
+  def __init__(self, d=""):
+    # Params is a cdef class, its __cinit__ already got d
+    self.cache: Dict[bytes, Optional[bytes]] = {}
+    self.generation: Dict[bytes, int] = defaultdict(int)
+    self.callbacks: Dict[bytes, List[Callable[[str, Optional[bytes]], None]]] = defaultdict(list)
+    # last value the callbacks of a key saw, a put shows up as more than one inotify event
+    self.notified: Dict[bytes, Optional[bytes]] = {}
+    self.cache_lock = threading.Lock()
+
+    self.watcher = get_watcher(self.get_param_path())
+    self.watcher.add_listener(self.on_change)
+
+  def on_change(self, key: Optional[str]) -> None:
+    with self.cache_lock:
+      if key is None:
+        keys = list(self.cache.keys() | self.callbacks.keys())
+        self.cache.clear()
+      else:
+        keys = [key.encode()]
+        self.cache.pop(keys[0], None)
+
+      for k in keys:
+        self.generation[k] += 1
+      subscribed = [k for k in keys if self.callbacks.get(k)]
+
+    for k in subscribed:
+      val = self.get(k)
+      with self.cache_lock:
+        if self.notified.get(k) == val:
+          continue
+        self.notified[k] = val
+        callbacks = list(self.callbacks[k])
+      for cb in callbacks:
+        cb(k.decode(), val)
+
+  def subscribe(self, key, callback: Callable[[str, Optional[bytes]], None]) -> None:
+    """Calls callback(key, value) from the watcher thread whenever the value of key changes"""
+    k = self.check_key(key)
+    val = super().get(k)
+    with self.cache_lock:
+      self.notified.setdefault(k, val)
+      self.callbacks[k].append(callback)
+
+  def get(self, key, block=False, encoding=None):
+    if block or not self.watcher.active:
+      return super().get(key, block, encoding)
+
+    k = self.check_key(key)
+    try:
+      val = self.cache[k]
+    except KeyError:
+      generation = self.generation[k]
+      val = super().get(k)
+      with self.cache_lock:
+        # don't cache a value that changed while we were reading it
+        if generation == self.generation[k]:
+          self.cache[k] = val
+
+    return val if val is None or encoding is None else val.decode(encoding)
+
+  def get_bool(self, key, block=False):
+    return self.get(key, block) == b"1"
+
+  def invalidate(self, key) -> None:
+    k = self.check_key(key)
+    with self.cache_lock:
+      self.cache.pop(k, None)
+      self.generation[k] += 1
+
+  def put(self, key, dat):
+    super().put(key, dat)
+    self.invalidate(key)
+
+  def put_bool(self, key, val):
+    super().put_bool(key, val)
+    self.invalidate(key)
+
+  def remove(self, key):
+    super().remove(key)
+    self.invalidate(key)
+
+
+class ParamsWriter:
+  """
+  Writes params in the background without blocking the caller on fsync. There is
+  at most one writer thread, and a key written again before it's on disk is only
+  written once with the latest value. The thread exits when idle, and isn't a
+  daemon thread, so pending writes finish before the process exits.
+  """
+  def __init__(self):
+    self.pid: Optional[int] = None
+
+  def reset(self) -> None:
+    self.cv = threading.Condition()
+    self.pending: Dict[Tuple[str, str], Tuple[bool, Union[str, bytes, bool]]] = {}
+    self.running = False
+    self.pid = os.getpid()
+
+  def put(self, key, val, d="", put_bool=False) -> None:
+    if self.pid != os.getpid():
+      self.reset()
+
+    with self.cv:
+      # moving the key to the end keeps the writes in order
+      self.pending.pop((d, key), None)
+      self.pending[(d, key)] = (put_bool, val)
+
+      if not self.running:
+        self.running = True
+        threading.Thread(target=self.writer_thread, name="params_writer").start()
+
+  def writer_thread(self) -> None:
+    params: Dict[str, Params] = {}
+    while True:
+      with self.cv:
+        if not self.pending:
+          self.running = False
+          self.cv.notify_all()
+          return
+        (d, key), (put_bool, val) = next(iter(self.pending.items()))
+        del self.pending[(d, key)]
+
+      try:
+        if d not in params:
+          params[d] = Params(d)
+        if put_bool:
+          params[d].put_bool(key, val)
+        else:
+          params[d].put(key, val)
+      except Exception:
+        traceback.print_exc()
+
+  def flush(self, timeout: Optional[float] = None) -> bool:
+    """Waits for all pending writes, returns False on timeout"""
+    if self.pid != os.getpid():
+      return True
+
+    with self.cv:
+      return self.cv.wait_for(lambda: not self.running, timeout)
+
+
+params_writer = ParamsWriter()
+
+def put_nonblocking(key, val, d=""):
+  params_writer.put(key, val, d)
+
+def put_bool_nonblocking(key, val, d=""):
+  params_writer.put(key, bool(val), d, put_bool=True)
+
 
 if __name__ == "__main__":
   import sys
@@ -0,0 +1,73 @@
+import os
+import subprocess
+import tempfile
+import time
+import unittest
+
+from common.git import GitDirWatcher, GitRepo, ls_remote
+
+
+class TestGit(unittest.TestCase):
+  def setUp(self):
+    self.tmpdir = tempfile.TemporaryDirectory()
+    self.remote = os.path.join(self.tmpdir.name, "remote")
+    self.clone = os.path.join(self.tmpdir.name, "clone")
+
+    self.git("init", "-q", "-b", "master", self.remote, cwd=self.tmpdir.name)
+    for i in range(20):
+      with open(os.path.join(self.remote, "file"), "w") as f:
+        f.write("\n".join(str(j) for j in range(i * 100)))
+      self.git("add", "file")
+      self.git("commit", "-q", "-m", f"commit {i}")
+    self.git("branch", "other", "HEAD~3")
+    # packed objects with deltas, and packed refs
+    self.git("gc", "-q", "--aggressive")
+    self.git("clone", "-q", self.remote, self.clone, cwd=self.tmpdir.name)
+
+  def tearDown(self):
+    self.tmpdir.cleanup()
+
+  def git(self, *args, cwd=None):
+    env = dict(os.environ, GIT_AUTHOR_NAME="a", GIT_AUTHOR_EMAIL="a@a", GIT_COMMITTER_NAME="a", GIT_COMMITTER_EMAIL="a@a")
+    return subprocess.check_output(["git", *args], cwd=cwd or self.remote, env=env, encoding='utf8').strip()
+
+  def test_refs(self):
+    repo = GitRepo(self.remote)
+    self.assertEqual(repo.branch(), "master")
+    self.assertEqual(repo.rev_parse(), self.git("rev-parse", "HEAD"))
+    self.assertEqual(repo.rev_parse("other"), self.git("rev-parse", "other"))
+    self.assertEqual(repo.commit_time(), int(self.git("show", "-s", "--format=%ct", "HEAD")))
+
+    self.git("checkout", "-q", "--detach", "HEAD~1")
+    self.assertEqual(repo.branch(), "HEAD")
+    self.assertEqual(repo.rev_parse(), self.git("rev-parse", "HEAD"))
+
+  def test_objects(self):
+    repo = GitRepo(self.remote)
+    for line in self.git("rev-list", "--objects", "--all").splitlines():
+      sha = line.split()[0]
+      obj_type, data = repo.read_object(sha)
+      self.assertEqual(obj_type, self.git("cat-file", "-t", sha))
+      self.assertEqual(data, subprocess.check_output(["git", "cat-file", obj_type, sha], cwd=self.remote))
+
+  def test_ls_remote(self):
+    expected = {}
+    for line in self.git("ls-remote", cwd=self.clone).splitlines():
+      sha, ref = line.split()
+      expected[ref] = sha
+    self.assertEqual(ls_remote(GitRepo(self.clone)), expected)
+
+  def test_git_dir_watcher(self):
+    watcher = GitDirWatcher(os.path.join(self.clone, ".git"))
+    t = time.time() + 1
+    self.assertFalse(watcher.newer_than(t))
+    self.assertFalse(watcher.newer_than(t))
+
+    self.git("branch", "new", cwd=self.clone)
+    for fn in ("refs/heads/new", "refs/heads"):
+      os.utime(os.path.join(self.clone, ".git", fn), (t + 1, t + 1))
+    self.assertTrue(watcher.newer_than(t))
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -4,7 +4,8 @@ import tempfile
 import shutil
 import unittest
 
-from common.params import Params, ParamKeyType, UnknownKeyName, put_nonblocking, put_bool_nonblocking
+from common import params_pyx # pylint: disable=no-name-in-module, import-error
+from common.params import Params, CachedParams, ParamKeyType, UnknownKeyName, put_nonblocking, put_bool_nonblocking, params_writer
 
 class TestParams(unittest.TestCase):
   def setUp(self):
@@ -98,6 +99,46 @@ class TestParams(unittest.TestCase):
     assert q.get("CarParams") is None
     assert q.get("CarParams", True) == b"1"
 
+  def test_put_non_blocking_coalesced(self):
+    for i in range(100):
+      put_nonblocking("CarParams", str(i), self.tmpdir)
+    put_bool_nonblocking("IsMetric", True, self.tmpdir)
+    assert params_writer.flush(timeout=5)
+    assert self.params.get("CarParams") == b"99"
+    assert self.params.get_bool("IsMetric")
+
+  def test_cached_params_init(self):
+    # constructed on top of the compiled Params, like the daemons do
+    self.assertIs(CachedParams.__bases__[0], params_pyx.Params)
+    for q in (CachedParams(), CachedParams(self.tmpdir), CachedParams(d=self.tmpdir)):
+      self.assertIsInstance(q, Params)
+    self.assertEqual(CachedParams(self.tmpdir).get_param_path(), self.params.get_param_path())
+
+  def test_cached_params(self):
+    q = CachedParams(self.tmpdir)
+    assert q.get("CarParams") is None
+
+    # own writes are visible immediately
+    q.put("CarParams", "test")
+    assert q.get("CarParams") == b"test"
+    assert q.get("CarParams", encoding='utf8') == "test"
+
+    # writes from elsewhere invalidate the cache
+    changes = []
+    removed = threading.Event()
+    q.subscribe("IsMetric", lambda k, v: changes.append((k, v)))
+    q.subscribe("CarParams", lambda k, v: v is None and removed.set())
+    self.params.put_bool("IsMetric", True)
+    self.params.remove("CarParams")
+    # callbacks run after the cache is invalidated, in the order of the writes
+    assert removed.wait(timeout=5)
+    assert q.get_bool("IsMetric")
+    assert q.get("CarParams") is None
+    assert changes == [("IsMetric", b"1")], changes
+
+    with self.assertRaises(UnknownKeyName):
+      q.get("swag")
+
   def test_params_all_keys(self):
     keys = Params().all_keys()
 
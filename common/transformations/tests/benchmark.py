@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+import time
+import numpy as np
+
+import common.transformations.coordinates as coord
+import common.transformations.orientation as orient
+from common.transformations.orientation import numpy_wrap
+from common.transformations.transformations import (ecef2geodetic_single, euler2rot_single, geodetic2ecef_single,
+                                                    quat2rot_single, rot2euler_single)
+
+N = 100_000
+
+# the per-row wrappers these used to be
+single = {
+  'quat2rot': numpy_wrap(quat2rot_single, (4,), (3, 3)),
+  'euler2rot': numpy_wrap(euler2rot_single, (3,), (3, 3)),
+  'rot2euler': numpy_wrap(rot2euler_single, (3, 3), (3,)),
+  'geodetic2ecef': numpy_wrap(geodetic2ecef_single, (3,), (3,)),
+  'ecef2geodetic': numpy_wrap(ecef2geodetic_single, (3,), (3,)),
+  'LocalCoord.ecef2ned': numpy_wrap(coord.LocalCoord_single.ecef2ned_single, (3,), (3,)),
+}
+
+
+def timeit(f, *args, **kwargs):
+  t = time.perf_counter()
+  f(*args, **kwargs)
+  return time.perf_counter() - t
+
+
+if __name__ == "__main__":
+  np.random.seed(0)
+  quats = np.random.normal(size=(N, 4))
+  quats /= np.linalg.norm(quats, axis=1, keepdims=True)
+  eulers = np.random.uniform(-np.pi, np.pi, size=(N, 3))
+  rots = orient.euler2rot(eulers)
+  geodetic = np.column_stack([np.random.uniform(-80, 80, N), np.random.uniform(-180, 180, N), np.random.uniform(0, 3000, N)])
+  ecef = coord.geodetic2ecef(geodetic)
+  lc = coord.LocalCoord.from_geodetic(geodetic[0])
+
+  cases = {
+    'quat2rot': (orient.quat2rot, (quats,)),
+    'euler2rot': (orient.euler2rot, (eulers,)),
+    'rot2euler': (orient.rot2euler, (rots,)),
+    'geodetic2ecef': (coord.geodetic2ecef, (geodetic,)),
+    'ecef2geodetic': (coord.ecef2geodetic, (ecef,)),
+    'LocalCoord.ecef2ned': (lc.ecef2ned, (ecef,)),
+  }
+
+  print(f"{N} rows          per row     batched   batched+out  speedup")
+  for name, (f, args) in cases.items():
+    out = np.empty_like(f(*args))
+    old_args = (lc,) + args if name.startswith('LocalCoord') else args
+    t_single = timeit(single[name], *old_args)
+    t_batch = timeit(f, *args)
+    t_out = timeit(f, *args, out=out)
+    assert np.array_equal(out, single[name](*old_args))
+    print(f"{name:20s} {t_single*1e3:8.1f} ms {t_batch*1e3:8.1f} ms {t_out*1e3:8.1f} ms {t_single/t_batch:8.1f}x")
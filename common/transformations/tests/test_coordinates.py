@@ -4,6 +4,7 @@ import numpy as np
 import unittest
 
 import common.transformations.coordinates as coord
+from common.transformations.transformations import ecef2geodetic_single, geodetic2ecef_single
 
 geodetic_positions = np.array([[37.7610403, -122.4778699, 115],
                                  [27.4840915, -68.5867592, 2380],
@@ -105,5 +106,33 @@ class TestNED(unittest.TestCase):
     np.testing.assert_allclose(converter.ned2ecef(ned_offsets_batch),
                                                            ecef_positions_offset_batch,
                                                            rtol=1e-9, atol=1e-7)
+
+  def test_batch_matches_single(self):
+    np.testing.assert_array_equal(coord.geodetic2ecef(geodetic_positions),
+                                  np.array([geodetic2ecef_single(g) for g in geodetic_positions]))
+    np.testing.assert_array_equal(coord.ecef2geodetic(ecef_positions),
+                                  np.array([ecef2geodetic_single(e) for e in ecef_positions]))
+
+    converter = coord.LocalCoord.from_ecef(ecef_init_batch)
+    np.testing.assert_array_equal(converter.ecef2ned(ecef_positions_offset_batch),
+                                  np.array([converter.ecef2ned_single(e) for e in ecef_positions_offset_batch]))
+    np.testing.assert_array_equal(converter.ned2ecef(ned_offsets_batch),
+                                  np.array([converter.ned2ecef_single(n) for n in ned_offsets_batch]))
+    np.testing.assert_array_equal(converter.geodetic2ned(geodetic_positions),
+                                  np.array([converter.geodetic2ned_single(g) for g in geodetic_positions]))
+    np.testing.assert_array_equal(converter.ned2geodetic(ned_offsets_batch),
+                                  np.array([converter.ned2geodetic_single(n) for n in ned_offsets_batch]))
+
+  def test_out(self):
+    out = np.empty_like(ecef_positions)
+    self.assertIs(coord.geodetic2ecef(geodetic_positions, out=out), out)
+    np.testing.assert_allclose(out, ecef_positions, rtol=1e-9)
+
+    converter = coord.LocalCoord.from_ecef(ecef_init_batch)
+    out = np.empty_like(ned_offsets_batch)
+    self.assertIs(converter.ecef2ned(ecef_positions_offset_batch, out=out), out)
+    np.testing.assert_allclose(out, ned_offsets_batch, rtol=1e-9, atol=1e-7)
+
+
 if __name__ == "__main__":
   unittest.main()
@@ -5,7 +5,10 @@ import unittest
 
 from common.transformations.orientation import euler2quat, quat2euler, euler2rot, rot2euler, \
                                                rot2quat, quat2rot, \
-                                               ned_euler_from_ecef
+                                               ned_euler_from_ecef, ecef_euler_from_ned
+from common.transformations.transformations import euler2quat_single, quat2euler_single, euler2rot_single, \
+                                                   rot2euler_single, rot2quat_single, quat2rot_single, \
+                                                   ned_euler_from_ecef_single, ecef_euler_from_ned_single
 
 eulers = np.array([[ 1.46520501,  2.78688383,  2.92780854],
        [ 4.86909526,  3.60618161,  4.30648981],
@@ -63,6 +66,39 @@ class TestOrientation(unittest.TestCase):
       #np.testing.assert_allclose(eulers[i], ecef_euler_from_ned(ecef_positions[i], ned_eulers[i]), rtol=1e-7)
     # np.testing.assert_allclose(ned_eulers, ned_euler_from_ecef(ecef_positions, eulers), rtol=1e-7)
 
+  def test_batch_matches_single(self):
+    rots = np.array([euler2rot_single(eul) for eul in eulers])
+    for batch, single, inputs in [(euler2quat, euler2quat_single, eulers),
+                                  (quat2euler, quat2euler_single, quats),
+                                  (euler2rot, euler2rot_single, eulers),
+                                  (quat2rot, quat2rot_single, quats),
+                                  (rot2euler, rot2euler_single, rots),
+                                  (rot2quat, rot2quat_single, rots)]:
+      np.testing.assert_array_equal(batch(inputs), np.array([single(i) for i in inputs]))
+
+    for batch, single in [(ned_euler_from_ecef, ned_euler_from_ecef_single),
+                          (ecef_euler_from_ned, ecef_euler_from_ned_single)]:
+      np.testing.assert_array_equal(batch(ecef_positions[0], eulers),
+                                    np.array([single(ecef_positions[0], eul) for eul in eulers]))
+
+  def test_batch_shapes(self):
+    self.assertEqual(quat2rot(quats[0]).shape, (3, 3))
+    self.assertEqual(quat2rot(quats).shape, (5, 3, 3))
+    self.assertEqual(quat2rot(np.zeros((0, 4))).shape, (0, 3, 3))
+    self.assertEqual(rot2euler(quat2rot(quats.reshape(5, 1, 4))).shape, (5, 1, 3))
+    with self.assertRaises(ValueError):
+      quat2rot(eulers)
+
+  def test_out(self):
+    out = np.zeros((5, 3, 3))
+    self.assertIs(quat2rot(quats, out=out), out)
+    np.testing.assert_array_equal(out, quat2rot(quats))
+
+    with self.assertRaises(ValueError):
+      quat2rot(quats, out=np.zeros((5, 9)))
+    with self.assertRaises(ValueError):
+      quat2rot(quats, out=np.zeros((5, 3, 3), dtype=np.float32))
+
 
 if __name__ == "__main__":
   unittest.main()
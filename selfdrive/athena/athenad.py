@@ -16,11 +16,12 @@ import sys
 import tempfile
 import threading
 import time
+from collections import deque
 from dataclasses import asdict, dataclass, replace
 from datetime import datetime
 from functools import partial
 from queue import Queue
-from typing import BinaryIO, Callable, Dict, List, Optional, Set, Union, cast
+from typing import Any, BinaryIO, Callable, Deque, Dict, List, Optional, Set, Tuple, Union, cast
 
 import requests
 from jsonrpc import JSONRPCResponseManager, dispatcher
@@ -55,6 +56,15 @@ MAX_RETRY_COUNT = 30  # Try for at most 5 minutes if upload fails immediately
 MAX_AGE = 31 * 24 * 3600  # seconds
 WS_FRAME_SIZE = 4096
 
+# bounded queues, a full queue makes the producer wait instead of piling up requests in memory
+RECV_QUEUE_SIZE = 64
+SEND_QUEUE_SIZE = 64
+LOW_PRIORITY_SEND_QUEUE_SIZE = 2
+LOG_RECV_QUEUE_SIZE = 16
+# longest ws_recv waits for room in recv_queue, it has to keep answering pings
+RECV_QUEUE_TIMEOUT = 1.  # seconds
+STATS_BATCH_SIZE = 64  # files per storeStats call
+
 NetworkType = log.DeviceState.NetworkType
 
 UploadFileDict = Dict[str, Union[str, int, float, bool]]
@@ -93,12 +103,48 @@ class UploadItem:
                d["progress"], d["allow_cellular"])
 
 
+class SendQueue:
+  """
+  Bounded queue of messages for the server with two lanes. Responses to requests
+  always go out before low priority messages (logs, stats), and a producer waits
+  while its lane is full.
+  """
+  def __init__(self, maxsize: int, low_priority_maxsize: int):
+    self.cv = threading.Condition()
+    self.lanes: Tuple[Deque[str], Deque[str]] = (deque(), deque())
+    self.maxsize = (maxsize, low_priority_maxsize)
+
+  def put(self, data: str, low_priority: bool = False, timeout: Optional[float] = None) -> None:
+    lane = int(low_priority)
+    with self.cv:
+      if not self.cv.wait_for(lambda: len(self.lanes[lane]) < self.maxsize[lane], timeout):
+        raise queue.Full
+      self.lanes[lane].append(data)
+      self.cv.notify_all()
+
+  def put_nowait(self, data: str, low_priority: bool = False) -> None:
+    self.put(data, low_priority, timeout=0)
+
+  def get(self, timeout: Optional[float] = None) -> str:
+    with self.cv:
+      if not self.cv.wait_for(lambda: any(self.lanes), timeout):
+        raise queue.Empty
+      data = (self.lanes[0] or self.lanes[1]).popleft()
+      self.cv.notify_all()
+      return data
+
+  def get_nowait(self) -> str:
+    return self.get(timeout=0)
+
+  def qsize(self) -> int:
+    return sum(len(l) for l in self.lanes)
+
+
 dispatcher["echo"] = lambda s: s
-recv_queue: Queue[str] = queue.Queue()
-send_queue: Queue[str] = queue.Queue()
+recv_queue: Queue[str] = queue.Queue(maxsize=RECV_QUEUE_SIZE)
+send_queue = SendQueue(SEND_QUEUE_SIZE, LOW_PRIORITY_SEND_QUEUE_SIZE)
 upload_queue: Queue[UploadItem] = queue.Queue()
-low_priority_send_queue: Queue[str] = queue.Queue()
-log_recv_queue: Queue[str] = queue.Queue()
+log_recv_queue: Queue[str] = queue.Queue(maxsize=LOG_RECV_QUEUE_SIZE)
 cancelled_uploads: Set[str] = set()
 
 cur_upload_items: Dict[int, Optional[UploadItem]] = {}
@@ -114,16 +160,30 @@ class AbortTransferException(Exception):
   pass
 
 
+def put_until_end(q: Union[Queue, SendQueue], item: Any, end_event: threading.Event, **kwargs) -> bool:
+  """Waits for space in a bounded queue, returns False if end_event was set first"""
+  while not end_event.is_set():
+    try:
+      q.put(item, timeout=1, **kwargs)
+      return True
+    except queue.Full:
+      pass
+  return False
+
+
 class UploadQueueCache:
   params = Params()
+  last_items: Optional[List[UploadItem]] = None
 
   @staticmethod
   def initialize(upload_queue: Queue[UploadItem]) -> None:
     try:
       upload_queue_json = UploadQueueCache.params.get("AthenadUploadQueue")
       if upload_queue_json is not None:
-        for item in json.loads(upload_queue_json):
-          upload_queue.put(UploadItem.from_dict(item))
+        items = [UploadItem.from_dict(item) for item in json.loads(upload_queue_json)]
+        for item in items:
+          upload_queue.put(item)
+        UploadQueueCache.last_items = items
     except Exception:
       cloudlog.exception("athena.UploadQueueCache.initialize.exception")
 
@@ -131,8 +191,12 @@ class UploadQueueCache:
   def cache(upload_queue: Queue[UploadItem]) -> None:
     try:
       queue: List[Optional[UploadItem]] = list(upload_queue.queue)
-      items = [asdict(i) for i in queue if i is not None and (i.id not in cancelled_uploads)]
-      UploadQueueCache.params.put("AthenadUploadQueue", json.dumps(items))
+      items = [i for i in queue if i is not None and (i.id not in cancelled_uploads)]
+
+      # items compare by value, only serialize and hit the disk when the queue actually changed
+      if items != UploadQueueCache.last_items:
+        UploadQueueCache.params.put("AthenadUploadQueue", json.dumps([asdict(i) for i in items]))
+        UploadQueueCache.last_items = items
     except Exception:
       cloudlog.exception("athena.UploadQueueCache.cache.exception")
 
@@ -173,16 +237,20 @@ def jsonrpc_handler(end_event: threading.Event) -> None:
       if "method" in data:
         cloudlog.debug(f"athena.jsonrpc_handler.call_method {data}")
         response = JSONRPCResponseManager.handle(data, dispatcher)
-        send_queue.put_nowait(response.json)
+        put_until_end(send_queue, response.json, end_event)
       elif "id" in data and ("result" in data or "error" in data):
-        log_recv_queue.put_nowait(data)
+        try:
+          log_recv_queue.put_nowait(data)
+        except queue.Full:
+          # unacknowledged logs are sent again later
+          cloudlog.warning("athena.jsonrpc_handler.log_recv_queue_full")
       else:
         raise Exception("not a valid request or response")
     except queue.Empty:
       pass
     except Exception as e:
       cloudlog.exception("athena jsonrpc handler failed")
-      send_queue.put_nowait(json.dumps({"error": str(e)}))
+      put_until_end(send_queue, json.dumps({"error": str(e)}), end_event)
 
 
 def retry_upload(tid: int, end_event: threading.Event, increase_count: bool = True) -> None:
@@ -607,7 +675,7 @@ def log_handler(end_event: threading.Event) -> None:
               "jsonrpc": "2.0",
               "id": log_entry
             }
-            low_priority_send_queue.put_nowait(json.dumps(jsonrpc))
+          if put_until_end(send_queue, json.dumps(jsonrpc), end_event, low_priority=True):
             curr_log = log_entry
         except OSError:
           pass  # file could be deleted by log rotation
@@ -639,25 +707,34 @@ def log_handler(end_event: threading.Event) -> None:
 
 
 def stat_handler(end_event: threading.Event) -> None:
+  last_scan = 0.
   while not end_event.is_set():
-    last_scan = 0
     curr_scan = sec_since_boot()
     try:
       if curr_scan - last_scan > 10:
-        stat_filenames = list(filter(lambda name: not name.startswith(tempfile.gettempprefix()), os.listdir(STATS_DIR)))
-        if len(stat_filenames) > 0:
-          stat_path = os.path.join(STATS_DIR, stat_filenames[0])
-          with open(stat_path) as f:
-            jsonrpc = {
-              "method": "storeStats",
-              "params": {
-                "stats": f.read()
-              },
-              "jsonrpc": "2.0",
-              "id": stat_filenames[0]
-            }
-            low_priority_send_queue.put_nowait(json.dumps(jsonrpc))
-          os.remove(stat_path)
+        stat_filenames = sorted(filter(lambda name: not name.startswith(tempfile.gettempprefix()), os.listdir(STATS_DIR)))
+
+        # stats are influx line protocol, so several files can go out in one message
+        for i in range(0, len(stat_filenames), STATS_BATCH_SIZE):
+          batch = stat_filenames[i:i+STATS_BATCH_SIZE]
+          stats = ""
+          for stat_filename in batch:
+            with open(os.path.join(STATS_DIR, stat_filename)) as f:
+              stats += f.read()
+
+          jsonrpc = {
+            "method": "storeStats",
+            "params": {
+              "stats": stats
+            },
+            "jsonrpc": "2.0",
+            "id": batch[0]
+          }
+          if not put_until_end(send_queue, json.dumps(jsonrpc), end_event, low_priority=True):
+            break
+
+          for stat_filename in batch:
+            os.remove(os.path.join(STATS_DIR, stat_filename))
         last_scan = curr_scan
     except Exception:
       cloudlog.exception("athena.stat_handler.exception")
@@ -716,7 +793,11 @@ def ws_recv(ws: WebSocket, end_event: threading.Event) -> None:
       if opcode in (ABNF.OPCODE_TEXT, ABNF.OPCODE_BINARY):
         if opcode == ABNF.OPCODE_TEXT:
           data = data.decode("utf-8")
-        recv_queue.put_nowait(data)
+        # wait a bit for the handlers, but keep reading pings
+        try:
+          recv_queue.put(data, timeout=RECV_QUEUE_TIMEOUT)
+        except queue.Full:
+          cloudlog.warning("athena.ws_recv.recv_queue_full")
       elif opcode == ABNF.OPCODE_PING:
         last_ping = int(sec_since_boot() * 1e9)
         Params().put("LastAthenaPingTime", str(last_ping))
@@ -733,10 +814,7 @@ def ws_recv(ws: WebSocket, end_event: threading.Event) -> None:
 def ws_send(ws: WebSocket, end_event: threading.Event) -> None:
   while not end_event.is_set():
     try:
-      try:
-        data = send_queue.get_nowait()
-      except queue.Empty:
-        data = low_priority_send_queue.get(timeout=1)
+      data = send_queue.get(timeout=1)
       for i in range(0, len(data), WS_FRAME_SIZE):
         frame = data[i:i+WS_FRAME_SIZE]
         last = i + WS_FRAME_SIZE >= len(data)
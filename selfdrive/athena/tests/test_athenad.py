@@ -16,7 +16,7 @@ from multiprocessing import Process
 from pathlib import Path
 from unittest import mock
 from websocket import ABNF
-from websocket._exceptions import WebSocketConnectionClosedException
+from websocket._exceptions import WebSocketConnectionClosedException, WebSocketTimeoutException
 
 from system import swaglog
 from selfdrive.athena import athenad
@@ -40,6 +40,7 @@ class TestAthenadMethods(unittest.TestCase):
     athenad.upload_queue = queue.Queue()
     athenad.cur_upload_items.clear()
     athenad.cancelled_uploads.clear()
+    athenad.UploadQueueCache.last_items = None
 
     for i in os.listdir(athenad.ROOT):
       p = os.path.join(athenad.ROOT, i)
@@ -407,6 +408,100 @@ class TestAthenadMethods(unittest.TestCase):
       end_event.set()
       thread.join()
 
+  def test_send_queue(self):
+    q = athenad.SendQueue(2, 1)
+    q.put_nowait("low", low_priority=True)
+    with self.assertRaises(queue.Full):
+      q.put_nowait("low2", low_priority=True)
+    q.put_nowait("high")
+
+    # responses go out before low priority messages
+    self.assertEqual(q.get_nowait(), "high")
+    self.assertEqual(q.get_nowait(), "low")
+    with self.assertRaises(queue.Empty):
+      q.get(timeout=0.01)
+
+  def test_ws_send(self):
+    class WebsocketStandIn:
+      def __init__(self):
+        self.frames = []
+
+      def send_frame(self, frame):
+        self.frames.append((frame.opcode, frame.fin, frame.data))
+
+    athenad.send_queue.put_nowait("low", low_priority=True)
+    athenad.send_queue.put_nowait("a" * int(athenad.WS_FRAME_SIZE * 1.5))
+
+    ws = WebsocketStandIn()
+    end_event = threading.Event()
+    thread = threading.Thread(target=athenad.ws_send, args=(ws, end_event))
+    thread.start()
+    try:
+      deadline = time.monotonic() + 5
+      while len(ws.frames) < 3 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    finally:
+      end_event.set()
+      thread.join()
+
+    self.assertEqual([(op, fin) for op, fin, _ in ws.frames],
+                     [(ABNF.OPCODE_TEXT, 0), (ABNF.OPCODE_CONT, 1), (ABNF.OPCODE_TEXT, 1)])
+    self.assertEqual(ws.frames[2][2], b"low")
+
+  def test_ws_recv_full(self):
+    class WebsocketStandIn:
+      def __init__(self, frames):
+        self.frames = frames
+
+      def recv_data(self, control_frame=False):
+        if not self.frames:
+          end_event.set()
+          raise WebSocketTimeoutException
+        return self.frames.pop(0)
+
+    recv_queue = queue.Queue(maxsize=1)
+    recv_queue.put_nowait("busy")
+    ws = WebsocketStandIn([(ABNF.OPCODE_TEXT, b"dropped"), (ABNF.OPCODE_PING, b"")])
+    end_event = threading.Event()
+    with mock.patch.object(athenad, 'recv_queue', recv_queue), mock.patch.object(athenad, 'RECV_QUEUE_TIMEOUT', 0.01):
+      athenad.ws_recv(ws, end_event)
+
+    # the message is dropped instead of blocking the ping
+    self.assertEqual(list(recv_queue.queue), ["busy"])
+    self.assertIsNotNone(MockParams().get("LastAthenaPingTime"))
+
+  def test_upload_queue_cache_unchanged(self):
+    item = athenad.UploadItem(path="_", url="_", headers={}, created_at=int(time.time()), id='id1')
+    athenad.upload_queue.put_nowait(item)
+    with mock.patch.object(athenad.UploadQueueCache, 'params') as params:
+      athenad.UploadQueueCache.cache(athenad.upload_queue)
+      athenad.UploadQueueCache.cache(athenad.upload_queue)
+      self.assertEqual(params.put.call_count, 1)
+
+      athenad.upload_queue.put_nowait(replace(item, id='id2'))
+      athenad.UploadQueueCache.cache(athenad.upload_queue)
+      self.assertEqual(params.put.call_count, 2)
+
+  def test_stat_handler_batching(self):
+    with tempfile.TemporaryDirectory() as stats_dir, mock.patch.object(athenad, 'STATS_DIR', stats_dir):
+      lines = [f"gauge.test value={i} {i}\n" for i in range(5)]
+      for i, line in enumerate(lines):
+        with open(os.path.join(stats_dir, f"{i}_0"), "w") as f:
+          f.write(line)
+
+      end_event = threading.Event()
+      thread = threading.Thread(target=athenad.stat_handler, args=(end_event,))
+      thread.start()
+      try:
+        msg = json.loads(athenad.send_queue.get(timeout=5))
+      finally:
+        end_event.set()
+        thread.join()
+
+    self.assertEqual(msg['method'], "storeStats")
+    self.assertEqual(msg['id'], "0_0")
+    self.assertEqual(msg['params']['stats'], "".join(lines))
+
   def test_get_logs_to_send_sorted(self):
     fl = list()
     for i in range(10):
@@ -1,12 +1,13 @@
 # pylint: skip-file
 
 # Cython, now uses scons to build
-from selfdrive.boardd.boardd_api_impl import can_list_to_can_capnp
+from selfdrive.boardd.boardd_api_impl import can_list_to_can_capnp, can_capnp_to_can_array, can_array_dtype
 assert can_list_to_can_capnp
+assert can_capnp_to_can_array
+assert can_array_dtype
 
 def can_capnp_to_can_list(can, src_filter=None):
-  ret = []
-  for msg in can:
-    if src_filter is None or msg.src in src_filter:
-      ret.append((msg.address, msg.busTime, msg.dat, msg.src))
-  return ret
+  if src_filter is None:
+    return [(msg.address, msg.busTime, msg.dat, msg.src) for msg in can]
+  src_filter = set(src_filter)
+  return [(msg.address, msg.busTime, msg.dat, msg.src) for msg in can if msg.src in src_filter]
@@ -1,5 +1,9 @@
 # distutils: language = c++
 # cython: language_level=3
+import warnings
+import numpy as np
+from libc.stdint cimport uint8_t, uint32_t
+from libc.string cimport memcpy
 from libcpp.vector cimport vector
 from libcpp.string cimport string
 from libcpp cimport bool
@@ -11,6 +15,8 @@ cdef struct can_frame:
   long src
 
 cdef extern void can_list_to_can_capnp_cpp(const vector[can_frame] &can_list, string &out, bool sendCan, bool valid)
+cdef extern bool can_capnp_to_can_array_cpp(const uint8_t *data, size_t size, vector[uint8_t] &out, size_t dat_size, bool sendCan,
+                                            const vector[uint8_t] &src_filter, const vector[uint32_t] &address_filter)
 
 def can_list_to_can_capnp(can_msgs, msgtype='can', valid=True):
   cdef vector[can_frame] can_list
@@ -26,3 +32,35 @@ def can_list_to_can_capnp(can_msgs, msgtype='can', valid=True):
   cdef string out
   can_list_to_can_capnp_cpp(can_list, out, msgtype == 'sendcan', valid)
   return out
+
+def can_array_dtype(dat_size=8):
+  # same layout as the records written by can_capnp_to_can_array_cpp
+  return np.dtype([('logMonoTime', np.uint64), ('address', np.uint32), ('busTime', np.uint16),
+                   ('src', np.uint8), ('length', np.uint8), ('dat', np.uint8, (dat_size,))])
+
+def can_capnp_to_can_array(strings, src_filter=None, address_filter=None, dat_size=8, msgtype='can'):
+  """
+  Structured array of the frames in serialized can events, like the ones drain_sock_raw returns,
+  or in whole decompressed logs. Payloads longer than dat_size are cut off, length is the full length.
+  Takes bytes or any other buffer, they're only copied if they aren't word aligned.
+  """
+  if isinstance(strings, (bytes, bytearray, memoryview, np.ndarray)):
+    strings = [strings]
+
+  cdef vector[uint8_t] out
+  cdef vector[uint8_t] srcs = [] if src_filter is None else list(src_filter)
+  cdef vector[uint32_t] addresses = [] if address_filter is None else list(address_filter)
+  cdef bool sendcan = msgtype == 'sendcan'
+  cdef const uint8_t[:] s
+  for s in strings:
+    if s.shape[0] == 0:
+      continue
+    if not can_capnp_to_can_array_cpp(&s[0], s.shape[0], out, dat_size, sendcan, srcs, addresses):
+      warnings.warn("Corrupted events detected", RuntimeWarning)
+
+  dtype = can_array_dtype(dat_size)
+  arr = np.empty(out.size() // dtype.itemsize, dtype=dtype)
+  cdef uint8_t[:] view = arr.view(np.uint8)
+  if out.size():
+    memcpy(&view[0], out.data(), out.size())
+  return arr
@@ -1,3 +1,6 @@
+#include <algorithm>
+#include <unordered_set>
+
 #include "cereal/messaging/messaging.h"
 #include "panda.h"
 
@@ -22,4 +25,66 @@ void can_list_to_can_capnp_cpp(const std::vector<can_frame> &can_list, std::stri
   capnp::writeMessage(output_stream, msg);
 }
 
+// Appends the frames of serialized events, or a whole log of them, as fixed size records:
+// logMonoTime u64, address u32, busTime u16, src u8, length u8, dat[dat_size]
+// Returns false if the data is corrupt, the frames before that are kept.
+bool can_capnp_to_can_array_cpp(const uint8_t *data, size_t size, std::vector<uint8_t> &out, size_t dat_size, bool sendCan,
+                                 const std::vector<uint8_t> &src_filter, const std::vector<uint32_t> &address_filter) {
+  const size_t header_size = 16;
+  const size_t record_size = header_size + dat_size;
+
+  bool srcs[256] = {};
+  for (auto src : src_filter) srcs[src] = true;
+  std::unordered_set<uint32_t> addresses(address_filter.begin(), address_filter.end());
+
+  // python buffers aren't guaranteed to be word aligned, only copy the ones that aren't
+  kj::Array<capnp::word> buf;
+  kj::ArrayPtr<const capnp::word> words;
+  if (reinterpret_cast<uintptr_t>(data) % alignof(capnp::word) == 0) {
+    words = kj::arrayPtr(reinterpret_cast<const capnp::word *>(data), size / sizeof(capnp::word));
+  } else {
+    buf = kj::heapArray<capnp::word>(size / sizeof(capnp::word));
+    memcpy(buf.begin(), data, buf.size() * sizeof(capnp::word));
+    words = buf.asPtr();
+  }
+
+  try {
+    while (words.size() > 0) {
+      capnp::FlatArrayMessageReader reader(words);
+      words = kj::arrayPtr(reader.getEnd(), words.end());
+
+      auto event = reader.getRoot<cereal::Event>();
+      auto which = event.which();
+      if (which != (sendCan ? cereal::Event::SENDCAN : cereal::Event::CAN)) continue;
+
+      uint64_t mono_time = event.getLogMonoTime();
+      auto frames = sendCan ? event.getSendcan() : event.getCan();
+      for (auto frame : frames) {
+        uint8_t src = frame.getSrc();
+        uint32_t address = frame.getAddress();
+        if ((!src_filter.empty() && !srcs[src]) || (!addresses.empty() && addresses.find(address) == addresses.end())) {
+          continue;
+        }
+
+        auto dat = frame.getDat();
+        uint16_t bus_time = frame.getBusTime();
+        uint8_t length = std::min(dat.size(), (size_t)UINT8_MAX);
+
+        size_t offset = out.size();
+        out.resize(offset + record_size);
+        uint8_t *record = out.data() + offset;
+        memcpy(record, &mono_time, sizeof(mono_time));
+        memcpy(record + 8, &address, sizeof(address));
+        memcpy(record + 12, &bus_time, sizeof(bus_time));
+        record[14] = src;
+        record[15] = length;
+        memcpy(record + header_size, dat.begin(), std::min(dat.size(), dat_size));
+      }
+    }
+  } catch (const kj::Exception &e) {
+    return false;
+  }
+  return true;
+}
+
 }
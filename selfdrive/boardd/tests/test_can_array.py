@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+import random
+import unittest
+
+import numpy as np
+
+from selfdrive.boardd.boardd import can_list_to_can_capnp, can_capnp_to_can_array
+
+
+def random_can_msgs(n, max_len=8):
+  return [[random.randint(0, 0x1FFFFFFF), random.randint(0, 0xFFFF), bytes(random.getrandbits(8) for _ in range(random.randint(0, max_len))),
+           random.randint(0, 2)] for _ in range(n)]
+
+
+class TestCanArray(unittest.TestCase):
+  def assertFramesEqual(self, arr, can_msgs):
+    self.assertEqual(len(arr), len(can_msgs))
+    for f, (address, bus_time, dat, src) in zip(arr, can_msgs):
+      self.assertEqual((f['address'], f['busTime'], f['src'], f['length']), (address, bus_time, src, len(dat)))
+      self.assertEqual(bytes(f['dat'][:f['length']]), dat[:len(f['dat'])])
+
+  def test_round_trip(self):
+    events = [random_can_msgs(random.randint(0, 50)) for _ in range(20)]
+    strings = [can_list_to_can_capnp(msgs) for msgs in events]
+    arr = can_capnp_to_can_array(strings)
+    self.assertFramesEqual(arr, sum(events, []))
+
+    # a whole log is the events back to back
+    self.assertTrue(np.array_equal(can_capnp_to_can_array(b''.join(strings)), arr))
+
+  def test_buffers(self):
+    msgs = random_can_msgs(100)
+    s = can_list_to_can_capnp(msgs)
+    self.assertFramesEqual(can_capnp_to_can_array(bytearray(s)), msgs)
+    self.assertFramesEqual(can_capnp_to_can_array(np.frombuffer(s, dtype=np.uint8)), msgs)
+    self.assertEqual(len(can_capnp_to_can_array([b'', s[:0]])), 0)
+
+    # not word aligned, copied first
+    unaligned = memoryview(b'\x00' + s)[1:]
+    self.assertFramesEqual(can_capnp_to_can_array(unaligned), msgs)
+    self.assertFramesEqual(can_capnp_to_can_array([s, unaligned]), msgs + msgs)
+
+  def test_filters(self):
+    msgs = random_can_msgs(500)
+    s = can_list_to_can_capnp(msgs)
+    addresses = {msgs[0][0], msgs[10][0]}
+
+    self.assertFramesEqual(can_capnp_to_can_array(s, src_filter=[1]), [m for m in msgs if m[3] == 1])
+    self.assertFramesEqual(can_capnp_to_can_array(s, address_filter=addresses), [m for m in msgs if m[0] in addresses])
+    self.assertFramesEqual(can_capnp_to_can_array(s, src_filter=[0, 2], address_filter=addresses),
+                           [m for m in msgs if m[0] in addresses and m[3] in (0, 2)])
+
+  def test_msgtype(self):
+    msgs = random_can_msgs(10)
+    self.assertEqual(len(can_capnp_to_can_array(can_list_to_can_capnp(msgs, msgtype='sendcan'))), 0)
+    self.assertFramesEqual(can_capnp_to_can_array(can_list_to_can_capnp(msgs, msgtype='sendcan'), msgtype='sendcan'), msgs)
+
+  def test_can_fd(self):
+    msgs = random_can_msgs(100, max_len=64)
+    s = can_list_to_can_capnp(msgs)
+    self.assertFramesEqual(can_capnp_to_can_array(s, dat_size=64), msgs)
+    # longer payloads are cut off
+    self.assertFramesEqual(can_capnp_to_can_array(s), msgs)
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,233 @@
+#!/usr/bin/env python3
+"""
+Watches the CPU and latency budgets of the onroad processes.
+
+Joins the per-process CPU usage from procLog with the inter-arrival jitter of the
+main services, the timing fields the processes already publish, and the
+camera -> modeld -> plannerd -> controlsd -> sendcan latency chain. Rolling
+percentiles go to statsd and the log every REPORT_INTERVAL, and an error event is
+logged when a metric stays over its budget.
+"""
+from collections import defaultdict, deque
+from typing import Any, Deque, Dict, List, Tuple
+
+import numpy as np
+
+import cereal.messaging as messaging
+from cereal.services import service_list
+from common.realtime import Ratekeeper
+from selfdrive.statsd import GaugeDeadband, statlog
+from system.swaglog import cloudlog
+
+WINDOW = 30.  # s
+REPORT_INTERVAL = 5.  # s
+PERCENTILES = (50, 90, 99)
+EXCEEDED_REPORTS = 2  # consecutive reports over budget before it's an event
+MAX_PENDING = 100  # frames/plans kept to match the latency chain
+GAUGE_DEADBAND = 0.1  # ms or % of a core, smaller changes aren't sent to statsd
+
+# metric: (statistic, limit)
+# cpu is in percent of one core, latencies and execution times in ms
+BUDGETS: Dict[str, Tuple[str, float]] = {
+  "cpu.controlsd": ("p50", 45.),
+  "cpu.plannerd": ("p50", 15.),
+  "cpu.radard": ("p50", 7.),
+  "cpu.paramsd": ("p50", 12.),
+  "cpu.torqued": ("p50", 8.),
+  "cpu.calibrationd": ("p50", 4.),
+  "cpu.dmonitoringd": ("p50", 6.),
+  "cpu.locationd": ("p50", 12.),
+  "cpu.modeld": ("p50", 8.),
+  "cpu.dmonitoringmodeld": ("p50", 8.),
+  "cpu.camerad": ("p50", 20.),
+  "cpu.sensord": ("p50", 15.),
+  "cpu.boardd": ("p50", 6.),
+  "cpu.loggerd": ("p50", 15.),
+  "cpu.encoderd": ("p50", 22.),
+  "cpu.ui": ("p50", 25.),
+
+  "latency.cameraToModel": ("p99", 80.),
+  "latency.modelToPlan": ("p99", 30.),
+  "latency.planToSendcan": ("p99", 20.),
+  "latency.cameraToSendcan": ("p99", 120.),
+
+  "exec.modelExecutionTime": ("p99", 50.),
+  "exec.lateralPlanSolver": ("p99", 15.),
+  "exec.longitudinalPlanSolver": ("p99", 15.),
+  "exec.controlsLag": ("p99", 10.),
+}
+
+# service: max p99 inter-arrival time, as a multiple of its period
+JITTER_SERVICES = {
+  "sendcan": 2.5,
+  "carState": 2.5,
+  "controlsState": 2.5,
+  "roadCameraState": 2.5,
+  "modelV2": 2.5,
+  "lateralPlan": 2.5,
+  "longitudinalPlan": 2.5,
+  "liveLocationKalman": 2.5,
+}
+BUDGETS.update({f"jitter.{s}": ("p99", factor * 1e3 / service_list[s].frequency) for s, factor in JITTER_SERVICES.items()})
+
+SERVICES = ["procLog", "roadCameraState", "modelV2", "lateralPlan", "longitudinalPlan", "sendcan", "controlsState"] + list(JITTER_SERVICES)
+
+
+def proc_name(cmdline0: str) -> str:
+  # ./_modeld -> modeld, selfdrive.controls.controlsd -> controlsd
+  return cmdline0.split('/')[-1].lstrip('_').split('.')[-1]
+
+
+def put_bounded(d: Dict, k: Any, v: Any, maxlen: int = MAX_PENDING) -> None:
+  d[k] = v
+  if len(d) > maxlen:
+    del d[next(iter(d))]
+
+
+class BudgetMonitor:
+  def __init__(self, budgets: Dict[str, Tuple[str, float]] = BUDGETS, window: float = WINDOW):
+    self.budgets = budgets
+    self.window = window
+    self.samples: Dict[str, Deque[Tuple[float, float]]] = defaultdict(deque)
+    self.over: Dict[str, int] = defaultdict(int)
+    self.exceeded: Dict[str, bool] = defaultdict(bool)
+
+    self.cpu_procs = {m.split('.', 1)[1] for m in budgets if m.startswith("cpu.")}
+    self.last_cpu: Dict[int, Tuple[float, float]] = {}
+    self.last_arrival: Dict[str, float] = {}
+
+    # latency chain: frameId -> start of frame, modelV2 time -> frameId, lateralPlan time -> modelV2 time
+    self.frame_sof: Dict[int, int] = {}
+    self.model_frame: Dict[int, int] = {}
+    self.plan_model: Dict[int, int] = {}
+    self.last_sendcan = 0
+    self.last_controls_plan = 0
+
+  def add(self, metric: str, t: float, value: float) -> None:
+    self.samples[metric].append((t, value))
+
+  def handle_log(self, msg) -> None:
+    which = msg.which()
+    t = msg.logMonoTime * 1e-9
+
+    if which in JITTER_SERVICES:
+      if which in self.last_arrival:
+        self.add(f"jitter.{which}", t, (t - self.last_arrival[which]) * 1e3)
+      self.last_arrival[which] = t
+
+    if which == "procLog":
+      cpu_times = {}
+      for p in msg.procLog.procs:
+        if not len(p.cmdline):
+          continue
+        name = proc_name(p.cmdline[0])
+        if name not in self.cpu_procs:
+          continue
+
+        cpu = p.cpuUser + p.cpuSystem + p.cpuChildrenUser + p.cpuChildrenSystem
+        cpu_times[p.pid] = (t, cpu)
+        if p.pid in self.last_cpu:
+          last_t, last_cpu = self.last_cpu[p.pid]
+          if t > last_t:
+            self.add(f"cpu.{name}", t, (cpu - last_cpu) / (t - last_t) * 100.)
+      # forget processes that exited
+      self.last_cpu = cpu_times
+
+    elif which == "roadCameraState":
+      put_bounded(self.frame_sof, msg.roadCameraState.frameId, msg.roadCameraState.timestampSof)
+
+    elif which == "modelV2":
+      frame_id = msg.modelV2.frameId
+      put_bounded(self.model_frame, msg.logMonoTime, frame_id)
+      if frame_id in self.frame_sof:
+        self.add("latency.cameraToModel", t, (msg.logMonoTime - self.frame_sof[frame_id]) * 1e-6)
+      self.add("exec.modelExecutionTime", t, msg.modelV2.modelExecutionTime * 1e3)
+
+    elif which == "lateralPlan":
+      model_t = msg.lateralPlan.modelMonoTime
+      put_bounded(self.plan_model, msg.logMonoTime, model_t)
+      if model_t in self.model_frame:
+        self.add("latency.modelToPlan", t, (msg.logMonoTime - model_t) * 1e-6)
+      self.add("exec.lateralPlanSolver", t, msg.lateralPlan.solverExecutionTime * 1e3)
+
+    elif which == "longitudinalPlan":
+      self.add("exec.longitudinalPlanSolver", t, msg.longitudinalPlan.solverExecutionTime * 1e3)
+
+    elif which == "sendcan":
+      self.last_sendcan = msg.logMonoTime
+
+    elif which == "controlsState":
+      self.add("exec.controlsLag", t, msg.controlsState.cumLagMs)
+
+      # sendcan is published right before controlsState, only the first controls
+      # loop that used a new plan counts for the chain
+      plan_t = msg.controlsState.lateralPlanMonoTime
+      if plan_t != self.last_controls_plan and plan_t in self.plan_model and self.last_sendcan >= plan_t:
+        self.last_controls_plan = plan_t
+        self.add("latency.planToSendcan", t, (self.last_sendcan - plan_t) * 1e-6)
+
+        frame_id = self.model_frame.get(self.plan_model[plan_t])
+        if frame_id in self.frame_sof:
+          self.add("latency.cameraToSendcan", t, (self.last_sendcan - self.frame_sof[frame_id]) * 1e-6)
+
+  def report(self, t: float) -> Tuple[Dict[str, Dict[str, float]], List[Dict[str, Any]]]:
+    """Rolling statistics of every metric, and the budget state changes since the last report"""
+    stats: Dict[str, Dict[str, float]] = {}
+    for metric, samples in self.samples.items():
+      while len(samples) and samples[0][0] < t - self.window:
+        samples.popleft()
+      if not len(samples):
+        continue
+
+      values = np.array([v for _, v in samples])
+      stats[metric] = {f"p{p}": float(v) for p, v in zip(PERCENTILES, np.percentile(values, PERCENTILES))}
+      stats[metric]["max"] = float(values.max())
+      stats[metric]["count"] = len(values)
+
+    changes = []
+    for metric, (stat, limit) in self.budgets.items():
+      if metric not in stats:
+        continue
+      value = stats[metric][stat]
+      self.over[metric] = self.over[metric] + 1 if value > limit else 0
+
+      exceeded = self.over[metric] >= EXCEEDED_REPORTS
+      if exceeded != self.exceeded[metric]:
+        self.exceeded[metric] = exceeded
+        changes.append({"metric": metric, "exceeded": exceeded, "stat": stat, "value": value, "limit": limit})
+
+    return stats, changes
+
+
+def main():
+  socks = {s: messaging.sub_sock(s, conflate=False) for s in SERVICES}
+  monitor = BudgetMonitor()
+  gauge_deadband = GaugeDeadband(GAUGE_DEADBAND)
+
+  rk = Ratekeeper(10, print_delay_threshold=None)
+  last_report = 0.
+  while True:
+    msgs = [m for sock in socks.values() for m in messaging.drain_sock(sock)]
+    for m in sorted(msgs, key=lambda m: m.logMonoTime):
+      monitor.handle_log(m)
+
+    t = max((m.logMonoTime * 1e-9 for m in msgs), default=0.)
+    if t - last_report > REPORT_INTERVAL:
+      last_report = t
+      stats, changes = monitor.report(t)
+
+      gauges = {f"budget.{metric}.p{p}": s[f"p{p}"] for metric, s in stats.items() for p in PERCENTILES}
+      statlog.gauges(gauge_deadband.update(gauges, t))
+      cloudlog.event("budget stats", stats=stats)
+
+      for c in changes:
+        if c["exceeded"]:
+          cloudlog.event("budget exceeded", error=True, **c)
+        else:
+          cloudlog.event("budget recovered", **c)
+
+    rk.keep_time()
+
+
+if __name__ == "__main__":
+  main()
@@ -1,6 +1,7 @@
 #!/usr/bin/env python3
 from collections import defaultdict
-from typing import Any, Optional, Set, Tuple
+from functools import lru_cache
+from typing import Any, Dict, List, Optional, Set, Tuple
 from tqdm import tqdm
 
 import panda.python.uds as uds
@@ -44,35 +45,68 @@ def get_brand_addrs():
   return brand_addrs
 
 
-def match_fw_to_car_fuzzy(fw_versions_dict, log=True, exclude=None):
-  """Do a fuzzy FW match. This function will return a match, and the number of firmware version
-  that were matched uniquely to that specific car. If multiple ECUs uniquely match to different cars
-  the match is rejected."""
+# These ECUs are known to be shared between models (EPS only between hybrid/ICE version)
+# Getting this exactly right isn't crucial, but excluding camera and radar makes it almost
+# impossible to get 3 matching versions, even if two models with shared parts are released at the same
+# time and only one is in our database.
+FUZZY_EXCLUDE_ECUS = [Ecu.fwdCamera, Ecu.fwdRadar, Ecu.eps, Ecu.debug]
 
-  # These ECUs are known to be shared between models (EPS only between hybrid/ICE version)
-  # Getting this exactly right isn't crucial, but excluding camera and radar makes it almost
-  # impossible to get 3 matching versions, even if two models with shared parts are released at the same
-  # time and only one is in our database.
-  exclude_types = [Ecu.fwdCamera, Ecu.fwdRadar, Ecu.eps, Ecu.debug]
 
-  # Build lookup table from (addr, sub_addr, fw) to list of candidate cars
+@lru_cache(maxsize=None)
+def fuzzy_lookup() -> Dict[Tuple[int, Optional[int], bytes], Tuple[str, ...]]:
+  """(addr, sub_addr, fw) to the cars that have it, built once"""
   all_fw_versions = defaultdict(list)
   for candidate, fw_by_addr in FW_VERSIONS.items():
-    if candidate == exclude:
-      continue
-
     for addr, fws in fw_by_addr.items():
-      if addr[0] in exclude_types:
+      if addr[0] in FUZZY_EXCLUDE_ECUS:
         continue
       for f in fws:
         all_fw_versions[(addr[1], addr[2], f)].append(candidate)
+  return {k: tuple(v) for k, v in all_fw_versions.items()}
+
+
+@lru_cache(maxsize=None)
+def exact_lookup() -> Tuple[Dict[Tuple[Tuple[int, Optional[int]], bytes], Set[Tuple[str, Any]]], Dict[str, List[Tuple[Any, bool]]]]:
+  """
+  (addr, fw) to the (car, ecu) pairs it's a valid version for, and per car the ecus that have to match,
+  with whether they have to be present. Built once.
+  """
+  versions: Dict[Tuple[Tuple[int, Optional[int]], bytes], Set[Tuple[str, Any]]] = defaultdict(set)
+  ecus: Dict[str, List[Tuple[Any, bool]]] = {}
+  for candidate, fws in FW_VERSIONS.items():
+    config = FW_QUERY_CONFIGS[MODEL_TO_BRAND[candidate]]
+    ecus[candidate] = []
+    for ecu, expected_versions in fws.items():
+      ecu_type = ecu[0]
+
+      # Virtual debug ecu doesn't need to match the database
+      if ecu_type == Ecu.debug:
+        continue
+
+      # Some models can sometimes miss an ecu, or show on two different addresses
+      # Non essential ecus can be missing
+      required = candidate not in config.non_essential_ecus.get(ecu_type, []) and ecu_type in ESSENTIAL_ECUS
+      ecus[candidate].append((ecu, required))
+      for version in expected_versions:
+        versions[(ecu[1:], version)].add((candidate, ecu))
+  return dict(versions), ecus
+
+
+def match_fw_to_car_fuzzy(fw_versions_dict, log=True, exclude=None):
+  """Do a fuzzy FW match. This function will return a match, and the number of firmware version
+  that were matched uniquely to that specific car. If multiple ECUs uniquely match to different cars
+  the match is rejected."""
+
+  all_fw_versions = fuzzy_lookup()
 
   match_count = 0
   candidate = None
   for addr, versions in fw_versions_dict.items():
     for version in versions:
       # All cars that have this FW response on the specified address
-      candidates = all_fw_versions[(addr[0], addr[1], version)]
+      candidates = all_fw_versions.get((addr[0], addr[1], version), ())
+      if exclude is not None:
+        candidates = tuple(c for c in candidates if c != exclude)
 
       if len(candidates) == 1:
         match_count += 1
@@ -95,34 +129,19 @@ def match_fw_to_car_exact(fw_versions_dict):
   FW versions for a list of "essential" ECUs. If an ECU is not considered
   essential the FW version can be missing to get a fingerprint, but if it's present it
   needs to match the database."""
-  invalid = []
-  candidates = FW_VERSIONS
-
-  for candidate, fws in candidates.items():
-    for ecu, expected_versions in fws.items():
-      config = FW_QUERY_CONFIGS[MODEL_TO_BRAND[candidate]]
-      ecu_type = ecu[0]
-      addr = ecu[1:]
-
-      found_versions = fw_versions_dict.get(addr, set())
-      if not len(found_versions):
-        # Some models can sometimes miss an ecu, or show on two different addresses
-        if candidate in config.non_essential_ecus.get(ecu_type, []):
-          continue
-
-        # Ignore non essential ecus
-        if ecu_type not in ESSENTIAL_ECUS:
-          continue
-
-      # Virtual debug ecu doesn't need to match the database
-      if ecu_type == Ecu.debug:
-        continue
-
-      if not any([found_version in expected_versions for found_version in found_versions]):
-        invalid.append(candidate)
-        break
-
-  return set(candidates.keys()) - set(invalid)
+  versions, ecus = exact_lookup()
+
+  # every (car, ecu) one of the found versions is valid for
+  valid = set()
+  for addr, found_versions in fw_versions_dict.items():
+    for found_version in found_versions:
+      valid |= versions.get((addr, found_version), set())
+
+  matches = set()
+  for candidate, candidate_ecus in ecus.items():
+    if all((candidate, ecu) in valid or (not required and ecu[1:] not in fw_versions_dict) for ecu, required in candidate_ecus):
+      matches.add(candidate)
+  return matches
 
 
 def match_fw_to_car(fw_versions, allow_exact=True, allow_fuzzy=True):
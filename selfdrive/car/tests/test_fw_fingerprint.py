@@ -7,7 +7,7 @@ from parameterized import parameterized
 from cereal import car
 from selfdrive.car.car_helpers import get_interface_attr, interfaces
 from selfdrive.car.fingerprints import FW_VERSIONS
-from selfdrive.car.fw_versions import FW_QUERY_CONFIGS, match_fw_to_car
+from selfdrive.car.fw_versions import ESSENTIAL_ECUS, FW_QUERY_CONFIGS, MODEL_TO_BRAND, match_fw_to_car, match_fw_to_car_exact
 
 CarFw = car.CarParams.CarFw
 Ecu = car.CarParams.Ecu
@@ -37,6 +37,40 @@ class TestFwFingerprint(unittest.TestCase):
       _, matches = match_fw_to_car(CP.carFw)
       self.assertFingerprints(matches, car_model)
 
+  def test_exact_match_lookup(self):
+    # the lookup tables give the same matches as checking every ecu of every car
+    def brute_force(fw_versions_dict):
+      matches = set()
+      for candidate, fws in FW_VERSIONS.items():
+        config = FW_QUERY_CONFIGS[MODEL_TO_BRAND[candidate]]
+        for (ecu_type, addr, sub_addr), expected_versions in fws.items():
+          found_versions = fw_versions_dict.get((addr, sub_addr), set())
+          if not len(found_versions) and (candidate in config.non_essential_ecus.get(ecu_type, []) or ecu_type not in ESSENTIAL_ECUS):
+            continue
+          if ecu_type != Ecu.debug and not any(v in expected_versions for v in found_versions):
+            break
+        else:
+          matches.add(candidate)
+      return matches
+
+    versions_by_addr = defaultdict(set)
+    for fws in FW_VERSIONS.values():
+      for ecu, versions in fws.items():
+        versions_by_addr[ecu[1:]] |= set(versions)
+
+    random.seed(0)
+    for car_model, ecus in FW_VERSIONS.items():
+      for _ in range(20):
+        # drop some ecus and take some versions from other cars
+        fw_versions_dict = {}
+        for ecu, versions in ecus.items():
+          if random.random() < 0.2 or not len(versions):
+            continue
+          pool = list(versions_by_addr[ecu[1:]]) if random.random() < 0.2 else list(versions)
+          fw_versions_dict[ecu[1:]] = set(random.sample(pool, min(len(pool), random.randint(1, 2))))
+        with self.subTest(car_model=car_model):
+          self.assertEqual(match_fw_to_car_exact(fw_versions_dict), brute_force(fw_versions_dict))
+
   def test_no_duplicate_fw_versions(self):
     for car_model, ecus in FW_VERSIONS.items():
       with self.subTest(car_model=car_model):
@@ -6,6 +6,7 @@ from casadi import SX, vertcat, sin, cos
 
 from common.realtime import sec_since_boot
 from selfdrive.modeld.constants import T_IDXS
+from selfdrive.controls.lib.mpc_warm_start import WarmStart
 
 if __name__ == '__main__':  # generating code
   from third_party.acados.acados_template import AcadosModel, AcadosOcp, AcadosOcpSolver
@@ -131,30 +132,46 @@ def gen_lat_ocp():
 class LateralMpc():
   def __init__(self, x0=np.zeros(X_DIM)):
     self.solver = AcadosOcpSolverCython(MODEL_NAME, ACADOS_SOLVER_TYPE, N)
+    self.warm_start = WarmStart(T_IDXS[:N+1], X_DIM, 1, nominal=self.nominal_trajectory)
+    self.p = np.zeros(P_DIM)
     self.reset(x0)
 
+  @staticmethod
+  def nominal_trajectory(v):
+    # driving straight at constant speed, relative to the initial state
+    x = np.zeros((N+1, X_DIM))
+    x[:,0] = v * T_IDXS[:N+1]
+    return x, np.zeros((N, 1))
+
   def reset(self, x0=np.zeros(X_DIM)):
-    self.x_sol = np.zeros((N+1, X_DIM))
-    self.u_sol = np.zeros((N, 1))
     self.yref = np.zeros((N+1, COST_DIM))
-    for i in range(N):
-      self.solver.cost_set(i, "yref", self.yref[i])
+    self.solver.set_stages("yref", self.yref[:N])
     self.solver.cost_set(N, "yref", self.yref[N][:COST_E_DIM])
 
-    # Somehow needed for stable init
-    for i in range(N+1):
-      self.solver.set(i, 'x', np.zeros(X_DIM))
-      self.solver.set(i, 'p', np.zeros(P_DIM))
+    # Restart from the shifted last good solution, or a nominal one at the last speed,
+    # so the next run converges in one iteration. Zeros (the first time) are somehow
+    # needed for stable init.
+    self.x_sol, self.u_sol = self.warm_start.guess(sec_since_boot(), x0, self.p[0])
+    self.solver.set_stages('x', self.x_sol)
+    self.solver.set_stages('u', self.u_sol)
+    self.solver.set_stages('p', np.tile(self.p, (N+1, 1)))
     self.solver.constraints_set(0, "lbx", x0)
     self.solver.constraints_set(0, "ubx", x0)
     self.solver.solve()
     self.solution_status = 0
     self.solve_time = 0.0
     self.cost = 0
+    self.weights = None
 
   def set_weights(self, path_weight, heading_weight,
                   lat_accel_weight, lat_jerk_weight,
                   steering_rate_weight):
+    # plannerd calls this every cycle, only upload the cost matrices when they change
+    weights = (path_weight, heading_weight, lat_accel_weight, lat_jerk_weight, steering_rate_weight)
+    if weights == self.weights:
+      return
+    self.weights = weights
+
     W = np.asfortranarray(np.diag([path_weight, heading_weight,
                                    lat_accel_weight, lat_jerk_weight,
                                    steering_rate_weight]))
@@ -165,6 +182,7 @@ class LateralMpc():
   def run(self, x0, p, y_pts, heading_pts, yaw_rate_pts):
     x0_cp = np.copy(x0)
     p_cp = np.copy(p)
+    self.p = p_cp
     self.solver.constraints_set(0, "lbx", x0_cp)
     self.solver.constraints_set(0, "ubx", x0_cp)
     self.yref[:,0] = y_pts
@@ -172,22 +190,21 @@ class LateralMpc():
     # rotation_radius = p_cp[1]
     self.yref[:,1] = heading_pts * (v_ego + SPEED_OFFSET)
     self.yref[:,2] = yaw_rate_pts * (v_ego + SPEED_OFFSET)
-    for i in range(N):
-      self.solver.cost_set(i, "yref", self.yref[i])
-      self.solver.set(i, "p", p_cp)
-    self.solver.set(N, "p", p_cp)
+    self.solver.set_stages("yref", self.yref[:N])
+    self.solver.set_stages("p", np.tile(p_cp, (N+1, 1)))
     self.solver.cost_set(N, "yref", self.yref[N][:COST_E_DIM])
 
     t = sec_since_boot()
     self.solution_status = self.solver.solve()
     self.solve_time = sec_since_boot() - t
 
-    for i in range(N+1):
-      self.x_sol[i] = self.solver.get(i, 'x')
-    for i in range(N):
-      self.u_sol[i] = self.solver.get(i, 'u')
+    self.x_sol = self.solver.get_stages('x')
+    self.u_sol = self.solver.get_stages('u', 0, N)
     self.cost = self.solver.get_cost()
 
+    if self.solution_status == 0:
+      self.warm_start.store(t, self.x_sol, self.u_sol, p_cp[0])
+
 
 if __name__ == "__main__":
   ocp = gen_lat_ocp()
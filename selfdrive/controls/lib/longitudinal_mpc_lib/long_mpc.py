@@ -7,6 +7,7 @@ from common.numpy_fast import clip
 from system.swaglog import cloudlog
 from selfdrive.modeld.constants import index_function
 from selfdrive.controls.lib.radar_helpers import _LEAD_ACCEL_TAU
+from selfdrive.controls.lib.mpc_warm_start import WarmStart
 
 if __name__ == '__main__':  # generating code
   from third_party.acados.acados_template import AcadosModel, AcadosOcp, AcadosOcpSolver
@@ -200,53 +201,73 @@ class LongitudinalMpc:
   def __init__(self, mode='acc'):
     self.mode = mode
     self.solver = AcadosOcpSolverCython(MODEL_NAME, ACADOS_SOLVER_TYPE, N)
+    self.warm_start = WarmStart(T_IDXS, X_DIM, U_DIM, nominal=self.nominal_trajectory)
+    self.weight_cache = {}
     self.reset()
     self.source = SOURCES[2]
 
+  @staticmethod
+  def nominal_trajectory(v):
+    # cruising at constant speed, relative to the initial state
+    x = np.zeros((N+1, X_DIM))
+    x[:,0] = v * T_IDXS
+    return x, np.zeros((N, U_DIM))
+
   def reset(self):
     # self.solver = AcadosOcpSolverCython(MODEL_NAME, ACADOS_SOLVER_TYPE, N)
     self.solver.reset()
     # self.solver.options_set('print_level', 2)
-    self.v_solution = np.zeros(N+1)
-    self.a_solution = np.zeros(N+1)
-    self.prev_a = np.array(self.a_solution)
-    self.j_solution = np.zeros(N)
+    self.reset_solution()
     self.yref = np.zeros((N+1, COST_DIM))
-    for i in range(N):
-      self.solver.cost_set(i, "yref", self.yref[i])
+    self.solver.set_stages('yref', self.yref[:N])
     self.solver.cost_set(N, "yref", self.yref[N][:COST_E_DIM])
-    self.x_sol = np.zeros((N+1, X_DIM))
-    self.u_sol = np.zeros((N,1))
     self.params = np.zeros((N+1, PARAM_DIM))
-    for i in range(N+1):
-      self.solver.set(i, 'x', np.zeros(X_DIM))
+    self.solver.set_stages('x', self.x_sol)
     self.last_cloudlog_t = 0
     self.status = False
-    self.crash_cnt = 0.0
-    self.solution_status = 0
     # timers
     self.solve_time = 0.0
     self.time_qp_solution = 0.0
     self.time_linearization = 0.0
     self.time_integrator = 0.0
     self.x0 = np.zeros(X_DIM)
+    self.weights = None
     self.set_weights()
 
-  def set_cost_weights(self, cost_weights, constraint_cost_weights):
+  @staticmethod
+  def get_cost_matrices(cost_weights, constraint_cost_weights):
     W = np.asfortranarray(np.diag(cost_weights))
+    Ws = []
     for i in range(N):
       # TODO don't hardcode A_CHANGE_COST idx
       # reduce the cost on (a-a_prev) later in the horizon.
       W[4,4] = cost_weights[4] * np.interp(T_IDXS[i], [0.0, 1.0, 2.0], [1.0, 1.0, 0.0])
-      self.solver.cost_set(i, 'W', W)
+      Ws.append(np.copy(W, order='F'))
     # Setting the slice without the copy make the array not contiguous,
     # causing issues with the C interface.
-    self.solver.cost_set(N, 'W', np.copy(W[:COST_E_DIM, :COST_E_DIM]))
+    W_e = np.copy(W[:COST_E_DIM, :COST_E_DIM], order='F')
 
-    # Set L2 slack cost on lower bound constraints
+    # L2 slack cost on lower bound constraints
     Zl = np.array(constraint_cost_weights)
+    return Ws, W_e, Zl
+
+  def set_cost_weights(self, cost_weights, constraint_cost_weights):
+    # the weights only change with the mode or prev_accel_constraint,
+    # skip uploading N+1 identical matrices every cycle
+    weights = (tuple(cost_weights), tuple(constraint_cost_weights))
+    if weights == self.weights:
+      return
+    self.weights = weights
+
+    # a mode switch still has to upload, but the matrices are only built once
+    if weights not in self.weight_cache:
+      self.weight_cache[weights] = self.get_cost_matrices(cost_weights, constraint_cost_weights)
+    Ws, W_e, Zl = self.weight_cache[weights]
+
     for i in range(N):
+      self.solver.cost_set(i, 'W', Ws[i])
       self.solver.cost_set(i, 'Zl', Zl)
+    self.solver.cost_set(N, 'W', W_e)
 
   def set_weights(self, prev_accel_constraint=True):
     if self.mode == 'acc':
@@ -266,8 +287,7 @@ class LongitudinalMpc:
     self.x0[1] = v
     self.x0[2] = a
     if abs(v_prev - v) > 2.:  # probably only helps if v < v_prev
-      for i in range(0, N+1):
-        self.solver.set(i, 'x', self.x0)
+      self.solver.set_stages('x', np.tile(self.x0, (N+1, 1)))
 
   @staticmethod
   def extrapolate_lead(x_lead, v_lead, a_lead, a_lead_tau):
@@ -333,7 +353,7 @@ class LongitudinalMpc:
       v_cruise_clipped = np.clip(v_cruise * np.ones(N+1),
                                  v_lower,
                                  v_upper)
-      cruise_obstacle = np.cumsum(T_DIFFS * v_cruise_clipped) + get_safe_obstacle_distance(v_cruise_clipped)
+      cruise_obstacle = np.cumsum(T_DIFFS * v_cruise_clipped) + get_safe_obstacle_distance(v_cruise_clipped, T_FOLLOW)
       x_obstacles = np.column_stack([lead_0_obstacle, lead_1_obstacle, cruise_obstacle])
       self.source = SOURCES[np.argmin(x_obstacles[0])]
 
@@ -361,8 +381,7 @@ class LongitudinalMpc:
     self.yref[:,2] = v
     self.yref[:,3] = a
     self.yref[:,5] = j
-    for i in range(N):
-      self.solver.set(i, "yref", self.yref[i])
+    self.solver.set_stages("yref", self.yref[:N])
     self.solver.set(N, "yref", self.yref[N][:COST_E_DIM])
 
     self.params[:,2] = np.min(x_obstacles, axis=1)
@@ -388,8 +407,7 @@ class LongitudinalMpc:
   def run(self):
     # t0 = sec_since_boot()
     # reset = 0
-    for i in range(N+1):
-      self.solver.set(i, 'p', self.params[i])
+    self.solver.set_stages('p', self.params)
     self.solver.constraints_set(0, "lbx", self.x0)
     self.solver.constraints_set(0, "ubx", self.x0)
 
@@ -405,10 +423,8 @@ class LongitudinalMpc:
     # print(f"long_mpc residuals: {res[0]:.2e}, {res[1]:.2e}, {res[2]:.2e}, {res[3]:.2e}")
     # self.solver.print_statistics()
 
-    for i in range(N+1):
-      self.x_sol[i] = self.solver.get(i, 'x')
-    for i in range(N):
-      self.u_sol[i] = self.solver.get(i, 'u')
+    self.x_sol = self.solver.get_stages('x')
+    self.u_sol = self.solver.get_stages('u', 0, N)
 
     self.v_solution = self.x_sol[:,1]
     self.a_solution = self.x_sol[:,2]
@@ -417,14 +433,35 @@ class LongitudinalMpc:
     self.prev_a = np.interp(T_IDXS + 0.05, T_IDXS, self.a_solution)
 
     t = sec_since_boot()
-    if self.solution_status != 0:
+    if self.solution_status == 0:
+      self.warm_start.store(t, self.x_sol, self.u_sol, self.x0[1], self.status)
+    else:
       if t > self.last_cloudlog_t + 5.0:
         self.last_cloudlog_t = t
         cloudlog.warning(f"Long mpc reset, solution_status: {self.solution_status}")
-      self.reset()
-      # reset = 1
+      self.recover(t)
     # print(f"long_mpc timings: total internal {self.solve_time:.2e}, external: {(sec_since_boot() - t0):.2e} qp {self.time_qp_solution:.2e}, lin {self.time_linearization:.2e} qp_iter {qp_iter}, reset {reset}")
 
+  def reset_solution(self):
+    self.v_solution = np.zeros(N+1)
+    self.a_solution = np.zeros(N+1)
+    self.prev_a = np.array(self.a_solution)
+    self.j_solution = np.zeros(N)
+    self.x_sol = np.zeros((N+1, X_DIM))
+    self.u_sol = np.zeros((N,1))
+    self.crash_cnt = 0.0
+    self.solution_status = 0
+
+  def recover(self, t):
+    # Same as reset(), but the solver restarts from a warm start guess instead of
+    # zeros, so it doesn't take several SQP_RTI iterations to get back on track.
+    # The guess never converged, so it's only the solver's iterate and isn't published.
+    self.solver.reset()
+    self.reset_solution()
+    x_guess, u_guess = self.warm_start.guess(t, self.x0, self.x0[1], self.status)
+    self.solver.set_stages('x', x_guess)
+    self.solver.set_stages('u', u_guess)
+
 
 if __name__ == "__main__":
   ocp = gen_long_ocp()
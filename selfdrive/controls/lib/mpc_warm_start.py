@@ -0,0 +1,79 @@
+from typing import Callable, Dict, Optional, Tuple
+
+import numpy as np
+
+Trajectory = Tuple[np.ndarray, np.ndarray]
+
+SPEED_BINS = np.arange(0., 42., 2.)  # m/s
+MAX_SHIFT_AGE = 1.0  # s
+
+
+class WarmStart:
+  """
+  Initial guesses for an MPC to restart from after a solver reset.
+
+  The last converged solution is kept and shifted forward to the time of the reset.
+  Converged solutions are also banked by speed and lead state, relative to their
+  initial state, for when the last good solution is too old. The bank can be seeded
+  with nominal trajectories, otherwise the guess falls back to holding the state.
+  """
+  def __init__(self, t_idxs: np.ndarray, x_dim: int, u_dim: int,
+               nominal: Optional[Callable[[float], Trajectory]] = None,
+               speed_bins: np.ndarray = SPEED_BINS, max_age: float = MAX_SHIFT_AGE):
+    self.t_idxs = np.asarray(t_idxs, dtype=np.float64)
+    self.N = len(self.t_idxs) - 1
+    self.x_dim = x_dim
+    self.u_dim = u_dim
+    self.speed_bins = speed_bins
+    self.max_age = max_age
+
+    self.last: Optional[Tuple[float, np.ndarray, np.ndarray]] = None
+    self.bank: Dict[Tuple[int, bool], Trajectory] = {}
+    if nominal is not None:
+      for i, v in enumerate(speed_bins):
+        self.bank[(i, False)] = nominal(v)
+
+  def key(self, v: float, lead: bool = False) -> Tuple[int, bool]:
+    return int(np.argmin(np.abs(self.speed_bins - v))), bool(lead)
+
+  def store(self, t: float, x_sol: np.ndarray, u_sol: np.ndarray, v: float, lead: bool = False) -> bool:
+    """Keeps a converged solution, returns False if it isn't finite"""
+    if not (np.isfinite(x_sol).all() and np.isfinite(u_sol).all()):
+      return False
+
+    self.last = (t, np.array(x_sol), np.array(u_sol))
+    self.bank[self.key(v, lead)] = (x_sol - x_sol[0], np.array(u_sol))
+    return True
+
+  def shifted(self, t: float) -> Optional[Trajectory]:
+    """The last converged solution shifted forward to t, None if there is none or it's too old"""
+    if self.last is None:
+      return None
+
+    t_last, x, u = self.last
+    dt = t - t_last
+    if not 0. <= dt <= self.max_age:
+      return None
+
+    # states past the horizon are held at the last value
+    x_shifted = np.column_stack([np.interp(self.t_idxs + dt, self.t_idxs, x[:, i]) for i in range(self.x_dim)])
+    u_shifted = np.column_stack([np.interp(self.t_idxs[:-1] + dt, self.t_idxs[:-1], u[:, i]) for i in range(self.u_dim)])
+    return x_shifted, u_shifted
+
+  def guess(self, t: float, x0: np.ndarray, v: float, lead: bool = False) -> Trajectory:
+    """Initial guess for x and u starting at x0"""
+    shifted = self.shifted(t)
+    if shifted is not None:
+      x, u = shifted
+      return x - x[0] + x0, u
+
+    rel = self.bank.get(self.key(v, lead))
+    if rel is None:
+      rel = self.bank.get(self.key(v, False))
+    if rel is not None:
+      return rel[0] + x0, np.array(rel[1])
+
+    return np.tile(x0, (self.N + 1, 1)), np.zeros((self.N, self.u_dim))
+
+  def clear(self) -> None:
+    self.last = None
@@ -2,7 +2,7 @@ import unittest
 import numpy as np
 from selfdrive.controls.lib.lateral_mpc_lib.lat_mpc import LateralMpc
 from selfdrive.controls.lib.drive_helpers import CAR_ROTATION_RADIUS
-from selfdrive.controls.lib.lateral_mpc_lib.lat_mpc import N as LAT_MPC_N
+from selfdrive.controls.lib.lateral_mpc_lib.lat_mpc import N as LAT_MPC_N, X_DIM as LAT_MPC_X_DIM, COST_DIM, COST_E_DIM
 
 
 def run_mpc(lat_mpc=None, v_ref=30., x_init=0., y_init=0., psi_init=0., curvature_init=0.,
@@ -83,6 +83,49 @@ class TestLateralMpc(unittest.TestCase):
     left_psi_deg = np.degrees(sol[:,2])
     np.testing.assert_almost_equal(right_psi_deg, -left_psi_deg, decimal=3)
 
+  def test_set_get_stages(self):
+    solver = LateralMpc().solver
+    x = np.random.default_rng(0).standard_normal((LAT_MPC_N + 1, LAT_MPC_X_DIM))
+    u = np.random.default_rng(1).standard_normal((LAT_MPC_N, 1))
+
+    solver.set_stages('x', x)
+    for i in range(LAT_MPC_N):
+      solver.set(i, 'u', u[i])
+    for i in range(LAT_MPC_N + 1):
+      np.testing.assert_array_equal(solver.get(i, 'x'), x[i])
+    np.testing.assert_array_equal(solver.get_stages('u', 0, LAT_MPC_N), u)
+
+    solver.set_stages('x', 2 * x[3:7], start=3)
+    np.testing.assert_array_equal(solver.get_stages('x', 3, 7), 2 * x[3:7])
+    np.testing.assert_array_equal(solver.get_stages('x')[:3], x[:3])
+
+  def test_set_stages_solution(self):
+    # yref and p can't be read back, solving with either has to give the same solution
+    yref = np.zeros((LAT_MPC_N + 1, COST_DIM))
+    yref[:, 0] = np.linspace(0., 1., LAT_MPC_N + 1)
+    p = np.array([20., CAR_ROTATION_RADIUS])
+    x0 = np.array([0., 0.2, 0., 0.])
+
+    sols = []
+    for stages in (True, False):
+      lat_mpc = LateralMpc()
+      lat_mpc.set_weights(1., .1, 0.0, .05, 800)
+      solver = lat_mpc.solver
+      if stages:
+        solver.set_stages('yref', yref[:LAT_MPC_N])
+        solver.set_stages('p', np.tile(p, (LAT_MPC_N + 1, 1)))
+      else:
+        for i in range(LAT_MPC_N):
+          solver.set(i, 'yref', yref[i])
+        for i in range(LAT_MPC_N + 1):
+          solver.set(i, 'p', p)
+      solver.cost_set(LAT_MPC_N, 'yref', yref[LAT_MPC_N][:COST_E_DIM])
+      solver.constraints_set(0, 'lbx', x0)
+      solver.constraints_set(0, 'ubx', x0)
+      solver.solve()
+      sols.append([solver.get(i, 'x') for i in range(LAT_MPC_N + 1)])
+    np.testing.assert_array_equal(sols[0], sols[1])
+
 
 if __name__ == "__main__":
   unittest.main()
@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+import unittest
+import numpy as np
+
+import cereal.messaging as messaging
+from common.realtime import sec_since_boot
+from selfdrive.controls.lib.longitudinal_mpc_lib.long_mpc import LongitudinalMpc, N
+
+
+class FailingSolver:
+  """Solver that reports a failure for the next solve"""
+  def __init__(self, solver):
+    self.solver = solver
+    self.fail = False
+
+  def solve(self):
+    status = self.solver.solve()
+    if self.fail:
+      self.fail = False
+      return 4  # ACADOS_QP_FAILURE
+    return status
+
+  def __getattr__(self, name):
+    return getattr(self.solver, name)
+
+
+class TestLongitudinalMpc(unittest.TestCase):
+  def setUp(self):
+    self.mpc = LongitudinalMpc()
+    self.mpc.solver = FailingSolver(self.mpc.solver)
+    self.mpc.set_weights()
+    self.mpc.set_accel_limits(-3.5, 2.0)
+    self.radar = messaging.new_message('radarState').radarState
+
+  def step(self, v_ego, a_ego, v_cruise=25.):
+    self.mpc.set_cur_state(v_ego, a_ego)
+    self.mpc.update(self.radar, v_cruise, *(np.zeros(N+1) for _ in range(4)))
+
+  def test_recover(self):
+    # accelerating to the cruise speed
+    for _ in range(10):
+      self.step(20., 1.)
+    self.assertEqual(self.mpc.solution_status, 0)
+    self.assertGreater(self.mpc.a_solution[1], 0.1)
+    self.mpc.crash_cnt = 2.
+
+    self.mpc.solver.fail = True
+    self.step(20., 1.)
+    x_guess, _ = self.mpc.warm_start.guess(sec_since_boot(), self.mpc.x0, 20.)
+
+    # the same state as a reset, the warm start guess is only used by the solver
+    self.assertEqual(self.mpc.crash_cnt, 0)
+    self.assertEqual(self.mpc.solution_status, 0)
+    for sol in (self.mpc.v_solution, self.mpc.a_solution, self.mpc.j_solution, self.mpc.prev_a, self.mpc.x_sol):
+      np.testing.assert_array_equal(sol, 0.)
+    self.assertFalse(np.allclose(self.mpc.v_solution, x_guess[:,1]))
+
+    self.step(20., 1.)
+    self.assertEqual(self.mpc.solution_status, 0)
+    self.assertAlmostEqual(self.mpc.v_solution[0], 20., places=3)
+    self.assertGreater(self.mpc.a_solution[1], 0.1)
+
+
+if __name__ == "__main__":
+  unittest.main()
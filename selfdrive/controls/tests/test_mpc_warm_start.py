@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+import unittest
+import numpy as np
+
+from selfdrive.controls.lib.mpc_warm_start import WarmStart
+
+T_IDXS = np.arange(11) * 0.2
+N = len(T_IDXS) - 1
+
+
+def nominal(v):
+  x = np.zeros((N+1, 3))
+  x[:,0] = v * T_IDXS
+  return x, np.zeros((N, 1))
+
+
+def solution(x0, v, a):
+  t = T_IDXS
+  x = np.column_stack([x0 + v*t + a*t**2/2, v + a*t, a*np.ones_like(t)])
+  return x, np.ones((N, 1)) * a
+
+
+class TestWarmStart(unittest.TestCase):
+  def test_hold_state(self):
+    ws = WarmStart(T_IDXS, 3, 1)
+    x, u = ws.guess(0., np.array([0., 5., 0.]), 5.)
+    self.assertEqual(x.shape, (N+1, 3))
+    self.assertEqual(u.shape, (N, 1))
+    np.testing.assert_allclose(x[:,1], 5.)
+
+  def test_nominal(self):
+    ws = WarmStart(T_IDXS, 3, 1, nominal=nominal)
+    x, _ = ws.guess(0., np.array([0., 10., 0.]), 10.)
+    np.testing.assert_allclose(x[:,0], 10. * T_IDXS)
+    np.testing.assert_allclose(x[:,1], 10.)
+
+  def test_shifted(self):
+    ws = WarmStart(T_IDXS, 3, 1, nominal=nominal)
+    x_sol, u_sol = solution(0., 10., 1.)
+    self.assertTrue(ws.store(1., x_sol, u_sol, 10.))
+
+    # a reset 0.2s later starts from the previous solution one step ahead
+    x0 = x_sol[1] - [x_sol[1, 0], 0., 0.]
+    x, u = ws.guess(1.2, x0, x0[1])
+    np.testing.assert_allclose(x[:-1, 1:], x_sol[1:, 1:])
+    np.testing.assert_allclose(x[:-1, 0], x_sol[1:, 0] - x_sol[1, 0])
+    np.testing.assert_allclose(x[-1], x[-2])
+    np.testing.assert_allclose(u, u_sol)
+
+  def test_bank(self):
+    ws = WarmStart(T_IDXS, 3, 1, nominal=nominal)
+    x_sol, u_sol = solution(0., 10., -1.)
+    ws.store(1., x_sol, u_sol, 10., lead=True)
+
+    # too old to shift, but the banked solution for this speed and lead state is used
+    x, u = ws.guess(5., np.array([0., 10., -1.]), 10.5, lead=True)
+    np.testing.assert_allclose(x, x_sol)
+    np.testing.assert_allclose(u, u_sol)
+
+    # no banked solution with a lead at this speed, falls back to the nominal one
+    x, _ = ws.guess(5., np.array([0., 20., 0.]), 20., lead=True)
+    np.testing.assert_allclose(x[:,0], 20. * T_IDXS)
+
+  def test_nan(self):
+    ws = WarmStart(T_IDXS, 3, 1)
+    x_sol, u_sol = solution(0., 10., 0.)
+    x_sol[3, 1] = np.nan
+    self.assertFalse(ws.store(0., x_sol, u_sol, 10.))
+    self.assertIsNone(ws.shifted(0.1))
+    self.assertTrue(np.isfinite(ws.guess(0.1, np.zeros(3), 10.)[0]).all())
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -3,8 +3,11 @@ import argparse
 import binascii
 from collections import defaultdict
 
+import numpy as np
+
 import cereal.messaging as messaging
 from common.realtime import sec_since_boot
+from selfdrive.boardd.boardd import can_capnp_to_can_array
 
 
 def can_printer(bus, max_msg, addr, ascii_decode):
@@ -12,23 +15,27 @@ def can_printer(bus, max_msg, addr, ascii_decode):
 
   start = sec_since_boot()
   lp = sec_since_boot()
-  msgs = defaultdict(list)
+  counts = defaultdict(int)
+  last_dat = {}
   while 1:
-    can_recv = messaging.drain_sock(logcan, wait_for_one=True)
-    for x in can_recv:
-      for y in x.can:
-        if y.src == bus:
-          msgs[y.address].append(y.dat)
+    can_recv = messaging.drain_sock_raw(logcan, wait_for_one=True)
+    frames = can_capnp_to_can_array(can_recv, src_filter=[bus], dat_size=64)
+
+    # count and keep the newest payload of every address
+    addrs, last, n = np.unique(frames['address'][::-1], return_index=True, return_counts=True)
+    for address, i, cnt in zip(addrs.tolist(), (len(frames) - 1 - last).tolist(), n.tolist()):
+      counts[address] += cnt
+      last_dat[address] = frames['dat'][i][:frames['length'][i]].tobytes()
 
     if sec_since_boot() - lp > 0.1:
       dd = chr(27) + "[2J"
       dd += f"{sec_since_boot() - start:5.2f}\n"
-      for addr in sorted(msgs.keys()):
-        a = f"\"{msgs[addr][-1].decode('ascii', 'backslashreplace')}\"" if ascii_decode else ""
-        x = binascii.hexlify(msgs[addr][-1]).decode('ascii')
-        freq = len(msgs[addr]) / (sec_since_boot() - start)
+      for addr in sorted(last_dat.keys()):
+        a = f"\"{last_dat[addr].decode('ascii', 'backslashreplace')}\"" if ascii_decode else ""
+        x = binascii.hexlify(last_dat[addr]).decode('ascii')
+        freq = counts[addr] / (sec_since_boot() - start)
         if max_msg is None or addr < max_msg:
-          dd += "%04X(%4d)(%6d)(%3dHz) %s %s\n" % (addr, addr, len(msgs[addr]), freq, x.ljust(20), a)
+          dd += "%04X(%4d)(%6d)(%3dHz) %s %s\n" % (addr, addr, counts[addr], freq, x.ljust(20), a)
       print(dd)
       lp = sec_since_boot()
 
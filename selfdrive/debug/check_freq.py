@@ -1,5 +1,6 @@
 #!/usr/bin/env python3
 import argparse
+import sys
 import numpy as np
 from collections import defaultdict, deque
 from typing import DefaultDict, Deque, MutableSequence
@@ -8,14 +9,33 @@ from common.realtime import sec_since_boot
 import cereal.messaging as messaging
 
 
-if __name__ == "__main__":
-  context = messaging.Context()
-  poller = messaging.Poller()
+def print_route_freq(route, socket_names, qlog):
+  from tools.lib.segment_summary import merge_summaries, route_summaries
+
+  summary = merge_summaries(route_summaries(route, qlog=qlog))
+  for name in (socket_names or sorted(summary['intervals'])):
+    i = summary['intervals'].get(name)
+    if i is None:
+      print(f"{name}: not enough messages")
+      continue
+    print(f"{name}: Freq {1.0 / i['mean']:.2f} Hz, Min {i['min'] / i['mean'] * 100:.2f}%, Max {i['max'] / i['mean'] * 100:.2f}%, "
+          f"p99 {i['p99'] / i['mean'] * 100:.2f}%, invalid {summary['invalid'].get(name, 0)}/{summary['counts'].get(name, 0)}")
+
 
+if __name__ == "__main__":
   parser = argparse.ArgumentParser()
   parser.add_argument("socket", type=str, nargs='*', help="socket name")
+  parser.add_argument("--route", help="frequencies over a route from its segment summaries, instead of live sockets")
+  parser.add_argument("--qlog", action="store_true", help="use the qlogs of the route")
   args = parser.parse_args()
 
+  if args.route:
+    print_route_freq(args.route, args.socket, args.qlog)
+    sys.exit(0)
+
+  context = messaging.Context()
+  poller = messaging.Poller()
+
   socket_names = args.socket
   sockets = {}
 
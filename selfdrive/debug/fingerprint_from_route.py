@@ -2,23 +2,16 @@
 
 import sys
 from tools.lib.route import Route
-from tools.lib.logreader import MultiLogIterator
+from tools.lib.segment_summary import car_params, get_summary, merge_summaries
 
 
-def get_fingerprint(lr):
+def get_fingerprint(summary):
   # TODO: make this a nice tool for car ports. should also work with qlogs for FW
 
-  fw = None
-  msgs = {}
-  for msg in lr:
-    if msg.which() == 'carParams':
-      fw = msg.carParams.carFw
-    elif msg.which() == 'can':
-      for c in msg.can:
-        # read also msgs sent by EON on CAN bus 0x80 and filter out the
-        # addr with more than 11 bits
-        if c.src % 0x80 == 0 and c.address < 0x800:
-          msgs[c.address] = len(c.dat)
+  # msgs also sent by EON on CAN bus 0x80, without the addr with more than 11 bits
+  msgs = {int(addr): length for addr, length in summary['can_fingerprint'].items()}
+  CP = car_params(summary)
+  fw = CP.carFw if CP is not None else []
 
   # show CAN fingerprint
   fingerprint = ', '.join("%d: %d" % v for v in sorted(msgs.items()))
@@ -41,5 +34,5 @@ if __name__ == "__main__":
     sys.exit(1)
 
   route = Route(sys.argv[1])
-  lr = MultiLogIterator(route.log_paths()[:5])
-  get_fingerprint(lr)
+  summary = merge_summaries(get_summary(p) for p in route.log_paths()[:5] if p is not None)
+  get_fingerprint(summary)
@@ -0,0 +1,188 @@
+#!/usr/bin/env python3
+"""
+Checks the FW database against a corpus of carFw sets from routes.
+
+Collect the first carParams of many routes once (through the segment summaries):
+  ./fw_corpus.py collect routes.txt corpus.jsonl -j 16
+
+and then match the whole corpus after every change to FW_VERSIONS, the lookup tables are only built once:
+  ./fw_corpus.py check corpus.jsonl > report.txt
+
+The report is sorted and has no timings, so two reports can be diffed.
+"""
+import argparse
+import json
+import multiprocessing
+import os
+from collections import Counter, defaultdict
+from typing import Any, Dict, List, NamedTuple, Optional
+
+from cereal import car
+from selfdrive.car.fw_versions import FW_VERSIONS, MODEL_TO_BRAND, exact_lookup, fuzzy_lookup, match_fw_to_car
+
+try:
+  from xx.pipeline.c.CarState import migration
+except ImportError:
+  migration = {}
+
+Ecu = car.CarParams.Ecu
+ECU_NAME = {v: k for k, v in Ecu.schema.enumerants.items()}
+
+Record = Dict[str, Any]
+
+
+class FwVersion(NamedTuple):
+  brand: str
+  ecu: str
+  address: int
+  subAddress: int
+  fwVersion: bytes
+
+
+def record_from_route(route_name: str) -> Optional[Record]:
+  from tools.lib.route import Route
+  from tools.lib.segment_summary import car_params, get_summary
+
+  route = Route(route_name)
+  qlog_path = next((p for p in route.qlog_paths() if p is not None), None)
+  if qlog_path is None:
+    return None
+  summary = get_summary(qlog_path)
+  if summary is None:
+    return None
+  CP = car_params(summary)
+  if CP is None or len(CP.carFw) == 0:
+    return None
+  return {
+    'route': route_name,
+    'carFingerprint': CP.carFingerprint,
+    'carFw': [{'brand': fw.brand, 'ecu': str(fw.ecu), 'address': fw.address, 'subAddress': fw.subAddress,
+               'fwVersion': fw.fwVersion.hex()} for fw in CP.carFw],
+  }
+
+
+def collect_worker(route_name: str) -> Optional[Record]:
+  try:
+    return record_from_route(route_name)
+  except Exception as e:
+    print(f"{route_name} failed: {e}")
+    return None
+
+
+def fw_versions(record: Record) -> List[FwVersion]:
+  return [FwVersion(fw['brand'], fw['ecu'], fw['address'], fw['subAddress'], bytes.fromhex(fw['fwVersion'])) for fw in record['carFw']]
+
+
+def missing_versions(live_fingerprint: str, car_fw: List[FwVersion]) -> List[tuple]:
+  """Versions of the car that aren't in the database for it, like test_fw_query_on_routes reports them"""
+  expected = FW_VERSIONS.get(live_fingerprint)
+  brand = MODEL_TO_BRAND.get(live_fingerprint)
+  missing = []
+  for fw in car_fw:
+    sub_addr = None if fw.subAddress == 0 else fw.subAddress
+    if expected is None:
+      missing.append((fw.ecu, fw.address, sub_addr, fw.fwVersion))
+      continue
+    if len(fw.brand) and fw.brand != brand:
+      continue
+    for (ecu, addr, expected_sub_addr), versions in expected.items():
+      if (addr, expected_sub_addr) == (fw.address, sub_addr) and fw.fwVersion not in versions:
+        missing.append((ECU_NAME[ecu], fw.address, sub_addr, fw.fwVersion))
+  return missing
+
+
+def match_record(record: Record) -> Record:
+  car_fw = fw_versions(record)
+  live_fingerprint = migration.get(record['carFingerprint'], record['carFingerprint'])
+  _, exact = match_fw_to_car(car_fw, allow_exact=True, allow_fuzzy=False)
+  _, fuzzy = match_fw_to_car(car_fw, allow_exact=False, allow_fuzzy=True)
+  return {'route': record['route'], 'live': live_fingerprint, 'exact': sorted(exact), 'fuzzy': sorted(fuzzy),
+          'missing': missing_versions(live_fingerprint, car_fw)}
+
+
+def classify(result: Record) -> str:
+  exact, fuzzy, live = result['exact'], result['fuzzy'], result['live']
+  if exact == [live]:
+    return 'exact'
+  if len(exact) > 1:
+    return 'ambiguous'
+  if len(exact) == 1:
+    return 'wrong exact'
+  if fuzzy == [live]:
+    return 'fuzzy'
+  if len(fuzzy) == 1:
+    return 'wrong fuzzy'
+  return 'no match'
+
+
+def report(results: List[Record]) -> str:
+  by_car: Dict[str, List[Record]] = defaultdict(list)
+  for r in results:
+    by_car[r['live']].append(r)
+
+  totals: Counter = Counter()
+  lines = []
+  for candidate in sorted(by_car):
+    outcomes = Counter(classify(r) for r in by_car[candidate])
+    totals.update(outcomes)
+    lines.append(f"{candidate}: {len(by_car[candidate])} routes, " + ", ".join(f"{k} {v}" for k, v in sorted(outcomes.items())))
+
+    # wrong and ambiguous matches, with the cars they matched
+    for r in sorted(by_car[candidate], key=lambda r: r['route']):
+      outcome = classify(r)
+      if outcome not in ('exact', 'fuzzy'):
+        lines.append(f"  {outcome}: {r['route']} exact {r['exact']} fuzzy {r['fuzzy']}")
+
+    missing: Dict[tuple, Counter] = defaultdict(Counter)
+    for r in by_car[candidate]:
+      for ecu, addr, sub_addr, version in set(r['missing']):
+        missing[(ecu, addr, sub_addr)][version] += 1
+    for (ecu, addr, sub_addr), versions in sorted(missing.items(), key=lambda kv: (kv[0][1], kv[0][2] or 0, kv[0][0])):
+      lines.append(f"  missing (Ecu.{ecu}, {hex(addr)}, {None if sub_addr is None else hex(sub_addr)}):")
+      for version, count in sorted(versions.items()):
+        lines.append(f"    {version!r},  # {count} routes")
+
+  lines.append("")
+  lines.append(f"{len(results)} routes: " + ", ".join(f"{k} {v}" for k, v in sorted(totals.items())))
+  return "\n".join(lines)
+
+
+def check(corpus: List[Record], jobs: int) -> List[Record]:
+  # build the lookup tables before forking, every worker shares them
+  fuzzy_lookup()
+  exact_lookup()
+  if jobs <= 1:
+    return [match_record(r) for r in corpus]
+  with multiprocessing.Pool(jobs) as pool:
+    return pool.map(match_record, corpus, chunksize=max(1, len(corpus) // (jobs * 8)))
+
+
+def load_corpus(fn: str) -> List[Record]:
+  with open(fn) as f:
+    return [json.loads(line) for line in f if line.strip()]
+
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser(description="Check FW_VERSIONS against the carFw of many routes")
+  subparsers = parser.add_subparsers(dest="cmd", required=True)
+
+  collect_parser = subparsers.add_parser("collect", help="collect the carFw of routes into a corpus")
+  collect_parser.add_argument("routes", help="file with a route per line")
+  collect_parser.add_argument("corpus", help="corpus to write, a JSON record per line")
+  collect_parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count())
+
+  check_parser = subparsers.add_parser("check", help="match a corpus against the database and print a report")
+  check_parser.add_argument("corpus")
+  check_parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count())
+  args = parser.parse_args()
+
+  if args.cmd == "collect":
+    with open(args.routes) as f:
+      # one route per dongle is enough
+      routes = list({r.split('|')[0]: r for r in (line.strip() for line in f) if r}.values())
+    with multiprocessing.Pool(args.jobs) as pool, open(args.corpus, "w") as out:
+      for record in pool.imap_unordered(collect_worker, routes):
+        if record is not None:
+          out.write(json.dumps(record) + "\n")
+  else:
+    print(report(check(load_corpus(args.corpus), args.jobs)))
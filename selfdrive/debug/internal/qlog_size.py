@@ -1,20 +1,15 @@
 #!/usr/bin/env python3
 import argparse
-import bz2
-from collections import defaultdict
 
 import matplotlib.pyplot as plt
 
-from cereal.services import service_list
-from tools.lib.logreader import LogReader
 from tools.lib.route import Route
+from tools.lib.segment_summary import get_summary
 
 MIN_SIZE = 0.5  # Percent size of total to show as separate entry
 
 
-def make_pie(msgs, typ):
-  compressed_length_by_type = {k: len(bz2.compress(b"".join(v))) for k, v in msgs.items()}
-
+def make_pie(compressed_length_by_type, typ):
   total = sum(compressed_length_by_type.values())
 
   sizes = sorted(compressed_length_by_type.items(), key=lambda kv: kv[1])
@@ -42,21 +37,10 @@ if __name__ == "__main__":
 
   r = Route(args.route)
   rlog = r.log_paths()[args.segment]
-  msgs = list(LogReader(rlog))
-
-  msgs_by_type = defaultdict(list)
-  for m in msgs:
-    msgs_by_type[m.which()].append(m.as_builder().to_bytes())
-
-  qlog_by_type = defaultdict(list)
-  for name, service in service_list.items():
-    if service.decimation is None:
-      continue
-
-    for i, msg in enumerate(msgs_by_type[name]):
-      if i % service.decimation == 0:
-        qlog_by_type[name].append(msg)
+  # compressed sizes per service, and of only the messages that go into the qlog
+  summary = get_summary(rlog)
+  assert summary is not None
 
-  make_pie(msgs_by_type, 'rlog')
-  make_pie(qlog_by_type, 'qlog')
+  make_pie(summary['sizes'], 'rlog')
+  make_pie(summary['decimated_sizes'], 'qlog')
   plt.show()
@@ -279,7 +279,9 @@ class LocKalman():
                [h_pseudorange_rate_sym, ObservationKind.PSEUDORANGE_RATE_GLONASS, sat_pos_vel_sym],
                [h_relative_motion, ObservationKind.CAMERA_ODO_TRANSLATION, None],
                [h_phone_rot_sym, ObservationKind.CAMERA_ODO_ROTATION, None],
-               [h_acc_stationary_sym, ObservationKind.NO_ACCEL, None]]
+               [h_acc_stationary_sym, ObservationKind.NO_ACCEL, None],
+               [pos, ObservationKind.ECEF_POS, None],
+               [sp.Matrix([vx, vy, vz]), ObservationKind.ECEF_VEL, None]]
 
     wide_from_device = euler_rotate(*wide_from_device_euler)
     # MSCKF configuration
@@ -359,6 +361,7 @@ class LocKalman():
                       ObservationKind.IMU_FRAME: np.diag([0.05**2, 0.05**2, 0.05**2]),
                       ObservationKind.NO_ROT: np.diag([0.0025**2, 0.0025**2, 0.0025**2]),
                       ObservationKind.ECEF_POS: np.diag([5**2, 5**2, 5**2]),
+                      ObservationKind.ECEF_VEL: np.diag([.5**2, .5**2, .5**2]),
                       ObservationKind.NO_ACCEL: np.diag([0.0025**2, 0.0025**2, 0.0025**2])}
 
     # MSCKF stuff
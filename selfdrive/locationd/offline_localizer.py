@@ -0,0 +1,324 @@
+#!/usr/bin/env python3
+"""
+Offline localizer: runs LocKalman over a whole log as fast as possible, optionally
+RTS-smooths the result and writes the poses to a columnar .npz file.
+
+The observations are prepared like locationd does, but extracted from the log in bulk
+and fed to the filter in batches of the same time and kind, without any real-time
+constraints. The smoother runs over windows of the forward pass, so memory stays
+bounded on long routes.
+"""
+import argparse
+from typing import Any, Dict, Iterable, List, Optional
+
+import numpy as np
+
+from cereal import log
+from common.transformations.coordinates import ecef2geodetic, geodetic2ecef
+from common.transformations.orientation import ecef_euler_from_ned, euler2quat, euler2rot
+from selfdrive.locationd.models.constants import GENERATED_DIR, ObservationKind
+from selfdrive.locationd.models.live_kf import LiveKalman
+from selfdrive.locationd.models.loc_kf import LocKalman, States
+
+# same sanity checks and tuning as locationd
+ACCEL_SANITY_CHECK = 100.0  # m/s^2
+ROTATION_SANITY_CHECK = 10.0  # rad/s
+TRANS_SANITY_CHECK = 200.0  # m/s
+CALIB_RPY_SANITY_CHECK = 0.5  # rad
+ALTITUDE_SANITY_CHECK = 10000  # m
+MIN_STD_SANITY_CHECK = 1e-5  # m or rad
+SANE_GPS_UNCERTAINTY = 1500.0  # m
+GPS_MUL_FACTOR = 10.0
+GPS_QUECTEL_SENSOR_TIME_OFFSET = 0.630  # s
+GPS_UBLOX_SENSOR_TIME_OFFSET = 0.095  # s
+
+SENSOR_ACCELEROMETER = 1
+SENSOR_GYRO_UNCALIBRATED = 5
+SENSOR_TYPE_ACCELEROMETER = 1
+SENSOR_TYPE_GYROSCOPE_UNCALIBRATED = 16
+
+SMOOTH_WINDOW = 10.  # s
+SMOOTH_LAG = 5.  # s
+OUTPUT_RATE = 20.  # Hz
+
+OBSERVATION_COLUMNS = ('t', 'kind', 'z', 'R')
+
+
+def ned2ecef_rot(lat: np.ndarray, lon: np.ndarray) -> np.ndarray:
+  """(N, 3, 3) rotations from NED to ECEF at the given geodetic positions in degrees"""
+  lat, lon = np.radians(lat), np.radians(lon)
+  slat, clat, slon, clon = np.sin(lat), np.cos(lat), np.sin(lon), np.cos(lon)
+  zero = np.zeros_like(lat)
+  ecef2ned = np.stack([np.stack([-slat * clon, -slat * slon, clat], axis=-1),
+                       np.stack([-slon, clon, zero], axis=-1),
+                       np.stack([-clat * clon, -clat * slon, -slat], axis=-1)], axis=-2)
+  return np.swapaxes(ecef2ned, -1, -2)
+
+
+def observation_table(t: List[float], kind: List[int], z: List, R: List) -> Dict[str, np.ndarray]:
+  return {
+    't': np.array(t, dtype=np.float64),
+    'kind': np.array(kind, dtype=np.int32),
+    'z': np.array(z, dtype=np.float64).reshape(-1, 3),
+    'R': np.array(R, dtype=np.float64).reshape(-1, 3),
+  }
+
+
+def extract_observations(lr: Iterable) -> Dict[str, np.ndarray]:
+  """
+  All filter observations in the log as columns sorted by time: t, kind, z (N, 3)
+  and the diagonal of R (N, 3). A NaN R means the filter's default noise.
+  """
+  t: List[float] = []
+  kind: List[int] = []
+  z: List = []
+  R: List = []
+  gps_rows = []
+  device_from_calib = np.eye(3)
+  nan3 = [np.nan] * 3
+  ublox_available = None
+
+  for msg in lr:
+    which = msg.which()
+    log_t = msg.logMonoTime * 1e-9
+
+    if which in ('accelerometer', 'gyroscope'):
+      ev = getattr(msg, which)
+      if ev.timestamp == 0 or ev.source == log.SensorEventData.SensorSource.bmx055:
+        continue
+      sensor_t = ev.timestamp * 1e-9
+      if abs(log_t - sensor_t) > 0.1:
+        continue
+
+      if ev.sensor == SENSOR_GYRO_UNCALIBRATED and ev.type == SENSOR_TYPE_GYROSCOPE_UNCALIBRATED:
+        v, k, limit = ev.gyroUncalibrated.v, ObservationKind.PHONE_GYRO, ROTATION_SANITY_CHECK
+      elif ev.sensor == SENSOR_ACCELEROMETER and ev.type == SENSOR_TYPE_ACCELEROMETER:
+        v, k, limit = ev.acceleration.v, ObservationKind.PHONE_ACCEL, ACCEL_SANITY_CHECK
+      else:
+        continue
+
+      meas = [-v[2], -v[1], -v[0]]
+      if np.linalg.norm(meas) < limit:
+        t.append(sensor_t)
+        kind.append(k)
+        z.append(meas)
+        R.append(nan3)
+
+    elif which == 'liveCalibration':
+      rpy = list(msg.liveCalibration.rpyCalib)
+      if len(rpy) and all(abs(x) <= CALIB_RPY_SANITY_CHECK for x in rpy):
+        device_from_calib = euler2rot(rpy)
+
+    elif which == 'cameraOdometry':
+      co = msg.cameraOdometry
+      rot = device_from_calib @ np.array(co.rot)
+      trans = device_from_calib @ np.array(co.trans)
+      rot_std, trans_std = np.array(co.rotStd), np.array(co.transStd)
+      if np.linalg.norm(rot) > ROTATION_SANITY_CHECK or np.linalg.norm(trans) > TRANS_SANITY_CHECK:
+        continue
+      if min(rot_std.min(), trans_std.min()) <= MIN_STD_SANITY_CHECK:
+        continue
+      if np.linalg.norm(rot_std) > 10 * ROTATION_SANITY_CHECK or np.linalg.norm(trans_std) > 10 * TRANS_SANITY_CHECK:
+        continue
+
+      # stds are inflated for temporally correlated noise, and rotated as covariances
+      for k, meas, std in ((ObservationKind.CAMERA_ODO_ROTATION, rot, rot_std),
+                           (ObservationKind.CAMERA_ODO_TRANSLATION, trans, trans_std)):
+        t.append(log_t)
+        kind.append(k)
+        z.append(meas)
+        R.append(np.diag(device_from_calib @ np.diag((10 * std)**2) @ device_from_calib.T))
+
+    elif which == 'carState':
+      if msg.carState.standstill:
+        for k in (ObservationKind.NO_ROT, ObservationKind.NO_ACCEL):
+          t.append(log_t)
+          kind.append(k)
+          z.append([0., 0., 0.])
+          R.append(nan3)
+
+    elif which in ('gpsLocationExternal', 'gpsLocation'):
+      if which == 'gpsLocationExternal':
+        ublox_available = True
+      elif ublox_available:
+        continue
+      gps = getattr(msg, which)
+      offset = GPS_UBLOX_SENSOR_TIME_OFFSET if which == 'gpsLocationExternal' else GPS_QUECTEL_SENSOR_TIME_OFFSET
+      gps_rows.append([log_t - offset, gps.flags, gps.latitude, gps.longitude, gps.altitude, *gps.vNED,
+                       gps.accuracy, gps.verticalAccuracy, gps.speedAccuracy, gps.bearingAccuracyDeg,
+                       which == 'gpsLocation'])
+
+  obs = observation_table(t, kind, z, R)
+  gps = gps_observations(np.array(gps_rows, dtype=np.float64).reshape(-1, 13))
+  obs = {c: np.concatenate([obs[c], gps[c]]) for c in OBSERVATION_COLUMNS}
+
+  order = np.argsort(obs['t'], kind='stable')
+  return {c: obs[c][order] for c in OBSERVATION_COLUMNS}
+
+
+def gps_observations(gps: np.ndarray) -> Dict[str, np.ndarray]:
+  """ECEF_POS and ECEF_VEL observations for all sane fixes, vectorized over the fixes"""
+  t, flags, lat, lon, alt = gps[:, 0], gps[:, 1], gps[:, 2], gps[:, 3], gps[:, 4]
+  vned = gps[:, 5:8]
+  accuracy, vertical_accuracy, speed_accuracy, bearing_accuracy, quectel = gps[:, 8], gps[:, 9], gps[:, 10], gps[:, 11], gps[:, 12]
+
+  valid = (flags % 2 == 1)
+  valid &= np.hypot(accuracy, vertical_accuracy) < SANE_GPS_UNCERTAINTY
+  valid &= (vertical_accuracy > 0) & (speed_accuracy > 0) & (bearing_accuracy > 0)
+  valid &= (np.abs(lat) <= 90) & (np.abs(lon) <= 180) & (np.abs(alt) <= ALTITUDE_SANITY_CHECK)
+  valid &= np.linalg.norm(vned, axis=1) <= TRANS_SANITY_CHECK
+  valid &= ~((quectel == 1) & (vertical_accuracy == 500))  # quectel clips verticalAccuracy to 500
+
+  n = int(valid.sum())
+  ecef_pos = geodetic2ecef(np.column_stack([lat, lon, alt])[valid])
+  ecef_vel = np.einsum('nij,nj->ni', ned2ecef_rot(lat[valid], lon[valid]), vned[valid])
+  pos_var = (GPS_MUL_FACTOR * accuracy[valid])**2 + (GPS_MUL_FACTOR * vertical_accuracy[valid])**2
+  vel_var = (GPS_MUL_FACTOR * speed_accuracy[valid])**2
+
+  return {
+    't': np.concatenate([t[valid], t[valid]]),
+    'kind': np.concatenate([np.full(n, ObservationKind.ECEF_POS), np.full(n, ObservationKind.ECEF_VEL)]).astype(np.int32),
+    'z': np.concatenate([ecef_pos, ecef_vel]).reshape(-1, 3),
+    'R': np.concatenate([np.repeat(pos_var, 3), np.repeat(vel_var, 3)]).reshape(-1, 3),
+  }
+
+
+class OfflineLocalizer:
+  def __init__(self, smooth: bool = True, output_rate: float = OUTPUT_RATE,
+               smooth_window: float = SMOOTH_WINDOW, smooth_lag: float = SMOOTH_LAG):
+    self.kf = LocKalman(GENERATED_DIR)
+    self.smooth = smooth
+    self.output_rate = output_rate
+    self.smooth_window = smooth_window
+    self.smooth_lag = smooth_lag
+
+    self.estimates: List = []
+    self.rows: Dict[str, List[Any]] = {k: [] for k in ('t', 'x', 'std', 'run')}
+    self.last_output_t = -np.inf
+    self.run = -1
+
+  def init_from_gps(self, t: float, ecef_pos: np.ndarray, ecef_vel: np.ndarray) -> None:
+    # orientation from the direction of travel, like a locationd reset
+    lat, lon, _ = ecef2geodetic(ecef_pos)
+    v_ned = ned2ecef_rot(lat, lon).T @ ecef_vel
+    bearing = np.arctan2(v_ned[1], v_ned[0])
+    x = np.array(LocKalman.x_initial)
+    x[States.ECEF_POS] = ecef_pos
+    x[States.ECEF_VELOCITY] = ecef_vel
+    x[States.ECEF_ORIENTATION] = euler2quat(ecef_euler_from_ned(ecef_pos, [0., 0., bearing]))
+
+    P = np.array(LocKalman.P_initial)
+    P[States.ECEF_POS_ERR, States.ECEF_POS_ERR] = np.diag(LiveKalman.obs_noise_diag[ObservationKind.ECEF_POS])
+    P[States.ECEF_VELOCITY_ERR, States.ECEF_VELOCITY_ERR] = np.diag(LiveKalman.obs_noise_diag[ObservationKind.ECEF_VEL])
+    self.kf.init_state(x, covs=P, filter_time=t)
+    self.run += 1
+
+  def output(self, estimates: List, states: Optional[np.ndarray] = None, covs: Optional[np.ndarray] = None) -> None:
+    for i, e in enumerate(estimates):
+      t = e[4]
+      if t - self.last_output_t < 1. / self.output_rate:
+        continue
+      self.last_output_t = t
+
+      x = e[1] if states is None else states[i]
+      P = e[3] if covs is None else covs[i]
+      self.rows['t'].append(t)
+      self.rows['x'].append(x[:self.kf.dim_main])
+      self.rows['std'].append(np.sqrt(np.abs(np.diagonal(P)[:self.kf.dim_main_err])))
+      self.rows['run'].append(self.run)
+
+  def flush(self, final: bool = False) -> None:
+    if not self.estimates:
+      return
+    if not self.smooth:
+      self.output(self.estimates)
+      self.estimates = []
+      return
+
+    # smooth the window, but only output up to the lag, the rest gets smoothed again
+    # with the next window once later observations are in
+    states, covs = self.kf.rts_smooth(self.estimates)
+    t_end = self.estimates[-1][4]
+    n = len(self.estimates) if final else sum(e[4] < t_end - self.smooth_lag for e in self.estimates)
+    self.output(self.estimates[:n], states[:n], covs[:n])
+    self.estimates = self.estimates[n:]
+
+  def process(self, obs: Dict[str, np.ndarray]) -> Dict[str, np.ndarray]:
+    t, kind, z, R = (obs[c] for c in OBSERVATION_COLUMNS)
+    default_R = self.kf.obs_noise
+
+    # batches of consecutive observations with the same time and kind
+    starts = np.flatnonzero(np.r_[True, (np.diff(t) != 0) | (np.diff(kind) != 0)])
+    ends = np.r_[starts[1:], len(t)]
+
+    initialized = False
+    for s, e in zip(starts, ends):
+      k = int(kind[s])
+      if not initialized:
+        if k != ObservationKind.ECEF_POS:
+          continue
+        vel = np.flatnonzero((t == t[s]) & (kind == ObservationKind.ECEF_VEL))
+        if not len(vel):
+          continue
+        self.init_from_gps(t[s], z[s], z[vel[0]])
+        initialized = True
+
+      R_batch = np.array([np.diag(r) if np.isfinite(r).all() else default_R[k] for r in R[s:e]])
+      try:
+        estimate = self.kf.filter.predict_and_update_batch(t[s], k, z[s:e], R_batch)
+      except RuntimeError:
+        estimate = None
+
+      x = self.kf.x
+      if estimate is None or not np.isfinite(x).all() or not 0.1 < np.linalg.norm(x[States.ECEF_ORIENTATION]) < 10:
+        # the filter diverged, keep what we have and restart from the next fix
+        self.flush(final=True)
+        initialized = False
+        continue
+
+      self.estimates.append(estimate)
+      if self.estimates[-1][4] - self.estimates[0][4] > self.smooth_window + self.smooth_lag:
+        self.flush()
+
+    self.flush(final=True)
+    return self.poses()
+
+  def poses(self) -> Dict[str, np.ndarray]:
+    x = np.array(self.rows['x']).reshape(-1, self.kf.dim_main)
+    std = np.array(self.rows['std']).reshape(-1, self.kf.dim_main_err)
+    return {
+      't': np.array(self.rows['t']),
+      'run': np.array(self.rows['run'], dtype=np.int32),
+      'smoothed': np.full(len(x), self.smooth),
+      'ecef_pos': x[:, States.ECEF_POS],
+      'ecef_pos_std': std[:, States.ECEF_POS_ERR],
+      'geodetic': ecef2geodetic(x[:, States.ECEF_POS]),
+      'ecef_vel': x[:, States.ECEF_VELOCITY],
+      'ecef_vel_std': std[:, States.ECEF_VELOCITY_ERR],
+      'ecef_orientation': x[:, States.ECEF_ORIENTATION],
+      'ecef_orientation_std': std[:, States.ECEF_ORIENTATION_ERR],
+      'angular_velocity': x[:, States.ANGULAR_VELOCITY],
+      'acceleration': x[:, States.ACCELERATION],
+      'gyro_bias': x[:, States.GYRO_BIAS],
+      'accelerometer_bias': x[:, States.ACCELEROMETER_BIAS],
+    }
+
+
+def localize(lr: Iterable, smooth: bool = True, output_rate: float = OUTPUT_RATE) -> Dict[str, np.ndarray]:
+  return OfflineLocalizer(smooth, output_rate).process(extract_observations(lr))
+
+
+if __name__ == "__main__":
+  from tools.lib.logreader import logreader_from_route_or_segment
+
+  parser = argparse.ArgumentParser(description="Estimate the poses of a route offline",
+                                   formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+  parser.add_argument("route", help="route or segment name")
+  parser.add_argument("out", help="output .npz file")
+  parser.add_argument("--no-smooth", action="store_true", help="only run the forward pass")
+  parser.add_argument("--rate", type=float, default=OUTPUT_RATE, help="output rate in Hz")
+  args = parser.parse_args()
+
+  poses: Dict[str, Any] = localize(logreader_from_route_or_segment(args.route, sort_by_time=True), not args.no_smooth, args.rate)
+  np.savez(args.out, **poses)
+  print(f"wrote {len(poses['t'])} poses to {args.out}")
@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+import unittest
+
+import numpy as np
+
+import cereal.messaging as messaging
+from common.transformations.coordinates import LocalCoord, geodetic2ecef
+from selfdrive.locationd.models.constants import ObservationKind
+from selfdrive.locationd.offline_localizer import (GPS_MUL_FACTOR, GPS_QUECTEL_SENSOR_TIME_OFFSET, GPS_UBLOX_SENSOR_TIME_OFFSET,
+                                                   extract_observations, gps_observations, ned2ecef_rot)
+
+GEODETIC = [[37.7749, -122.4194, 10.], [-33.8688, 151.2093, 50.], [0., 0., 0.], [89., 45., 100.]]
+
+
+def gps_row(t, flags=1, lat=37.7749, lon=-122.4194, alt=10., vned=(10., 5., 0.), accuracy=5., vertical_accuracy=8., quectel=False):
+  return [t, flags, lat, lon, alt, *vned, accuracy, vertical_accuracy, 0.5, 1.0, quectel]
+
+
+def new_message(which, t):
+  msg = messaging.new_message(which)
+  msg.logMonoTime = int(t * 1e9)
+  return msg
+
+
+def sensor_message(which, t, v):
+  msg = new_message(which, t)
+  ev = getattr(msg, which)
+  ev.timestamp = int(t * 1e9)
+  if which == 'accelerometer':
+    ev.sensor, ev.type = 1, 1
+    ev.acceleration.v = v
+  else:
+    ev.sensor, ev.type = 5, 16
+    ev.gyroUncalibrated.v = v
+  return msg
+
+
+def gps_message(which, t, lat=37.7749, lon=-122.4194):
+  msg = new_message(which, t)
+  gps = getattr(msg, which)
+  gps.flags = 1
+  gps.latitude, gps.longitude, gps.altitude = lat, lon, 10.
+  gps.vNED = [10., 5., 0.]
+  gps.accuracy, gps.verticalAccuracy, gps.speedAccuracy, gps.bearingAccuracyDeg = 5., 8., 0.5, 1.0
+  return msg
+
+
+class TestOfflineLocalizer(unittest.TestCase):
+  def test_ned2ecef_rot(self):
+    geodetic = np.array(GEODETIC)
+    rots = ned2ecef_rot(geodetic[:, 0], geodetic[:, 1])
+    self.assertEqual(rots.shape, (len(geodetic), 3, 3))
+    for g, rot in zip(geodetic, rots):
+      np.testing.assert_allclose(rot, LocalCoord.from_geodetic(g).ned2ecef_matrix, atol=1e-12)
+
+  def test_gps_observations(self):
+    gps = np.array([
+      gps_row(1.),
+      gps_row(2., flags=0),
+      gps_row(3., quectel=True, vertical_accuracy=500.),
+      gps_row(4., lat=-33.8688, lon=151.2093, vned=(-3., 1., 0.5)),
+      gps_row(5., accuracy=2000.),
+    ], dtype=np.float64)
+    obs = gps_observations(gps)
+
+    valid = gps[[0, 3]]
+    np.testing.assert_array_equal(obs['t'], [1., 4., 1., 4.])
+    np.testing.assert_array_equal(obs['kind'], [ObservationKind.ECEF_POS] * 2 + [ObservationKind.ECEF_VEL] * 2)
+    np.testing.assert_allclose(obs['z'][:2], geodetic2ecef(valid[:, 2:5]))
+    for row, vel in zip(valid, obs['z'][2:]):
+      np.testing.assert_allclose(vel, LocalCoord.from_geodetic(row[2:5]).ned2ecef_matrix @ row[5:8], atol=1e-9)
+    pos_var = (GPS_MUL_FACTOR * 5.)**2 + (GPS_MUL_FACTOR * 8.)**2
+    np.testing.assert_allclose(obs['R'], [[pos_var] * 3] * 2 + [[(GPS_MUL_FACTOR * 0.5)**2] * 3] * 2)
+
+    empty = gps_observations(np.zeros((0, 13)))
+    self.assertEqual([empty[c].shape for c in ('t', 'z', 'R')], [(0,), (0, 3), (0, 3)])
+
+  def test_extract_observations(self):
+    cam = new_message('cameraOdometry', 1.2)
+    cam.cameraOdometry.rot = [0.1, 0., 0.]
+    cam.cameraOdometry.trans = [1., 0., 0.]
+    cam.cameraOdometry.rotStd = [0.1] * 3
+    cam.cameraOdometry.transStd = [0.1] * 3
+
+    stopped = new_message('carState', 1.02)
+    stopped.carState.standstill = True
+
+    no_timestamp = sensor_message('accelerometer', 1.1, [1., 2., 3.])
+    no_timestamp.accelerometer.timestamp = 0
+
+    msgs = [
+      gps_message('gpsLocation', 1.5),
+      sensor_message('accelerometer', 1., [1., 2., 3.]),
+      sensor_message('gyroscope', 1.01, [0.1, 0.2, 0.3]),
+      stopped,
+      no_timestamp,
+      cam,
+      gps_message('gpsLocationExternal', 2.),
+      # quectel is ignored once there is ublox
+      gps_message('gpsLocation', 2.5),
+    ]
+    obs = extract_observations(msgs)
+
+    K = ObservationKind
+    np.testing.assert_array_equal(obs['kind'], [K.ECEF_POS, K.ECEF_VEL, K.PHONE_ACCEL, K.PHONE_GYRO, K.NO_ROT, K.NO_ACCEL,
+                                                K.CAMERA_ODO_ROTATION, K.CAMERA_ODO_TRANSLATION, K.ECEF_POS, K.ECEF_VEL])
+    np.testing.assert_allclose(obs['t'], [1.5 - GPS_QUECTEL_SENSOR_TIME_OFFSET] * 2 + [1., 1.01, 1.02, 1.02, 1.2, 1.2] +
+                               [2. - GPS_UBLOX_SENSOR_TIME_OFFSET] * 2)
+    np.testing.assert_allclose(obs['z'][2:8], [[-3., -2., -1.], [-0.3, -0.2, -0.1], [0.] * 3, [0.] * 3, [0.1, 0., 0.], [1., 0., 0.]])
+    # default noise for the sensors, inflated stds for the camera
+    self.assertTrue(np.isnan(obs['R'][2:6]).all())
+    np.testing.assert_allclose(obs['R'][6:8], np.ones((2, 3)))
+
+
+if __name__ == "__main__":
+  unittest.main()
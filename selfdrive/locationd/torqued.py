@@ -93,7 +93,7 @@ class PointBuckets:
 
 
 class TorqueEstimator:
-  def __init__(self, CP, decimated=False):
+  def __init__(self, CP, decimated=False, restore=True):
     self.hist_len = int(HISTORY / DT_MDL)
     self.lag = CP.steerActuatorDelay + .2   # from controlsd
     if decimated:
@@ -134,9 +134,9 @@ class TorqueEstimator:
     self.max_friction = (1.0 + self.friction_sanity) * self.offline_friction
 
     # try to restore cached params
-    params = Params()
-    params_cache = params.get("LiveTorqueCarParams")
-    torque_cache = params.get("LiveTorqueParameters")
+    params = Params() if restore else None
+    params_cache = params.get("LiveTorqueCarParams") if params is not None else None
+    torque_cache = params.get("LiveTorqueParameters") if params is not None else None
     if params_cache is not None and torque_cache is not None:
       try:
         cache_ltp = log.Event.from_bytes(torque_cache).liveTorqueParameters
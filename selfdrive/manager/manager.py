@@ -10,13 +10,15 @@ from typing import List, Tuple, Union
 import cereal.messaging as messaging
 import selfdrive.sentry as sentry
 from common.basedir import BASEDIR
-from common.params import Params, ParamKeyType
+from common.params import Params, CachedParams, ParamKeyType
+from common.realtime import sec_since_boot
 from common.text_window import TextWindow
 from selfdrive.boardd.set_time import set_time
 from system.hardware import HARDWARE, PC
 from selfdrive.manager.helpers import unblock_stdout
-from selfdrive.manager.process import ensure_running
+from selfdrive.manager.process import ensure_running, exited_processes
 from selfdrive.manager.process_config import managed_processes
+from selfdrive.manager.startup import StartupScheduler, preload, freeze
 from selfdrive.athena.registration import register, UNREGISTERED_DONGLE_ID
 from system.swaglog import cloudlog, add_file_handler
 from system.version import is_dirty, get_commit, get_version, get_origin, get_short_branch, \
@@ -97,8 +99,10 @@ def manager_init() -> None:
 
 
 def manager_prepare() -> None:
+  preload()
   for p in managed_processes.values():
     p.prepare()
+  freeze()
 
 
 def manager_cleanup() -> None:
@@ -118,7 +122,7 @@ def manager_thread() -> None:
   cloudlog.info("manager start")
   cloudlog.info({"environ": os.environ})
 
-  params = Params()
+  params = CachedParams()
 
   ignore: List[str] = []
   if params.get("DongleId", encoding='utf8') in (None, UNREGISTERED_DONGLE_ID):
@@ -130,22 +134,36 @@ def manager_thread() -> None:
   sm = messaging.SubMaster(['deviceState', 'carParams'], poll=['deviceState'])
   pm = messaging.PubMaster(['managerState'])
 
+  scheduler = StartupScheduler(managed_processes)
   ensure_running(managed_processes.values(), False, params=params, CP=sm['carParams'], not_run=ignore)
 
+  last_proc_state = None
+  msg = messaging.new_message('managerState')
   while True:
     sm.update()
 
     started = sm['deviceState'].started
-    ensure_running(managed_processes.values(), started, params=params, CP=sm['carParams'], not_run=ignore)
-
-    running = ' '.join("%s%s\u001b[0m" % ("\u001b[32m" if p.proc.is_alive() else "\u001b[31m", p.name)
-                       for p in managed_processes.values() if p.proc)
-    print(running)
-    cloudlog.debug(running)
-
-    # send managerState
-    msg = messaging.new_message('managerState')
-    msg.managerState.processes = [p.get_process_state_msg() for p in managed_processes.values()]
+    scheduler.update(started)
+    ensure_running(managed_processes.values(), started, params=params, CP=sm['carParams'], not_run=ignore, scheduler=scheduler)
+
+    # only rebuild the state when a process started or exited
+    exited = {p.name for p in exited_processes(managed_processes.values())}
+    proc_state = [(p.name, p.proc.pid, p.shutting_down, p.proc.exitcode if p.name in exited else None)
+                  for p in managed_processes.values() if p.proc]
+    if proc_state != last_proc_state:
+      last_proc_state = proc_state
+
+      running = ' '.join("%s%s\u001b[0m" % ("\u001b[31m" if p.name in exited else "\u001b[32m", p.name)
+                         for p in managed_processes.values() if p.proc)
+      print(running)
+      cloudlog.debug(running)
+
+      msg = messaging.new_message('managerState')
+      msg.managerState.processes = [p.get_process_state_msg(p.name not in exited) for p in managed_processes.values()]
+    else:
+      msg.logMonoTime = int(sec_since_boot() * 1e9)
+
+    # send managerState, every loop since its frequency is checked by controlsd
     pm.send('managerState', msg)
 
     # Exit main loop when uninstall/shutdown/reboot is needed
@@ -1,12 +1,14 @@
 import importlib
+import mmap
 import os
 import signal
 import struct
 import time
 import subprocess
-from typing import Optional, Callable, List, ValuesView
+from typing import Any, Dict, Optional, Callable, Iterable, List, Tuple
 from abc import ABC, abstractmethod
 from multiprocessing import Process
+from multiprocessing.connection import wait
 
 from setproctitle import setproctitle  # pylint: disable=no-name-in-module
 
@@ -21,9 +23,45 @@ from system.hardware import HARDWARE
 from cereal import log
 
 WATCHDOG_FN = "/dev/shm/wd_"
+WATCHDOG_TABLE_FN = "/dev/shm/wd_table"
+WATCHDOG_SLOTS = 32
 ENABLE_WATCHDOG = os.getenv("NO_WATCHDOG") is None
 
 
+class WatchdogTable:
+  """Shared memory table of watchdog timestamps, one uint64 slot per watched process.
+  Processes get their slot through the WATCHDOG_SLOT environment variable."""
+  def __init__(self, fn: str = WATCHDOG_TABLE_FN, slots: int = WATCHDOG_SLOTS):
+    self.fn = fn
+    self.slots = slots
+    self.next_slot = 0
+    self.mm: Optional[mmap.mmap] = None
+
+  def open(self) -> mmap.mmap:
+    if self.mm is None:
+      fd = os.open(self.fn, os.O_RDWR | os.O_CREAT, 0o666)
+      try:
+        os.ftruncate(fd, self.slots * 8)
+        self.mm = mmap.mmap(fd, self.slots * 8)
+      finally:
+        os.close(fd)
+    return self.mm
+
+  def allocate(self) -> int:
+    assert self.next_slot < self.slots, "out of watchdog slots"
+    self.next_slot += 1
+    return self.next_slot - 1
+
+  def reset(self, slot: int) -> None:
+    struct.pack_into('Q', self.open(), slot * 8, 0)
+
+  def read(self) -> Tuple[int, ...]:
+    return struct.unpack(f'{self.slots}Q', self.open()[:])  # pylint: disable=no-member
+
+
+watchdog_table = WatchdogTable()
+
+
 def launcher(proc: str, name: str) -> None:
   try:
     # import the process
@@ -50,8 +88,10 @@ def launcher(proc: str, name: str) -> None:
     raise
 
 
-def nativelauncher(pargs: List[str], cwd: str, name: str) -> None:
+def nativelauncher(pargs: List[str], cwd: str, name: str, watchdog_slot: Optional[int] = None) -> None:
   os.environ['MANAGER_DAEMON'] = name
+  if watchdog_slot is not None:
+    os.environ['WATCHDOG_SLOT'] = str(watchdog_slot)
 
   # exec the process
   os.chdir(cwd)
@@ -60,12 +100,20 @@ def nativelauncher(pargs: List[str], cwd: str, name: str) -> None:
 
 def join_process(process: Process, timeout: float) -> None:
   # Process().join(timeout) will hang due to a python 3 bug: https://bugs.python.org/issue28382
-  # We have to poll the exitcode instead
+  # Wait for the sentinel instead, it becomes ready as soon as the process exits. The exitcode
+  # is only available once the process is reaped, so poll it for the last bit.
   t = time.monotonic()
+  wait([process.sentinel], timeout)
   while time.monotonic() - t < timeout and process.exitcode is None:
     time.sleep(0.001)
 
 
+def exited_processes(procs: Iterable['ManagerProcess'], timeout: Optional[float] = 0) -> List['ManagerProcess']:
+  """Returns the processes that have exited, checking all of them in a single poll"""
+  sentinels: Dict[Any, ManagerProcess] = {p.proc.sentinel: p for p in procs if p.proc is not None}
+  return [sentinels[s] for s in wait(list(sentinels), timeout)]
+
+
 class ManagerProcess(ABC):
   unkillable = False
   daemon = False
@@ -79,6 +127,7 @@ class ManagerProcess(ABC):
 
   last_watchdog_time = 0
   watchdog_max_dt: Optional[int] = None
+  watchdog_slot: Optional[int] = None
   watchdog_seen = False
   shutting_down = False
 
@@ -94,16 +143,21 @@ class ManagerProcess(ABC):
     self.stop()
     self.start()
 
-  def check_watchdog(self, started: bool) -> None:
+  def check_watchdog(self, started: bool, watchdog_times: Optional[Tuple[int, ...]] = None) -> None:
     if self.watchdog_max_dt is None or self.proc is None:
       return
 
-    try:
-      fn = WATCHDOG_FN + str(self.proc.pid)
-      # TODO: why can't pylint find struct.unpack?
-      self.last_watchdog_time = struct.unpack('Q', open(fn, "rb").read())[0] # pylint: disable=no-member
-    except Exception:
-      pass
+    if self.watchdog_slot is not None:
+      if watchdog_times is None:
+        watchdog_times = watchdog_table.read()
+      self.last_watchdog_time = watchdog_times[self.watchdog_slot]
+    else:
+      try:
+        fn = WATCHDOG_FN + str(self.proc.pid)
+        # TODO: why can't pylint find struct.unpack?
+        self.last_watchdog_time = struct.unpack('Q', open(fn, "rb").read())[0] # pylint: disable=no-member
+      except Exception:
+        pass
 
     dt = sec_since_boot() - self.last_watchdog_time / 1e9
 
@@ -172,11 +226,11 @@ class ManagerProcess(ABC):
     cloudlog.info(f"sending signal {sig} to {self.name}")
     os.kill(self.proc.pid, sig)
 
-  def get_process_state_msg(self):
+  def get_process_state_msg(self, alive: Optional[bool] = None):
     state = log.ManagerState.ProcessState.new_message()
     state.name = self.name
     if self.proc:
-      state.running = self.proc.is_alive()
+      state.running = self.proc.is_alive() if alive is None else alive
       state.shouldBeRunning = self.proc is not None and not self.shutting_down
       state.pid = self.proc.pid or 0
       state.exitCode = self.proc.exitcode or 0
@@ -195,6 +249,8 @@ class NativeProcess(ManagerProcess):
     self.unkillable = unkillable
     self.sigkill = sigkill
     self.watchdog_max_dt = watchdog_max_dt
+    if watchdog_max_dt is not None:
+      self.watchdog_slot = watchdog_table.allocate()
 
   def prepare(self) -> None:
     pass
@@ -207,9 +263,12 @@ class NativeProcess(ManagerProcess):
     if self.proc is not None:
       return
 
+    if self.watchdog_slot is not None:
+      watchdog_table.reset(self.watchdog_slot)
+
     cwd = os.path.join(BASEDIR, self.cwd)
     cloudlog.info(f"starting process {self.name}")
-    self.proc = Process(name=self.name, target=nativelauncher, args=(self.cmdline, cwd, self.name))
+    self.proc = Process(name=self.name, target=nativelauncher, args=(self.cmdline, cwd, self.name, self.watchdog_slot))
     self.proc.start()
     self.watchdog_seen = False
     self.shutting_down = False
@@ -289,12 +348,16 @@ class DaemonProcess(ManagerProcess):
     pass
 
 
-def ensure_running(procs: ValuesView[ManagerProcess], started: bool, params=None, CP: car.CarParams=None,
-                   not_run: Optional[List[str]]=None) -> List[ManagerProcess]:
+def ensure_running(procs: Iterable[ManagerProcess], started: bool, params=None, CP: car.CarParams=None,
+                   not_run: Optional[List[str]]=None, scheduler=None) -> List[ManagerProcess]:
   if not_run is None:
     not_run = []
 
+  if scheduler is not None:
+    procs = scheduler.order(procs)
+
   running = []
+  watchdog_times = watchdog_table.read()
   for p in procs:
     # Conditions that make a process run
     run = any((
@@ -311,11 +374,13 @@ def ensure_running(procs: ValuesView[ManagerProcess], started: bool, params=None
     ))
 
     if run:
+      if scheduler is not None and scheduler.defer(p):
+        continue
       p.start()
       running.append(p)
     else:
       p.stop(block=False)
 
-    p.check_watchdog(started)
+    p.check_watchdog(started, watchdog_times)
 
   return running
@@ -0,0 +1,146 @@
+import gc
+import importlib
+from typing import Dict, List, Optional, Tuple, Iterable
+
+import cereal.messaging as messaging
+from common.realtime import sec_since_boot
+from selfdrive.manager.process import ManagerProcess
+from system.swaglog import cloudlog
+
+# Heavy imports shared by most python daemons. They are loaded into manager before
+# anything is forked, so manager acts as a warm zygote for the python processes.
+PRELOAD_MODULES = [
+  "numpy",
+  "cereal.messaging",
+  "cereal.log",
+  "cereal.car",
+  "selfdrive.car.car_helpers",
+  "selfdrive.controls.lib.events",
+]
+
+# name: (services published, services it needs before it can do useful work)
+# needs only list the inputs a process blocks on, so the graph stays acyclic
+# (e.g. modeld also subscribes to lateralPlan, but it doesn't wait for it).
+STARTUP_DEPS: Dict[str, Tuple[List[str], List[str]]] = {
+  "camerad": (["roadCameraState", "wideRoadCameraState", "driverCameraState"], []),
+  "sensord": (["accelerometer", "gyroscope"], []),
+  "modeld": (["modelV2", "cameraOdometry"], ["roadCameraState"]),
+  "calibrationd": (["liveCalibration"], ["cameraOdometry"]),
+  "locationd": (["liveLocationKalman"], ["cameraOdometry", "accelerometer"]),
+  "paramsd": (["liveParameters"], ["liveLocationKalman"]),
+  "torqued": (["liveTorqueParameters"], ["liveLocationKalman"]),
+  "radard": (["radarState"], ["modelV2"]),
+  "plannerd": (["longitudinalPlan", "lateralPlan"], ["modelV2", "radarState"]),
+  "controlsd": (["controlsState"], ["modelV2", "liveCalibration", "liveLocationKalman", "liveParameters",
+                                    "liveTorqueParameters", "radarState", "longitudinalPlan", "lateralPlan"]),
+}
+CRITICAL_PROCESS = "controlsd"
+
+# the start of every drive has to be logged and the driver monitored, these are never deferred
+NEVER_DEFER = ["loggerd", "encoderd", "proclogd", "dmonitoringmodeld", "dmonitoringd"]
+
+# start everything else anyway if the critical path doesn't come up
+DEFER_TIMEOUT = 10.  # seconds
+
+
+def preload() -> None:
+  for module in PRELOAD_MODULES:
+    importlib.import_module(module)
+
+
+def freeze() -> None:
+  # Move everything allocated so far into the permanent generation, so the garbage
+  # collector in the forked children doesn't write to (and copy) the shared pages.
+  gc.collect()
+  gc.freeze()
+
+
+class StartupScheduler:
+  """
+  Starts onroad processes in dependency order on ignition.
+
+  Processes on the critical path of controlsd are started producers first, everything
+  else but logging and driver monitoring is deferred until the critical path has published
+  or DEFER_TIMEOUT passed.
+  The time from ignition until manager sees each process' first message is logged.
+  """
+  def __init__(self, procs: Dict[str, ManagerProcess], deps: Optional[Dict[str, Tuple[List[str], List[str]]]] = None,
+               critical: str = CRITICAL_PROCESS, defer_timeout: float = DEFER_TIMEOUT,
+               never_defer: Optional[List[str]] = None):
+    self.deps = STARTUP_DEPS if deps is None else deps
+    self.defer_timeout = defer_timeout
+    self.never_defer = set(NEVER_DEFER if never_defer is None else never_defer)
+
+    enabled = {name for name, p in procs.items() if p.enabled and name in self.deps}
+    self.producers = {s: name for name, (pubs, _) in self.deps.items() if name in enabled for s in pubs}
+
+    self.stages: Dict[str, int] = {}
+    for name in enabled:
+      self._stage(name, set())
+
+    self.critical = self._upstream(critical) if critical in enabled else set()
+
+    self.ignition_time: Optional[float] = None
+    self.first_publish: Dict[str, float] = {}
+    self.socks: Dict[str, messaging.SubSocket] = {}
+
+  def _needs(self, name: str) -> List[str]:
+    return [self.producers[s] for s in self.deps[name][1] if s in self.producers and self.producers[s] != name]
+
+  def _stage(self, name: str, visiting: set) -> int:
+    if name in self.stages:
+      return self.stages[name]
+    if name in visiting:
+      raise ValueError(f"startup dependency cycle through {name}")
+
+    visiting.add(name)
+    self.stages[name] = 1 + max((self._stage(n, visiting) for n in self._needs(name)), default=-1)
+    visiting.discard(name)
+    return self.stages[name]
+
+  def _upstream(self, name: str) -> set:
+    ret = {name}
+    for n in self._needs(name):
+      ret |= self._upstream(n)
+    return ret
+
+  @property
+  def critical_ready(self) -> bool:
+    if self.ignition_time is None:
+      return True
+    if sec_since_boot() - self.ignition_time > self.defer_timeout:
+      return True
+    return self.critical.issubset(self.first_publish)
+
+  def order(self, procs: Iterable[ManagerProcess]) -> List[ManagerProcess]:
+    # stable sort keeps the configured order for processes outside the graph
+    return sorted(procs, key=lambda p: (p.name not in self.critical, self.stages.get(p.name, len(self.stages))))
+
+  def defer(self, p: ManagerProcess) -> bool:
+    return p.proc is None and p.name not in self.critical and p.name not in self.never_defer and not self.critical_ready
+
+  def update(self, started: bool) -> None:
+    if started and self.ignition_time is None:
+      # subscribe before anything starts so we see the first message
+      self.ignition_time = sec_since_boot()
+      self.first_publish = {}
+      self.socks = {name: messaging.sub_sock(self.deps[name][0][0]) for name in self.stages}
+    elif not started:
+      self.ignition_time = None
+      self.socks = {}
+
+    critical_ready = self.critical_ready
+    for name, sock in list(self.socks.items()):
+      msg = messaging.recv_one_or_none(sock)
+      if msg is None:
+        continue
+
+      # time of receipt, on the same clock as ignition_time
+      self.first_publish[name] = sec_since_boot() - self.ignition_time
+      del self.socks[name]
+      cloudlog.event("startup first publish", name=name, service=msg.which(), stage=self.stages[name],
+                     ignition_dt=self.first_publish[name])
+
+    if self.critical_ready and not critical_ready:
+      cloudlog.event("startup critical path ready", ignition_dt=sec_since_boot() - self.ignition_time,
+                     first_publish={n: self.first_publish.get(n) for n in self.critical})
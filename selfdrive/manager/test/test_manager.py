@@ -1,14 +1,18 @@
 #!/usr/bin/env python3
+import contextlib
 import os
 import signal
 import time
 import unittest
+from unittest import mock
 
 from cereal import car
 from common.params import Params
+from common.realtime import sec_since_boot
 import selfdrive.manager.manager as manager
-from selfdrive.manager.process import ensure_running
+from selfdrive.manager.process import DaemonProcess, ManagerProcess, NativeProcess, PythonProcess, ensure_running
 from selfdrive.manager.process_config import managed_processes
+from selfdrive.manager.startup import NEVER_DEFER, StartupScheduler, STARTUP_DEPS
 from system.hardware import HARDWARE
 
 os.environ['FAKEUPLOAD'] = "1"
@@ -40,6 +44,42 @@ class TestManager(unittest.TestCase):
       t = time.monotonic() - start
       assert t < MAX_STARTUP_TIME, f"startup took {t}s, expected <{MAX_STARTUP_TIME}s"
 
+  def test_startup_order(self):
+    scheduler = StartupScheduler(managed_processes)
+    order = [p.name for p in scheduler.order(managed_processes.values())]
+
+    # producers are started before their consumers
+    for name, (_, needs) in STARTUP_DEPS.items():
+      for producer, (pubs, _) in STARTUP_DEPS.items():
+        if name in order and producer in order and set(pubs) & set(needs):
+          self.assertLess(order.index(producer), order.index(name), f"{producer} should start before {name}")
+
+    # non-critical processes wait for the critical path on ignition
+    scheduler.ignition_time = sec_since_boot()
+    self.assertTrue(scheduler.defer(managed_processes['uploader']))
+    self.assertFalse(scheduler.defer(managed_processes['controlsd']))
+    self.assertLess(order.index('controlsd'), order.index('dmonitoringd'))
+
+  def test_never_deferred(self):
+    """Logging and driver monitoring start on the first onroad cycle, before the critical path is up"""
+    scheduler = StartupScheduler(managed_processes)
+    scheduler.ignition_time = sec_since_boot()
+    self.assertFalse(scheduler.critical_ready)
+
+    # nothing is actually started
+    with contextlib.ExitStack() as stack:
+      for cls in (ManagerProcess, NativeProcess, PythonProcess, DaemonProcess):
+        for method in ('start', 'stop', 'check_watchdog'):
+          if method in vars(cls):
+            stack.enter_context(mock.patch.object(cls, method))
+      procs = ensure_running(managed_processes.values(), True, params=Params(), CP=car.CarParams.new_message(), scheduler=scheduler)
+    running = {p.name for p in procs}
+
+    for name in NEVER_DEFER:
+      if managed_processes[name].enabled:
+        self.assertIn(name, running)
+    self.assertNotIn('uploader', running)
+
   def test_clean_exit(self):
     """
       Ensure all processes exit cleanly when stopped.
@@ -2,10 +2,11 @@ from __future__ import annotations
 
 import json
 import math
-from typing import Any, Dict, List, Optional, Tuple, Union, cast
+from typing import Any, Dict, List, Optional, Sequence, Tuple, Union, cast
+
+import numpy as np
 
 from common.conversions import Conversions
-from common.numpy_fast import clip
 from common.params import Params
 
 EARTH_MEAN_RADIUS = 6371007.2
@@ -14,6 +15,11 @@ SPEED_CONVERSIONS = {
     'mph': Conversions.MPH_TO_MS,
   }
 
+# segments searched on each side of the last match, more than we drive past between updates
+SEARCH_WINDOW = 32
+# farther than this from the route in the window, check the whole step
+FULL_SEARCH_DISTANCE = 25.
+
 
 class Coordinate:
   def __init__(self, latitude: float, longitude: float) -> None:
@@ -66,38 +72,89 @@ class Coordinate:
     return x * EARTH_MEAN_RADIUS
 
 
-def minimum_distance(a: Coordinate, b: Coordinate, p: Coordinate):
-  if a.distance_to(b) < 0.01:
-    return a.distance_to(p)
-
-  ap = p - a
-  ab = b - a
-  t = clip(ap.dot(ab) / ab.dot(ab), 0.0, 1.0)
-  projection = a + ab * t
-  return projection.distance_to(p)
-
-
-def distance_along_geometry(geometry: List[Coordinate], pos: Coordinate) -> float:
-  if len(geometry) <= 2:
-    return geometry[0].distance_to(pos)
-
-  # 1. Find segment that is closest to current position
-  # 2. Total distance is sum of distance to start of closest segment
-  #    + all previous segments
-  total_distance = 0.0
-  total_distance_closest = 0.0
-  closest_distance = 1e9
-
-  for i in range(len(geometry) - 1):
-    d = minimum_distance(geometry[i], geometry[i + 1], pos)
-
-    if d < closest_distance:
-      closest_distance = d
-      total_distance_closest = total_distance + geometry[i].distance_to(pos)
-
-    total_distance += geometry[i].distance_to(geometry[i + 1])
-
-  return total_distance_closest
+def haversine(lat1: np.ndarray, lon1: np.ndarray, lat2: np.ndarray, lon2: np.ndarray) -> np.ndarray:
+  lat1, lon1, lat2, lon2 = (np.radians(x) for x in (lat1, lon1, lat2, lon2))
+  y = np.sin((lat2 - lat1) / 2.0)**2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2.0)**2
+  d: np.ndarray = 2 * np.arcsin(np.sqrt(y)) * EARTH_MEAN_RADIUS
+  return d
+
+
+class StepGeometry:
+  """
+  Geometry of a route step as local east/north points in meters around its first point, with
+  the cumulative distance and maxspeed annotation of every point. Positions are matched in
+  a window around the last match, so an update doesn't depend on the length of the step.
+  """
+  def __init__(self, coordinates: Sequence[Tuple[float, float]], maxspeeds: Sequence[Optional[float]]) -> None:
+    lonlat = np.array(coordinates, dtype=np.float64).reshape(-1, 2)
+    self.lat, self.lon = lonlat[:, 1], lonlat[:, 0]
+
+    self.lat0, self.lon0 = self.lat[0], self.lon[0]
+    self.start = Coordinate(float(self.lat0), float(self.lon0))
+    self.points = self.to_local(self.lat, self.lon)
+    self.segments = np.diff(self.points, axis=0)
+    self.segment_lengths_sq = np.sum(self.segments**2, axis=1)
+    self.cumulative_distance = np.r_[0., np.cumsum(haversine(self.lat[:-1], self.lon[:-1], self.lat[1:], self.lon[1:]))]
+    self.maxspeed = np.array([np.nan if m is None else m for m in maxspeeds], dtype=np.float64)
+
+    self.last_idx = 0
+
+  def __len__(self) -> int:
+    return len(self.points)
+
+  def to_local(self, lat, lon) -> np.ndarray:
+    north = np.radians(np.asarray(lat) - self.lat0) * EARTH_MEAN_RADIUS
+    east = np.radians(np.asarray(lon) - self.lon0) * EARTH_MEAN_RADIUS * math.cos(math.radians(self.lat0))
+    return np.stack([east, north], axis=-1)
+
+  def segment_distances(self, p: np.ndarray, lo: int, hi: int, min_length: float) -> np.ndarray:
+    """Distance from p to segments lo..hi, inf for the ones shorter than min_length"""
+    a, ab, length_sq = self.points[lo:hi], self.segments[lo:hi], self.segment_lengths_sq[lo:hi]
+    t = np.clip(np.sum((p - a) * ab, axis=1) / np.maximum(length_sq, 1e-9), 0.0, 1.0)
+    d = np.linalg.norm(a + ab * t[:, None] - p, axis=1)
+    # degenerate segments are their first point
+    d = np.where(length_sq < 0.01**2, np.linalg.norm(a - p, axis=1), d)
+    return np.where(length_sq < min_length**2, np.inf, d)
+
+  def match(self, pos: Coordinate, min_length: float = 0.0) -> Tuple[int, float]:
+    """Closest segment to pos and its distance, searching around the last match first"""
+    p = self.to_local(pos.latitude, pos.longitude)
+    n = len(self.segments)
+    lo, hi = max(self.last_idx - SEARCH_WINDOW, 0), min(self.last_idx + SEARCH_WINDOW + 1, n)
+    d = self.segment_distances(p, lo, hi, min_length)
+    idx = int(np.argmin(d))
+
+    # on the edge of the window or far from the route, the closest can be anywhere
+    if d[idx] > FULL_SEARCH_DISTANCE or (idx == 0 and lo > 0) or (idx == len(d) - 1 and hi < n):
+      lo = 0
+      d = self.segment_distances(p, 0, n, min_length)
+      idx = int(np.argmin(d))
+
+    if min_length == 0.0:
+      self.last_idx = lo + idx
+    return lo + idx, float(d[idx])
+
+  def distance_along(self, pos: Coordinate) -> float:
+    """Distance to the start of the closest segment, plus from there to pos"""
+    if len(self) <= 2:
+      return self.start.distance_to(pos)
+    idx, _ = self.match(pos)
+    return float(self.cumulative_distance[idx] + np.linalg.norm(self.to_local(pos.latitude, pos.longitude) - self.points[idx]))
+
+  def distance_to(self, pos: Coordinate, min_length: float = 0.0) -> float:
+    """Distance from pos to the closest segment at least min_length long"""
+    if len(self) < 2:
+      return self.start.distance_to(pos)
+    return self.match(pos, min_length)[1]
+
+  def maxspeed_at(self, along: float) -> Optional[float]:
+    """Maxspeed of the last point we're past"""
+    idx = int(np.clip(np.searchsorted(self.cumulative_distance, along, side='right') - 1, 0, len(self) - 1))
+    m = self.maxspeed[idx]
+    return None if np.isnan(m) else float(m)
+
+  def coordinate_dicts(self) -> List[Dict[str, float]]:
+    return [{'latitude': lat, 'longitude': lon} for lat, lon in zip(self.lat.tolist(), self.lon.tolist())]
 
 
 def coordinate_from_param(param: str, params: Optional[Params] = None) -> Optional[Coordinate]:
@@ -13,10 +13,8 @@ from common.api import Api
 from common.params import Params
 from common.realtime import Ratekeeper
 from common.transformations.coordinates import ecef2geodetic
-from selfdrive.navd.helpers import (Coordinate, coordinate_from_param,
-                                    distance_along_geometry, maxspeed_to_ms,
-                                    minimum_distance,
-                                    parse_banner_instructions)
+from selfdrive.navd.helpers import (Coordinate, StepGeometry, coordinate_from_param,
+                                    maxspeed_to_ms, parse_banner_instructions)
 from system.swaglog import cloudlog
 
 REROUTE_DISTANCE = 25
@@ -43,6 +41,8 @@ class RouteEngine:
     self.step_idx = None
     self.route = None
     self.route_geometry = None
+    self.route_coordinates = []
+    self.remaining_totals = None
 
     self.recompute_backoff = 0
     self.recompute_countdown = 0
@@ -173,22 +173,24 @@ class RouteEngine:
 
         # Convert coordinates
         for step in self.route:
-          coords = []
-
-          for c in step['geometry']['coordinates']:
-            coord = Coordinate.from_mapbox_tuple(c)
-
-            # Last step does not have maxspeed
-            if (maxspeed_idx < len(maxspeeds)):
-              maxspeed = maxspeeds[maxspeed_idx]
-              if ('unknown' not in maxspeed) and ('none' not in maxspeed):
-                coord.annotations['maxspeed'] = maxspeed_to_ms(maxspeed)
-
-            coords.append(coord)
-            maxspeed_idx += 1
-
-          self.route_geometry.append(coords)
-          maxspeed_idx -= 1  # Every segment ends with the same coordinate as the start of the next
+          coords = step['geometry']['coordinates']
+          step_maxspeeds = []
+          for maxspeed in maxspeeds[maxspeed_idx:maxspeed_idx + len(coords)]:
+            if ('unknown' not in maxspeed) and ('none' not in maxspeed):
+              step_maxspeeds.append(maxspeed_to_ms(maxspeed))
+            else:
+              step_maxspeeds.append(None)
+          # Last step does not have maxspeed
+          step_maxspeeds += [None] * (len(coords) - len(step_maxspeeds))
+
+          self.route_geometry.append(StepGeometry(coords, step_maxspeeds))
+          maxspeed_idx += len(coords) - 1  # Every segment ends with the same coordinate as the start of the next
+
+        # Totals of the steps after each step
+        totals = np.array([[s['distance'], s['duration'], s['duration'] if s['duration_typical'] is None else s['duration_typical']]
+                           for s in self.route], dtype=np.float64)
+        self.remaining_totals = np.cumsum(totals[::-1], axis=0)[::-1] - totals
+        self.route_coordinates = [c for g in self.route_geometry for c in g.coordinate_dicts()]
 
         self.step_idx = 0
       else:
@@ -215,7 +217,7 @@ class RouteEngine:
 
     step = self.route[self.step_idx]
     geometry = self.route_geometry[self.step_idx]
-    along_geometry = distance_along_geometry(geometry, self.last_position)
+    along_geometry = geometry.distance_along(self.last_position)
     distance_to_maneuver_along_geometry = step['distance'] - along_geometry
 
     # Current instruction
@@ -232,25 +234,16 @@ class RouteEngine:
     else:
       total_time_typical = step['duration_typical'] * remaining
 
-    # Add up totals for future steps
-    for i in range(self.step_idx + 1, len(self.route)):
-      total_distance += self.route[i]['distance']
-      total_time += self.route[i]['duration']
-      total_time_typical += self.route[i]['duration_typical']
-
-    msg.navInstruction.distanceRemaining = total_distance
-    msg.navInstruction.timeRemaining = total_time
-    msg.navInstruction.timeRemainingTypical = total_time_typical
+    # Add totals for future steps
+    future_distance, future_time, future_time_typical = self.remaining_totals[self.step_idx]
+    msg.navInstruction.distanceRemaining = total_distance + future_distance
+    msg.navInstruction.timeRemaining = total_time + future_time
+    msg.navInstruction.timeRemainingTypical = total_time_typical + future_time_typical
 
     # Speed limit
-    closest_idx, closest = min(enumerate(geometry), key=lambda p: p[1].distance_to(self.last_position))
-    if closest_idx > 0:
-      # If we are not past the closest point, show previous
-      if along_geometry < distance_along_geometry(geometry, geometry[closest_idx]):
-        closest = geometry[closest_idx - 1]
-
-    if ('maxspeed' in closest.annotations) and self.localizer_valid:
-      msg.navInstruction.speedLimit = closest.annotations['maxspeed']
+    speed_limit = geometry.maxspeed_at(along_geometry)
+    if speed_limit is not None and self.localizer_valid:
+      msg.navInstruction.speedLimit = speed_limit
 
     # Speed limit sign type
     if 'speedLimitSign' in step:
@@ -277,19 +270,15 @@ class RouteEngine:
           self.clear_route()
 
   def send_route(self):
-    coords = []
-
-    if self.route is not None:
-      for path in self.route_geometry:
-        coords += [c.as_dict() for c in path]
-
     msg = messaging.new_message('navRoute')
-    msg.navRoute.coordinates = coords
+    msg.navRoute.coordinates = self.route_coordinates if self.route is not None else []
     self.pm.send('navRoute', msg)
 
   def clear_route(self):
     self.route = None
     self.route_geometry = None
+    self.route_coordinates = []
+    self.remaining_totals = None
     self.step_idx = None
     self.nav_destination = None
 
@@ -301,17 +290,8 @@ class RouteEngine:
     if self.step_idx == len(self.route) - 1:
       return False
 
-    # Compute closest distance to all line segments in the current path
-    min_d = REROUTE_DISTANCE + 1
-    path = self.route_geometry[self.step_idx]
-    for i in range(len(path) - 1):
-      a = path[i]
-      b = path[i + 1]
-
-      if a.distance_to(b) < 1.0:
-        continue
-
-      min_d = min(min_d, minimum_distance(a, b, self.last_position))
+    # Closest distance to the line segments in the current path, ignoring very short ones
+    min_d = self.route_geometry[self.step_idx].distance_to(self.last_position, min_length=1.0)
 
     if min_d > REROUTE_DISTANCE:
       self.reroute_counter += 1
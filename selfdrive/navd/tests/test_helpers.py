@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+import math
+import random
+import unittest
+
+from common.numpy_fast import clip
+from selfdrive.navd.helpers import EARTH_MEAN_RADIUS, Coordinate, StepGeometry
+
+
+# the per point implementations StepGeometry replaced
+def minimum_distance(a, b, p):
+  if a.distance_to(b) < 0.01:
+    return a.distance_to(p)
+
+  ap = p - a
+  ab = b - a
+  t = clip(ap.dot(ab) / ab.dot(ab), 0.0, 1.0)
+  projection = a + ab * t
+  return projection.distance_to(p)
+
+
+def distance_along_geometry(geometry, pos):
+  if len(geometry) <= 2:
+    return geometry[0].distance_to(pos)
+
+  total_distance = 0.0
+  total_distance_closest = 0.0
+  closest_distance = 1e9
+
+  for i in range(len(geometry) - 1):
+    d = minimum_distance(geometry[i], geometry[i + 1], pos)
+
+    if d < closest_distance:
+      closest_distance = d
+      total_distance_closest = total_distance + geometry[i].distance_to(pos)
+
+    total_distance += geometry[i].distance_to(geometry[i + 1])
+
+  return total_distance_closest
+
+
+def distance_to_route(geometry, pos):
+  min_d = 1e9
+  for a, b in zip(geometry[:-1], geometry[1:]):
+    if a.distance_to(b) < 1.0:
+      continue
+    min_d = min(min_d, minimum_distance(a, b, pos))
+  return min_d
+
+
+def maxspeed(geometry, pos, along):
+  closest_idx, closest = min(enumerate(geometry), key=lambda p: p[1].distance_to(pos))
+  if closest_idx > 0:
+    if along < distance_along_geometry(geometry, geometry[closest_idx]):
+      closest = geometry[closest_idx - 1]
+  return closest.annotations.get('maxspeed')
+
+
+def offset(c, east, north):
+  return Coordinate(c.latitude + math.degrees(north / EARTH_MEAN_RADIUS),
+                    c.longitude + math.degrees(east / (EARTH_MEAN_RADIUS * math.cos(math.radians(c.latitude)))))
+
+
+def random_step(rng, n=60):
+  """Route with turns, a segment shorter than a meter and points without maxspeed"""
+  points = [Coordinate(37.7749, -122.4194)]
+  heading = 0.
+  for i in range(n - 1):
+    heading += rng.uniform(-1., 1.)
+    length = 0.5 if i == n // 2 else rng.uniform(20., 80.)
+    points.append(offset(points[-1], length * math.sin(heading), length * math.cos(heading)))
+
+  maxspeeds = [None if rng.random() < 0.2 else rng.choice([10., 15., 20.]) for _ in points]
+  for p, m in zip(points, maxspeeds):
+    if m is not None:
+      p.annotations['maxspeed'] = m
+  return points, maxspeeds
+
+
+def drive(rng, geometry):
+  """Positions close to the route in driving order"""
+  for a, b in zip(geometry[:-1], geometry[1:]):
+    if a.distance_to(b) < 1.0:
+      continue
+    for t in (0.25, 0.5, 0.75):
+      east = (b.longitude - a.longitude) * EARTH_MEAN_RADIUS * math.cos(math.radians(a.latitude)) * math.pi / 180
+      north = (b.latitude - a.latitude) * EARTH_MEAN_RADIUS * math.pi / 180
+      length = math.hypot(east, north)
+      side = rng.uniform(-3., 3.)
+      yield offset(a, east * t - north / length * side, north * t + east / length * side)
+
+
+class TestStepGeometry(unittest.TestCase):
+  def setUp(self):
+    self.rng = random.Random(0)
+    self.geometry, maxspeeds = random_step(self.rng)
+    self.step = StepGeometry([(c.longitude, c.latitude) for c in self.geometry], maxspeeds)
+
+  def check(self, pos, check_maxspeed=True):
+    along = self.step.distance_along(pos)
+    old_along = distance_along_geometry(self.geometry, pos)
+    self.assertAlmostEqual(along, old_along, delta=0.05 + 1e-4 * old_along)
+    # the old projection was in degrees, which skews it a bit away from the equator
+    old_d = distance_to_route(self.geometry, pos)
+    self.assertAlmostEqual(self.step.distance_to(pos, min_length=1.0), old_d, delta=0.05 + 0.05 * old_d)
+    if check_maxspeed:
+      self.assertEqual(self.step.maxspeed_at(along), maxspeed(self.geometry, pos, old_along))
+
+  def test_drive(self):
+    positions = list(drive(self.rng, self.geometry))
+    for pos in positions:
+      self.check(pos)
+
+    # jumping back to the start and off the route needs a search of the whole step
+    self.check(positions[0])
+    # far off the route the old maxspeed went by the closest point, not the distance along
+    self.check(offset(self.geometry[-1], 100., 100.), check_maxspeed=False)
+    self.check(positions[-1])
+
+  def test_points(self):
+    # on a point it's a tie which maxspeed applies
+    for c in self.geometry:
+      self.check(c, check_maxspeed=False)
+
+  def test_short(self):
+    pos = offset(self.geometry[0], 5., 5.)
+    for n in (1, 2):
+      step = StepGeometry([(c.longitude, c.latitude) for c in self.geometry[:n]], [None] * n)
+      self.assertAlmostEqual(step.distance_along(pos), distance_along_geometry(self.geometry[:n], pos))
+    self.assertAlmostEqual(step.distance_to(pos), minimum_distance(self.geometry[0], self.geometry[1], pos), delta=0.05)
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -5,7 +5,7 @@ import time
 from pathlib import Path
 from collections import defaultdict
 from datetime import datetime, timezone
-from typing import NoReturn, Union, List, Dict
+from typing import NoReturn, Union, List, Dict, Tuple
 
 from common.params import Params
 from cereal.messaging import SubMaster
@@ -44,12 +44,37 @@ class StatLog:
   def gauge(self, name: str, value: float) -> None:
     self._send(f"{name}:{value}|{METRIC_TYPE.GAUGE}")
 
+  # Many gauges in one message, one metric per line
+  def gauges(self, values: Dict[str, float]) -> None:
+    if len(values):
+      self._send("\n".join(f"{name}:{value}|{METRIC_TYPE.GAUGE}" for name, value in values.items()))
+
   # Samples will be recorded in a buffer and at aggregation time,
   # statistical properties will be logged (mean, count, percentiles, ...)
   def sample(self, name: str, value: float):
     self._send(f"{name}:{value}|{METRIC_TYPE.SAMPLE}")
 
 
+class GaugeDeadband:
+  """
+  Passes on the gauges that changed by at least deadband since they were last passed on,
+  and the ones that weren't for max_age seconds, so every statsd flush still has them.
+  """
+  def __init__(self, deadband: float, max_age: float = STATS_FLUSH_TIME_S / 2) -> None:
+    self.deadband = deadband
+    self.max_age = max_age
+    self.sent: Dict[str, Tuple[float, float]] = {}
+
+  def update(self, values: Dict[str, float], t: float) -> Dict[str, float]:
+    changed = {}
+    for name, value in values.items():
+      prev = self.sent.get(name)
+      if prev is None or abs(value - prev[0]) >= self.deadband or t - prev[1] >= self.max_age:
+        changed[name] = value
+        self.sent[name] = (value, t)
+    return changed
+
+
 def main() -> NoReturn:
   dongle_id = Params().get("DongleId", encoding='utf-8')
   def get_influxdb_line(measurement: str, value: Union[float, Dict[str, float]],  timestamp: datetime, tags: dict) -> str:
@@ -99,7 +124,11 @@ def main() -> NoReturn:
     # Update metrics
     while True:
       try:
-        metric = sock.recv_string(zmq.NOBLOCK)
+        packet = sock.recv_string(zmq.NOBLOCK)
+      except zmq.error.Again:
+        break
+
+      for metric in packet.split('\n'):
         try:
           metric_type = metric.split('|')[1]
           metric_name = metric.split(':')[0]
@@ -113,8 +142,6 @@ def main() -> NoReturn:
             cloudlog.event("unknown metric type", metric_type=metric_type)
         except Exception:
           cloudlog.event("malformed metric", metric=metric)
-      except zmq.error.Again:
-        break
 
     # flush when started state changes or after FLUSH_TIME_S
     if (time.monotonic() > last_flush_time + STATS_FLUSH_TIME_S) or (sm['deviceState'].started != started_prev):
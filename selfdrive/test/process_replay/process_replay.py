@@ -390,10 +390,10 @@ CONFIGS = [
 ]
 
 
-def replay_process(cfg, lr, fingerprint=None):
+def replay_process(cfg, lr, fingerprint=None, timings=None):
   with OpenpilotPrefix():
     if cfg.fake_pubsubmaster:
-      return python_replay_process(cfg, lr, fingerprint)
+      return python_replay_process(cfg, lr, fingerprint, timings)
     else:
       return cpp_replay_process(cfg, lr, fingerprint)
 
@@ -452,25 +452,8 @@ def setup_env(simulation=False, CP=None, cfg=None, controlsState=None):
     params.put_bool("DashcamOverride", True)
 
 
-def python_replay_process(cfg, lr, fingerprint=None):
-  sub_sockets = [s for _, sub in cfg.pub_sub.items() for s in sub]
-  pub_sockets = [s for s in cfg.pub_sub.keys() if s != 'can']
-
-  fsm = FakeSubMaster(pub_sockets, **cfg.submaster_config)
-  fpm = FakePubMaster(sub_sockets)
-  args = (fsm, fpm)
-  if 'can' in list(cfg.pub_sub.keys()):
-    can_sock = FakeSocket()
-    args = (fsm, fpm, can_sock)
-
+def python_replay_process(cfg, lr, fingerprint=None, timings=None):
   all_msgs = sorted(lr, key=lambda msg: msg.logMonoTime)
-  pub_msgs = [msg for msg in all_msgs if msg.which() in list(cfg.pub_sub.keys())]
-
-  # laikad needs decision between submaster ubloxGnss and qcomGnss, prio given to ubloxGnss
-  if cfg.proc_name == "laikad":
-    args = (*args, not any(m.which() == "ubloxGnss" for m in pub_msgs))
-    service = "qcomGnss" if args[2] else "ubloxGnss"
-    pub_msgs = [m for m in pub_msgs if m.which() == service or m.which() == 'clocks']
 
   controlsState = None
   initialized = False
@@ -492,60 +475,109 @@ def python_replay_process(cfg, lr, fingerprint=None):
     CP = [m for m in lr if m.which() == 'carParams'][0].carParams
     setup_env(CP=CP, cfg=cfg, controlsState=controlsState)
 
-  assert(type(managed_processes[cfg.proc_name]) is PythonProcess)
-  managed_processes[cfg.proc_name].prepare()
-  mod = importlib.import_module(managed_processes[cfg.proc_name].module)
-
-  thread = threading.Thread(target=mod.main, args=args)
-  thread.daemon = True
-  thread.start()
-
-  if cfg.init_callback is not None:
-    if 'can' not in list(cfg.pub_sub.keys()):
-      can_sock = None
-    cfg.init_callback(all_msgs, fsm, can_sock, fingerprint)
+  proc = PythonReplayProcess(cfg, all_msgs, fingerprint, timings)
+  proc.start()
 
-  CP = car.CarParams.from_bytes(Params().get("CarParams", block=True))
+  log_msgs = []
+  for msg in proc.pub_msgs:
+    log_msgs += proc.step(msg)
+  return log_msgs
 
-  # wait for started process to be ready
-  if 'can' in list(cfg.pub_sub.keys()):
-    can_sock.wait_for_recv()
-  else:
-    fsm.wait_for_update()
 
-  log_msgs, msg_queue = [], []
-  for msg in pub_msgs:
+class PythonReplayProcess:
+  """
+  A python process running in a thread with a fake SubMaster and PubMaster. Every step
+  feeds it one message and returns its responses, stamped with the time of that message.
+  """
+  def __init__(self, cfg, all_msgs, fingerprint=None, timings=None):
+    self.cfg = cfg
+    self.all_msgs = all_msgs
+    self.fingerprint = fingerprint
+    self.timings = timings
+
+    sub_sockets = [s for _, sub in cfg.pub_sub.items() for s in sub]
+    pub_sockets = [s for s in cfg.pub_sub.keys() if s != 'can']
+
+    self.fsm = FakeSubMaster(pub_sockets, **cfg.submaster_config)
+    self.fpm = FakePubMaster(sub_sockets)
+    self.can_sock = FakeSocket() if 'can' in cfg.pub_sub else None
+    self.args = (self.fsm, self.fpm) if self.can_sock is None else (self.fsm, self.fpm, self.can_sock)
+
+    self.services = set(cfg.pub_sub.keys())
+    # laikad needs decision between submaster ubloxGnss and qcomGnss, prio given to ubloxGnss
+    if cfg.proc_name == "laikad":
+      use_qcom = not any(m.which() == "ubloxGnss" for m in all_msgs)
+      self.args = (*self.args, use_qcom)
+      self.services = {"qcomGnss" if use_qcom else "ubloxGnss", "clocks"}
+    self.pub_msgs = [msg for msg in all_msgs if msg.which() in self.services]
+
+    self.msg_queue = []
+
+  def start(self):
+    cfg = self.cfg
+    assert(type(managed_processes[cfg.proc_name]) is PythonProcess)
+    managed_processes[cfg.proc_name].prepare()
+    mod = importlib.import_module(managed_processes[cfg.proc_name].module)
+
+    self.thread = threading.Thread(target=mod.main, args=self.args, name=cfg.proc_name)
+    self.thread.daemon = True
+    self.thread.start()
+
+    if cfg.init_callback is not None:
+      cfg.init_callback(self.all_msgs, self.fsm, self.can_sock, self.fingerprint)
+
+    self.CP = car.CarParams.from_bytes(Params().get("CarParams", block=True))
+
+    # wait for started process to be ready
+    if self.can_sock is not None:
+      self.can_sock.wait_for_recv()
+    else:
+      self.fsm.wait_for_update()
+
+    # optionally record the wall and thread CPU time of every loop iteration of the process
+    # (all messages since the previous response)
+    self.cpu_clock = None
+    if self.timings is not None and hasattr(time, 'pthread_getcpuclockid'):
+      self.cpu_clock = time.pthread_getcpuclockid(self.thread.ident)
+    self.t0 = time.perf_counter()
+    self.cpu0 = time.clock_gettime(self.cpu_clock) if self.cpu_clock is not None else 0.
+
+  def step(self, msg):
+    cfg, fsm = self.cfg, self.fsm
     if cfg.should_recv_callback is not None:
-      recv_socks, should_recv = cfg.should_recv_callback(msg, CP, cfg, fsm)
+      recv_socks, should_recv = cfg.should_recv_callback(msg, self.CP, cfg, fsm)
     else:
       recv_socks = [s for s in cfg.pub_sub[msg.which()] if
                     (fsm.frame + 1) % int(service_list[msg.which()].frequency / service_list[s].frequency) == 0]
       should_recv = bool(len(recv_socks))
 
     if msg.which() == 'can':
-      can_sock.send(msg.as_builder().to_bytes())
+      self.can_sock.send(msg.as_builder().to_bytes())
     else:
-      msg_queue.append(msg.as_builder())
+      self.msg_queue.append(msg.as_builder())
 
+    log_msgs = []
     if should_recv:
-      fsm.update_msgs(msg.logMonoTime / 1e9, msg_queue)
-      msg_queue = []
+      fsm.update_msgs(msg.logMonoTime / 1e9, self.msg_queue)
+      self.msg_queue = []
 
       recv_cnt = len(recv_socks)
       while recv_cnt > 0:
-        m = fpm.wait_for_msg().as_builder()
+        m = self.fpm.wait_for_msg().as_builder()
         m.logMonoTime = msg.logMonoTime
         m = m.as_reader()
 
         log_msgs.append(m)
         recv_cnt -= m.which() in recv_socks
-  return log_msgs
 
+      if self.timings is not None:
+        t, cpu = time.perf_counter(), time.clock_gettime(self.cpu_clock) if self.cpu_clock is not None else float('nan')
+        self.timings.append((t - self.t0, cpu - self.cpu0))
+        self.t0, self.cpu0 = t, cpu
+    return log_msgs
 
-def cpp_replay_process(cfg, lr, fingerprint=None):
-  sub_sockets = [s for _, sub in cfg.pub_sub.items() for s in sub]  # We get responses here
-  pm = messaging.PubMaster(cfg.pub_sub.keys())
 
+def cpp_replay_process(cfg, lr, fingerprint=None):
   all_msgs = sorted(lr, key=lambda msg: msg.logMonoTime)
   pub_msgs = [msg for msg in all_msgs if msg.which() in list(cfg.pub_sub.keys())]
   log_msgs = []
@@ -553,43 +585,69 @@ def cpp_replay_process(cfg, lr, fingerprint=None):
   # We need to fake SubMaster alive since we can't inject a fake clock
   setup_env(simulation=True, cfg=cfg)
 
-  managed_processes[cfg.proc_name].prepare()
-  managed_processes[cfg.proc_name].start()
-
+  proc = CppReplayProcess(cfg)
   try:
     with Timeout(TIMEOUT, error_msg=f"timed out testing process {repr(cfg.proc_name)}"):
-      while not all(pm.all_readers_updated(s) for s in cfg.pub_sub.keys()):
-        time.sleep(0)
-
-      # Make sure all subscribers are connected
-      sockets = {s: messaging.sub_sock(s, timeout=2000) for s in sub_sockets}
-      for s in sub_sockets:
-        messaging.recv_one_or_none(sockets[s])
-
+      proc.start()
       for i, msg in enumerate(pub_msgs):
-        pm.send(msg.which(), msg.as_builder())
+        log_msgs += proc.step(msg, i)
+  finally:
+    proc.stop()
 
-        resp_sockets = cfg.pub_sub[msg.which()] if cfg.should_recv_callback is None else cfg.should_recv_callback(msg)
-        for s in resp_sockets:
-          response = messaging.recv_one_retry(sockets[s])
+  return log_msgs
 
-          if response is None:
-            print(f"Warning, no response received {i}")
-          else:
 
-            response = response.as_builder()
-            response.logMonoTime = msg.logMonoTime
-            response = response.as_reader()
-            log_msgs.append(response)
+class CppReplayProcess:
+  """
+  A managed process over real sockets. Every step publishes one message and waits for its responses.
+  Another process can share the publisher, then only the responses are waited for on the services
+  it also reads, as it doesn't read in step with this one.
+  """
+  def __init__(self, cfg, pm=None, shared=()):
+    self.cfg = cfg
+    self.services = set(cfg.pub_sub.keys())
+    self.sub_sockets = [s for _, sub in cfg.pub_sub.items() for s in sub]  # We get responses here
+    self.pm = messaging.PubMaster(cfg.pub_sub.keys()) if pm is None else pm
+    self.shared = set(shared)
+
+  def start(self):
+    managed_processes[self.cfg.proc_name].prepare()
+    managed_processes[self.cfg.proc_name].start()
+
+    while not all(self.pm.all_readers_updated(s) for s in self.cfg.pub_sub.keys()):
+      time.sleep(0)
+
+    # Make sure all subscribers are connected
+    self.sockets = {s: messaging.sub_sock(s, timeout=2000) for s in self.sub_sockets}
+    for s in self.sub_sockets:
+      messaging.recv_one_or_none(self.sockets[s])
+
+  def step(self, msg, i=0):
+    cfg = self.cfg
+    self.pm.send(msg.which(), msg.as_builder())
+
+    log_msgs = []
+    resp_sockets = cfg.pub_sub[msg.which()] if cfg.should_recv_callback is None else cfg.should_recv_callback(msg)
+    for s in resp_sockets:
+      response = messaging.recv_one_retry(self.sockets[s])
+
+      if response is None:
+        print(f"Warning, no response received {i}")
+      else:
 
-        if not len(resp_sockets):  # We only need to wait if we didn't already wait for a response
-          while not pm.all_readers_updated(msg.which()):
-            time.sleep(0)
-  finally:
-    managed_processes[cfg.proc_name].signal(signal.SIGKILL)
-    managed_processes[cfg.proc_name].stop()
+        response = response.as_builder()
+        response.logMonoTime = msg.logMonoTime
+        response = response.as_reader()
+        log_msgs.append(response)
 
-  return log_msgs
+    if not len(resp_sockets) and msg.which() not in self.shared:  # We only need to wait if we didn't already wait for a response
+      while not self.pm.all_readers_updated(msg.which()):
+        time.sleep(0)
+    return log_msgs
+
+  def stop(self):
+    managed_processes[self.cfg.proc_name].signal(signal.SIGKILL)
+    managed_processes[self.cfg.proc_name].stop()
 
 
 def check_enabled(msgs):
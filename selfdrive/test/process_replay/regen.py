@@ -1,9 +1,14 @@
 #!/usr/bin/env python3
 import bz2
 import os
+import sys
 import time
 import multiprocessing
 import argparse
+import traceback
+from collections import Counter, defaultdict, deque
+
+import numpy as np
 from tqdm import tqdm
 # run DM procs
 os.environ["USE_WEBCAM"] = "1"
@@ -14,22 +19,22 @@ from cereal.services import service_list
 from cereal.visionipc import VisionIpcServer, VisionStreamType
 from common.params import Params
 from common.realtime import Ratekeeper, DT_MDL, DT_DMON, sec_since_boot
+from common.timeout import Timeout
 from common.transformations.camera import eon_f_frame_size, eon_d_frame_size, tici_f_frame_size, tici_d_frame_size
 from panda.python import Panda
 from selfdrive.car.toyota.values import EPS_SCALE
 from selfdrive.manager.process import ensure_running
 from selfdrive.manager.process_config import managed_processes
-from selfdrive.test.process_replay.process_replay import FAKEDATA, setup_env, check_enabled
+from selfdrive.test.process_replay.compare_logs import compare_logs, save_log
+from selfdrive.test.process_replay.helpers import OpenpilotPrefix
+from selfdrive.test.process_replay.process_replay import CONFIGS, FAKEDATA, TIMEOUT, CppReplayProcess, PythonReplayProcess, \
+                                                         setup_env, check_enabled
 from selfdrive.test.update_ci_routes import upload_route
 from tools.lib.route import Route
-from tools.lib.framereader import FrameReader
+from tools.lib.framereader import FrameReader, StreamingFrameSource
 from tools.lib.logreader import LogReader
 
-def replay_panda_states(s, msgs):
-  pm = messaging.PubMaster([s, 'peripheralState'])
-  rk = Ratekeeper(service_list[s].frequency, print_delay_threshold=None)
-  smsgs = [m for m in msgs if m.which() in ['pandaStates', 'pandaStateDEPRECATED']]
-
+def get_safety_param(msgs):
   # TODO: safety param migration should be handled automatically
   safety_param_migration = {
     "TOYOTA PRIUS 2017": EPS_SCALE["TOYOTA PRIUS 2017"] | Panda.FLAG_TOYOTA_STOCK_LONGITUDINAL,
@@ -47,6 +52,14 @@ def replay_panda_states(s, msgs):
       safety_param = cp.safetyConfigs[0].safetyParamDEPRECATED
   else:
     safety_param = cp.safetyParamDEPRECATED
+  return safety_param
+
+
+def replay_panda_states(s, msgs):
+  pm = messaging.PubMaster([s, 'peripheralState'])
+  rk = Ratekeeper(service_list[s].frequency, print_delay_threshold=None)
+  smsgs = [m for m in msgs if m.which() in ['pandaStates', 'pandaStateDEPRECATED']]
+  safety_param = get_safety_param(msgs)
 
   while True:
     for m in smsgs:
@@ -127,17 +140,19 @@ def replay_cameras(lr, frs, disable_tqdm=False):
     ("driverCameraState", DT_MDL, tici_d_frame_size, VisionStreamType.VISION_STREAM_DRIVER, False),
   ]
 
-  def replay_camera(s, stream, dt, vipc_server, frames, size, use_extra_client):
+  def replay_camera(s, stream, dt, vipc_server, fr, size, use_extra_client):
     services = [(s, stream)]
     if use_extra_client:
       services.append(("wideRoadCameraState", VisionStreamType.VISION_STREAM_WIDE_ROAD))
     pm = messaging.PubMaster([s for s, _ in services])
     rk = Ratekeeper(1 / dt, print_delay_threshold=None)
 
-    img = b"\x00" * int(size[0] * size[1] * 3 / 2)
+    # frames are decoded as they're sent, the wide camera gets the same frame
+    frames = iter(StreamingFrameSource(fr, loop=True)) if fr is not None else None
+    img = np.zeros(int(size[0] * size[1] * 3 / 2), dtype=np.uint8)
     while True:
       if frames is not None:
-        img = frames[rk.frame % len(frames)]
+        img = next(frames)
 
       rk.keep_time()
 
@@ -160,19 +175,11 @@ def replay_cameras(lr, frs, disable_tqdm=False):
   for (s, dt, size, stream, use_extra_client) in cameras:
     fr = frs.get(s, None)
 
-    frames = None
-    if fr is not None:
-      print(f"Decompressing frames {s}")
-      frames = []
-      for i in tqdm(range(fr.frame_count), disable=disable_tqdm):
-        img = fr.get(i, pix_fmt='nv12')[0]
-        frames.append(img.flatten().tobytes())
-
     vs.create_buffers(stream, 40, False, size[0], size[1])
     if use_extra_client:
       vs.create_buffers(VisionStreamType.VISION_STREAM_WIDE_ROAD, 40, False, size[0], size[1])
     p.append(multiprocessing.Process(target=replay_camera,
-                                     args=(s, stream, dt, vs, frames, size, use_extra_client)))
+                                     args=(s, stream, dt, vs, fr, size, use_extra_client)))
 
   vs.start_listener()
   return vs, p
@@ -311,15 +318,299 @@ def regen_segment(lr, frs=None, outdir=FAKEDATA, disable_tqdm=False):
   return seg_path
 
 
-def regen_and_save(route, sidx, upload=False, use_route_meta=True, outdir=FAKEDATA, disable_tqdm=False):
+# regenerated by the daemons, or timing fields that are never reproducible
+FAST_REGEN_IGNORE = [
+  "controlsState.startMonoTime", "controlsState.cumLagMs", "radarState.cumLagMs",
+  "longitudinalPlan.processingDelay", "longitudinalPlan.solverExecutionTime", "lateralPlan.solverExecutionTime",
+  "modelV2.modelExecutionTime", "modelV2.gpuExecutionTime", "driverStateV2.modelExecutionTime", "driverStateV2.dspExecutionTime",
+]
+RATE_TOLERANCE = 0.1
+ENGAGED_TOLERANCE = 0.05
+
+
+def fast_regen_inputs(lr):
+  """What the fake daemons of the real-time regen publish, at the times of the source log"""
+  safety_param = get_safety_param(lr)
+  frame_ids = defaultdict(int)
+
+  inputs = []
+  for m in lr:
+    which = m.which()
+    if which in ('accelerometer', 'gyroscope', 'magnetometer'):
+      new_m = m.as_builder()
+      getattr(new_m, which).timestamp = m.logMonoTime
+      inputs.append(new_m.as_reader())
+
+    elif which in ('can', 'ubloxRaw'):
+      inputs.append(m)
+
+    elif which in ('pandaStates', 'pandaStateDEPRECATED'):
+      if which == 'pandaStateDEPRECATED':
+        new_m = messaging.new_message('pandaStates', 1)
+        new_m.pandaStates[0] = m.pandaStateDEPRECATED
+      else:
+        new_m = m.as_builder()
+      new_m.pandaStates[-1].safetyParam = safety_param
+      new_m.logMonoTime = m.logMonoTime
+      inputs.append(new_m.as_reader())
+
+      new_m = messaging.new_message('peripheralState')
+      new_m.logMonoTime = m.logMonoTime
+      inputs.append(new_m.as_reader())
+
+    elif which == 'deviceState':
+      new_m = m.as_builder()
+      new_m.deviceState.freeSpacePercent = 50
+      new_m.deviceState.memoryUsagePercent = 50
+      inputs.append(new_m.as_reader())
+
+      # same frequency as deviceState
+      new_m = messaging.new_message('managerState')
+      new_m.logMonoTime = m.logMonoTime
+      new_m.managerState.processes = [{'name': name, 'running': True} for name in managed_processes]
+      inputs.append(new_m.as_reader())
+
+    elif which in ('roadCameraState', 'driverCameraState'):
+      # the road camera is also sent as the wide camera, like the real-time regen
+      for s in ((which, 'wideRoadCameraState') if which == 'roadCameraState' else (which,)):
+        frame_ids[s] += 1
+        new_m = messaging.new_message(s)
+        new_m.logMonoTime = m.logMonoTime
+        cs = getattr(new_m, s)
+        cs.frameId = frame_ids[s]
+        cs.timestampSof = m.logMonoTime
+        cs.timestampEof = m.logMonoTime
+        inputs.append(new_m.as_reader())
+
+  return sorted(inputs, key=lambda m: m.logMonoTime)
+
+
+class FastModelReplay:
+  """modeld and dmonitoringmodeld over VisionIPC, a frame is done once its model outputs are back"""
+  OUTPUTS = {'roadCameraState': ['modelV2', 'cameraOdometry'], 'driverCameraState': ['driverStateV2']}
+  STREAMS = {'roadCameraState': VisionStreamType.VISION_STREAM_ROAD, 'wideRoadCameraState': VisionStreamType.VISION_STREAM_WIDE_ROAD,
+             'driverCameraState': VisionStreamType.VISION_STREAM_DRIVER}
+
+  SERVICES = ('roadCameraState', 'wideRoadCameraState', 'driverCameraState', 'liveCalibration', 'lateralPlan', 'driverMonitoringState')
+
+  def __init__(self, lr, frs, pm):
+    self.services = {'roadCameraState', 'driverCameraState', 'liveCalibration', 'lateralPlan', 'driverMonitoringState'}
+
+    init_data = [m for m in lr if m.which() == 'initData'][0]
+    tici = init_data.initData.deviceType == 'tici'
+    self.sizes = {
+      'roadCameraState': tici_f_frame_size if tici else eon_f_frame_size,
+      'driverCameraState': tici_d_frame_size if tici else eon_d_frame_size,
+    }
+    self.sizes['wideRoadCameraState'] = self.sizes['roadCameraState']
+    self.blank = {s: np.zeros(int(w * h * 3 / 2), dtype=np.uint8) for s, (w, h) in self.sizes.items()}
+    # frames are asked for in order, so they're decoded ahead as they're sent
+    self.frames = {s: iter(StreamingFrameSource(fr, loop=True)) for s, fr in frs.items()}
+
+    self.vs = VisionIpcServer("camerad")
+    for s, stream in self.STREAMS.items():
+      self.vs.create_buffers(stream, 40, False, *self.sizes[s])
+    self.vs.start_listener()
+
+    self.pm = pm
+    self.sockets = {s: messaging.sub_sock(s, timeout=TIMEOUT * 1000) for outs in self.OUTPUTS.values() for s in outs}
+
+  def start(self):
+    managed_processes["modeld"].start()
+    managed_processes["dmonitoringmodeld"].start()
+
+    # the models subscribe after loading and connecting to VisionIPC
+    with Timeout(60, "timed out waiting for the models to start"):
+      while not all(self.pm.all_readers_updated(s) for s in ('roadCameraState', 'driverCameraState')):
+        time.sleep(0.01)
+
+  def stop(self):
+    managed_processes["modeld"].stop()
+    managed_processes["dmonitoringmodeld"].stop()
+
+  def next_frame(self, s):
+    return next(self.frames[s]) if s in self.frames else self.blank[s]
+
+  def step(self, msg):
+    which = msg.which()
+    if which not in self.OUTPUTS:
+      # picked up with the next frame
+      self.pm.send(which, msg.as_builder())
+      return []
+
+    cs = getattr(msg, which)
+    streams = ('roadCameraState', 'wideRoadCameraState') if which == 'roadCameraState' else (which,)
+    for s in streams:
+      new_m = messaging.new_message(s)
+      getattr(new_m, s).frameId = cs.frameId
+      getattr(new_m, s).timestampSof = cs.timestampSof
+      getattr(new_m, s).timestampEof = cs.timestampEof
+      self.pm.send(s, new_m)
+    # the road camera frame is also the wide camera frame
+    img = self.next_frame(which)
+    for s in streams:
+      self.vs.send(self.STREAMS[s], img, cs.frameId, cs.timestampSof, cs.timestampEof)
+
+    log_msgs = []
+    for s in self.OUTPUTS[which]:
+      m = messaging.recv_one(self.sockets[s])
+      if m is None:
+        raise Exception(f"no {s} for {which} {cs.frameId}")
+      m = m.as_builder()
+      m.logMonoTime = msg.logMonoTime
+      log_msgs.append(m.as_reader())
+    return log_msgs
+
+
+def regen_segment_fast(lr, frs=None, outdir=FAKEDATA, disable_tqdm=False):
+  """
+  Regenerates a segment on the clock of the source log instead of wall time.
+
+  The inputs of the real-time regen are stepped through in time order, and every message
+  is handed to the processes that subscribe to it. A process replies for the messages its
+  process replay config waits on, those replies are stamped with the current time and
+  handed on before the next input. The python processes run in lockstep threads, the cpp
+  processes and the models over real sockets, so a segment takes as long as its processing.
+  Only the processes with a process replay config and the models are regenerated.
+  """
+  lr = migrate_carparams(list(lr))
+  lr = migrate_sensorEvents(list(lr), old_logtime=True)
+  if frs is None:
+    frs = dict()
+
+  params = Params()
+  CP = [m for m in lr if m.which() == 'carParams'][0].carParams
+  controlsState = [m for m in lr if m.which() == 'controlsState'][0].controlsState
+  liveCalibration = [m for m in lr if m.which() == 'liveCalibration'][0]
+
+  setup_env(CP=CP, controlsState=controlsState)
+  params.put("CalibrationParams", liveCalibration.as_builder().to_bytes())
+
+  inputs = fast_regen_inputs(lr)
+  all_msgs = sorted(lr, key=lambda m: m.logMonoTime)
+  procs = [PythonReplayProcess(cfg, all_msgs) for cfg in CONFIGS if cfg.fake_pubsubmaster]
+
+  # one publisher per service for everything over real sockets
+  cpp_cfgs = [cfg for cfg in CONFIGS if not cfg.fake_pubsubmaster]
+  pm = messaging.PubMaster(set(FastModelReplay.SERVICES) | {s for cfg in cpp_cfgs for s in cfg.pub_sub})
+  models = FastModelReplay(lr, frs, pm)
+  cpp_procs = [CppReplayProcess(cfg, pm, shared=models.services) for cfg in cpp_cfgs]
+
+  subscribers = defaultdict(list)
+  for p in [models, *procs, *cpp_procs]:
+    for s in p.services:
+      subscribers[s].append(p)
+
+  log_msgs = [m for m in lr if m.which() == 'initData'][:1]
+  try:
+    # python processes read SIMULATION on import, the cpp processes need it to fake SubMaster alive
+    for p in procs:
+      p.start()
+    os.environ["SIMULATION"] = "1"
+    for p in cpp_procs:
+      p.start()
+    del os.environ["SIMULATION"]
+    models.start()
+
+    for msg in tqdm(inputs, disable=disable_tqdm):
+      # replies go out at the time of the message that caused them
+      pending = deque([msg])
+      while len(pending):
+        m = pending.popleft()
+        log_msgs.append(m)
+        for p in subscribers[m.which()]:
+          pending.extend(p.step(m))
+  finally:
+    models.stop()
+    for p in cpp_procs:
+      p.stop()
+
+  seg_path = os.path.join(outdir, time.strftime("%Y-%m-%d--%H-%M-%S") + "--0")
+  os.makedirs(seg_path, exist_ok=True)
+  save_log(os.path.join(seg_path, "rlog"), log_msgs, compress=False)
+
+  # check to make sure openpilot is engaged in the route
+  if not check_enabled(log_msgs):
+    raise Exception(f"Route did not engage for long enough: {seg_path}")
+
+  return seg_path
+
+
+def regen_in_process(regen, lr, frs=None, outdir=FAKEDATA, disable_tqdm=False):
+  """
+  Runs a regen in a forked process with its own prefix, so the replay threads, module
+  globals and params of one run can't leak into the next. Returns the segment path.
+  """
+  ctx = multiprocessing.get_context('fork')
+  result = ctx.SimpleQueue()
+
+  def job():
+    with OpenpilotPrefix():
+      try:
+        result.put((regen(lr, frs, outdir, disable_tqdm), None))
+      except Exception:
+        result.put((None, traceback.format_exc()))
+
+  proc = ctx.Process(target=job)
+  proc.start()
+  proc.join()
+  if result.empty():
+    raise Exception(f"{regen.__name__} exited with {proc.exitcode}")
+  seg_path, err = result.get()
+  if err is not None:
+    raise Exception(f"{regen.__name__} failed:\n{err}")
+  return seg_path
+
+
+def check_fast_regen(lr, frs=None, outdir=FAKEDATA, disable_tqdm=False):
+  """
+  Fast regen must be deterministic, and match the real-time regen in the message rates and
+  how long openpilot was engaged. Returns the list of failures.
+  """
+  lr = list(lr)
+  fast = [list(LogReader(os.path.join(regen_in_process(regen_segment_fast, lr, frs, outdir, disable_tqdm), "rlog"))) for _ in range(2)]
+  real = list(LogReader(os.path.join(regen_in_process(regen_segment, lr, frs, outdir, disable_tqdm), "rlog")))
+
+  failures = []
+  try:
+    diff = compare_logs(fast[0], fast[1], ignore_fields=FAST_REGEN_IGNORE)
+    if len(diff):
+      failures.append(f"fast regen is not deterministic, {len(diff)} differences, first: {diff[0]}")
+  except Exception as e:
+    failures.append(f"fast regen is not deterministic: {e}")
+
+  def duration(msgs):
+    t = [m.logMonoTime for m in msgs if m.which() == 'can']
+    return (t[-1] - t[0]) * 1e-9
+
+  fast_cnt = Counter(m.which() for m in fast[0])
+  real_cnt = Counter(m.which() for m in real)
+  fast_duration, real_duration = duration(fast[0]), duration(real)
+  for s in sorted(set(sub for cfg in CONFIGS for subs in cfg.pub_sub.values() for sub in subs) | {'modelV2', 'driverStateV2'}):
+    fast_rate, real_rate = fast_cnt[s] / fast_duration, real_cnt[s] / real_duration
+    if abs(fast_rate - real_rate) > RATE_TOLERANCE * max(real_rate, 1e-3):
+      failures.append(f"{s}: {fast_rate:.2f} Hz with fast regen, {real_rate:.2f} Hz in real time")
+
+  def engaged(msgs):
+    active = [m.controlsState.active for m in msgs if m.which() == 'controlsState']
+    return sum(active) / max(len(active), 1)
+
+  if abs(engaged(fast[0]) - engaged(real)) > ENGAGED_TOLERANCE:
+    failures.append(f"engaged {engaged(fast[0]):.1%} of the time with fast regen, {engaged(real):.1%} in real time")
+  return failures
+
+
+def segment_readers(route, sidx, use_route_meta=True):
   if use_route_meta:
     r = Route(route)
-    lr = LogReader(r.log_paths()[sidx])
-    fr = FrameReader(r.camera_paths()[sidx])
-  else:
-    lr = LogReader(f"cd:/{route.replace('|', '/')}/{sidx}/rlog.bz2")
-    fr = FrameReader(f"cd:/{route.replace('|', '/')}/{sidx}/fcamera.hevc")
-  rpath = regen_segment(lr, {'roadCameraState': fr}, outdir=outdir, disable_tqdm=disable_tqdm)
+    return LogReader(r.log_paths()[sidx]), FrameReader(r.camera_paths()[sidx])
+  return LogReader(f"cd:/{route.replace('|', '/')}/{sidx}/rlog.bz2"), FrameReader(f"cd:/{route.replace('|', '/')}/{sidx}/fcamera.hevc")
+
+
+def regen_and_save(route, sidx, upload=False, use_route_meta=True, outdir=FAKEDATA, disable_tqdm=False, fast=False):
+  lr, fr = segment_readers(route, sidx, use_route_meta)
+  regen = regen_segment_fast if fast else regen_segment
+  rpath = regen(lr, {'roadCameraState': fr}, outdir=outdir, disable_tqdm=disable_tqdm)
 
   # compress raw rlog before uploading
   with open(os.path.join(rpath, "rlog"), "rb") as f:
@@ -346,5 +637,15 @@ if __name__ == "__main__":
   parser.add_argument("--upload", action="store_true", help="Upload the new segment to the CI bucket")
   parser.add_argument("route", type=str, help="The source route")
   parser.add_argument("seg", type=int, help="Segment in source route")
+  parser.add_argument("--fast", action="store_true", help="Regenerate on the clock of the source log, as fast as the processes go")
+  parser.add_argument("--check", action="store_true", help="Check fast regen is deterministic and matches the real-time regen")
+  parser.add_argument("--no-route-meta", action="store_true", help="Read the segment from the CI bucket instead of through the route API")
   args = parser.parse_args()
-  regen_and_save(args.route, args.seg, args.upload)
+
+  if args.check:
+    lr, fr = segment_readers(args.route, args.seg, not args.no_route_meta)
+    failures = check_fast_regen(lr, {'roadCameraState': fr})
+    print("\n".join(failures) if failures else "fast regen is deterministic and matches the real-time regen")
+    sys.exit(len(failures) > 0)
+
+  regen_and_save(args.route, args.seg, args.upload, use_route_meta=not args.no_route_meta, fast=args.fast)
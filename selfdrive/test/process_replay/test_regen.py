@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+import unittest
+
+import cereal.messaging as messaging
+from selfdrive.manager.process_config import managed_processes
+from selfdrive.test.process_replay.regen import fast_regen_inputs
+
+
+def new_message(which, t, *args):
+  m = messaging.new_message(which, *args)
+  m.logMonoTime = int(t * 1e9)
+  return m
+
+
+def synthetic_log():
+  msgs = []
+  cp = new_message('carParams', 0.)
+  cp.carParams.carFingerprint = "HONDA CIVIC 2016"
+  cp.carParams.safetyConfigs = [{'safetyParam': 3}]
+  msgs.append(cp)
+
+  for i in range(20):
+    t = 1. + i * 0.05
+    msgs.append(new_message('can', t + 0.001, 2))
+    msgs.append(new_message('carState', t + 0.002))
+    msgs.append(new_message('accelerometer', t + 0.003))
+    msgs.append(new_message('roadCameraState', t + 0.004))
+    if i % 2 == 0:
+      msgs.append(new_message('driverCameraState', t + 0.005))
+    if i % 10 == 0:
+      msgs.append(new_message('pandaStates', t + 0.006, 1))
+      msgs.append(new_message('deviceState', t + 0.007))
+  return [m.as_reader() for m in msgs]
+
+
+class TestRegen(unittest.TestCase):
+  def test_fast_regen_inputs(self):
+    lr = synthetic_log()
+    inputs = fast_regen_inputs(lr)
+
+    t = [m.logMonoTime for m in inputs]
+    self.assertEqual(t, sorted(t))
+
+    by_service = {}
+    for m in inputs:
+      by_service.setdefault(m.which(), []).append(m)
+    self.assertEqual(set(by_service), {'can', 'accelerometer', 'roadCameraState', 'wideRoadCameraState', 'driverCameraState',
+                                       'pandaStates', 'peripheralState', 'deviceState', 'managerState'})
+    self.assertEqual(len(by_service['can']), 20)
+
+    for m in by_service['accelerometer']:
+      self.assertEqual(m.accelerometer.timestamp, m.logMonoTime)
+    for m in by_service['pandaStates']:
+      self.assertEqual(m.pandaStates[0].safetyParam, 3)
+    for m in by_service['deviceState']:
+      self.assertEqual(m.deviceState.freeSpacePercent, 50)
+
+    # peripheralState and managerState go with every pandaStates and deviceState
+    self.assertEqual([m.logMonoTime for m in by_service['peripheralState']], [m.logMonoTime for m in by_service['pandaStates']])
+    self.assertEqual([m.logMonoTime for m in by_service['managerState']], [m.logMonoTime for m in by_service['deviceState']])
+    self.assertEqual({p.name for p in by_service['managerState'][0].managerState.processes}, set(managed_processes))
+
+    # the road camera is also the wide camera, frames are numbered in order
+    for s, n in (('roadCameraState', 20), ('wideRoadCameraState', 20), ('driverCameraState', 10)):
+      frames = [getattr(m, s) for m in by_service[s]]
+      self.assertEqual([f.frameId for f in frames], list(range(1, n + 1)))
+      self.assertEqual([f.timestampSof for f in frames], [m.logMonoTime for m in by_service[s]])
+    self.assertEqual([m.logMonoTime for m in by_service['wideRoadCameraState']], [m.logMonoTime for m in by_service['roadCameraState']])
+
+
+if __name__ == "__main__":
+  unittest.main()
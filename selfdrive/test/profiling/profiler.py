@@ -1,101 +1,235 @@
 #!/usr/bin/env python3
+"""
+Profiles the python daemons under process replay.
+
+Every process runs through its process replay config while a sampling profiler
+records the stacks of its thread. For each process this writes:
+  - <proc>.folded: collapsed stacks for flamegraph.pl or speedscope
+  - <proc>.speedscope.json: https://www.speedscope.app
+and a summary.json with per-loop-iteration wall and CPU time distributions and
+the functions with the most self time. The sampler holds the GIL while it walks
+the stack, so the times come from a separate replay without it.
+
+The summary can be compared against a saved baseline, which fails if the CPU time
+per iteration of a process regressed. CPU times are only comparable on the same
+machine, so keep a baseline per machine:
+
+  ./profiler.py controlsd plannerd radard --update-baseline baseline.json
+  ./profiler.py controlsd plannerd radard --baseline baseline.json
+"""
+import argparse
+import json
 import os
 import sys
-import cProfile  # pylint: disable=import-error
-import pprofile  # pylint: disable=import-error
-import pyprof2calltree  # pylint: disable=import-error
+import threading
+import time
+from collections import Counter
+from typing import Any, Dict, List, Tuple
 
-from common.params import Params
+import numpy as np
+
+from selfdrive.test.openpilotci import get_url
+from selfdrive.test.process_replay.process_replay import CONFIGS, replay_process
+from selfdrive.test.process_replay.test_processes import segments
+from system.version import get_commit
 from tools.lib.logreader import LogReader
-from selfdrive.test.profiling.lib import SubMaster, PubMaster, SubSocket, ReplayDone
-from selfdrive.test.process_replay.process_replay import CONFIGS
-from selfdrive.car.toyota.values import CAR as TOYOTA
-from selfdrive.car.honda.values import CAR as HONDA
-from selfdrive.car.volkswagen.values import CAR as VW
-
-BASE_URL = "https://commadataci.blob.core.windows.net/openpilotci/"
-
-CARS = {
-  'toyota': ("0982d79ebb0de295|2021-01-03--20-03-36/6", TOYOTA.RAV4),
-  'honda': ("0982d79ebb0de295|2021-01-08--10-13-10/6", HONDA.CIVIC),
-  "vw": ("ef895f46af5fd73f|2021-05-22--14-06-35/6", VW.AUDI_A3_MK3),
-}
-
-
-def get_inputs(msgs, process, fingerprint):
-  for config in CONFIGS:
-    if config.proc_name == process:
-      sub_socks = list(config.pub_sub.keys())
-      trigger = sub_socks[0]
-      break
-
-  # some procs block on CarParams
-  for msg in msgs:
-    if msg.which() == 'carParams':
-      m = msg.as_builder()
-      m.carParams.carFingerprint = fingerprint
-      Params().put("CarParams", m.carParams.copy().to_bytes())
-      break
-
-  sm = SubMaster(msgs, trigger, sub_socks)
-  pm = PubMaster()
-  if 'can' in sub_socks:
-    can_sock = SubSocket(msgs, 'can')
-  else:
-    can_sock = None
-  return sm, pm, can_sock
-
-
-def profile(proc, func, car='toyota'):
-  segment, fingerprint = CARS[car]
-  segment = segment.replace('|', '/')
-  rlog_url = f"{BASE_URL}{segment}/rlog.bz2"
-  msgs = list(LogReader(rlog_url)) * int(os.getenv("LOOP", "1"))
-
-  os.environ['FINGERPRINT'] = fingerprint
-  os.environ['SKIP_FW_QUERY'] = "1"
-  os.environ['REPLAY'] = "1"
-
-  def run(sm, pm, can_sock):
-    try:
-      if can_sock is not None:
-        func(sm, pm, can_sock)
-      else:
-        func(sm, pm)
-    except ReplayDone:
-      pass
-
-  # Statistical
-  sm, pm, can_sock = get_inputs(msgs, proc, fingerprint)
-  with pprofile.StatisticalProfile()(period=0.00001) as pr:
-    run(sm, pm, can_sock)
-  pr.dump_stats(f'cachegrind.out.{proc}_statistical')
-
-  # Deterministic
-  sm, pm, can_sock = get_inputs(msgs, proc, fingerprint)
-  with cProfile.Profile() as pr:
-    run(sm, pm, can_sock)
-  pyprof2calltree.convert(pr.getstats(), f'cachegrind.out.{proc}_deterministic')
-
-
-if __name__ == '__main__':
-  from selfdrive.controls.controlsd import main as controlsd_thread
-  from selfdrive.controls.radard import radard_thread
-  from selfdrive.locationd.paramsd import main as paramsd_thread
-  from selfdrive.controls.plannerd import main as plannerd_thread
-  from selfdrive.locationd.laikad import main as laikad_thread
-
-  procs = {
-    'radard': radard_thread,
-    'controlsd': controlsd_thread,
-    'paramsd': paramsd_thread,
-    'plannerd': plannerd_thread,
-    'laikad': laikad_thread,
+
+SAMPLE_INTERVAL = 0.001  # s
+PERCENTILES = (50, 90, 99)
+HIST_BINS_MS = [0, 0.5, 1, 2, 3, 5, 7.5, 10, 15, 20, 30, 50, 100, np.inf]
+TOP_FUNCTIONS = 25
+TOLERANCE = 0.15
+
+Frame = Tuple[str, str, int]
+
+
+class StackSampler:
+  """Samples the python stack of a thread, by name, from a background thread"""
+  def __init__(self, thread_name: str, interval: float = SAMPLE_INTERVAL):
+    self.thread_name = thread_name
+    self.interval = interval
+    self.stacks: Counter = Counter()
+    self.running = False
+
+  def __enter__(self):
+    # only threads started from here on, replays of the same process before can leave theirs behind
+    self.existing = {t.ident for t in threading.enumerate()}
+    self.running = True
+    self.thread = threading.Thread(target=self.sample_thread, daemon=True)
+    self.thread.start()
+    return self
+
+  def __exit__(self, *args):
+    self.running = False
+    self.thread.join()
+
+  def sample_thread(self) -> None:
+    ident = None
+    while self.running:
+      if ident is None:
+        ident = next((t.ident for t in threading.enumerate() if t.name == self.thread_name and t.ident not in self.existing), None)
+
+      frame = sys._current_frames().get(ident) if ident is not None else None  # pylint: disable=protected-access
+      if frame is not None:
+        stack = []
+        while frame is not None:
+          code = frame.f_code
+          stack.append((code.co_name, code.co_filename, code.co_firstlineno))
+          frame = frame.f_back
+        self.stacks[tuple(reversed(stack))] += 1
+      time.sleep(self.interval)
+
+  @property
+  def samples(self) -> int:
+    return sum(self.stacks.values())
+
+  @staticmethod
+  def label(frame: Frame) -> str:
+    name, filename, line = frame
+    return f"{name} ({os.path.relpath(filename)}:{line})"
+
+  def folded(self) -> str:
+    return "".join(f"{';'.join(self.label(f) for f in stack)} {n}\n" for stack, n in self.stacks.most_common())
+
+  def speedscope(self, name: str) -> Dict[str, Any]:
+    frames: Dict[Frame, int] = {}
+    samples, weights = [], []
+    for stack, n in self.stacks.items():
+      samples.append([frames.setdefault(f, len(frames)) for f in stack])
+      weights.append(n * self.interval)
+
+    return {
+      "$schema": "https://www.speedscope.app/file-format-schema.json",
+      "shared": {"frames": [{"name": f[0], "file": os.path.relpath(f[1]), "line": f[2]} for f in frames]},
+      "profiles": [{
+        "type": "sampled",
+        "name": name,
+        "unit": "seconds",
+        "startValue": 0,
+        "endValue": sum(weights),
+        "samples": samples,
+        "weights": weights,
+      }],
+      "name": name,
+      "exporter": "openpilot profiler",
+    }
+
+  def top_self(self, n: int = TOP_FUNCTIONS) -> List[Dict[str, Any]]:
+    total = self.samples
+    self_samples: Counter = Counter()
+    for stack, count in self.stacks.items():
+      self_samples[stack[-1]] += count
+    return [{"function": self.label(f), "fraction": c / total} for f, c in self_samples.most_common(n)]
+
+
+def distribution(x: np.ndarray) -> Dict[str, float]:
+  if not len(x):
+    return {}
+  ret = {f"p{p}": float(np.percentile(x, p)) for p in PERCENTILES}
+  ret["max"] = float(np.max(x))
+  ret["mean"] = float(np.mean(x))
+  return ret
+
+
+def profile_process(cfg, msgs: List, out_dir: str, interval: float = SAMPLE_INTERVAL) -> Dict[str, Any]:
+  name = cfg.proc_name + cfg.subtest_name
+  timings: List[Tuple[float, float]] = []
+  replay_process(cfg, msgs, timings=timings)
+  with StackSampler(cfg.proc_name, interval) as sampler:
+    replay_process(cfg, msgs)
+
+  with open(os.path.join(out_dir, f"{name}.folded"), "w") as f:
+    f.write(sampler.folded())
+  with open(os.path.join(out_dir, f"{name}.speedscope.json"), "w") as f:
+    json.dump(sampler.speedscope(name), f)
+
+  t = np.array(timings).reshape(-1, 2) * 1e3
+  wall, cpu = t[:, 0], t[np.isfinite(t[:, 1]), 1]
+  counts, _ = np.histogram(cpu if len(cpu) else wall, bins=HIST_BINS_MS)
+  return {
+    "iterations": len(timings),
+    "wall_ms": distribution(wall),
+    "cpu_ms": distribution(cpu),
+    "cpu_total_s": float(np.sum(cpu) / 1e3),
+    "histogram": {"bins_ms": HIST_BINS_MS[:-1], "counts": counts.tolist()},
+    "samples": sampler.samples,
+    "top_self": sampler.top_self(),
   }
 
-  proc = sys.argv[1]
-  if proc not in procs:
-    print(f"{proc} not available")
-    sys.exit(0)
-  else:
-    profile(proc, procs[proc])
+
+def compare(summary: Dict[str, Any], baseline: Dict[str, Any], tolerance: float = TOLERANCE) -> List[str]:
+  """Processes whose mean or p90 CPU time per iteration is worse than the baseline"""
+  failures = []
+  for name, cur in summary["procs"].items():
+    ref = baseline["procs"].get(name)
+    if ref is None or not ref["cpu_ms"] or not cur["cpu_ms"]:
+      continue
+    for stat in ("mean", "p90"):
+      r, c = ref["cpu_ms"][stat], cur["cpu_ms"][stat]
+      if c > r * (1 + tolerance):
+        failures.append(f"{name}: {stat} CPU time per iteration went from {r:.3f} ms to {c:.3f} ms (+{(c / r - 1) * 100:.0f}%)")
+  return failures
+
+
+def print_summary(summary: Dict[str, Any]) -> None:
+  for name, s in summary["procs"].items():
+    cpu = s["cpu_ms"]
+    print(f"{name}: {s['iterations']} iterations, {s['cpu_total_s']:.2f} s CPU, "
+          f"per iteration mean {cpu.get('mean', 0):.3f} ms  p90 {cpu.get('p90', 0):.3f} ms  p99 {cpu.get('p99', 0):.3f} ms")
+    hist = s["histogram"]
+    total = max(sum(hist["counts"]), 1)
+    for lo, n in zip(hist["bins_ms"], hist["counts"]):
+      if n:
+        print(f"  >= {lo:5.1f} ms {n:7d} {'#' * int(50 * n / total)}")
+    for f in s["top_self"][:5]:
+      print(f"  {f['fraction'] * 100:5.1f}% {f['function']}")
+
+
+if __name__ == "__main__":
+  python_procs = sorted({cfg.proc_name for cfg in CONFIGS if cfg.fake_pubsubmaster})
+
+  parser = argparse.ArgumentParser(description="Profile python processes under process replay",
+                                   formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+  parser.add_argument("procs", nargs="*", default=python_procs, help=f"processes to profile, out of {', '.join(python_procs)}")
+  parser.add_argument("--car", default="TOYOTA2", help="process replay segment to run on")
+  parser.add_argument("--segment", help="segment name, instead of a process replay segment")
+  parser.add_argument("--out", default="profiles", help="output directory")
+  parser.add_argument("--interval", type=float, default=SAMPLE_INTERVAL, help="sampling interval in seconds")
+  parser.add_argument("--baseline", help="compare with this summary, fails on regressions")
+  parser.add_argument("--tolerance", type=float, default=TOLERANCE, help="allowed relative CPU time increase")
+  parser.add_argument("--update-baseline", help="write the summary to this baseline file")
+  args = parser.parse_args()
+
+  unknown = set(args.procs) - set(python_procs)
+  if unknown:
+    print(f"can't profile {', '.join(sorted(unknown))}, only python processes are supported")
+    sys.exit(1)
+
+  segment = args.segment if args.segment else dict(segments)[args.car]
+  r, n = segment.rsplit("--", 1)
+  msgs = list(LogReader(get_url(r, n)))
+
+  os.makedirs(args.out, exist_ok=True)
+  summary: Dict[str, Any] = {"commit": get_commit(), "segment": segment, "procs": {}}
+  for cfg in CONFIGS:
+    if cfg.proc_name in args.procs:
+      print(f"profiling {cfg.proc_name}{cfg.subtest_name}")
+      summary["procs"][cfg.proc_name + cfg.subtest_name] = profile_process(cfg, msgs, args.out, args.interval)
+
+  with open(os.path.join(args.out, "summary.json"), "w") as f:
+    json.dump(summary, f, indent=2)
+  print_summary(summary)
+
+  if args.update_baseline:
+    with open(args.update_baseline, "w") as f:
+      json.dump(summary, f, indent=2)
+
+  if args.baseline:
+    with open(args.baseline) as f:
+      baseline = json.load(f)
+    failures = compare(summary, baseline, args.tolerance)
+    if failures:
+      print(f"\nCPU regressions against {args.baseline} (commit {baseline.get('commit')}):")
+      print("\n".join(failures))
+      sys.exit(1)
+    print(f"\nno CPU regressions against {args.baseline}")
@@ -0,0 +1,32 @@
+#!/usr/bin/env python3
+import unittest
+
+from selfdrive.test.profiling.profiler import compare
+
+
+def summary(**procs):
+  return {"procs": {name: {"cpu_ms": {"mean": mean, "p90": p90} if mean is not None else {}}
+                    for name, (mean, p90) in procs.items()}}
+
+
+class TestProfiler(unittest.TestCase):
+  def test_compare(self):
+    baseline = summary(controlsd=(2., 3.), plannerd=(1., 2.), radard=(0.5, 1.), paramsd=(None, None))
+
+    self.assertEqual(compare(baseline, baseline), [])
+    # within the tolerance, or faster
+    self.assertEqual(compare(summary(controlsd=(2.2, 3.3), plannerd=(0.5, 1.)), baseline, tolerance=0.15), [])
+
+    failures = compare(summary(controlsd=(2.5, 3.), plannerd=(1., 2.5), radard=(1., 2.)), baseline, tolerance=0.15)
+    self.assertEqual(len(failures), 4)
+    self.assertTrue(failures[0].startswith("controlsd: mean"))
+    self.assertTrue(failures[1].startswith("plannerd: p90"))
+    self.assertTrue(all(f.startswith("radard") for f in failures[2:]))
+    self.assertEqual(compare(summary(controlsd=(2.5, 3.)), baseline, tolerance=0.3), [])
+
+    # new processes and ones without CPU times aren't compared
+    self.assertEqual(compare(summary(locationd=(10., 10.), paramsd=(10., 10.), radard=(None, None)), baseline), [])
+
+
+if __name__ == "__main__":
+  unittest.main()
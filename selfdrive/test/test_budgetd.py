@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+import unittest
+
+import cereal.messaging as messaging
+from selfdrive.budgetd import BudgetMonitor, EXCEEDED_REPORTS
+
+
+def msg(which, t, **kwargs):
+  m = messaging.new_message(which)
+  m.logMonoTime = int(t * 1e9)
+  for k, v in kwargs.items():
+    setattr(getattr(m, which), k, v)
+  return m.as_reader()
+
+
+def proc_log(t, cpu_time):
+  m = messaging.new_message('procLog')
+  m.logMonoTime = int(t * 1e9)
+  procs = m.procLog.init('procs', 1)
+  procs[0].pid = 1234
+  procs[0].cmdline = ["selfdrive.controls.controlsd"]
+  procs[0].cpuUser = cpu_time
+  return m.as_reader()
+
+
+class TestBudgetMonitor(unittest.TestCase):
+
+  def test_cpu(self):
+    monitor = BudgetMonitor({"cpu.controlsd": ("p50", 45.)})
+    for i in range(10):
+      monitor.handle_log(proc_log(i * 0.5, i * 0.25))
+    stats, _ = monitor.report(5.)
+    self.assertAlmostEqual(stats["cpu.controlsd"]["p50"], 50.)
+    self.assertEqual(stats["cpu.controlsd"]["count"], 9)
+
+  def test_latency_chain(self):
+    monitor = BudgetMonitor({})
+    monitor.handle_log(msg('roadCameraState', 1.010, frameId=7, timestampSof=int(1.000 * 1e9)))
+    monitor.handle_log(msg('modelV2', 1.050, frameId=7))
+    monitor.handle_log(msg('lateralPlan', 1.060, modelMonoTime=int(1.050 * 1e9)))
+    monitor.handle_log(msg('sendcan', 1.065))
+    monitor.handle_log(msg('controlsState', 1.066, lateralPlanMonoTime=int(1.060 * 1e9)))
+    # later loops on the same plan don't count
+    monitor.handle_log(msg('sendcan', 1.075))
+    monitor.handle_log(msg('controlsState', 1.076, lateralPlanMonoTime=int(1.060 * 1e9)))
+
+    stats, _ = monitor.report(2.)
+    self.assertAlmostEqual(stats["latency.cameraToModel"]["p50"], 50., places=3)
+    self.assertAlmostEqual(stats["latency.modelToPlan"]["p50"], 10., places=3)
+    self.assertAlmostEqual(stats["latency.planToSendcan"]["p50"], 5., places=3)
+    self.assertAlmostEqual(stats["latency.cameraToSendcan"]["p50"], 65., places=3)
+    self.assertEqual(stats["latency.cameraToSendcan"]["count"], 1)
+
+  def test_budget_events(self):
+    monitor = BudgetMonitor({"jitter.modelV2": ("p99", 125.)})
+    t = 0.
+    changes = []
+    for report in range(EXCEEDED_REPORTS + 2):
+      # modelV2 drops to 5 Hz for two reports, then recovers
+      dt = 0.2 if report < EXCEEDED_REPORTS else 0.05
+      for _ in range(20):
+        t += dt
+        monitor.handle_log(msg('modelV2', t))
+      changes.append(monitor.report(t)[1])
+      monitor.samples.clear()
+
+    self.assertEqual([len(c) for c in changes[:EXCEEDED_REPORTS - 1]], [0] * (EXCEEDED_REPORTS - 1))
+    self.assertTrue(changes[EXCEEDED_REPORTS - 1][0]["exceeded"])
+    self.assertFalse(changes[EXCEEDED_REPORTS][0]["exceeded"])
+    self.assertEqual(changes[EXCEEDED_REPORTS + 1], [])
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+import errno
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+import selfdrive.updated as updated
+
+LOWER_FILES = {
+  "a.txt": b"a",
+  "dir/b.txt": b"b" * 100,
+  "shadowed.txt": b"lower",
+  "changed.txt": b"old",
+  ".git/HEAD": b"ref: refs/heads/master\n",
+  ".git/objects/ab/cdef": b"object",
+}
+UPPER_FILES = {
+  "shadowed.txt": b"upper!",
+  "new.txt": b"new",
+  ".git/objects/12/3456": b"new object",
+}
+
+
+class TestFinalizeUpdate(unittest.TestCase):
+  def setUp(self):
+    self.tmp_dir = tempfile.TemporaryDirectory()
+    self.lower, self.upper, self.merged, self.finalized = (os.path.join(self.tmp_dir.name, d) for d in
+                                                           ("lower", "upper", "merged", "finalized"))
+
+    for layer, files in ((self.lower, LOWER_FILES), (self.upper, UPPER_FILES)):
+      for fn, data in files.items():
+        self.write(os.path.join(layer, fn), data)
+    os.symlink("a.txt", os.path.join(self.lower, "link"))
+
+    # what the overlay shows, the upper layer wins
+    shutil.copytree(self.lower, self.merged, symlinks=True)
+    shutil.copytree(self.upper, self.merged, symlinks=True, dirs_exist_ok=True)
+    # changed in the merged view without a copy in the upper layer
+    self.write(os.path.join(self.merged, "changed.txt"), b"changed")
+
+  def tearDown(self):
+    self.tmp_dir.cleanup()
+
+  def write(self, path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as f:
+      f.write(data)
+
+  def assertSameTree(self, a, b):
+    for root, dirs, files in os.walk(a):
+      rel_root = os.path.relpath(root, a)
+      self.assertEqual(sorted(dirs + files), sorted(os.listdir(os.path.join(b, rel_root))), rel_root)
+      for fn in files:
+        path_a, path_b = os.path.join(root, fn), os.path.join(b, rel_root, fn)
+        self.assertEqual(os.path.islink(path_a), os.path.islink(path_b), path_a)
+        if os.path.islink(path_a):
+          self.assertEqual(os.readlink(path_a), os.readlink(path_b))
+        else:
+          with open(path_a, "rb") as fa, open(path_b, "rb") as fb:
+            self.assertEqual(fa.read(), fb.read(), path_a)
+
+  def inode(self, *path):
+    return os.lstat(os.path.join(*path)).st_ino
+
+  def test_link_tree(self):
+    updated.link_tree(self.merged, self.finalized, [self.upper, self.lower])
+    self.assertSameTree(self.merged, self.finalized)
+
+    # linked from the top layer that has them
+    for fn in ("a.txt", "dir/b.txt", ".git/objects/ab/cdef"):
+      self.assertEqual(self.inode(self.finalized, fn), self.inode(self.lower, fn), fn)
+    for fn in ("shadowed.txt", "new.txt", ".git/objects/12/3456"):
+      self.assertEqual(self.inode(self.finalized, fn), self.inode(self.upper, fn), fn)
+
+    # git metadata and files that don't match their layer are copied
+    self.assertNotEqual(self.inode(self.finalized, ".git/HEAD"), self.inode(self.lower, ".git/HEAD"))
+    self.assertNotEqual(self.inode(self.finalized, "changed.txt"), self.inode(self.lower, "changed.txt"))
+
+  def test_link_fallback(self):
+    layer_inodes = {os.lstat(os.path.join(root, fn)).st_ino for layer in (self.upper, self.lower)
+                    for root, _, files in os.walk(layer) for fn in files}
+
+    for err in (errno.EXDEV, errno.EPERM):
+      shutil.rmtree(self.finalized, ignore_errors=True)
+      with mock.patch("os.link", side_effect=OSError(err, os.strerror(err))):
+        updated.link_tree(self.merged, self.finalized, [self.upper, self.lower])
+      self.assertSameTree(self.merged, self.finalized)
+      for root, _, files in os.walk(self.finalized):
+        for fn in files:
+          self.assertNotIn(self.inode(root, fn), layer_inodes)
+
+    shutil.rmtree(self.finalized)
+    with mock.patch("os.link", side_effect=OSError(errno.EIO, os.strerror(errno.EIO))), self.assertRaises(OSError):
+      updated.link_tree(self.merged, self.finalized, [self.upper, self.lower])
+
+  def test_finalize_update(self):
+    self.write(os.path.join(self.finalized, "stale.txt"), b"stale")
+    with mock.patch.multiple(updated, OVERLAY_MERGED=self.merged, OVERLAY_UPPER=self.upper, BASEDIR=self.lower,
+                             FINALIZED=self.finalized), \
+         mock.patch.object(updated, "run") as run:
+      updated.finalize_update()
+
+    self.assertTrue(os.path.isfile(os.path.join(self.finalized, ".overlay_consistent")))
+    os.unlink(os.path.join(self.finalized, ".overlay_consistent"))
+    self.assertSameTree(self.merged, self.finalized)
+    self.assertEqual(self.inode(self.finalized, "a.txt"), self.inode(self.lower, "a.txt"))
+    self.assertIn(mock.call(["git", "reset", "--hard"], self.finalized), run.call_args_list)
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -39,6 +39,7 @@ PROCS = {
   "selfdrive.locationd.torqued": 5.0,
   "./_soundd": 1.0,
   "selfdrive.monitoring.dmonitoringd": 4.0,
+  "selfdrive.budgetd": 5.0,
   "./proclogd": 1.54,
   "system.logmessaged": 0.2,
   "./clocksd": 0.02,
@@ -0,0 +1,116 @@
+"""
+Cheap sampling of the sysfs and procfs files thermald reads every cycle. Files are
+opened once and reread with pread, which regenerates their contents without an open.
+"""
+import os
+from typing import Dict, List, Optional, Sequence, Tuple, Union
+
+THERMAL_ZONE_DIR = "/sys/devices/virtual/thermal"
+PROC_STAT = "/proc/stat"
+PROC_MEMINFO = "/proc/meminfo"
+
+Zone = Union[None, int, str]
+
+
+class SysfsReader:
+  def __init__(self) -> None:
+    self.fds: Dict[str, int] = {}
+
+  def read(self, path: str, size: int = 4096) -> Optional[bytes]:
+    fd = self.fds.get(path)
+    try:
+      if fd is None:
+        fd = os.open(path, os.O_RDONLY)
+        self.fds[path] = fd
+      return os.pread(fd, size, 0)
+    except OSError:
+      # missing or gone, try opening it again next time
+      if fd is not None:
+        os.close(fd)
+        del self.fds[path]
+      return None
+
+  def read_int(self, path: str, default: int = 0) -> int:
+    dat = self.read(path, 64)
+    try:
+      return default if dat is None else int(dat)
+    except ValueError:
+      return default
+
+  def close(self) -> None:
+    for fd in self.fds.values():
+      os.close(fd)
+    self.fds.clear()
+
+
+class ThermalSampler:
+  def __init__(self, reader: Optional[SysfsReader] = None, zone_dir: str = THERMAL_ZONE_DIR) -> None:
+    self.reader = SysfsReader() if reader is None else reader
+    self.zone_dir = zone_dir
+    self.zone_by_type: Optional[Dict[str, int]] = None
+
+  def zone_path(self, zone: Union[int, str]) -> Optional[str]:
+    if isinstance(zone, str):
+      if self.zone_by_type is None:
+        self.zone_by_type = {}
+        for n in os.listdir(self.zone_dir):
+          if n.startswith("thermal_zone"):
+            with open(os.path.join(self.zone_dir, n, "type")) as f:
+              self.zone_by_type[f.read().strip()] = int(n[len("thermal_zone"):])
+      if zone not in self.zone_by_type:
+        return None
+      zone = self.zone_by_type[zone]
+    return os.path.join(self.zone_dir, f"thermal_zone{zone}", "temp")
+
+  def read_zone(self, zone: Zone) -> int:
+    if zone is None:
+      return 0
+    path = self.zone_path(zone)
+    return 0 if path is None else self.reader.read_int(path)
+
+  def temps(self, zones: Sequence[Zone], scale: float) -> List[float]:
+    return [self.read_zone(z) / scale for z in zones]
+
+  def temp(self, zone: Zone, scale: float) -> float:
+    return self.read_zone(zone) / scale
+
+
+class CpuUsage:
+  """Usage of every cpu in percent since the last update from one read of /proc/stat, like psutil.cpu_percent(percpu=True)"""
+  def __init__(self, reader: Optional[SysfsReader] = None) -> None:
+    self.reader = SysfsReader() if reader is None else reader
+    self.prev: Dict[bytes, Tuple[int, int]] = {}
+
+  def update(self) -> List[float]:
+    # the cpu lines come first, the interrupt counts after them can be long
+    dat = self.reader.read(PROC_STAT, 4096) or b""
+    usage = []
+    for line in dat.split(b"\n"):
+      if not line.startswith(b"cpu"):
+        break
+      fields = line.split()
+      if fields[0] == b"cpu":
+        continue
+
+      # user nice system idle iowait irq softirq steal, guest time is part of user time
+      t = [int(x) for x in fields[1:9]]
+      total = sum(t)
+      busy = total - sum(t[3:5])
+
+      prev_busy, prev_total = self.prev.get(fields[0], (busy, total))
+      self.prev[fields[0]] = (busy, total)
+      usage.append(100.0 * max(busy - prev_busy, 0) / (total - prev_total) if total > prev_total else 0.0)
+    return usage
+
+
+def memory_usage_percent(reader: SysfsReader) -> float:
+  """Same as psutil.virtual_memory().percent"""
+  meminfo = {}
+  for line in (reader.read(PROC_MEMINFO) or b"").split(b"\n"):
+    name, _, value = line.partition(b":")
+    if name in (b"MemTotal", b"MemAvailable"):
+      meminfo[name] = int(value.split()[0])
+  total = meminfo.get(b"MemTotal", 0)
+  if total == 0:
+    return 0.0
+  return 100.0 * (total - meminfo.get(b"MemAvailable", total)) / total
@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+import os
+import tempfile
+import unittest
+from unittest.mock import patch
+
+from selfdrive.thermald.sampler import CpuUsage, SysfsReader, ThermalSampler, memory_usage_percent
+from selfdrive.statsd import GaugeDeadband
+
+
+class TestSampler(unittest.TestCase):
+  def setUp(self):
+    self.tmp = tempfile.TemporaryDirectory()
+    self.reader = SysfsReader()
+
+  def tearDown(self):
+    self.reader.close()
+    self.tmp.cleanup()
+
+  def write(self, path, contents):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as f:
+      f.write(contents)
+
+  def test_reread(self):
+    fn = os.path.join(self.tmp.name, "value")
+    self.write(fn, "1\n")
+    self.assertEqual(self.reader.read_int(fn), 1)
+    self.assertEqual(len(self.reader.fds), 1)
+
+    # same fd sees the new contents
+    with open(fn, 'r+') as f:
+      f.write("42\n")
+    self.assertEqual(self.reader.read_int(fn), 42)
+    self.assertEqual(len(self.reader.fds), 1)
+
+    self.assertEqual(self.reader.read_int(os.path.join(self.tmp.name, "missing"), -1), -1)
+
+  def test_thermal_zones(self):
+    for i, (name, temp) in enumerate([("cpu0", 45000), ("gpu", 50000)]):
+      self.write(os.path.join(self.tmp.name, f"thermal_zone{i}", "type"), name + "\n")
+      self.write(os.path.join(self.tmp.name, f"thermal_zone{i}", "temp"), f"{temp}\n")
+
+    sampler = ThermalSampler(self.reader, self.tmp.name)
+    self.assertEqual(sampler.temps(["cpu0", 1, "missing"], 1000), [45., 50., 0.])
+    self.assertEqual(sampler.temp(None, 1000), 0.)
+
+  def test_cpu_usage(self):
+    fn = os.path.join(self.tmp.name, "stat")
+    usage = CpuUsage(self.reader)
+
+    self.write(fn, "cpu  2 0 2 4 0 0 0 0 0 0\ncpu0 1 0 1 2 0 0 0 0 0 0\ncpu1 1 0 1 2 0 0 0 0 0 0\nintr 1 2 3\n")
+    with patch("selfdrive.thermald.sampler.PROC_STAT", fn):
+      self.assertEqual(usage.update(), [0., 0.])
+
+      # cpu0 fully busy, cpu1 a quarter busy with a quarter waiting on io
+      self.write(fn, "cpu  8 0 3 7 1 0 0 0 0 0\ncpu0 5 0 1 2 0 0 0 0 0 0\ncpu1 2 0 1 4 1 0 0 0 0 0\nintr 1 2 3\n")
+      self.assertEqual(usage.update(), [100., 25.])
+
+  def test_memory_usage(self):
+    fn = os.path.join(self.tmp.name, "meminfo")
+    self.write(fn, "MemTotal:        1000 kB\nMemFree:          100 kB\nMemAvailable:     250 kB\n")
+    with patch("selfdrive.thermald.sampler.PROC_MEMINFO", fn):
+      self.assertEqual(memory_usage_percent(self.reader), 75.)
+
+  def test_gauge_deadband(self):
+    deadband = GaugeDeadband(1.0, max_age=10.)
+    self.assertEqual(deadband.update({"a": 1., "b": 2.}, 0.), {"a": 1., "b": 2.})
+    self.assertEqual(deadband.update({"a": 1.5, "b": 3.}, 1.), {"b": 3.})
+    self.assertEqual(deadband.update({"a": 2., "b": 3.}, 2.), {"a": 2.})
+    # stale gauges are sent again
+    self.assertEqual(deadband.update({"a": 2., "b": 3.}, 11.), {"b": 3.})
+
+
+if __name__ == "__main__":
+  unittest.main()
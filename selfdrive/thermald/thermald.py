@@ -8,21 +8,20 @@ from collections import OrderedDict, namedtuple
 from pathlib import Path
 from typing import Dict, Optional, Tuple
 
-import psutil
-
 import cereal.messaging as messaging
 from cereal import log
 from common.dict_helpers import strip_deprecated_keys
 from common.filter_simple import FirstOrderFilter
-from common.params import Params
+from common.params import CachedParams
 from common.realtime import DT_TRML, sec_since_boot
 from selfdrive.controls.lib.alertmanager import set_offroad_alert
 from system.hardware import HARDWARE, TICI, AGNOS
 from selfdrive.loggerd.config import get_available_percent
-from selfdrive.statsd import statlog
+from selfdrive.statsd import GaugeDeadband, statlog
 from system.swaglog import cloudlog
 from selfdrive.thermald.power_monitoring import PowerMonitoring
 from selfdrive.thermald.fan_controller import TiciFanController
+from selfdrive.thermald.sampler import CpuUsage, SysfsReader, ThermalSampler, memory_usage_percent
 from system.version import terms_version, training_version
 
 ThermalStatus = log.DeviceState.ThermalStatus
@@ -48,41 +47,18 @@ THERMAL_BANDS = OrderedDict({
 # Override to highest thermal band when offroad and above this temp
 OFFROAD_DANGER_TEMP = 79.5
 
-prev_offroad_states: Dict[str, Tuple[bool, Optional[str]]] = {}
-
-tz_by_type: Optional[Dict[str, int]] = None
-def populate_tz_by_type():
-  global tz_by_type
-  tz_by_type = {}
-  for n in os.listdir("/sys/devices/virtual/thermal"):
-    if not n.startswith("thermal_zone"):
-      continue
-    with open(os.path.join("/sys/devices/virtual/thermal", n, "type")) as f:
-      tz_by_type[f.read().strip()] = int(n.lstrip("thermal_zone"))
-
-def read_tz(x):
-  if x is None:
-    return 0
-
-  if isinstance(x, str):
-    if tz_by_type is None:
-      populate_tz_by_type()
-    x = tz_by_type[x]
-
-  try:
-    with open(f"/sys/devices/virtual/thermal/thermal_zone{x}/temp") as f:
-      return int(f.read())
-  except FileNotFoundError:
-    return 0
+# gauges are only sent to statsd when they change by this much
+GAUGE_DEADBAND = 1.0
 
+prev_offroad_states: Dict[str, Tuple[bool, Optional[str]]] = {}
 
-def read_thermal(thermal_config):
+def read_thermal(thermal_config, sampler: ThermalSampler):
   dat = messaging.new_message('deviceState')
-  dat.deviceState.cpuTempC = [read_tz(z) / thermal_config.cpu[1] for z in thermal_config.cpu[0]]
-  dat.deviceState.gpuTempC = [read_tz(z) / thermal_config.gpu[1] for z in thermal_config.gpu[0]]
-  dat.deviceState.memoryTempC = read_tz(thermal_config.mem[0]) / thermal_config.mem[1]
-  dat.deviceState.ambientTempC = read_tz(thermal_config.ambient[0]) / thermal_config.ambient[1]
-  dat.deviceState.pmicTempC = [read_tz(z) / thermal_config.pmic[1] for z in thermal_config.pmic[0]]
+  dat.deviceState.cpuTempC = sampler.temps(*thermal_config.cpu)
+  dat.deviceState.gpuTempC = sampler.temps(*thermal_config.gpu)
+  dat.deviceState.memoryTempC = sampler.temp(*thermal_config.mem)
+  dat.deviceState.ambientTempC = sampler.temp(*thermal_config.ambient)
+  dat.deviceState.pmicTempC = sampler.temps(*thermal_config.pmic)
   return dat
 
 
@@ -183,12 +159,17 @@ def thermald_thread(end_event, hw_queue):
   in_car = False
   engaged_prev = False
 
-  params = Params()
+  params = CachedParams()
   power_monitor = PowerMonitoring()
 
   HARDWARE.initialize_hardware()
   thermal_config = HARDWARE.get_thermal_config()
 
+  reader = SysfsReader()
+  thermal_sampler = ThermalSampler(reader)
+  cpu_usage = CpuUsage(reader)
+  gauge_deadband = GaugeDeadband(GAUGE_DEADBAND)
+
   fan_controller = None
 
   while not end_event.is_set():
@@ -197,7 +178,7 @@ def thermald_thread(end_event, hw_queue):
     pandaStates = sm['pandaStates']
     peripheralState = sm['peripheralState']
 
-    msg = read_thermal(thermal_config)
+    msg = read_thermal(thermal_config, thermal_sampler)
 
     if sm.updated['pandaStates'] and len(pandaStates) > 0:
 
@@ -224,8 +205,8 @@ def thermald_thread(end_event, hw_queue):
       pass
 
     msg.deviceState.freeSpacePercent = get_available_percent(default=100.0)
-    msg.deviceState.memoryUsagePercent = int(round(psutil.virtual_memory().percent))
-    msg.deviceState.cpuUsagePercent = [int(round(n)) for n in psutil.cpu_percent(percpu=True)]
+    msg.deviceState.memoryUsagePercent = int(round(memory_usage_percent(reader)))
+    msg.deviceState.cpuUsagePercent = [int(round(n)) for n in cpu_usage.update()]
     msg.deviceState.gpuUsagePercent = int(round(HARDWARE.get_gpu_usage_percent()))
 
     msg.deviceState.networkType = last_hw_state.network_type
@@ -376,26 +357,29 @@ def thermald_thread(end_event, hw_queue):
 
     should_start_prev = should_start
 
-    # Log to statsd
-    statlog.gauge("free_space_percent", msg.deviceState.freeSpacePercent)
-    statlog.gauge("gpu_usage_percent", msg.deviceState.gpuUsagePercent)
-    statlog.gauge("memory_usage_percent", msg.deviceState.memoryUsagePercent)
+    # Log to statsd, in one message with only what changed
+    gauges = {
+      "free_space_percent": msg.deviceState.freeSpacePercent,
+      "gpu_usage_percent": msg.deviceState.gpuUsagePercent,
+      "memory_usage_percent": msg.deviceState.memoryUsagePercent,
+      "memory_temperature": msg.deviceState.memoryTempC,
+      "ambient_temperature": msg.deviceState.ambientTempC,
+      "fan_speed_percent_desired": msg.deviceState.fanSpeedPercentDesired,
+      "screen_brightness_percent": msg.deviceState.screenBrightnessPercent,
+    }
     for i, usage in enumerate(msg.deviceState.cpuUsagePercent):
-      statlog.gauge(f"cpu{i}_usage_percent", usage)
+      gauges[f"cpu{i}_usage_percent"] = usage
     for i, temp in enumerate(msg.deviceState.cpuTempC):
-      statlog.gauge(f"cpu{i}_temperature", temp)
+      gauges[f"cpu{i}_temperature"] = temp
     for i, temp in enumerate(msg.deviceState.gpuTempC):
-      statlog.gauge(f"gpu{i}_temperature", temp)
-    statlog.gauge("memory_temperature", msg.deviceState.memoryTempC)
-    statlog.gauge("ambient_temperature", msg.deviceState.ambientTempC)
+      gauges[f"gpu{i}_temperature"] = temp
     for i, temp in enumerate(msg.deviceState.pmicTempC):
-      statlog.gauge(f"pmic{i}_temperature", temp)
+      gauges[f"pmic{i}_temperature"] = temp
     for i, temp in enumerate(last_hw_state.nvme_temps):
-      statlog.gauge(f"nvme_temperature{i}", temp)
+      gauges[f"nvme_temperature{i}"] = temp
     for i, temp in enumerate(last_hw_state.modem_temps):
-      statlog.gauge(f"modem_temperature{i}", temp)
-    statlog.gauge("fan_speed_percent_desired", msg.deviceState.fanSpeedPercentDesired)
-    statlog.gauge("screen_brightness_percent", msg.deviceState.screenBrightnessPercent)
+      gauges[f"modem_temperature{i}"] = temp
+    statlog.gauges(gauge_deadband.update(gauges, sec_since_boot()))
 
     # report to server once every 10 minutes
     if (count % int(600. / DT_TRML)) == 0:
@@ -1,11 +1,12 @@
 #!/usr/bin/env python3
 import os
-import re
 import datetime
+import errno
 import subprocess
 import psutil
 import shutil
 import signal
+import stat
 import fcntl
 import time
 import threading
@@ -15,6 +16,7 @@ from typing import List, Union, Optional
 from markdown_it import MarkdownIt
 
 from common.basedir import BASEDIR
+from common.git import GitDirWatcher, GitError, GitRepo, ls_remote
 from common.params import Params
 from system.hardware import AGNOS, HARDWARE
 from system.swaglog import cloudlog
@@ -34,6 +36,8 @@ OVERLAY_INIT = Path(os.path.join(BASEDIR, ".overlay_init"))
 DAYS_NO_CONNECTIVITY_MAX = 14     # do not allow to engage after this many days
 DAYS_NO_CONNECTIVITY_PROMPT = 10  # send an offroad prompt after this many days
 
+GIT_DIR_WATCHER = GitDirWatcher(os.path.join(BASEDIR, ".git"))
+
 class WaitTimeHelper:
   def __init__(self):
     self.ready_event = threading.Event()
@@ -89,7 +93,7 @@ def setup_git_options(cwd: str) -> None:
   # there is a lot of unnecessary churn. This appears to be a common need on
   # OSX as well: https://www.git-tower.com/blog/make-git-rebase-safe-on-osx/
 
-  # We are using copytree to copy the directory, which also changes
+  # Files we can't hardlink during finalize are copied, which also changes
   # inode numbers. Ignore those changes too.
 
   # Set protocol to the new version (default after git 2.26) to reduce data
@@ -101,8 +105,10 @@ def setup_git_options(cwd: str) -> None:
     ("gc.auto", "0"),
     ("gc.autoDetach", "false"),
   ]
+  config = GitRepo(cwd).config()
   for option, value in git_cfg:
-    run(["git", "config", option, value], cwd)
+    if config.get(option.lower()) != value:
+      run(["git", "config", option, value], cwd)
 
 
 def dismount_overlay() -> None:
@@ -115,9 +121,7 @@ def init_overlay() -> None:
 
   # Re-create the overlay if BASEDIR/.git has changed since we created the overlay
   if OVERLAY_INIT.is_file() and os.path.ismount(OVERLAY_MERGED):
-    git_dir_path = os.path.join(BASEDIR, ".git")
-    new_files = run(["find", git_dir_path, "-newer", str(OVERLAY_INIT)])
-    if not len(new_files.splitlines()):
+    if not GIT_DIR_WATCHER.newer_than(OVERLAY_INIT.stat().st_mtime):
       # A valid overlay already exists
       return
     else:
@@ -161,9 +165,74 @@ def init_overlay() -> None:
   cloudlog.info(f"git diff output:\n{git_diff}")
 
 
+def is_git_metadata(rel_path: str) -> bool:
+  """Files under a .git that can change in place. Objects never do"""
+  parts = rel_path.split(os.sep)
+  if ".git" not in parts:
+    return False
+  git_parts = parts[parts.index(".git"):]
+  return "objects" not in git_parts
+
+
+def link_from_layers(rel_path: str, st: os.stat_result, dst_path: str, layers: List[str]) -> bool:
+  for layer in layers:
+    layer_path = os.path.join(layer, rel_path)
+    try:
+      layer_st = os.lstat(layer_path)
+    except (FileNotFoundError, NotADirectoryError):
+      continue
+
+    # the top layer that has it is the one in the view
+    if stat.S_ISREG(layer_st.st_mode) and (layer_st.st_size, layer_st.st_mtime_ns) == (st.st_size, st.st_mtime_ns):
+      try:
+        os.link(layer_path, dst_path)
+      except OSError as e:
+        # layer on another filesystem, or hardlinks not allowed there, copy it instead
+        if e.errno not in (errno.EXDEV, errno.EPERM, errno.EMLINK):
+          raise
+        return False
+      return True
+    return False
+  return False
+
+
+def link_tree(src: str, dst: str, layers: List[str]) -> None:
+  """
+  Recreates the overlay view at src in dst, hardlinking files from the overlay layers
+  (top first) instead of copying them. Git metadata and files that don't match their
+  layer are copied.
+  """
+  for root, dirs, files in os.walk(src):
+    rel_root = os.path.relpath(root, src)
+    dst_root = os.path.normpath(os.path.join(dst, rel_root))
+    os.makedirs(dst_root, exist_ok=True)
+
+    for name in dirs + files:
+      src_path, dst_path = os.path.join(root, name), os.path.join(dst_root, name)
+      rel_path = os.path.normpath(os.path.join(rel_root, name))
+      st = os.lstat(src_path)
+
+      if stat.S_ISLNK(st.st_mode):
+        os.symlink(os.readlink(src_path), dst_path)
+        if name in dirs:
+          dirs.remove(name)
+      elif stat.S_ISDIR(st.st_mode):
+        continue
+      elif is_git_metadata(rel_path) or not link_from_layers(rel_path, st, dst_path, layers):
+        shutil.copy2(src_path, dst_path)
+
+  # directory permissions and times, once nothing is created in them anymore
+  for root, dirs, _ in os.walk(src, topdown=False):
+    for name in dirs:
+      if not os.path.islink(os.path.join(root, name)):
+        shutil.copystat(os.path.join(root, name), os.path.normpath(os.path.join(dst, os.path.relpath(root, src), name)))
+  shutil.copystat(src, dst)
+
+
 def finalize_update() -> None:
   """Take the current OverlayFS merged view and finalize a copy outside of
-  OverlayFS, ready to be swapped-in at BASEDIR. Copy using shutil.copytree"""
+  OverlayFS, ready to be swapped-in at BASEDIR. Files are hardlinked from the
+  overlay layers where possible instead of copied"""
 
   # Remove the update ready flag and any old updates
   cloudlog.info("creating finalized version of the overlay")
@@ -172,7 +241,9 @@ def finalize_update() -> None:
   # Copy the merged overlay view and set the update ready flag
   if os.path.exists(FINALIZED):
     shutil.rmtree(FINALIZED)
-  shutil.copytree(OVERLAY_MERGED, FINALIZED, symlinks=True)
+  t = time.monotonic()
+  link_tree(OVERLAY_MERGED, FINALIZED, [OVERLAY_UPPER, BASEDIR])
+  cloudlog.event("Done linking finalized update", duration=time.monotonic() - t)
 
   run(["git", "reset", "--hard"], FINALIZED)
   run(["git", "submodule", "foreach", "--recursive", "git", "reset", "--hard"], FINALIZED)
@@ -251,10 +322,10 @@ class Updater:
     return False
 
   def get_branch(self, path: str) -> str:
-    return run(["git", "rev-parse", "--abbrev-ref", "HEAD"], path).rstrip()
+    return GitRepo(path).branch()
 
   def get_commit_hash(self, path: str = OVERLAY_MERGED) -> str:
-    return run(["git", "rev-parse", "HEAD"], path).rstrip()
+    return GitRepo(path).rev_parse()
 
   def set_params(self, failed_count: int, exception: Optional[str]) -> None:
     self.params.put("UpdateFailedCount", str(failed_count))
@@ -293,8 +364,7 @@ class Updater:
         with open(os.path.join(basedir, "common", "version.h")) as f:
           version = f.read().split('"')[1]
 
-        commit_unix_ts = run(["git", "show", "-s", "--format=%ct", "HEAD"], basedir).rstrip()
-        dt = datetime.datetime.fromtimestamp(int(commit_unix_ts))
+        dt = datetime.datetime.fromtimestamp(GitRepo(basedir).commit_time())
         commit_date = dt.strftime("%b %d")
       except Exception:
         cloudlog.exception("updater.get_description")
@@ -329,20 +399,19 @@ class Updater:
     excluded_branches = ('release2', 'release2-staging', 'dashcam', 'dashcam-staging')
 
     try:
-      run(["git", "ls-remote", "origin", "HEAD"], OVERLAY_MERGED)
+      remote_refs = ls_remote(GitRepo(OVERLAY_MERGED))
       self._has_internet = True
-    except subprocess.CalledProcessError:
+    except GitError:
       self._has_internet = False
+      raise
 
     setup_git_options(OVERLAY_MERGED)
-    output = run(["git", "ls-remote", "--heads"], OVERLAY_MERGED)
 
     self.branches = defaultdict(lambda: None)
-    for line in output.split('\n'):
-      ls_remotes_re = r'(?P<commit_sha>\b[0-9a-f]{5,40}\b)(\s+)(refs\/heads\/)(?P<branch_name>.*$)'
-      x = re.fullmatch(ls_remotes_re, line.strip())
-      if x is not None and x.group('branch_name') not in excluded_branches:
-        self.branches[x.group('branch_name')] = x.group('commit_sha')
+    for ref, commit in remote_refs.items():
+      branch = ref[len("refs/heads/"):]
+      if ref.startswith("refs/heads/") and branch not in excluded_branches:
+        self.branches[branch] = commit
 
     cur_branch = self.get_branch(OVERLAY_MERGED)
     cur_commit = self.get_commit_hash(OVERLAY_MERGED)
@@ -356,6 +425,14 @@ class Updater:
   def fetch_update(self) -> None:
     cloudlog.info("attempting git fetch inside staging overlay")
 
+    # nothing to do if the finalized update is already what we'd fetch
+    branch = self.target_branch
+    finalized_consistent = os.path.isfile(os.path.join(FINALIZED, ".overlay_consistent"))
+    if finalized_consistent and not self.update_available and self.get_branch(FINALIZED) == branch and \
+       self.get_commit_hash(FINALIZED) == self.branches[branch]:
+      cloudlog.info(f"finalized update already on {branch} ({self.branches[branch][:7]}), skipping fetch")
+      return
+
     self.params.put("UpdaterState", "downloading...")
 
     # TODO: cleanly interrupt this and invalidate old update
@@ -364,7 +441,6 @@ class Updater:
 
     setup_git_options(OVERLAY_MERGED)
 
-    branch = self.target_branch
     git_fetch_output = run(["git", "fetch", "origin", branch], OVERLAY_MERGED)
     cloudlog.info("git fetch success: %s", git_fetch_output)
 
@@ -459,6 +535,10 @@ def main() -> None:
       )
       exception = f"command failed: {e.cmd}\n{e.output}"
       OVERLAY_INIT.unlink(missing_ok=True)
+    except GitError as e:
+      cloudlog.event("update process failed", error=str(e))
+      exception = str(e)
+      OVERLAY_INIT.unlink(missing_ok=True)
     except Exception as e:
       cloudlog.exception("uncaught updated exception, shouldn't happen")
       exception = str(e)
@@ -11,6 +11,7 @@ from typing import Dict, Generator, List, Tuple, Union
 import requests
 
 import system.hardware.tici.casync as casync
+from system.hardware.tici.partition_hash import PartitionHashes
 
 SPARSE_CHUNK_FMT = struct.Struct('H2xI4x')
 CAIBX_URL = "https://commadist.azureedge.net/agnosupdate/"
@@ -104,17 +105,8 @@ def get_partition_path(target_slot_number: int, partition: dict) -> str:
   return path
 
 
-def get_raw_hash(path: str, partition_size: int) -> str:
-  raw_hash = hashlib.sha256()
-  pos, chunk_size = 0, 1024 * 1024
-
-  with open(path, 'rb+') as out:
-    while pos < partition_size:
-      n = min(chunk_size, partition_size - pos)
-      raw_hash.update(out.read(n))
-      pos += n
-
-  return raw_hash.hexdigest().lower()
+def get_raw_hash(path: str, partition_size: int, full: bool = True) -> str:
+  return PartitionHashes(path, partition_size).raw_hash(full)
 
 
 def verify_partition(target_slot_number: int, partition: Dict[str, Union[str, int]], force_full_check: bool = False) -> bool:
@@ -152,6 +144,8 @@ def clear_partition_hash(target_slot_number: int, partition: dict) -> None:
 def extract_compressed_image(target_slot_number: int, partition: dict, cloudlog):
   path = get_partition_path(target_slot_number, partition)
   downloader = StreamingDecompressor(partition['url'])
+  # the cached hashes are stale once writing starts, the next cached lookup reads it all
+  PartitionHashes(path, partition['size']).mark_dirty(0, partition['size'])
 
   with open(path, 'wb+') as out:
     # Flash partition
@@ -183,12 +177,14 @@ def extract_casync_image(target_slot_number: int, partition: dict, cloudlog):
   seed_path = path[:-1] + ('b' if path[-1] == 'a' else 'a')
 
   target = casync.parse_caibx(partition['casync_caibx'])
+  hashes = PartitionHashes(path, partition['size'])
 
   sources: List[Tuple[str, casync.ChunkReader, casync.ChunkDict]] = []
 
   # First source is the current partition.
   try:
-    raw_hash = get_raw_hash(seed_path, partition['size'])
+    # only picks the caibx, chunks read from the seed are checked against it
+    raw_hash = get_raw_hash(seed_path, partition['size'], full=False)
     caibx_url = f"{CAIBX_URL}{partition['name']}-{raw_hash}.caibx"
 
     try:
@@ -214,12 +210,18 @@ def extract_casync_image(target_slot_number: int, partition: dict, cloudlog):
       last_p = p
       print(f"Installing {partition['name']}: {p}", flush=True)
 
-  stats = casync.extract(target, sources, path, progress)
+  # Resume from the chunks an interrupted extract already got in place
+  known_in_place = hashes.journal(partition['hash_raw'].lower())
+  stats = casync.extract(target, sources, path, progress, known_in_place=known_in_place,
+                         writing=lambda c: hashes.mark_dirty(c.offset, c.length),
+                         placed=lambda chunks: hashes.add_to_journal([c.offset for c in chunks]))
   cloudlog.error(f'casync done {json.dumps(stats)}')
 
   os.sync()
   if not verify_partition(target_slot_number, partition, force_full_check=True):
+    hashes.clear_journal()
     raise Exception(f"Raw hash mismatch '{partition['hash_raw'].lower()}'")
+  hashes.clear_journal()
 
 
 def flash_partition(target_slot_number: int, partition: dict, cloudlog, standalone=False):
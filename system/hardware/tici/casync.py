@@ -4,10 +4,12 @@ import lzma
 import os
 import struct
 import sys
+import threading
 import time
 from abc import ABC, abstractmethod
 from collections import defaultdict, namedtuple
-from typing import Callable, Dict, List, Optional, Tuple
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Callable, Dict, List, Optional, Set, Tuple
 
 import requests
 from Crypto.Hash import SHA512
@@ -27,6 +29,11 @@ CHUNK_DOWNLOAD_RETRIES = 3
 
 CAIBX_DOWNLOAD_TIMEOUT = 120
 
+# downloads, lzma and hashing all release the GIL
+EXTRACT_WORKERS = max(4, os.cpu_count() or 1)
+# chunks placed before the target is synced and they're reported
+PLACED_SYNC_CHUNKS = 256
+
 Chunk = namedtuple('Chunk', ['sha', 'offset', 'length'])
 ChunkDict = Dict[bytes, Chunk]
 
@@ -41,14 +48,15 @@ class FileChunkReader(ChunkReader):
   """Reads chunks from a local file"""
   def __init__(self, fn: str) -> None:
     super().__init__()
-    self.f = open(fn, 'rb')
+    self.fn = fn
+    self.fd = os.open(fn, os.O_RDONLY)
 
   def __del__(self):
-    self.f.close()
+    os.close(self.fd)
 
   def read(self, chunk: Chunk) -> bytes:
-    self.f.seek(chunk.offset)
-    return self.f.read(chunk.length)
+    # positional, so it can be read from many threads
+    return os.pread(self.fd, chunk.length, chunk.offset)
 
 
 class RemoteChunkReader(ChunkReader):
@@ -57,7 +65,14 @@ class RemoteChunkReader(ChunkReader):
   def __init__(self, url: str) -> None:
     super().__init__()
     self.url = url
-    self.session = requests.Session()
+    self.local = threading.local()
+
+  @property
+  def session(self) -> requests.Session:
+    # one per thread, sessions aren't thread safe
+    if not hasattr(self.local, 'session'):
+      self.local.session = requests.Session()
+    return self.local.session
 
   def read(self, chunk: Chunk) -> bytes:
     sha_hex = chunk.sha.hex()
@@ -142,42 +157,124 @@ def build_chunk_dict(chunks: List[Chunk]) -> ChunkDict:
   return r
 
 
+def chunk_hash(bts: bytes) -> bytes:
+  digest: bytes = SHA512.new(bts, truncate="256").digest()
+  return digest
+
+
 def extract(target: List[Chunk],
             sources: List[Tuple[str, ChunkReader, ChunkDict]],
             out_path: str,
-            progress: Optional[Callable[[int], None]] = None):
+            progress: Optional[Callable[[int], None]] = None,
+            workers: int = EXTRACT_WORKERS,
+            known_in_place: Optional[Set[int]] = None,
+            writing: Optional[Callable[[Chunk], None]] = None,
+            placed: Optional[Callable[[List[Chunk]], None]] = None) -> Dict[str, int]:
+  """
+  Writes the target chunks to out_path, taking every chunk from the first source that has it.
+
+  If a source reads out_path itself, the target is a seed in place: chunks that already hold
+  the right bytes at their offset aren't written, and are read from there for the other
+  offsets they're needed at. Every distinct chunk is then fetched, decompressed and verified
+  once, in parallel, and written to all of its offsets.
+
+  Offsets in known_in_place are trusted without reading them, to resume an interrupted extract.
+  writing is called before a chunk is written, placed with batches of chunks that are in place
+  and synced to disk, also when the extract fails.
+  """
   stats: Dict[str, int] = defaultdict(int)
-
-  mode = 'rb+' if os.path.exists(out_path) else 'wb'
-  with open(out_path, mode) as out:
-    for cur_chunk in target:
-
-      # Find source for desired chunk
-      for name, chunk_reader, store_chunks in sources:
-        if cur_chunk.sha in store_chunks:
-          bts = chunk_reader.read(store_chunks[cur_chunk.sha])
-
-          # Check length
-          if len(bts) != cur_chunk.length:
-            continue
-
-          # Check hash
-          if SHA512.new(bts, truncate="256").digest() != cur_chunk.sha:
+  lock = threading.Lock()
+  placed_chunks: List[Chunk] = []
+
+  def done(name: str, length: int) -> None:
+    with lock:
+      stats[name] += length
+      if progress is not None:
+        progress(sum(stats.values()))
+
+  def sync_placed(chunks: List[Chunk]) -> None:
+    if placed is not None and len(chunks):
+      os.fsync(fd)
+      placed(chunks)
+
+  def add_placed(c: Chunk) -> None:
+    with lock:
+      placed_chunks.append(c)
+      if len(placed_chunks) < PLACED_SYNC_CHUNKS:
+        return
+      chunks = placed_chunks[:]
+      placed_chunks.clear()
+    sync_placed(chunks)
+
+  target_name, target_reader = next(((name, reader) for name, reader, _ in sources if isinstance(reader, FileChunkReader) and
+                                     os.path.realpath(reader.fn) == os.path.realpath(out_path)), (None, None))
+
+  fd = os.open(out_path, os.O_RDWR | os.O_CREAT, 0o644)
+  try:
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+      # chunks already in place
+      in_place: Dict[bytes, Chunk] = {}
+      todo = target
+      if target_name is not None and target_reader is not None:
+        known = known_in_place or set()
+        correct = pool.map(lambda c: c.offset in known or chunk_hash(target_reader.read(c)) == c.sha, target)
+        todo = []
+        for c, ok in zip(target, correct):
+          if ok:
+            in_place.setdefault(c.sha, c)
+            done(target_name, c.length)
+            add_placed(c)
+          else:
+            todo.append(c)
+
+      offsets: Dict[bytes, List[Chunk]] = defaultdict(list)
+      for c in todo:
+        offsets[c.sha].append(c)
+
+      def fetch_and_write(chunks: List[Chunk]) -> None:
+        sha, length = chunks[0].sha, chunks[0].length
+        for name, chunk_reader, store_chunks in sources:
+          if chunk_reader is target_reader and sha in in_place:
+            # never written, so it stays valid
+            store_chunk = in_place[sha]
+          elif sha in store_chunks:
+            store_chunk = store_chunks[sha]
+          else:
             continue
 
-          # Write to output
-          out.seek(cur_chunk.offset)
-          out.write(bts)
+          bts = chunk_reader.read(store_chunk)
 
-          stats[name] += cur_chunk.length
+          # Check length and hash, a chunk read back from the target can be in the middle of being overwritten
+          if len(bts) != length or chunk_hash(bts) != sha:
+            continue
 
-          if progress is not None:
-            progress(sum(stats.values()))
+          for i, c in enumerate(chunks):
+            if writing is not None:
+              writing(c)
+            os.pwrite(fd, bts, c.offset)
+            add_placed(c)
+            # reused chunks come from the target after the first write
+            done(name if i == 0 or target_name is None else target_name, c.length)
+          return
 
-          break
-      else:
         raise RuntimeError("Desired chunk not found in provided stores")
 
+      futures = [pool.submit(fetch_and_write, chunks) for chunks in offsets.values()]
+      try:
+        for f in as_completed(futures):
+          f.result()
+      except BaseException:
+        # don't keep writing the other chunks after one failed
+        for f in futures:
+          f.cancel()
+        raise
+  finally:
+    # the pool is done, every chunk written is in placed_chunks
+    try:
+      sync_placed(placed_chunks)
+    finally:
+      os.close(fd)
+
   return stats
 
 
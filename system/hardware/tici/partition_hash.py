@@ -0,0 +1,213 @@
+#!/usr/bin/env python3
+"""
+Cached raw hashes of AGNOS partitions.
+
+Partitions are read in large aligned blocks on a background thread, so reading overlaps
+hashing. Next to the raw hash of the whole partition, the sha256 of every block is kept,
+so the cached raw hash of a partition can be reused after only checking the blocks written
+since, as long as they hold what they held before. The sha256 of the whole partition can't
+be combined from block digests, so any changed block means reading the whole partition
+again. The raw hash is the generation of the cached contents. Writers log the blocks they
+are about to touch, and the chunks of an interrupted extract that are known to be in place.
+
+A cached hash is only good for skipping work, like picking the caibx of a seed partition.
+Verifying a partition reads all of it.
+"""
+import hashlib
+import json
+import os
+import queue
+import random
+import threading
+from typing import Iterable, Iterator, List, Optional, Set, Tuple
+
+HASH_BLOCK_SIZE = 32 * 1024 * 1024
+HASH_CACHE_DIR = os.getenv("AGNOS_HASH_CACHE_DIR", "/data/agnos_hashes")
+
+# blocks read ahead of hashing
+READ_AHEAD = 4
+# blocks that are hashed again when reusing a cached hash, catches writes we didn't see
+SPOT_CHECK_BLOCKS = 4
+
+
+def read_blocks(path: str, size: int, blocks: Iterable[int], block_size: int = HASH_BLOCK_SIZE) -> Iterator[Tuple[int, bytes]]:
+  """Reads the blocks in order on a background thread"""
+  q: queue.Queue = queue.Queue(maxsize=READ_AHEAD)
+  stop = threading.Event()
+
+  def reader():
+    try:
+      fd = os.open(path, os.O_RDONLY)
+      try:
+        for i in blocks:
+          if stop.is_set():
+            return
+          offset = i * block_size
+          q.put((i, os.pread(fd, min(block_size, size - offset), offset)))
+      finally:
+        os.close(fd)
+      q.put(None)
+    except Exception as e:
+      q.put(e)
+
+  t = threading.Thread(target=reader, daemon=True)
+  t.start()
+  try:
+    while (item := q.get()) is not None:
+      if isinstance(item, Exception):
+        raise item
+      yield item
+  finally:
+    stop.set()
+    while t.is_alive():
+      try:
+        q.get(timeout=0.1)
+      except queue.Empty:
+        pass
+
+
+class BlockHasher:
+  """Raw hash and block hashes of a stream of data"""
+  def __init__(self, block_size: int = HASH_BLOCK_SIZE) -> None:
+    self.block_size = block_size
+    self.raw_hash = hashlib.sha256()
+    self.block_hash = hashlib.sha256()
+    self.block_len = 0
+    self.blocks: List[str] = []
+
+  def update(self, data: bytes) -> None:
+    self.raw_hash.update(data)
+    view = memoryview(data)
+    while len(view):
+      n = min(len(view), self.block_size - self.block_len)
+      self.block_hash.update(view[:n])
+      self.block_len += n
+      view = view[n:]
+      if self.block_len == self.block_size:
+        self.blocks.append(self.block_hash.hexdigest())
+        self.block_hash = hashlib.sha256()
+        self.block_len = 0
+
+  def finish(self) -> Tuple[str, List[str]]:
+    blocks = self.blocks + ([self.block_hash.hexdigest()] if self.block_len else [])
+    return self.raw_hash.hexdigest().lower(), blocks
+
+
+class PartitionHashes:
+  def __init__(self, path: str, size: int, cache_dir: str = HASH_CACHE_DIR, block_size: int = HASH_BLOCK_SIZE) -> None:
+    self.path = path
+    self.size = size
+    self.block_size = block_size
+    self.num_blocks = (size + block_size - 1) // block_size
+
+    name = os.path.join(cache_dir, path.strip('/').replace('/', '_'))
+    self.cache_fn = name + ".json"
+    self.dirty_fn = name + ".dirty"
+    self.journal_fn = name + ".journal"
+
+    self.lock = threading.Lock()
+    self.dirty: Optional[Set[int]] = None
+
+  def _append(self, fn: str, lines: List[str], sync: bool = False) -> bool:
+    try:
+      os.makedirs(os.path.dirname(fn), exist_ok=True)
+      with open(fn, 'a') as f:
+        f.write(''.join(line + '\n' for line in lines))
+        if sync:
+          f.flush()
+          os.fsync(f.fileno())
+      return True
+    except OSError:
+      return False
+
+  def _lines(self, fn: str) -> List[str]:
+    try:
+      with open(fn) as f:
+        return f.read().splitlines()
+    except OSError:
+      return []
+
+  def _remove(self, fn: str) -> None:
+    try:
+      os.unlink(fn)
+    except OSError:
+      pass
+
+  def load(self) -> Optional[dict]:
+    try:
+      with open(self.cache_fn) as f:
+        cache: dict = json.load(f)
+    except (OSError, ValueError):
+      return None
+    if cache.get('size') != self.size or cache.get('block_size') != self.block_size or len(cache.get('blocks', [])) != self.num_blocks:
+      return None
+    return cache
+
+  def store(self, raw_hash: str, blocks: List[str]) -> None:
+    """Saves the hashes of the contents as they are now, and forgets the dirty blocks"""
+    try:
+      os.makedirs(os.path.dirname(self.cache_fn), exist_ok=True)
+      tmp_fn = self.cache_fn + ".tmp"
+      with open(tmp_fn, 'w') as f:
+        json.dump({'size': self.size, 'block_size': self.block_size, 'raw_hash': raw_hash, 'blocks': blocks}, f)
+      os.replace(tmp_fn, self.cache_fn)
+    except OSError:
+      return
+    with self.lock:
+      self._remove(self.dirty_fn)
+      self.dirty = None
+
+  def dirty_blocks(self) -> Set[int]:
+    return {int(line) for line in self._lines(self.dirty_fn) if line.isdigit()}
+
+  def mark_dirty(self, offset: int, length: int) -> None:
+    """Call before writing to the partition. Thread safe"""
+    first, last = offset // self.block_size, min((offset + max(length, 1) - 1) // self.block_size, self.num_blocks - 1)
+    with self.lock:
+      if self.dirty is None:
+        self.dirty = self.dirty_blocks()
+      new = [i for i in range(first, last + 1) if i not in self.dirty]
+      if new:
+        # has to be on disk before the write is, a cache that missed a write is dropped
+        if not self._append(self.dirty_fn, [str(i) for i in new], sync=True):
+          self._remove(self.cache_fn)
+        self.dirty.update(new)
+
+  def hash_blocks(self, blocks: Iterable[int]) -> Iterator[Tuple[int, str]]:
+    for i, data in read_blocks(self.path, self.size, blocks, self.block_size):
+      yield i, hashlib.sha256(data).hexdigest()
+
+  def raw_hash(self, full: bool = True) -> str:
+    """Sha256 of the partition. Without full, the cached one if the blocks written since it was hashed are unchanged"""
+    cache = None if full else self.load()
+    if cache is not None:
+      check = self.dirty_blocks() | set(random.sample(range(self.num_blocks), min(SPOT_CHECK_BLOCKS, self.num_blocks)))
+      if all(h == cache['blocks'][i] for i, h in self.hash_blocks(sorted(check))):
+        cached_hash: str = cache['raw_hash']
+        self.store(cached_hash, cache['blocks'])
+        return cached_hash
+
+    hasher = BlockHasher(self.block_size)
+    for _, data in read_blocks(self.path, self.size, range(self.num_blocks), self.block_size):
+      hasher.update(data)
+    raw_hash, blocks = hasher.finish()
+    self.store(raw_hash, blocks)
+    return raw_hash
+
+  def journal(self, generation: str) -> Set[int]:
+    """Offsets of the chunks an interrupted extract of this generation already got in place"""
+    lines = self._lines(self.journal_fn)
+    if not lines or lines[0] != generation:
+      self._remove(self.journal_fn)
+      self._append(self.journal_fn, [generation], sync=True)
+      return set()
+    return {int(line) for line in lines[1:] if line.isdigit()}
+
+  def add_to_journal(self, offsets: List[int]) -> None:
+    """Call once the chunks at offsets are synced to the partition. Thread safe"""
+    with self.lock:
+      self._append(self.journal_fn, [str(offset) for offset in offsets], sync=True)
+
+  def clear_journal(self) -> None:
+    with self.lock:
+      self._remove(self.journal_fn)
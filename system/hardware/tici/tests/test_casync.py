@@ -3,6 +3,7 @@ import os
 import unittest
 import tempfile
 import subprocess
+from unittest import mock
 
 import system.hardware.tici.casync as casync
 
@@ -121,6 +122,93 @@ class TestCasync(unittest.TestCase):
 
     self.assertLess(stats['remote'], len(self.contents))
 
+  def test_partially_done(self):
+    """Test that chunks already in place in the target aren't downloaded or written again"""
+    target = casync.parse_caibx(self.manifest_fn)
+
+    # Second half is outdated
+    half = len(self.contents) // 2
+    with open(self.target_fn, 'wb') as f:
+      f.write(self.contents[:half] + b"0" * (len(self.contents) - half))
+
+    sources = [('target', casync.FileChunkReader(self.target_fn), casync.build_chunk_dict(target))]
+    sources += [('remote', casync.RemoteChunkReader(self.store_fn), casync.build_chunk_dict(target))]
+
+    stats = casync.extract(target, sources, self.target_fn)
+
+    with open(self.target_fn, 'rb') as f:
+      self.assertEqual(f.read(), self.contents)
+
+    in_place = sum(c.length for c in target if c.offset + c.length <= half)
+    self.assertGreaterEqual(stats['target'], in_place)
+    self.assertLess(stats['remote'], len(self.contents) - in_place)
+
+  def test_single_worker(self):
+    """Test that the parallel extract is the same as a sequential one"""
+    target = casync.parse_caibx(self.manifest_fn)
+
+    for workers in (1, 8):
+      with open(self.target_fn, 'wb'):
+        pass
+
+      sources = [('target', casync.FileChunkReader(self.target_fn), casync.build_chunk_dict(target))]
+      sources += [('remote', casync.RemoteChunkReader(self.store_fn), casync.build_chunk_dict(target))]
+      stats = casync.extract(target, sources, self.target_fn, workers=workers)
+
+      with open(self.target_fn, 'rb') as f:
+        self.assertEqual(f.read(), self.contents)
+
+      self.assertEqual(sum(stats.values()), len(self.contents))
+      self.assertLess(stats['remote'], len(self.contents))
+
+  def test_interrupted(self):
+    """Test that an interrupted extract resumes from the chunks it reported as placed"""
+    target = casync.parse_caibx(self.manifest_fn)
+
+    with open(self.target_fn, 'wb'):
+      pass
+
+    def sources():
+      return [('target', casync.FileChunkReader(self.target_fn), casync.build_chunk_dict(target)),
+              ('remote', casync.RemoteChunkReader(self.store_fn), casync.build_chunk_dict(target))]
+
+    class Interrupted(Exception):
+      pass
+
+    written = []
+    placed = []
+
+    def writing(c):
+      if len(written) == 3:
+        raise Interrupted
+      written.append(c.offset)
+
+    with mock.patch.object(casync, 'PLACED_SYNC_CHUNKS', 2), \
+         mock.patch.object(casync.os, 'fsync', wraps=os.fsync) as fsync:
+      with self.assertRaises(Interrupted):
+        casync.extract(target, sources(), self.target_fn, workers=1, writing=writing, placed=placed.append)
+    # the target is synced before every batch is reported
+    self.assertEqual(fsync.call_count, len(placed))
+    self.assertEqual(sorted(c.offset for chunks in placed for c in chunks), sorted(written))
+
+    with open(self.target_fn, 'rb') as f:
+      partial = f.read()
+    for chunks in placed:
+      for c in chunks:
+        self.assertEqual(partial[c.offset:c.offset + c.length], self.contents[c.offset:c.offset + c.length])
+
+    # resume, trusting the placed chunks
+    known_in_place = set(written)
+    written = []
+    resumed = []
+    casync.extract(target, sources(), self.target_fn, known_in_place=known_in_place,
+                   writing=lambda c: written.append(c.offset), placed=resumed.append)
+
+    with open(self.target_fn, 'rb') as f:
+      self.assertEqual(f.read(), self.contents)
+    self.assertFalse(known_in_place & set(written))
+    self.assertEqual(sorted(c.offset for chunks in resumed for c in chunks), sorted(c.offset for c in target))
+
   @unittest.skipUnless(LOOPBACK, "requires loopback device")
   def test_lo_simple_extract(self):
     target = casync.parse_caibx(self.manifest_fn)
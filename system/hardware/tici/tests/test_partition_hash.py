@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+import hashlib
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import system.hardware.tici.partition_hash as partition_hash
+from system.hardware.tici.partition_hash import BlockHasher, PartitionHashes
+
+BLOCK_SIZE = 64 * 1024
+
+
+class TestPartitionHash(unittest.TestCase):
+  def setUp(self):
+    self.tmpdir = tempfile.TemporaryDirectory()
+    self.cache_dir = os.path.join(self.tmpdir.name, 'cache')
+    self.fn = os.path.join(self.tmpdir.name, 'partition')
+
+    self.contents = os.urandom(BLOCK_SIZE * 10 + 1234)
+    with open(self.fn, 'wb') as f:
+      f.write(self.contents)
+
+  def tearDown(self):
+    self.tmpdir.cleanup()
+
+  def hashes(self):
+    return PartitionHashes(self.fn, len(self.contents), cache_dir=self.cache_dir, block_size=BLOCK_SIZE)
+
+  def write(self, offset, data):
+    self.contents = self.contents[:offset] + data + self.contents[offset + len(data):]
+    with open(self.fn, 'rb+') as f:
+      f.seek(offset)
+      f.write(data)
+
+  def test_block_hasher(self):
+    hasher = BlockHasher(BLOCK_SIZE)
+    for i in range(0, len(self.contents), 1000):
+      hasher.update(self.contents[i:i + 1000])
+    raw_hash, blocks = hasher.finish()
+
+    self.assertEqual(raw_hash, hashlib.sha256(self.contents).hexdigest())
+    self.assertEqual(len(blocks), 11)
+    self.assertEqual(blocks[1], hashlib.sha256(self.contents[BLOCK_SIZE:2 * BLOCK_SIZE]).hexdigest())
+
+  def test_cached(self):
+    self.assertEqual(self.hashes().raw_hash(full=False), hashlib.sha256(self.contents).hexdigest())
+
+    # only dirty and spot checked blocks are read again if they're unchanged
+    hashes = self.hashes()
+    hashes.mark_dirty(3 * BLOCK_SIZE + 10, 100)
+    self.write(3 * BLOCK_SIZE + 10, self.contents[3 * BLOCK_SIZE + 10:3 * BLOCK_SIZE + 110])
+    with mock.patch.object(partition_hash, 'read_blocks', wraps=partition_hash.read_blocks) as read_blocks:
+      self.assertEqual(hashes.raw_hash(full=False), hashlib.sha256(self.contents).hexdigest())
+      self.assertEqual(len(read_blocks.call_args_list), 1)
+      self.assertIn(3, list(read_blocks.call_args_list[0][0][2]))
+
+    # a changed block means reading the whole partition again
+    hashes = self.hashes()
+    hashes.mark_dirty(3 * BLOCK_SIZE + 10, 100)
+    self.write(3 * BLOCK_SIZE + 10, b"\x01" * 100)
+    with mock.patch.object(partition_hash, 'read_blocks', wraps=partition_hash.read_blocks) as read_blocks:
+      self.assertEqual(hashes.raw_hash(full=False), hashlib.sha256(self.contents).hexdigest())
+      self.assertEqual(len(read_blocks.call_args_list), 2)
+      self.assertIn(3, list(read_blocks.call_args_list[0][0][2]))
+      self.assertEqual(list(read_blocks.call_args_list[1][0][2]), list(range(11)))
+
+    with mock.patch.object(partition_hash, 'read_blocks', wraps=partition_hash.read_blocks) as read_blocks:
+      self.assertEqual(self.hashes().raw_hash(full=False), hashlib.sha256(self.contents).hexdigest())
+      self.assertEqual(len(read_blocks.call_args_list), 1)
+      self.assertLessEqual(len(list(read_blocks.call_args_list[0][0][2])), partition_hash.SPOT_CHECK_BLOCKS)
+
+  def test_unlogged_write(self):
+    self.hashes().raw_hash(full=False)
+
+    # a write that isn't logged is caught by the spot check
+    self.write(0, os.urandom(len(self.contents)))
+    with mock.patch.object(partition_hash, 'SPOT_CHECK_BLOCKS', 11):
+      self.assertEqual(self.hashes().raw_hash(full=False), hashlib.sha256(self.contents).hexdigest())
+
+  def test_full(self):
+    self.hashes().raw_hash()
+
+    # a full hash never trusts the cache, not even with nothing logged as written
+    self.write(5 * BLOCK_SIZE, b"\x01" * 100)
+    with mock.patch.object(partition_hash, 'SPOT_CHECK_BLOCKS', 0), \
+         mock.patch.object(partition_hash, 'read_blocks', wraps=partition_hash.read_blocks) as read_blocks:
+      self.assertNotEqual(self.hashes().raw_hash(full=False), hashlib.sha256(self.contents).hexdigest())
+      self.assertEqual(self.hashes().raw_hash(), hashlib.sha256(self.contents).hexdigest())
+      self.assertEqual(list(read_blocks.call_args_list[-1][0][2]), list(range(11)))
+
+    # and refreshes it
+    with mock.patch.object(partition_hash, 'SPOT_CHECK_BLOCKS', 0):
+      self.assertEqual(self.hashes().raw_hash(full=False), hashlib.sha256(self.contents).hexdigest())
+
+  def test_dirty_log_failure(self):
+    self.hashes().raw_hash()
+
+    # a write that can't be logged drops the cache
+    hashes = self.hashes()
+    with mock.patch('builtins.open', side_effect=OSError):
+      hashes.mark_dirty(2 * BLOCK_SIZE, 100)
+    self.write(2 * BLOCK_SIZE, b"\x01" * 100)
+    self.assertIsNone(hashes.load())
+    with mock.patch.object(partition_hash, 'SPOT_CHECK_BLOCKS', 0):
+      self.assertEqual(self.hashes().raw_hash(full=False), hashlib.sha256(self.contents).hexdigest())
+
+  def test_journal(self):
+    hashes = self.hashes()
+    self.assertEqual(hashes.journal('a'), set())
+    hashes.add_to_journal([0])
+    hashes.add_to_journal([BLOCK_SIZE])
+
+    self.assertEqual(self.hashes().journal('a'), {0, BLOCK_SIZE})
+    # journal of another generation is dropped
+    self.assertEqual(self.hashes().journal('b'), set())
+    self.assertEqual(self.hashes().journal('a'), set())
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -21,11 +21,17 @@ def main() -> NoReturn:
   error_log_message_sock = messaging.pub_sock('errorLogMessage')
 
   while True:
-    dat = b''.join(sock.recv_multipart())
+    # python processes send [level + record, pre-encoded file record],
+    # native processes only send the first part
+    parts = sock.recv_multipart()
+    dat = parts[0]
     level = dat[0]
     record = dat[1:].decode("utf-8")
     if level >= log_level:
-      log_handler.emit(record)
+      if len(parts) > 1:
+        log_handler.emit_formatted(parts[1].decode("utf-8"))
+      else:
+        log_handler.emit(record)
 
     # then we publish them
     msg = messaging.new_message()
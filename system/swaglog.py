@@ -1,12 +1,16 @@
+import copy
 import logging
 import os
+import threading
 import time
+from collections import deque
 from pathlib import Path
 from logging.handlers import BaseRotatingHandler
+from typing import Deque
 
 import zmq
 
-from common.logging_extra import SwagLogger, SwagFormatter, SwagLogFileFormatter
+from common.logging_extra import SwagLogger, SwagFormatter, SwagLogFileFormatter, json_robust_dumps
 from system.hardware import PC
 
 if PC:
@@ -14,6 +18,10 @@ if PC:
 else:
   SWAGLOG_DIR = "/data/log/"
 
+SWAGLOG_IPC_PATH = "ipc:///tmp/logmessage"
+SWAGLOG_QUEUE_SIZE = 4096
+SWAGLOG_FLUSH_INTERVAL = 0.05  # seconds
+
 def get_file_handler():
   Path(SWAGLOG_DIR).mkdir(parents=True, exist_ok=True)
   base_filename = os.path.join(SWAGLOG_DIR, "swaglog")
@@ -66,31 +74,110 @@ class SwaglogRotatingFileHandler(BaseRotatingHandler):
         if os.path.exists(to_delete): # just being safe, should always exist
           os.remove(to_delete)
 
+  def emit_formatted(self, msg):
+    """Write an already formatted record, e.g. one pre-encoded by the sending process"""
+    self.acquire()
+    try:
+      if self.shouldRollover(None):
+        self.doRollover()
+      self.stream.write(msg + self.terminator)
+      self.flush()
+    finally:
+      self.release()
+
 class UnixDomainSocketHandler(logging.Handler):
-  def __init__(self, formatter):
+  """
+  Sends records to logmessaged without formatting them in the caller's thread.
+
+  emit() only snapshots the record and the logging context and appends it to a bounded
+  ring buffer. A background thread formats each record once into both the published
+  encoding and the on-disk encoding, and sends them as a two part message so
+  logmessaged can write and republish without re-parsing the JSON.
+  """
+  def __init__(self, formatter, queue_size=SWAGLOG_QUEUE_SIZE):
     logging.Handler.__init__(self)
     self.setFormatter(formatter)
+    self.file_formatter = SwagLogFileFormatter(formatter.swaglogger)
+    self.queue_size = queue_size
+    self.ipc_path = SWAGLOG_IPC_PATH
     self.pid = None
 
   def connect(self):
     self.zctx = zmq.Context()
     self.sock = self.zctx.socket(zmq.PUSH)
     self.sock.setsockopt(zmq.LINGER, 10)
-    self.sock.connect("ipc:///tmp/logmessage")
+    self.sock.connect(self.ipc_path)
+
+    # deque appends and pops are atomic, the oldest records are dropped when full
+    self.records: Deque[logging.LogRecord] = deque(maxlen=self.queue_size)
+    self.send_lock = threading.Lock()
+    self.wake = threading.Event()
     self.pid = os.getpid()
 
+    self.sender_thread = threading.Thread(target=self.sender, name="swaglog_sender", daemon=True)
+    self.sender_thread.start()
+
+  def prepare(self, record):
+    """
+    Like QueueHandler.prepare, a copy of the record without anything the caller can still
+    change or keep alive. Only the JSON encoding is left for the sender thread.
+    """
+    record = copy.copy(record)
+    if isinstance(record.msg, dict):
+      record.msg = copy.copy(record.msg)
+    else:
+      try:
+        record.msg = record.getMessage()
+        record.args = None
+      except (ValueError, TypeError):
+        # the formatter reports these as they are
+        pass
+    if record.exc_info:
+      record.exc_text = self.formatter.formatException(record.exc_info)
+      record.exc_info = None
+    record.swag_ctx = self.formatter.swaglogger.get_ctx()
+    return record
+
   def emit(self, record):
     if os.getpid() != self.pid:
       self.connect()
 
-    msg = self.format(record).rstrip('\n')
-    # print("SEND".format(repr(msg)))
-    try:
-      s = chr(record.levelno)+msg
-      self.sock.send(s.encode('utf8'), zmq.NOBLOCK)
-    except zmq.error.Again:
-      # drop :/
-      pass
+    self.records.append(self.prepare(record))
+    if not self.wake.is_set():
+      self.wake.set()
+
+  def sender(self):
+    while True:
+      self.wake.wait(SWAGLOG_FLUSH_INTERVAL)
+      self.wake.clear()
+      self.send_queued()
+
+  def send_queued(self):
+    with self.send_lock:
+      while True:
+        try:
+          record = self.records.popleft()
+        except IndexError:
+          break
+
+        try:
+          record_dict = self.formatter.format_dict(record)
+          msg = json_robust_dumps(record_dict)
+          file_msg = self.file_formatter.format_from_dict(record_dict)
+        except Exception:
+          self.handleError(record)
+          continue
+
+        try:
+          self.sock.send_multipart([chr(record.levelno).encode('utf8') + msg.encode('utf8'),
+                                    file_msg.encode('utf8')], zmq.NOBLOCK)
+        except zmq.error.Again:
+          # drop :/
+          pass
+
+  def flush(self):
+    if self.pid == os.getpid():
+      self.send_queued()
 
 
 def add_file_handler(log):
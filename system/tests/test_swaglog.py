@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+import json
+import os
+import time
+import unittest
+
+import zmq
+
+from system.swaglog import cloudlog, SWAGLOG_IPC_PATH, UnixDomainSocketHandler
+
+
+class TestSwaglog(unittest.TestCase):
+  def setUp(self):
+    self.ctx = zmq.Context()
+    self.sock = self.ctx.socket(zmq.PULL)
+    self.sock.setsockopt(zmq.RCVTIMEO, 1000)
+    # not the path of a logmessaged that might be running
+    ipc_path = f"ipc:///tmp/logmessage_test_{os.getpid()}"
+    self.sock.bind(ipc_path)
+
+    self.handler = next(h for h in cloudlog.handlers if isinstance(h, UnixDomainSocketHandler))
+    self.handler.ipc_path = ipc_path
+    self.handler.pid = None  # reconnect to our socket
+
+  def tearDown(self):
+    self.handler.ipc_path = SWAGLOG_IPC_PATH
+    self.handler.pid = None
+    self.sock.close()
+    self.ctx.term()
+
+  def _recv(self):
+    parts = self.sock.recv_multipart()
+    self.assertEqual(len(parts), 2)
+    return parts[0][0], json.loads(parts[0][1:]), json.loads(parts[1])
+
+  def test_preencoded_records(self):
+    with cloudlog.ctx(daemon="test"):
+      cloudlog.error("hello %s", "world")
+    cloudlog.event("test_event", value=1)
+
+    level, record, file_record = self._recv()
+    self.assertEqual(level, 40)
+    self.assertEqual(record['msg'], "hello world")
+    self.assertEqual(record['ctx']['daemon'], "test")
+    self.assertEqual(file_record['msg$s'], "hello world")
+    self.assertEqual(file_record['ctx'], record['ctx'])
+    self.assertIn('id', file_record)
+
+    level, record, file_record = self._recv()
+    self.assertEqual(level, 20)
+    self.assertEqual(record['msg'], {'event': 'test_event', 'value': 1})
+    self.assertNotIn('daemon', record['ctx'])
+    self.assertEqual(file_record['msg'], {'event$s': 'test_event', 'value$i': 1})
+
+  def test_record_snapshot(self):
+    # the record is taken as it was when logged, not when the sender thread gets to it
+    with self.handler.send_lock:
+      data = [1, 2]
+      cloudlog.error("data %s", data)
+      data.append(3)
+
+      try:
+        raise ValueError("boom")
+      except ValueError:
+        cloudlog.exception("failed")
+      self.assertIsNone(self.handler.records[-1].exc_info)
+
+    self.assertEqual(self._recv()[1]['msg'], "data [1, 2]")
+    record = self._recv()[1]
+    self.assertEqual(record['msg'], "failed")
+    self.assertIn("ValueError: boom", record['exc_info'])
+
+  def test_emit_overhead(self):
+    # warm up connection and sender thread
+    cloudlog.debug("warmup")
+    self._recv()
+
+    n = 1000
+    st = time.monotonic()
+    for i in range(n):
+      cloudlog.debug({'i': i, 'data': list(range(20))})
+    per_call = (time.monotonic() - st) / n
+    self.assertLess(per_call, 200e-6, f"cloudlog.debug took {per_call*1e6:.1f} us per call")
+
+    for i in range(n):
+      self.assertEqual(self._recv()[1]['msg']['i'], i)
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -548,6 +548,112 @@ cdef class AcadosOcpSolverCython:
                     self.nlp_solver, stage, field, <void *> value.data)
 
 
+    def set_stages(self, str field_, value_, int start=0):
+        """
+        Set numerical data for consecutive stages in one call.
+
+            :param field: string in ['x', 'u', 'pi', 'lam', 't', 'z', 'sl', 'su', 'p', 'yref', 'lbx', 'ubx', 'lbu', 'ubu']
+            :param value: array of shape (n_stages, dim), row i is written to stage start + i
+            :param start: first shooting node to set
+        """
+        cost_fields = ['y_ref', 'yref']
+        constraints_fields = ['lbx', 'ubx', 'lbu', 'ubu']
+        out_fields = ['x', 'u', 'pi', 'lam', 't', 'z', 'sl', 'su']
+
+        field = field_.encode('utf-8')
+
+        cdef cnp.ndarray[cnp.float64_t, ndim=2] value = np.ascontiguousarray(value_, dtype=np.float64)
+        cdef int n_stages = value.shape[0]
+        cdef int dim = value.shape[1]
+        cdef int i, dims
+
+        if start < 0 or start + n_stages > self.N + 1:
+            raise Exception('AcadosOcpSolverCython.set_stages(): stages [{}, {}) out of range [0, {}].'\
+                .format(start, start + n_stages, self.N))
+
+        if n_stages == 0:
+            return
+
+        # treat parameters separately
+        if field_ == 'p':
+            for i in range(n_stages):
+                assert acados_solver.acados_update_params(self.capsule, start + i, &value[i, 0], dim) == 0
+            return
+
+        if field_ not in constraints_fields + cost_fields + out_fields:
+            raise Exception("AcadosOcpSolverCython.set_stages(): {} is not a valid argument.\
+                \nPossible values are {}. Exiting.".format(field_, \
+                constraints_fields + cost_fields + out_fields + ['p']))
+
+        for i in range(n_stages):
+            dims = acados_solver_common.ocp_nlp_dims_get_from_attr(self.nlp_config,
+                self.nlp_dims, self.nlp_out, start + i, field)
+
+            if dim != dims:
+                msg = 'AcadosOcpSolverCython.set_stages(): mismatching dimension for field "{}" '.format(field_)
+                msg += 'at stage {} with dimension {} (you have {})'.format(start + i, dims, dim)
+                raise Exception(msg)
+
+            if field_ in constraints_fields:
+                acados_solver_common.ocp_nlp_constraints_model_set(self.nlp_config,
+                    self.nlp_dims, self.nlp_in, start + i, field, <void *> &value[i, 0])
+            elif field_ in cost_fields:
+                acados_solver_common.ocp_nlp_cost_model_set(self.nlp_config,
+                    self.nlp_dims, self.nlp_in, start + i, field, <void *> &value[i, 0])
+            else:
+                acados_solver_common.ocp_nlp_out_set(self.nlp_config,
+                    self.nlp_dims, self.nlp_out, start + i, field, <void *> &value[i, 0])
+
+
+    def get_stages(self, str field_, int start=0, int end=-1):
+        """
+        Get the last solution of the solver for consecutive stages in one call:
+
+            :param field: string in ['x', 'u', 'z', 'pi', 'lam', 't', 'sl', 'su',]
+            :param start: first shooting node
+            :param end: one past the last shooting node, defaults to N + 1
+
+            :returns: array of shape (end - start, dim)
+        """
+        out_fields = ['x', 'u', 'z', 'pi', 'lam', 't', 'sl', 'su']
+        field = field_.encode('utf-8')
+
+        if field_ not in out_fields:
+            raise Exception('AcadosOcpSolverCython.get_stages(): {} is an invalid argument.\
+                    \n Possible values are {}. Exiting.'.format(field_, out_fields))
+
+        if end < 0:
+            end = self.N + 1
+
+        if start < 0 or end > self.N + 1 or start > end:
+            raise Exception('AcadosOcpSolverCython.get_stages(): stages [{}, {}) out of range [0, {}].'\
+                .format(start, end, self.N))
+
+        if end == self.N + 1 and field_ == 'pi':
+            raise Exception('AcadosOcpSolverCython.get_stages(): field {} does not exist at final stage {}.'\
+                .format(field_, self.N))
+
+        cdef int i, dims
+        cdef int dim = 0
+        if end > start:
+            dim = acados_solver_common.ocp_nlp_dims_get_from_attr(self.nlp_config,
+                self.nlp_dims, self.nlp_out, start, field)
+
+        cdef cnp.ndarray[cnp.float64_t, ndim=2] out = np.zeros((end - start, dim))
+        for i in range(start, end):
+            dims = acados_solver_common.ocp_nlp_dims_get_from_attr(self.nlp_config,
+                self.nlp_dims, self.nlp_out, i, field)
+            if dims != dim:
+                raise Exception('AcadosOcpSolverCython.get_stages(): field {} has dimension {} at stage {}, '\
+                    'but {} at stage {}, use get() instead.'.format(field_, dims, i, dim, start))
+
+            if dim > 0:
+                acados_solver_common.ocp_nlp_out_get(self.nlp_config, \
+                    self.nlp_dims, self.nlp_out, i, field, <void *> &out[i - start, 0])
+
+        return out
+
+
     def cost_set(self, int stage, str field_, value_):
         """
         Set numerical data in the cost module of the solver.
@@ -1,20 +1,17 @@
 #!/usr/bin/env python3
 import argparse
 import json
-import matplotlib.patches as mpatches
-import matplotlib.pyplot as plt
-import mpld3
 import sys
-from bisect import bisect_left, bisect_right
 from collections import defaultdict
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
 
 from tools.lib.logreader import logreader_from_route_or_segment
 
 DEMO_ROUTE = "9f583b1d93915c31|2022-05-18--10-49-51--0"
 
 SERVICES = ['camerad', 'modeld', 'plannerd', 'controlsd', 'boardd']
-# Retrieve controlsd frameId from lateralPlan, mismatch with longitudinalPlan will be ignored
-MONOTIME_KEYS = ['modelMonoTime', 'lateralPlanMonoTime']
 MSGQ_TO_SERVICE = {
   'roadCameraState': 'camerad',
   'wideRoadCameraState': 'camerad',
@@ -29,83 +26,210 @@ SERVICE_TO_DURATIONS = {
   'modeld': ['modelExecutionTime', 'gpuExecutionTime'],
   'plannerd': ['solverExecutionTime'],
 }
+# messages with a frameId, and the ones that point to an earlier message with its logMonoTime
+FRAME_MSGQS = ['roadCameraState', 'wideRoadCameraState', 'modelV2']
+# controlsd frameId comes from lateralPlan, mismatch with longitudinalPlan will be ignored
+LINKED_MSGQS = {
+  'lateralPlan': ('modelMonoTime', 'modelV2'),
+  'longitudinalPlan': ('modelMonoTime', 'modelV2'),
+  'controlsState': ('lateralPlanMonoTime', 'lateralPlan'),
+}
+
+# per frame latencies between stages, from the first message of each stage
+STAGES = {
+  'cameraToModel': ('roadCameraState.sof', 'modelV2'),
+  'modelToPlan': ('modelV2', 'lateralPlan'),
+  'planToSendcan': ('lateralPlan', 'sendcan'),
+  'cameraToSendcan': ('roadCameraState.sof', 'sendcan'),
+}
+PERCENTILES = (50, 90, 99)
+
+Columns = Dict[str, Dict[str, np.ndarray]]
 
-def read_logs(lr):
-  data = defaultdict(lambda: defaultdict(lambda: defaultdict(list)))
-  mono_to_frame = {}
-  frame_mismatches = []
-  frame_id_fails = 0
-  latest_sendcan_monotime = 0
+
+def read_logs(lr) -> Tuple[Columns, List[Tuple[int, str, str, int]], int]:
+  """
+  One pass over the log. Returns the columns of every message queue (t, frame or link,
+  start of frame and durations), the cloudlog timestamps and the number of frame
+  mismatches between modelV2 frameId and frameIdExtra.
+  """
+  cols: Dict[str, Dict[str, list]] = defaultdict(lambda: defaultdict(list))
+  cloudlogs = []
+  frame_mismatches = 0
   for msg in lr:
-    if msg.which() == 'sendcan':
-      latest_sendcan_monotime = msg.logMonoTime
+    which = msg.which()
+    if which == 'logMessage':
+      # most log messages aren't timestamps, don't parse those
+      if '"timestamp"' not in msg.logMessage:
+        continue
+      jmsg = json.loads(msg.logMessage)
+      if "timestamp" in jmsg['msg']:
+        tstp = jmsg['msg']['timestamp']
+        cloudlogs.append((int(tstp['time']), jmsg['ctx']['daemon'], tstp['event'], int(tstp.get('frame_id', -1))))
       continue
 
-    if msg.which() in MSGQ_TO_SERVICE:
-      service = MSGQ_TO_SERVICE[msg.which()]
-      msg_obj = getattr(msg, msg.which())
-
-      frame_id = -1
-      if hasattr(msg_obj, "frameId"):
-        frame_id = msg_obj.frameId
-      else:
-        continue_outer = False
-        for key in MONOTIME_KEYS:
-          if hasattr(msg_obj, key):
-            if getattr(msg_obj, key) == 0:
-              # Filter out controlsd messages which arrive before the camera loop
-              continue_outer = True
-            elif getattr(msg_obj, key) in mono_to_frame:
-              frame_id = mono_to_frame[getattr(msg_obj, key)]
-        if continue_outer:
-          continue
-      if frame_id == -1:
-        frame_id_fails += 1
-        continue
-      mono_to_frame[msg.logMonoTime] = frame_id
-      data['timestamp'][frame_id][service].append((msg.which()+" published", msg.logMonoTime))
-
-      next_service = SERVICES[SERVICES.index(service)+1]
-      if not data['start'][frame_id][next_service]:
-        data['start'][frame_id][next_service] = msg.logMonoTime
-      data['end'][frame_id][service] = msg.logMonoTime
-
-      if service in SERVICE_TO_DURATIONS:
-        for duration in SERVICE_TO_DURATIONS[service]:
-          data['duration'][frame_id][service].append((msg.which()+"."+duration, getattr(msg_obj, duration)))
-
-      if service == SERVICES[0]:
-        data['timestamp'][frame_id][service].append((msg.which()+" start of frame", msg_obj.timestampSof))
-        if not data['start'][frame_id][service]:
-          data['start'][frame_id][service] = msg_obj.timestampSof
-      elif msg.which() == 'controlsState':
-        # Sendcan is published before controlsState, but the frameId is retrieved in CS
-        data['timestamp'][frame_id][service].append(("sendcan published", latest_sendcan_monotime))
-      elif msg.which() == 'modelV2':
-        if msg_obj.frameIdExtra != frame_id:
-          frame_mismatches.append(frame_id)
+    if which not in MSGQ_TO_SERVICE:
+      continue
 
-  if frame_id_fails > 20:
-    print("Warning, many frameId fetch fails", frame_id_fails)
-  if len(frame_mismatches) > 20:
-    print("Warning, many frame mismatches", len(frame_mismatches))
-  return (data, frame_mismatches)
-
-# This is not needed in 3.10 as a "key" parameter is added to bisect
-class KeyifyList(object):
-  def __init__(self, inner, key):
-    self.inner = inner
-    self.key = key
-  def __len__(self):
-    return len(self.inner)
-  def __getitem__(self, k):
-    return self.key(self.inner[k])
-
-def find_frame_id(time, service, start_times, end_times):
-  left = bisect_left(KeyifyList(list(start_times.items()),
-                     lambda x: x[1][service] if x[1][service] else -1), time) - 1
-  right = bisect_right(KeyifyList(list(end_times.items()),
-                      lambda x: x[1][service] if x[1][service] else float("inf")), time)
+    c = cols[which]
+    c['t'].append(msg.logMonoTime)
+    if which == 'sendcan':
+      continue
+
+    msg_obj = getattr(msg, which)
+    if which in FRAME_MSGQS:
+      c['frame'].append(msg_obj.frameId)
+    else:
+      c['link'].append(getattr(msg_obj, LINKED_MSGQS[which][0]))
+
+    if MSGQ_TO_SERVICE[which] == 'camerad':
+      c['sof'].append(msg_obj.timestampSof)
+    elif which == 'modelV2':
+      frame_mismatches += msg_obj.frameIdExtra != msg_obj.frameId
+    for duration in SERVICE_TO_DURATIONS.get(MSGQ_TO_SERVICE[which], []):
+      c[duration].append(getattr(msg_obj, duration))
+
+  arrays = {which: {k: np.array(v) for k, v in c.items()} for which, c in cols.items()}
+  return arrays, cloudlogs, frame_mismatches
+
+
+def lookup(keys: np.ndarray, sorted_keys: np.ndarray, values: np.ndarray, default=-1) -> np.ndarray:
+  """values at the exact matches of keys in sorted_keys, default where there is none"""
+  if not len(sorted_keys) or not len(keys):
+    return np.full(len(keys), default, dtype=values.dtype if len(values) else np.int64)
+  idx = np.clip(np.searchsorted(sorted_keys, keys), 0, len(sorted_keys) - 1)
+  return np.where(sorted_keys[idx] == keys, values[idx], default)
+
+
+def join_frames(cols: Columns) -> int:
+  """Adds a frame column to the linked message queues, returns the number of messages without one"""
+  empty = np.array([], dtype=np.int64)
+  fails = 0
+  # in dependency order, controlsState links to lateralPlan
+  for which, (_, src) in LINKED_MSGQS.items():
+    if which not in cols:
+      continue
+    c, s = cols[which], cols.get(src, {})
+    src_t, src_frame = s.get('t', empty), s.get('frame', empty)
+    order = np.argsort(src_t, kind='stable')
+    c['frame'] = lookup(c['link'], src_t[order], src_frame[order])
+    # a link of 0 means the message came before the camera loop, that's not a failure
+    fails += int(np.sum((c['frame'] == -1) & (c['link'] != 0)))
+  return fails
+
+
+def sendcan_times(cols: Columns) -> np.ndarray:
+  """sendcan is published right before controlsState, but the frameId is retrieved in controlsState"""
+  cs_t = cols['controlsState']['t']
+  if 'sendcan' not in cols:
+    return np.zeros(len(cs_t), dtype=np.int64)
+  sendcan = np.sort(cols['sendcan']['t'])
+  idx = np.searchsorted(sendcan, cs_t, side='right') - 1
+  return np.where(idx >= 0, sendcan[np.maximum(idx, 0)], 0)
+
+
+def first_per_frame(frame: np.ndarray, t: np.ndarray, values: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+  """unique frames with the values, the times by default, of the first and last message of each"""
+  valid = frame >= 0
+  frame, t = frame[valid], t[valid]
+  values = t if values is None else values[valid]
+  order = np.lexsort((t, frame))
+  frame, values = frame[order], values[order]
+  frames, first = np.unique(frame, return_index=True)
+  last = np.r_[first[1:], len(frame)] - 1
+  return frames, values[first], values[last]
+
+
+def stage_times(cols: Columns) -> Dict[str, Tuple[np.ndarray, np.ndarray]]:
+  """(frames, time) of the first message per frame of every stage"""
+  ret = {}
+  for which, c in cols.items():
+    if which == 'sendcan' or 'frame' not in c:
+      continue
+    frames, first, _ = first_per_frame(c['frame'], c['t'])
+    ret[which] = (frames, first)
+    if 'sof' in c:
+      frames, first, _ = first_per_frame(c['frame'], c['sof'])
+      ret[f'{which}.sof'] = (frames, first)
+
+  if 'controlsState' in cols:
+    frames, first, _ = first_per_frame(cols['controlsState']['frame'], sendcan_times(cols))
+    ret['sendcan'] = (frames, first)
+  return ret
+
+
+def distribution(x: np.ndarray) -> Dict[str, float]:
+  if not len(x):
+    return {'count': 0}
+  ret = {f'p{p}': float(v) for p, v in zip(PERCENTILES, np.percentile(x, PERCENTILES))}
+  ret['max'] = float(np.max(x))
+  ret['mean'] = float(np.mean(x))
+  ret['count'] = len(x)
+  return ret
+
+
+def latency_stats(cols: Columns) -> Dict[str, Dict[str, float]]:
+  """Distributions of the per frame latency of every stage, and of the published durations, in ms"""
+  times = stage_times(cols)
+  stats = {}
+  for stage, (a, b) in STAGES.items():
+    if a not in times or b not in times:
+      continue
+    frames, ia, ib = np.intersect1d(times[a][0], times[b][0], return_indices=True)
+    dt = (times[b][1][ib] - times[a][1][ia]) / 1e6
+    stats[stage] = distribution(dt[(times[b][1][ib] > 0) & (times[a][1][ia] > 0)])
+
+  for which, c in cols.items():
+    for duration in SERVICE_TO_DURATIONS.get(MSGQ_TO_SERVICE[which], []):
+      stats[f'{which}.{duration}'] = distribution(c[duration] * 1e3)
+  return stats
+
+
+def frame_spans(cols: Columns) -> Tuple[Dict, Dict]:
+  """
+  Per frame and service, when the service started and ended working on it. A service
+  starts with the first message of the service before it, camerad at start of frame.
+  """
+  start_times: Dict[int, Dict[str, int]] = defaultdict(lambda: defaultdict(int))
+  end_times: Dict[int, Dict[str, int]] = defaultdict(lambda: defaultdict(int))
+  for service, next_service in zip(SERVICES, SERVICES[1:]):
+    msgqs = [w for w, s in MSGQ_TO_SERVICE.items() if s == service and w in cols and 'frame' in cols[w]]
+    if not msgqs:
+      continue
+    frame = np.concatenate([cols[w]['frame'] for w in msgqs])
+    t = np.concatenate([cols[w]['t'] for w in msgqs])
+    frames, first, last = first_per_frame(frame, t)
+    for f, t0, t1 in zip(frames.tolist(), first.tolist(), last.tolist()):
+      start_times[f][next_service] = t0
+      end_times[f][service] = t1
+
+    if service == 'camerad':
+      # start of frame of the first camera message
+      frames, first, _ = first_per_frame(frame, t, np.concatenate([cols[w]['sof'] for w in msgqs]))
+      for f, t0 in zip(frames.tolist(), first.tolist()):
+        start_times[f][service] = t0
+  return start_times, end_times
+
+
+def find_frame_ids(times: np.ndarray, service: str, start_times, end_times) -> Tuple[np.ndarray, np.ndarray]:
+  """
+  Frames the service was working on at the given times: the last one it started before,
+  and the first one it ended after. Ambiguous if they differ, -1 if there is none.
+  """
+  frames = np.array(sorted(f for f in start_times if start_times[f][service] or end_times[f][service]), dtype=np.int64)
+  if not len(frames):
+    return np.full(len(times), -1), np.full(len(times), -1)
+
+  starts = np.array([start_times[f][service] or -1 for f in frames.tolist()], dtype=np.float64)
+  ends = np.array([end_times[f][service] or np.inf for f in frames.tolist()], dtype=np.float64)
+  # fill frames where it's missing, so both are sorted
+  starts = np.maximum.accumulate(starts)
+  ends = np.minimum.accumulate(ends[::-1])[::-1]
+
+  left = np.searchsorted(starts, times, side='left') - 1
+  right = np.searchsorted(ends, times, side='right')
+  left = np.where(left >= 0, frames[np.clip(left, 0, len(frames) - 1)], -1)
+  right = np.where(right < len(frames), frames[np.clip(right, 0, len(frames) - 1)], -1)
   return left, right
 
 def find_t0(start_times, frame_id=-1):
@@ -118,43 +242,50 @@ def find_t0(start_times, frame_id=-1):
     frame_id += 1
   raise Exception('No start time has been set')
 
-def insert_cloudlogs(lr, timestamps, start_times, end_times):
+
+def insert_cloudlogs(cloudlogs, timestamps, start_times, end_times):
   # at least one cloudlog must be made in controlsd
 
+  # filter out messages which arrive before the camera loop
   t0 = find_t0(start_times)
+  cloudlogs = [c for c in cloudlogs if c[0] >= t0]
+
+  by_service: Dict[str, List[int]] = defaultdict(list)
+  for i, (time, service, event, frame_id) in enumerate(cloudlogs):
+    if frame_id != -1:
+      timestamps[frame_id][service].append((event, time))
+    else:
+      by_service[service].append(i)
+
   failed_inserts = 0
-  latest_controls_frameid = 0
-  for msg in lr:
-    if msg.which() == "logMessage":
-      jmsg = json.loads(msg.logMessage)
-      if "timestamp" in jmsg['msg']:
-        time = int(jmsg['msg']['timestamp']['time'])
-        service = jmsg['ctx']['daemon']
-        event = jmsg['msg']['timestamp']['event']
-        if time < t0:
-          # Filter out controlsd messages which arrive before the camera loop
-          continue
-
-        if "frame_id" in jmsg['msg']['timestamp']:
-          timestamps[int(jmsg['msg']['timestamp']['frame_id'])][service].append((event, time))
-          continue
-
-        if service == "boardd":
-          timestamps[latest_controls_frameid][service].append((event, time))
-          end_times[latest_controls_frameid][service] = time
-        else:
-          frame_id = find_frame_id(time, service, start_times, end_times)
-          if frame_id:
-            if frame_id[0] != frame_id[1]:
-              event += " (warning: ambiguity)"
-            frame_id = frame_id[0]
-            if service == 'controlsd':
-              latest_controls_frameid = frame_id
-            timestamps[frame_id][service].append((event, time))
-          else:
-            failed_inserts += 1
-
-  if latest_controls_frameid == 0:
+  assigned = np.full(len(cloudlogs), -1, dtype=np.int64)
+  for service, idxs in by_service.items():
+    if service == 'boardd':
+      continue
+    left, right = find_frame_ids(np.array([cloudlogs[i][0] for i in idxs]), service, start_times, end_times)
+    for i, l, r in zip(idxs, left.tolist(), right.tolist()):
+      time, _, event, _ = cloudlogs[i]
+      if l == -1:
+        failed_inserts += 1
+        continue
+      if r != -1 and l != r:
+        event += " (warning: ambiguity)"
+      timestamps[l][service].append((event, time))
+      assigned[i] = l
+
+  # boardd logs go with the frame of the latest controlsd log
+  controls = np.array([i for i in by_service.get('controlsd', []) if assigned[i] != -1], dtype=np.int64)
+  boardd = np.array(by_service.get('boardd', []), dtype=np.int64)
+  latest = np.searchsorted(controls, boardd) - 1
+  for i, j in zip(boardd.tolist(), latest.tolist()):
+    if j < 0:
+      continue
+    time, service, event, _ = cloudlogs[i]
+    frame_id = int(assigned[controls[j]])
+    timestamps[frame_id][service].append((event, time))
+    end_times[frame_id][service] = time
+
+  if len(boardd) and not len(controls):
     print("Warning: failed to bind boardd logs to a frame ID. Add a timestamp cloudlog in controlsd.")
   elif failed_inserts > len(timestamps):
     print(f"Warning: failed to bind {failed_inserts} cloudlog timestamps to a frame ID")
@@ -176,6 +307,10 @@ def print_timestamps(timestamps, durations, start_times, relative):
         print("    "+'%-53s%-53s' %(event, str(time*1000)))
 
 def graph_timestamps(timestamps, start_times, end_times, relative, offset_services=False, title=""):
+  import matplotlib.patches as mpatches
+  import matplotlib.pyplot as plt
+  import mpld3
+
   # mpld3 doesn't convert properly to D3 font sizes
   plt.rcParams.update({'font.size': 18})
 
@@ -215,11 +350,52 @@ def graph_timestamps(timestamps, start_times, end_times, relative, offset_servic
   plt.legend(handles=[mpatches.Patch(color=colors[i], label=SERVICES[i]) for i in range(len(SERVICES))])
   return fig
 
+
+def frame_events(cols: Columns) -> Tuple[Dict, Dict]:
+  timestamps: Dict[int, Dict[str, list]] = defaultdict(lambda: defaultdict(list))
+  durations: Dict[int, Dict[str, list]] = defaultdict(lambda: defaultdict(list))
+  for which, c in cols.items():
+    if which == 'sendcan' or 'frame' not in c:
+      continue
+    service = MSGQ_TO_SERVICE[which]
+    sendcan = sendcan_times(cols) if which == 'controlsState' else None
+    for i in np.flatnonzero(c['frame'] >= 0).tolist():
+      frame_id = int(c['frame'][i])
+      timestamps[frame_id][service].append((which + " published", int(c['t'][i])))
+      if 'sof' in c:
+        timestamps[frame_id][service].append((which + " start of frame", int(c['sof'][i])))
+      if sendcan is not None:
+        timestamps[frame_id][service].append(("sendcan published", int(sendcan[i])))
+      for duration in SERVICE_TO_DURATIONS.get(service, []):
+        durations[frame_id][service].append((which + "." + duration, float(c[duration][i])))
+  return timestamps, durations
+
+
+def read_and_join(lr) -> Tuple[Columns, list]:
+  cols, cloudlogs, frame_mismatches = read_logs(lr)
+  frame_id_fails = join_frames(cols)
+  if frame_id_fails > 20:
+    print("Warning, many frameId fetch fails", frame_id_fails)
+  if frame_mismatches > 20:
+    print("Warning, many frame mismatches", frame_mismatches)
+  return cols, cloudlogs
+
+
 def get_timestamps(lr):
-  lr = list(lr)
-  data, frame_mismatches = read_logs(lr)
-  insert_cloudlogs(lr, data['timestamp'], data['start'], data['end'])
-  return data, frame_mismatches
+  cols, cloudlogs = read_and_join(lr)
+  data = {}
+  data['timestamp'], data['duration'] = frame_events(cols)
+  data['start'], data['end'] = frame_spans(cols)
+  insert_cloudlogs(cloudlogs, data['timestamp'], data['start'], data['end'])
+  return data
+
+
+def print_stats(stats: Dict[str, Dict[str, float]]) -> None:
+  print(f"{'':40s} {'count':>7s} {'p50':>8s} {'p90':>8s} {'p99':>8s} {'max':>8s}  (ms)")
+  for name, s in stats.items():
+    if s['count']:
+      print(f"{name:40s} {s['count']:7d} {s['p50']:8.2f} {s['p90']:8.2f} {s['p99']:8.2f} {s['max']:8.2f}")
+
 
 if __name__ == "__main__":
   parser = argparse.ArgumentParser(description="A tool for analyzing openpilot's end-to-end latency",
@@ -228,6 +404,10 @@ if __name__ == "__main__":
   parser.add_argument("--demo", action="store_true", help="Use the demo route instead of providing one")
   parser.add_argument("--plot", action="store_true", help="If a plot should be generated")
   parser.add_argument("--offset", action="store_true", help="Vertically offset service to better visualize overlap")
+  parser.add_argument("--stats", action="store_true", help="Only print the latency distributions of every stage")
+  parser.add_argument("--json", help="Write the latency distributions to this file")
+  parser.add_argument("--max-p99", action="append", default=[], metavar="STAGE=MS",
+                      help=f"Fail if the p99 latency of a stage is higher, stages: {', '.join(STAGES)}")
   parser.add_argument("route_or_segment_name", nargs='?', help="The route to print")
 
   if len(sys.argv) == 1:
@@ -238,7 +418,29 @@ if __name__ == "__main__":
   r = DEMO_ROUTE if args.demo else args.route_or_segment_name.strip()
   lr = logreader_from_route_or_segment(r, sort_by_time=True)
 
-  data, _ = get_timestamps(lr)
+  if args.stats or args.json or args.max_p99:
+    cols, _ = read_and_join(lr)
+    stats = latency_stats(cols)
+    print_stats(stats)
+    if args.json:
+      with open(args.json, 'w') as f:
+        json.dump(stats, f, indent=2)
+
+    failures = []
+    for limit in args.max_p99:
+      stage, ms = limit.split('=')
+      p99 = stats.get(stage, {}).get('p99')
+      if p99 is None:
+        failures.append(f"{stage}: no data")
+      elif p99 > float(ms):
+        failures.append(f"{stage}: p99 {p99:.2f} ms > {float(ms):.2f} ms")
+    if failures:
+      print("\n".join(failures))
+      sys.exit(1)
+    sys.exit()
+
+  data = get_timestamps(lr)
   print_timestamps(data['timestamp'], data['duration'], data['start'], args.relative)
   if args.plot:
+    import mpld3
     mpld3.show(graph_timestamps(data['timestamp'], data['start'], data['end'], args.relative, offset_services=args.offset, title=r))
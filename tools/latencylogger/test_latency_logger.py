@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+import json
+import random
+import unittest
+from collections import defaultdict
+from types import SimpleNamespace
+
+import numpy as np
+
+from tools.latencylogger.latency_logger import MSGQ_TO_SERVICE, SERVICES, SERVICE_TO_DURATIONS, get_timestamps, latency_stats, read_and_join
+
+MS = int(1e6)
+
+
+class Msg:
+  def __init__(self, which, t, value=None, **fields):
+    self._which = which
+    self.logMonoTime = t
+    setattr(self, which, SimpleNamespace(**fields) if value is None else value)
+
+  def which(self):
+    return self._which
+
+
+def synthetic_log(frames=100, seed=0):
+  """camerad -> modeld -> plannerd at 20 Hz and controlsd at 100 Hz, with jitter and dropped frames"""
+  rng = random.Random(seed)
+  msgs = []
+  model_t = {}
+  for f in range(frames):
+    sof = int(1e9) + f * 50 * MS
+    msgs.append(Msg('roadCameraState', sof + rng.randint(8, 12) * MS, frameId=f, timestampSof=sof, processingTime=rng.random() * 0.01))
+    msgs.append(Msg('wideRoadCameraState', sof + rng.randint(8, 12) * MS, frameId=f, timestampSof=sof + MS, processingTime=rng.random() * 0.01))
+    if f % 7 == 3:
+      continue  # modeld drops a frame
+
+    t = sof + rng.randint(30, 45) * MS
+    model_t[f] = t
+    extra = f if f % 11 else f - 1
+    msgs.append(Msg('modelV2', t, frameId=f, frameIdExtra=extra, modelExecutionTime=rng.random() * 0.05, gpuExecutionTime=rng.random() * 0.04))
+    for which in ('lateralPlan', 'longitudinalPlan'):
+      msgs.append(Msg(which, t + rng.randint(3, 8) * MS, modelMonoTime=t, solverExecutionTime=rng.random() * 0.01))
+
+  # controlsd uses the last lateralPlan it received, 0 before the first one
+  plans = sorted(m.logMonoTime for m in msgs if m.which() == 'lateralPlan')
+  for t in range(int(1e9), int(1e9) + frames * 50 * MS, 10 * MS):
+    t += rng.randint(0, 2) * MS
+    plan = max((p for p in plans if p < t), default=0)
+    msgs.append(Msg('sendcan', t))
+    msgs.append(Msg('controlsState', t + 100, lateralPlanMonoTime=plan))
+
+  # cloudlog timestamps with a frame id
+  for f, t in list(model_t.items())[::10]:
+    log = {'ctx': {'daemon': 'modeld'}, 'msg': {'timestamp': {'event': 'model start', 'time': t - MS, 'frame_id': f}}}
+    msgs.append(Msg('logMessage', t, json.dumps(log)))
+  msgs.append(Msg('logMessage', int(1e9), json.dumps({'ctx': {'daemon': 'modeld'}, 'msg': 'not a timestamp'})))
+  return sorted(msgs, key=lambda m: m.logMonoTime)
+
+
+def old_read_logs(lr):
+  """The per message read_logs from before the logs were read into columns"""
+  data = defaultdict(lambda: defaultdict(lambda: defaultdict(list)))
+  mono_to_frame = {}
+  latest_sendcan_monotime = 0
+  for msg in lr:
+    if msg.which() == 'sendcan':
+      latest_sendcan_monotime = msg.logMonoTime
+      continue
+
+    if msg.which() in MSGQ_TO_SERVICE:
+      service = MSGQ_TO_SERVICE[msg.which()]
+      msg_obj = getattr(msg, msg.which())
+
+      frame_id = -1
+      if hasattr(msg_obj, "frameId"):
+        frame_id = msg_obj.frameId
+      else:
+        continue_outer = False
+        for key in ['modelMonoTime', 'lateralPlanMonoTime']:
+          if hasattr(msg_obj, key):
+            if getattr(msg_obj, key) == 0:
+              continue_outer = True
+            elif getattr(msg_obj, key) in mono_to_frame:
+              frame_id = mono_to_frame[getattr(msg_obj, key)]
+        if continue_outer:
+          continue
+      if frame_id == -1:
+        continue
+      mono_to_frame[msg.logMonoTime] = frame_id
+      data['timestamp'][frame_id][service].append((msg.which()+" published", msg.logMonoTime))
+
+      next_service = SERVICES[SERVICES.index(service)+1]
+      if not data['start'][frame_id][next_service]:
+        data['start'][frame_id][next_service] = msg.logMonoTime
+      data['end'][frame_id][service] = msg.logMonoTime
+
+      if service in SERVICE_TO_DURATIONS:
+        for duration in SERVICE_TO_DURATIONS[service]:
+          data['duration'][frame_id][service].append((msg.which()+"."+duration, getattr(msg_obj, duration)))
+
+      if service == SERVICES[0]:
+        data['timestamp'][frame_id][service].append((msg.which()+" start of frame", msg_obj.timestampSof))
+        if not data['start'][frame_id][service]:
+          data['start'][frame_id][service] = msg_obj.timestampSof
+      elif msg.which() == 'controlsState':
+        data['timestamp'][frame_id][service].append(("sendcan published", latest_sendcan_monotime))
+  return data
+
+
+def normalized(d):
+  return {f: {s: sorted(v) if isinstance(v, list) else v for s, v in services.items() if v} for f, services in d.items()}
+
+
+class TestLatencyLogger(unittest.TestCase):
+  def setUp(self):
+    self.lr = synthetic_log()
+    self.old = old_read_logs(self.lr)
+
+  def test_timestamps(self):
+    data = get_timestamps(self.lr)
+    for k in ('duration', 'start', 'end'):
+      self.assertEqual(normalized(data[k]), normalized(self.old[k]), k)
+
+    # the same events, plus the cloudlogs with a frame id
+    for m in self.lr:
+      if m.which() == 'logMessage' and isinstance((log := json.loads(m.logMessage))['msg'], dict):
+        tstp = log['msg']['timestamp']
+        self.old['timestamp'][tstp['frame_id']][log['ctx']['daemon']].append((tstp['event'], tstp['time']))
+    self.assertEqual(normalized(data['timestamp']), normalized(self.old['timestamp']))
+
+  def test_latency_stats(self):
+    cols, _ = read_and_join(self.lr)
+    stats = latency_stats(cols)
+
+    # per frame latencies from the first message of every stage in the old data
+    def first(f, service, event):
+      return min((t for e, t in self.old['timestamp'][f][service] if e == event), default=None)
+
+    expected = defaultdict(list)
+    for f in self.old['timestamp']:
+      sof = first(f, 'camerad', 'roadCameraState start of frame')
+      model = first(f, 'modeld', 'modelV2 published')
+      plan = first(f, 'plannerd', 'lateralPlan published')
+      sendcan = first(f, 'controlsd', 'sendcan published')
+      for stage, a, b in (('cameraToModel', sof, model), ('modelToPlan', model, plan),
+                          ('planToSendcan', plan, sendcan), ('cameraToSendcan', sof, sendcan)):
+        if a is not None and b is not None:
+          expected[stage].append((b - a) / 1e6)
+
+    for stage, dt in expected.items():
+      self.assertEqual(stats[stage]['count'], len(dt), stage)
+      self.assertAlmostEqual(stats[stage]['p50'], float(np.percentile(dt, 50)), msg=stage)
+      self.assertAlmostEqual(stats[stage]['max'], max(dt), msg=stage)
+      self.assertAlmostEqual(stats[stage]['mean'], float(np.mean(dt)), msg=stage)
+    self.assertEqual(stats['modelV2.modelExecutionTime']['count'], sum(m.which() == 'modelV2' for m in self.lr))
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,287 @@
+#!/usr/bin/env python3
+"""
+Decodes DBC signals of a whole log at once, instead of feeding every can event through a CANParser.
+
+Frames come in as the structured array from can_capnp_to_can_array, are grouped by address once,
+and every signal is pulled out of the payload bytes of all frames of its message with a few numpy
+operations. Bits are walked the same way opendbc's parser does. Checksums and counters are checked
+for the whole message at once too.
+
+  ./can_decoder.py <route or segment> honda_civic_touring_2016_can_generated STEERING_SENSORS.STEER_ANGLE
+"""
+import argparse
+import bz2
+import os
+import re
+from dataclasses import dataclass, field
+from typing import Callable, Dict, Iterable, List, NamedTuple, Optional, Tuple, Union
+
+import numpy as np
+
+from common.basedir import BASEDIR
+from selfdrive.boardd.boardd import can_capnp_to_can_array
+from tools.lib.filereader import FileReader
+
+DBC_PATH = os.path.join(BASEDIR, "opendbc")
+
+BO_RE = re.compile(r"^BO_ (\w+) (\w+) *: (\w+) (\w+)")
+SG_RE = re.compile(r"^ *SG_ (\w+)(?: +\w+)? *: (\d+)\|(\d+)@([01])([+-]) +\(([0-9.+\-eE]+),([0-9.+\-eE]+)\)")
+
+# bit numbering of big endian signals, the start bit is the msb
+BIGENDIAN_BITS = [j + i * 8 for i in range(64) for j in range(7, -1, -1)]
+
+
+@dataclass
+class Signal:
+  name: str
+  size: int
+  lsb: int
+  msb: int
+  is_little_endian: bool
+  is_signed: bool
+  factor: float
+  offset: float
+
+
+@dataclass
+class Message:
+  name: str
+  address: int
+  size: int
+  signals: Dict[str, Signal] = field(default_factory=dict)
+
+
+class DBC:
+  def __init__(self, name: str) -> None:
+    self.name = os.path.splitext(os.path.basename(name))[0]
+    fn = name if os.path.isfile(name) else os.path.join(DBC_PATH, self.name + ".dbc")
+
+    self.msgs: Dict[int, Message] = {}
+    msg = None
+    with open(fn, encoding="utf-8", errors="replace") as f:
+      for line in f:
+        if (m := BO_RE.match(line)) is not None:
+          address = int(m.group(1))
+          if address & 0x80000000:
+            # extended frame flag
+            address &= 0x1FFFFFFF
+          msg = Message(m.group(2), address, int(m.group(3)))
+          self.msgs[address] = msg
+        elif (m := SG_RE.match(line)) is not None and msg is not None:
+          start_bit, size = int(m.group(2)), int(m.group(3))
+          is_little_endian = m.group(4) == "1"
+          if is_little_endian:
+            lsb, msb = start_bit, start_bit + size - 1
+          else:
+            lsb, msb = BIGENDIAN_BITS[BIGENDIAN_BITS.index(start_bit) + size - 1], start_bit
+          msg.signals[m.group(1)] = Signal(m.group(1), size, lsb, msb, is_little_endian, m.group(5) == "-",
+                                           float(m.group(6)), float(m.group(7)))
+        elif not line.startswith(" "):
+          msg = None
+
+    self.name_to_address = {msg.name: address for address, msg in self.msgs.items()}
+    self.checksum = get_checksum(self.name)
+
+  def lookup(self, msg: Union[str, int]) -> Message:
+    return self.msgs[self.name_to_address[msg] if isinstance(msg, str) else msg]
+
+
+def raw_values(dat: np.ndarray, sig: Signal) -> np.ndarray:
+  """Raw unsigned values of a signal for every row of payload bytes"""
+  ret = np.zeros(len(dat), dtype=np.uint64)
+  i, bits = sig.msb // 8, sig.size
+  while 0 <= i < dat.shape[1] and bits > 0:
+    lsb = sig.lsb if sig.lsb // 8 == i else i * 8
+    msb = sig.msb if sig.msb // 8 == i else (i + 1) * 8 - 1
+    size = msb - lsb + 1
+    d = (dat[:, i].astype(np.uint64) >> np.uint64(lsb - i * 8)) & np.uint64((1 << size) - 1)
+    ret |= d << np.uint64(bits - size)
+    bits -= size
+    i = i - 1 if sig.is_little_endian else i + 1
+  return ret
+
+
+def signal_values(dat: np.ndarray, sig: Signal) -> np.ndarray:
+  raw = raw_values(dat, sig)
+  if sig.is_signed:
+    raw = raw.view(np.int64)
+    if sig.size < 64:
+      raw = np.where(raw & (1 << (sig.size - 1)), raw - (1 << sig.size), raw)
+  return raw * sig.factor + sig.offset
+
+
+# checksums over all rows of payload bytes, like opendbc's
+def address_bytes_sum(address: int, nibbles: bool = False) -> int:
+  shift, mask = (4, 0xF) if nibbles else (8, 0xFF)
+  s = 0
+  while address:
+    s += address & mask
+    address >>= shift
+  return s
+
+
+def honda_checksum(address: int, dat: np.ndarray) -> np.ndarray:
+  d = dat.astype(np.int64)
+  s = (d[:, :-1] & 0xF).sum(axis=1) + (d[:, :-1] >> 4).sum(axis=1) + (d[:, -1] >> 4)
+  s = 8 - s - address_bytes_sum(address, nibbles=True)
+  if address > 0x7FF:
+    s += 3
+  return s & 0xF
+
+
+def toyota_checksum(address: int, dat: np.ndarray) -> np.ndarray:
+  return (dat.shape[1] + address_bytes_sum(address) + dat[:, :-1].astype(np.int64).sum(axis=1)) & 0xFF
+
+
+def subaru_checksum(address: int, dat: np.ndarray) -> np.ndarray:
+  return (address_bytes_sum(address) + dat[:, 1:].astype(np.int64).sum(axis=1)) & 0xFF
+
+
+def crc8_table(poly: int) -> np.ndarray:
+  table = np.zeros(256, dtype=np.uint8)
+  for i in range(256):
+    crc = i
+    for _ in range(8):
+      crc = ((crc << 1) ^ poly) & 0xFF if crc & 0x80 else (crc << 1) & 0xFF
+    table[i] = crc
+  return table
+
+
+CRC8_J1850 = crc8_table(0x1D)
+
+
+def chrysler_checksum(address: int, dat: np.ndarray) -> np.ndarray:
+  crc = np.full(len(dat), 0xFF, dtype=np.uint8)
+  for i in range(dat.shape[1] - 1):
+    crc = CRC8_J1850[crc ^ dat[:, i]]
+  return ~crc & 0xFF
+
+
+ChecksumFn = Callable[[int, np.ndarray], np.ndarray]
+
+CHECKSUMS: List[Tuple[Tuple[str, ...], ChecksumFn]] = [
+  (("honda_", "acura_"), honda_checksum),
+  (("toyota_", "lexus_"), toyota_checksum),
+  (("subaru_global_",), subaru_checksum),
+  (("chrysler_",), chrysler_checksum),
+]
+
+
+def get_checksum(dbc_name: str) -> Optional[ChecksumFn]:
+  for prefixes, fn in CHECKSUMS:
+    if dbc_name.startswith(prefixes):
+      return fn
+  return None
+
+
+class DecodedMessage(NamedTuple):
+  name: str
+  address: int
+  t: np.ndarray  # logMonoTime
+  bus: np.ndarray
+  signals: Dict[str, np.ndarray]
+  length_valid: np.ndarray
+  # None when the message has no CHECKSUM/COUNTER signal, or the checksum of this DBC isn't known
+  checksum_valid: Optional[np.ndarray]
+  counter_valid: Optional[np.ndarray]
+
+  @property
+  def valid(self) -> np.ndarray:
+    valid = self.length_valid.copy()
+    for v in (self.checksum_valid, self.counter_valid):
+      if v is not None:
+        valid &= v
+    return valid
+
+
+def counter_valid(counter: np.ndarray, bus: np.ndarray, size: int) -> np.ndarray:
+  """Counters have to go up by one on every frame of a bus, the first one of each bus is valid"""
+  valid = np.ones(len(counter), dtype=bool)
+  for b in np.unique(bus):
+    idx = np.flatnonzero(bus == b)
+    valid[idx[1:]] = (np.diff(counter[idx].astype(np.int64)) % (1 << size)) == 1
+  return valid
+
+
+def decode(dbc: DBC, frames: np.ndarray, signals: Optional[Iterable[Tuple[Union[str, int], str]]] = None,
+           bus: Optional[int] = None) -> Dict[str, DecodedMessage]:
+  """
+  Decodes (message, signal) pairs, or all signals of the DBC, for all frames of a
+  can_capnp_to_can_array array. Frames should be in log order.
+  """
+  if bus is not None:
+    frames = frames[frames['src'] == bus]
+
+  wanted: Dict[int, List[str]] = {}
+  if signals is None:
+    wanted = {address: list(msg.signals) for address, msg in dbc.msgs.items()}
+  else:
+    for msg_name, sig_name in signals:
+      msg = dbc.lookup(msg_name)
+      if sig_name not in msg.signals:
+        raise KeyError(f"{sig_name} not in {msg.name}")
+      wanted.setdefault(msg.address, []).append(sig_name)
+
+  # frames of every address next to each other, still in log order
+  order = np.argsort(frames['address'], kind='stable')
+  addresses, starts, counts = np.unique(frames['address'][order], return_index=True, return_counts=True)
+
+  ret = {}
+  for address, start, count in zip(addresses.tolist(), starts.tolist(), counts.tolist()):
+    if address not in wanted:
+      continue
+    msg = dbc.msgs[address]
+    f = frames[order[start:start + count]]
+    dat = f['dat'][:, :msg.size]
+
+    decoded = {name: signal_values(dat, msg.signals[name]) for name in wanted[address]}
+
+    checksum_ok = None
+    if dbc.checksum is not None and "CHECKSUM" in msg.signals:
+      checksum_ok = raw_values(dat, msg.signals["CHECKSUM"]) == dbc.checksum(address, dat)
+
+    counter_ok = None
+    if "COUNTER" in msg.signals:
+      sig = msg.signals["COUNTER"]
+      counter_ok = counter_valid(raw_values(dat, sig), f['src'], sig.size)
+
+    ret[msg.name] = DecodedMessage(msg.name, address, f['logMonoTime'], f['src'], decoded,
+                                   f['length'] == msg.size, checksum_ok, counter_ok)
+  return ret
+
+
+def can_frames_from_log(fn: str, dat_size: int = 8, **kwargs) -> np.ndarray:
+  """All frames of a log, without parsing anything else in python"""
+  with FileReader(fn) as f:
+    dat = f.read()
+  if fn.endswith(".bz2") or dat.startswith(b'BZh9'):
+    dat = bz2.decompress(dat)
+  return can_capnp_to_can_array(dat, dat_size=dat_size, **kwargs)
+
+
+if __name__ == "__main__":
+  from tools.lib.route import Route, SegmentName
+
+  parser = argparse.ArgumentParser(description="Decode DBC signals of a route or segment",
+                                   formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+  parser.add_argument("route_or_segment_name")
+  parser.add_argument("dbc", help="name of an opendbc DBC or path to one")
+  parser.add_argument("signals", nargs="+", help="MESSAGE.SIGNAL")
+  parser.add_argument("--bus", type=int, default=0)
+  parser.add_argument("--qlog", action="store_true")
+  args = parser.parse_args()
+
+  sn = SegmentName(args.route_or_segment_name, allow_route_name=True)
+  route = Route(sn.route_name.canonical_name)
+  paths = route.qlog_paths() if args.qlog else route.log_paths()
+  if sn.segment_num >= 0:
+    paths = [paths[sn.segment_num]]
+
+  dbc = DBC(args.dbc)
+  wanted = [tuple(s.split(".", 1)) for s in args.signals]
+  frames = np.concatenate([can_frames_from_log(p, src_filter=[args.bus]) for p in paths if p is not None])
+  for name, m in decode(dbc, frames, wanted).items():
+    invalid = int(np.sum(~m.valid))
+    print(f"{name} ({hex(m.address)}): {len(m.t)} frames, {invalid} invalid")
+    for sig_name, values in m.signals.items():
+      print(f"  {sig_name}: min {np.min(values):.3f} max {np.max(values):.3f} mean {np.mean(values):.3f}")
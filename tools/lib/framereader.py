@@ -2,6 +2,7 @@
 import json
 import os
 import pickle
+import queue
 import struct
 import subprocess
 import tempfile
@@ -379,7 +380,8 @@ class VideoStreamDecompressor:
     finally:
       self.proc.stdin.close()
 
-  def read(self):
+  def read(self, out=None):
+    # if given, frames are read into the buffers of out in turn instead of new ones
     threads = os.getenv("FFMPEG_THREADS", "0")
     cuda = os.getenv("FFMPEG_CUDA", "0") == "1"
     cmd = [
@@ -404,11 +406,24 @@ class VideoStreamDecompressor:
     try:
       self.t.start()
 
+      i = 0
       while True:
-        dat = self.proc.stdout.read(self.out_size)
-        if len(dat) == 0:
+        if out is None:
+          dat = self.proc.stdout.read(self.out_size)
+          n = len(dat)
+        else:
+          dat = out[i % len(out)]
+          view = memoryview(dat).cast('B')
+          n = 0
+          while n < self.out_size:
+            r = self.proc.stdout.readinto(view[n:])
+            if not r:
+              break
+            n += r
+          i += 1
+        if n == 0:
           break
-        assert len(dat) == self.out_size
+        assert n == self.out_size
         if self.pix_fmt == "rgb24":
           ret = np.frombuffer(dat, dtype=np.uint8).reshape((self.h, self.w, 3))
         elif self.pix_fmt == "yuv420p":
@@ -427,6 +442,84 @@ class VideoStreamDecompressor:
       self.proc.kill()
       self.t.join()
 
+class StreamingFrameSource:
+  """
+  Decodes the frames of a video in order, ahead of the reader into a bounded ring of buffers.
+  A frame is only valid until the next one is taken. Starts over at the end if loop is set.
+
+    for img in StreamingFrameSource(fr, loop=True):
+      vipc_server.send(stream, img, ...)
+  """
+  def __init__(self, fr, pix_fmt="nv12", ring_size=8, loop=False):
+    assert pix_fmt in ("nv12", "yuv420p")
+    self.fr = fr
+    self.pix_fmt = pix_fmt
+    self.loop = loop
+    self.ring = np.empty((ring_size, fr.w * fr.h * 3 // 2), dtype=np.uint8)
+
+    self.free = threading.Semaphore(ring_size)
+    self.filled: queue.Queue = queue.Queue()
+    self.running = False
+
+  def _frames(self, out):
+    if isinstance(self.fr, GOPReader):
+      # ffmpeg writes straight into the ring
+      yield from VideoStreamDecompressor(self.fr.fn, self.fr.vid_fmt, self.fr.w, self.fr.h, self.pix_fmt).read(out)
+    else:
+      for i in range(self.fr.frame_count):
+        yield self.fr.get(i, pix_fmt=self.pix_fmt)[0]
+
+  def _acquire_free(self):
+    while self.running:
+      if self.free.acquire(timeout=0.1):
+        return True
+    return False
+
+  def _decode_thread(self):
+    slot = 0
+    try:
+      while self.running:
+        # in the order the decoder fills the buffers
+        frames = self._frames([self.ring[(slot + i) % len(self.ring)] for i in range(len(self.ring))])
+        count = 0
+        while self._acquire_free():
+          img = next(frames, None)
+          if img is None:
+            self.free.release()
+            break
+          if img.ctypes.data != self.ring[slot].ctypes.data:
+            self.ring[slot][:] = img.reshape(-1)
+          self.filled.put(slot)
+          slot = (slot + 1) % len(self.ring)
+          count += 1
+        else:
+          return
+        # a video without frames would loop forever
+        if not self.loop or count == 0:
+          break
+      self.filled.put(None)
+    except Exception as e:
+      self.filled.put(e)
+
+  def __iter__(self):
+    self.running = True
+    thread = threading.Thread(target=self._decode_thread, daemon=True)
+    thread.start()
+    try:
+      while True:
+        slot = self.filled.get()
+        if slot is None:
+          return
+        if isinstance(slot, Exception):
+          raise slot
+        yield self.ring[slot]
+        # the reader is done with it once it takes the next one
+        self.free.release()
+    finally:
+      self.running = False
+      thread.join()
+
+
 class StreamGOPReader(GOPReader):
   def __init__(self, fn, frame_type, index_data):
     assert frame_type == FrameType.h265_stream
@@ -0,0 +1,239 @@
+#!/usr/bin/env python3
+"""
+Small per-segment summaries of a log, so route level debug tools don't have to
+download and decode every log again.
+
+A summary has the message counts and invalid counts per service, the carEvents
+histogram, the time range, inter-arrival statistics per service, compressed sizes
+per service, the CAN fingerprint, the first pandaType and the first carParams.
+It's written as a JSON sidecar next to local logs, or in the cache for remote ones.
+
+Precompute the summaries of many routes in parallel:
+  ./segment_summary.py routes.txt --qlog -j 16
+"""
+import argparse
+import base64
+import bz2
+import json
+import multiprocessing
+import os
+import urllib.parse
+from collections import Counter, defaultdict
+from typing import Any, Dict, Iterable, List, Optional
+
+import numpy as np
+
+from cereal import log as capnp_log
+from cereal.services import service_list
+from common.file_helpers import atomic_write_in_dir, mkdirs_exists_ok
+from tools.lib.cache import DEFAULT_CACHE_DIR
+from tools.lib.logreader import LogReader
+from tools.lib.route import Route
+
+SUMMARY_VERSION = 1
+SUMMARY_DIR = os.path.join(DEFAULT_CACHE_DIR, "summary")
+
+Summary = Dict[str, Any]
+
+
+def summary_path(log_path: str) -> str:
+  parsed = urllib.parse.urlparse(log_path)
+  if parsed.scheme == '' and os.access(os.path.dirname(os.path.abspath(log_path)), os.W_OK):
+    return log_path + ".summary.json"
+  # signed urls change, the host and path don't
+  name = os.path.abspath(log_path) if parsed.scheme == '' else f"{parsed.hostname}{parsed.path}"
+  return os.path.join(SUMMARY_DIR, name.replace("/", "_") + ".json")
+
+
+def interval_stats(t: List[int]) -> Optional[Dict[str, float]]:
+  if len(t) < 2:
+    return None
+  dt = np.diff(np.sort(np.array(t, dtype=np.int64))) * 1e-9
+  return {'count': len(dt), 'mean': float(np.mean(dt)), 'min': float(np.min(dt)),
+          'max': float(np.max(dt)), 'p99': float(np.percentile(dt, 99))}
+
+
+def summarize(lr: Iterable) -> Summary:
+  counts: Counter = Counter()
+  invalid: Counter = Counter()
+  events: Counter = Counter()
+  times: Dict[str, List[int]] = defaultdict(list)
+  # compressed on the fly, a compressor only buffers up to a bz2 block per service
+  compressors: Dict[str, bz2.BZ2Compressor] = defaultdict(bz2.BZ2Compressor)
+  decimated_compressors: Dict[str, bz2.BZ2Compressor] = defaultdict(bz2.BZ2Compressor)
+  sizes: Counter = Counter()
+  decimated_sizes: Counter = Counter()
+  can_fingerprint: Dict[int, int] = {}
+  panda_type = None
+  car_params = None
+
+  for msg in lr:
+    which = msg.which()
+    counts[which] += 1
+    times[which].append(msg.logMonoTime)
+
+    dat = msg.as_builder().to_bytes()
+    sizes[which] += len(compressors[which].compress(dat))
+    decimation = service_list[which].decimation if which in service_list else None
+    if decimation is not None and (counts[which] - 1) % decimation == 0:
+      decimated_sizes[which] += len(decimated_compressors[which].compress(dat))
+    if not msg.valid:
+      invalid[which] += 1
+
+    if which == 'carEvents':
+      for e in msg.carEvents:
+        events[str(e.name)] += 1
+    elif which == 'can':
+      for c in msg.can:
+        # also msgs sent by the device on bus 0x80, only 11 bit addresses
+        if c.src % 0x80 == 0 and c.address < 0x800:
+          can_fingerprint[c.address] = len(c.dat)
+    elif which == 'pandaStates' and panda_type is None and len(msg.pandaStates):
+      panda_type = str(msg.pandaStates[0].pandaType)
+    elif which == 'carParams' and car_params is None:
+      car_params = msg
+
+  start = min((min(t) for t in times.values()), default=None)
+  end = max((max(t) for t in times.values()), default=None)
+
+  for which, c in compressors.items():
+    sizes[which] += len(c.flush())
+  for which, c in decimated_compressors.items():
+    decimated_sizes[which] += len(c.flush())
+
+  return {
+    'version': SUMMARY_VERSION,
+    'start_time': start,
+    'end_time': end,
+    'counts': dict(counts),
+    'invalid': dict(invalid),
+    'events': dict(events),
+    'intervals': {which: s for which, t in times.items() if (s := interval_stats(t)) is not None},
+    'sizes': dict(sizes),
+    'decimated_sizes': dict(decimated_sizes),
+    'can_fingerprint': {str(addr): length for addr, length in sorted(can_fingerprint.items())},
+    'pandaType': panda_type,
+    'carFingerprint': None if car_params is None else car_params.carParams.carFingerprint,
+    'carVin': None if car_params is None else car_params.carParams.carVin,
+    'carParams': None if car_params is None else base64.b64encode(car_params.as_builder().to_bytes()).decode(),
+  }
+
+
+def load_summary(log_path: str) -> Optional[Summary]:
+  fn = summary_path(log_path)
+  if not os.path.isfile(fn):
+    return None
+  try:
+    with open(fn) as f:
+      summary = json.load(f)
+  except (OSError, ValueError):
+    return None
+  return summary if summary.get('version') == SUMMARY_VERSION else None
+
+
+def write_summary(log_path: str, summary: Summary) -> None:
+  fn = summary_path(log_path)
+  mkdirs_exists_ok(os.path.dirname(fn))
+  with atomic_write_in_dir(fn) as f:
+    json.dump(summary, f)
+
+
+def get_summary(log_path: str, compute: bool = True) -> Optional[Summary]:
+  """The summary from the sidecar, or computed and saved if there is none yet"""
+  summary = load_summary(log_path)
+  if summary is None and compute:
+    summary = summarize(LogReader(log_path))
+    write_summary(log_path, summary)
+  return summary
+
+
+def route_summaries(route: str, qlog: bool = True, max_segments: Optional[int] = None) -> List[Optional[Summary]]:
+  """Summaries of every segment of a route, None for missing logs"""
+  r = Route(route)
+  paths = r.qlog_paths() if qlog else r.log_paths()
+  return [None if p is None else get_summary(p) for p in paths[:max_segments]]
+
+
+def car_params(summary: Summary):
+  """The first carParams of the segment as a capnp reader"""
+  if summary['carParams'] is None:
+    return None
+  return capnp_log.Event.from_bytes(base64.b64decode(summary['carParams'])).carParams
+
+
+def merge_summaries(summaries: Iterable[Optional[Summary]]) -> Summary:
+  """Route level summary of segments, in order"""
+  ret: Summary = {'version': SUMMARY_VERSION, 'start_time': None, 'end_time': None, 'segments': 0,
+                  'counts': Counter(), 'invalid': Counter(), 'events': Counter(), 'intervals': {},
+                  'sizes': Counter(), 'decimated_sizes': Counter(), 'can_fingerprint': {},
+                  'pandaType': None, 'carFingerprint': None, 'carVin': None, 'carParams': None}
+
+  for s in summaries:
+    if s is None:
+      continue
+    ret['segments'] += 1
+    for k in ('counts', 'invalid', 'events', 'sizes', 'decimated_sizes'):
+      ret[k].update(s[k])
+    ret['can_fingerprint'].update(s['can_fingerprint'])
+
+    if s['start_time'] is not None:
+      ret['start_time'] = s['start_time'] if ret['start_time'] is None else min(ret['start_time'], s['start_time'])
+      ret['end_time'] = s['end_time'] if ret['end_time'] is None else max(ret['end_time'], s['end_time'])
+
+    for which, i in s['intervals'].items():
+      cur = ret['intervals'].get(which)
+      if cur is None:
+        ret['intervals'][which] = dict(i)
+        continue
+      count = cur['count'] + i['count']
+      cur['mean'] = (cur['mean'] * cur['count'] + i['mean'] * i['count']) / count
+      cur['min'] = min(cur['min'], i['min'])
+      cur['max'] = max(cur['max'], i['max'])
+      # not exact, the worst segment
+      cur['p99'] = max(cur['p99'], i['p99'])
+      cur['count'] = count
+
+    for k in ('pandaType', 'carFingerprint', 'carVin', 'carParams'):
+      if ret[k] is None:
+        ret[k] = s[k]
+
+  for k in ('counts', 'invalid', 'events', 'sizes', 'decimated_sizes'):
+    ret[k] = dict(ret[k])
+  return ret
+
+
+def summarize_worker(args) -> Optional[str]:
+  path, force = args
+  try:
+    if force or load_summary(path) is None:
+      write_summary(path, summarize(LogReader(path)))
+    return None
+  except Exception as e:
+    return f"{path}: {e!r}"
+
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser(description="Precompute the per-segment summaries of routes",
+                                   formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+  parser.add_argument("routes", nargs='+', help="route names, or files with one route per line")
+  parser.add_argument("--qlog", action="store_true", help="summarize qlogs instead of rlogs")
+  parser.add_argument("--force", action="store_true", help="recompute existing summaries")
+  parser.add_argument("-j", "--jobs", type=int, default=None, help="worker processes, defaults to the number of cores")
+  args = parser.parse_args()
+
+  routes = []
+  for r in args.routes:
+    if os.path.isfile(r):
+      with open(r) as f:
+        routes += [l.strip() for l in f if l.strip()]
+    else:
+      routes.append(r)
+
+  paths = []
+  for r in routes:
+    route = Route(r)
+    paths += [p for p in (route.qlog_paths() if args.qlog else route.log_paths()) if p is not None]
+
+  with multiprocessing.Pool(args.jobs) as pool:
+    for i, err in enumerate(pool.imap_unordered(summarize_worker, [(p, args.force) for p in paths])):
+      print(f"[{i + 1}/{len(paths)}] {'failed ' + err if err else 'ok'}")
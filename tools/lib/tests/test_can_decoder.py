@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+import os
+import random
+import tempfile
+import unittest
+
+import numpy as np
+
+from selfdrive.boardd.boardd import can_array_dtype
+from tools.lib import can_decoder
+from tools.lib.can_decoder import DBC, decode
+
+TEST_DBC = """
+BO_ 342 STEERING_SENSORS: 6 EPS
+ SG_ STEER_ANGLE : 7|16@0- (-0.1,0) [-500|500] "deg" EON
+ SG_ STEER_ANGLE_RATE : 23|16@0- (-1,0) [-3000|3000] "deg/s" EON
+ SG_ COUNTER : 45|2@0+ (1,0) [0|3] "" EON
+ SG_ CHECKSUM : 43|4@0+ (1,0) [0|3] "" EON
+
+BO_ 2566848766 LITTLE: 8 XXX
+ SG_ LE_SIGNAL : 4|12@1+ (0.5,1) [0|0] "" XXX
+ SG_ LE_SIGNED : 16|8@1- (1,0) [0|0] "" XXX
+"""
+
+
+# straight ports of opendbc's checksums in can/common.cc
+def honda_checksum(address, dat):
+  s = 0
+  extended = address > 0x7FF
+  while address:
+    s += address & 0xF
+    address >>= 4
+  for i, x in enumerate(dat):
+    if i == len(dat) - 1:
+      x >>= 4
+    s += (x & 0xF) + (x >> 4)
+  s = 8 - s
+  if extended:
+    s += 3
+  return s & 0xF
+
+
+def toyota_checksum(address, dat):
+  s = len(dat)
+  while address:
+    s += address & 0xFF
+    address >>= 8
+  for x in dat[:-1]:
+    s += x
+  return s & 0xFF
+
+
+def subaru_checksum(address, dat):
+  s = 0
+  while address:
+    s += address & 0xFF
+    address >>= 8
+  # skip checksum in first byte
+  for x in dat[1:]:
+    s += x
+  return s & 0xFF
+
+
+def chrysler_checksum(address, dat):
+  # bitwise CRC8 J1850, from http://illmatics.com/Remote%20Car%20Hacking.pdf
+  checksum = 0xFF
+  for curr in dat[:-1]:
+    shift = 0x80
+    for _ in range(8):
+      bit_sum = curr & shift
+      temp_chk = checksum & 0x80
+      if bit_sum != 0:
+        bit_sum = 1 if temp_chk != 0 else 0x1C
+        checksum = (checksum << 1) & 0xFF
+        temp_chk = checksum | 1
+        bit_sum ^= temp_chk
+      else:
+        if temp_chk != 0:
+          bit_sum = 0x1D
+        checksum = (checksum << 1) & 0xFF
+        bit_sum ^= checksum
+      checksum = bit_sum
+      shift >>= 1
+  return ~checksum & 0xFF
+
+
+class TestChecksums(unittest.TestCase):
+  def test_vectors(self):
+    vectors = [
+      # address, dat, checksum
+      (can_decoder.honda_checksum, 0x1FA, bytes([0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x05]), 0xE),
+      (can_decoder.toyota_checksum, 0x2E4, bytes([0x80, 0x00, 0x00, 0x00, 0x00]), 0x6B),
+      (can_decoder.subaru_checksum, 0x122, bytes([0x00, 0x01, 0x02, 0x03, 0x04, 0x05, 0x06, 0x07]), 0x3F),
+      # the CRC-8/SAE-J1850 check value of "123456789"
+      (can_decoder.chrysler_checksum, 0x2A6, b"123456789\x00", 0x4B),
+    ]
+    for fn, address, dat, expected in vectors:
+      self.assertEqual(int(fn(address, np.frombuffer(dat, dtype=np.uint8)[None])[0]), expected, fn.__name__)
+
+  def test_opendbc(self):
+    """Every row is checked like opendbc's C++ checks a single message"""
+    rng = random.Random(0)
+    for fn, ref in ((can_decoder.honda_checksum, honda_checksum), (can_decoder.toyota_checksum, toyota_checksum),
+                    (can_decoder.subaru_checksum, subaru_checksum), (can_decoder.chrysler_checksum, chrysler_checksum)):
+      for length in range(1, 9):
+        for address in (rng.randint(0, 0x7FF), rng.randint(0x800, 0x1FFFFFFF)):
+          dat = np.array([[rng.randint(0, 255) for _ in range(length)] for _ in range(100)], dtype=np.uint8)
+          expected = [ref(address, row.tolist()) for row in dat]
+          np.testing.assert_array_equal(fn(address, dat), expected, err_msg=f"{fn.__name__} {hex(address)} {length}")
+
+  def test_get_checksum(self):
+    self.assertIs(can_decoder.get_checksum("toyota_nodsu_pt_generated"), can_decoder.toyota_checksum)
+    self.assertIs(can_decoder.get_checksum("subaru_global_2017_generated"), can_decoder.subaru_checksum)
+    self.assertIs(can_decoder.get_checksum("chrysler_pacifica_2017_hybrid_generated"), can_decoder.chrysler_checksum)
+    self.assertIsNone(can_decoder.get_checksum("ford_lincoln_base_pt"))
+
+
+class TestCanDecoder(unittest.TestCase):
+  def setUp(self):
+    with tempfile.NamedTemporaryFile("w", prefix="honda_test_", suffix=".dbc", delete=False) as f:
+      f.write(TEST_DBC)
+    self.dbc = DBC(f.name)
+    os.unlink(f.name)
+
+  def frames(self, msgs):
+    arr = np.zeros(len(msgs), dtype=can_array_dtype(8))
+    for i, (address, dat, src) in enumerate(msgs):
+      arr[i] = (i * 10, address, 0, src, len(dat), np.frombuffer(dat.ljust(8, b'\x00'), dtype=np.uint8))
+    return arr
+
+  def steering(self, angle, counter, checksum_ok=True):
+    dat = bytearray(round(angle / -0.1).to_bytes(2, 'big', signed=True) + b'\x00\x10\x00' + bytes([counter << 4]))
+    dat[5] |= honda_checksum(342, dat) ^ (0 if checksum_ok else 1)
+    return bytes(dat)
+
+  def test_parse(self):
+    self.assertEqual(self.dbc.lookup("LITTLE").address, 0x18FF00FE)
+    sig = self.dbc.lookup(342).signals["STEER_ANGLE"]
+    self.assertEqual((sig.msb, sig.lsb, sig.is_signed, sig.is_little_endian), (7, 8, True, False))
+
+  def test_decode(self):
+    frames = self.frames([
+      (342, self.steering(10., 0), 0),
+      (0x18FF00FE, bytes([0xF0, 0xFF, 0x80]), 0),
+      (342, self.steering(-25.5, 1), 0),
+      (342, self.steering(3., 2, checksum_ok=False), 0),
+      (342, self.steering(4., 0), 0),
+      (342, self.steering(4., 0)[:5], 1),
+    ])
+
+    decoded = decode(self.dbc, frames, [("STEERING_SENSORS", "STEER_ANGLE"), (0x18FF00FE, "LE_SIGNAL"), ("LITTLE", "LE_SIGNED")])
+    steer = decoded["STEERING_SENSORS"]
+    np.testing.assert_allclose(steer.signals["STEER_ANGLE"], [10., -25.5, 3., 4., 4.])
+    np.testing.assert_array_equal(steer.t, [0, 20, 30, 40, 50])
+    np.testing.assert_array_equal(steer.checksum_valid[:4], [True, True, False, True])
+    # counter skips 3, first frame on bus 1 is valid
+    np.testing.assert_array_equal(steer.counter_valid, [True, True, True, False, True])
+    np.testing.assert_array_equal(steer.length_valid, [True, True, True, True, False])
+    np.testing.assert_array_equal(steer.valid, [True, True, False, False, False])
+
+    little = decoded["LITTLE"]
+    np.testing.assert_allclose(little.signals["LE_SIGNAL"], [0xFFF * 0.5 + 1])
+    np.testing.assert_allclose(little.signals["LE_SIGNED"], [-128])
+    self.assertIsNone(little.checksum_valid)
+
+    self.assertEqual(list(decode(self.dbc, frames, bus=1)), ["STEERING_SENSORS"])
+
+
+if __name__ == "__main__":
+  unittest.main()
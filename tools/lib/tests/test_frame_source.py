@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+import threading
+import time
+import unittest
+
+import numpy as np
+
+from tools.lib.framereader import StreamingFrameSource
+
+
+class FakeFrameReader:
+  """Frames filled with their frame number"""
+  w, h = 8, 4
+
+  def __init__(self, frame_count, fail_at=None):
+    self.frame_count = frame_count
+    self.fail_at = fail_at
+    self.calls = []
+    self.lock = threading.Lock()
+
+  def get(self, num, count=1, pix_fmt="nv12"):
+    with self.lock:
+      self.calls.append(num)
+    if num == self.fail_at:
+      raise ValueError(f"can't decode frame {num}")
+    return [np.full(self.w * self.h * 3 // 2, num, dtype=np.uint8)]
+
+
+def frame_numbers(source, n=None):
+  ret = []
+  for img in source:
+    # every pixel is the frame number, the buffer gets reused
+    assert (img == img[0]).all()
+    ret.append(int(img[0]))
+    if n is not None and len(ret) == n:
+      break
+  return ret
+
+
+class TestStreamingFrameSource(unittest.TestCase):
+  def test_in_order(self):
+    self.assertEqual(frame_numbers(StreamingFrameSource(FakeFrameReader(20), ring_size=4)), list(range(20)))
+    self.assertEqual(frame_numbers(StreamingFrameSource(FakeFrameReader(0))), [])
+
+  def test_loop(self):
+    fr = FakeFrameReader(7)
+    self.assertEqual(frame_numbers(StreamingFrameSource(fr, ring_size=3, loop=True), n=30), [i % 7 for i in range(30)])
+
+    # doesn't spin on a video without frames
+    self.assertEqual(frame_numbers(StreamingFrameSource(FakeFrameReader(0), loop=True)), [])
+
+  def test_reader_exception(self):
+    source = StreamingFrameSource(FakeFrameReader(10, fail_at=3), ring_size=4)
+    frames = []
+    with self.assertRaisesRegex(ValueError, "can't decode frame 3"):
+      for img in source:
+        frames.append(int(img[0]))
+    self.assertEqual(frames, [0, 1, 2])
+
+  def test_bounded(self):
+    ring_size = 3
+    fr = FakeFrameReader(50)
+    for i, img in enumerate(StreamingFrameSource(fr, ring_size=ring_size)):
+      # the frame being read and the ones decoded ahead fill the ring, no more
+      expected = min(i + ring_size - 1, 49)
+      deadline = time.monotonic() + 5
+      while max(fr.calls) < expected and time.monotonic() < deadline:
+        time.sleep(0.001)
+      time.sleep(0.01)
+      self.assertEqual(max(fr.calls), expected)
+      self.assertEqual(int(img[0]), i)
+      if i == 10:
+        break
+    self.assertLessEqual(max(fr.calls), 10 + ring_size - 1)
+
+
+if __name__ == "__main__":
+  unittest.main()
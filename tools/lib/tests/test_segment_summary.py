@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+import bz2
+import os
+import random
+import tempfile
+import unittest
+
+from cereal.services import service_list
+from tools.lib.segment_summary import SUMMARY_DIR, SUMMARY_VERSION, load_summary, merge_summaries, summarize, summary_path, write_summary
+
+
+def segment(start, end, counts, dt_max):
+  return {
+    'version': SUMMARY_VERSION, 'start_time': start, 'end_time': end, 'counts': counts, 'invalid': {'carState': 1},
+    'events': {'pcmEnable': 1}, 'sizes': {'carState': 100}, 'decimated_sizes': {'carState': 10},
+    'intervals': {'carState': {'count': counts['carState'] - 1, 'mean': 0.01, 'min': 0.009, 'max': dt_max, 'p99': dt_max}},
+    'can_fingerprint': {'513': 8}, 'pandaType': 'dos', 'carFingerprint': 'TOYOTA RAV4 2019', 'carVin': '0' * 17, 'carParams': None,
+  }
+
+
+class TestSegmentSummary(unittest.TestCase):
+
+  def test_merge(self):
+    summary = merge_summaries([segment(0, 60e9, {'carState': 6001}, 0.02), None, segment(60e9, 120e9, {'carState': 6001}, 0.05)])
+    self.assertEqual(summary['segments'], 2)
+    self.assertEqual((summary['start_time'], summary['end_time']), (0, 120e9))
+    self.assertEqual(summary['counts']['carState'], 12002)
+    self.assertEqual(summary['invalid']['carState'], 2)
+    self.assertEqual(summary['events']['pcmEnable'], 2)
+    self.assertEqual(summary['intervals']['carState']['count'], 12000)
+    self.assertAlmostEqual(summary['intervals']['carState']['mean'], 0.01)
+    self.assertEqual(summary['intervals']['carState']['max'], 0.05)
+    self.assertEqual(summary['carFingerprint'], 'TOYOTA RAV4 2019')
+
+  def test_sidecar(self):
+    with tempfile.TemporaryDirectory() as d:
+      log_path = os.path.join(d, "rlog.bz2")
+      self.assertEqual(summary_path(log_path), log_path + ".summary.json")
+      self.assertIsNone(load_summary(log_path))
+
+      s = segment(0, 60e9, {'carState': 6001}, 0.02)
+      write_summary(log_path, s)
+      self.assertEqual(load_summary(log_path), s)
+
+      # summaries of an older version are recomputed
+      write_summary(log_path, dict(s, version=SUMMARY_VERSION - 1))
+      self.assertIsNone(load_summary(log_path))
+
+  def test_sizes(self):
+    class Msg:
+      def __init__(self, which, t, dat):
+        self._which, self.logMonoTime, self.valid, self.dat = which, t, True, dat
+
+      def which(self):
+        return self._which
+
+      def as_builder(self):
+        return self
+
+      def to_bytes(self):
+        return self.dat
+
+    rng = random.Random(0)
+    dats = {which: [bytes(rng.getrandbits(8) for _ in range(rng.randint(10, 200))) * 3 for _ in range(500)]
+            for which in ('gpsLocationExternal', 'liveCalibration')}
+    msgs = [Msg(which, i, dat) for which, ds in dats.items() for i, dat in enumerate(ds)]
+    summary = summarize(sorted(msgs, key=lambda m: m.logMonoTime))
+
+    # same as compressing all messages of a service at once
+    for which, ds in dats.items():
+      self.assertEqual(summary['sizes'][which], len(bz2.compress(b"".join(ds))))
+      decimation = service_list[which].decimation
+      if decimation is None:
+        self.assertNotIn(which, summary['decimated_sizes'])
+      else:
+        self.assertEqual(summary['decimated_sizes'][which], len(bz2.compress(b"".join(ds[::decimation]))))
+
+  def test_remote_path(self):
+    a = summary_path("https://commadata2.blob.core.windows.net/commadata2/a2a0ccea32023010/2023-07-27--13-01-19/0/qlog.bz2?sig=1")
+    b = summary_path("https://commadata2.blob.core.windows.net/commadata2/a2a0ccea32023010/2023-07-27--13-01-19/0/qlog.bz2?sig=2")
+    self.assertEqual(a, b)
+    self.assertTrue(a.startswith(SUMMARY_DIR))
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,271 @@
+#!/usr/bin/env python3
+"""
+Runs the paramsd and torqued learners over many routes in parallel and aggregates
+the learned parameters per car fingerprint.
+
+Every route is processed in its own worker with a fresh ParamsLearner and
+TorqueEstimator, fed only the services those daemons subscribe to. The per-route
+results are merged into running statistics per fingerprint and saved after every
+route, so adding routes to an existing state file only processes the new ones.
+
+  ./fleet_params.py routes.txt --state fleet_params.json -j 16
+"""
+import argparse
+import json
+import math
+import multiprocessing
+import os
+import traceback
+from typing import Any, Dict, Iterable, List, Optional
+
+import numpy as np
+
+from selfdrive.locationd.paramsd import ParamsLearner, States
+from selfdrive.locationd.torqued import TorqueEstimator
+from tools.lib.logreader import LogReader
+from tools.lib.route import Route
+
+PARAMS_SERVICES = ('liveLocationKalman', 'carState')
+TORQUE_SERVICES = ('liveLocationKalman', 'carState', 'carControl')
+SERVICES = set(PARAMS_SERVICES) | set(TORQUE_SERVICES) | {'carParams'}
+
+# only use paramsd estimates once the learner has converged a bit
+MIN_ACTIVE_TIME = 60.  # s
+# longest time between liveLocationKalmans that counts as active, more is a gap in the logs
+MAX_LLK_DT = 1.  # s
+
+PARAMS_FIELDS = ('steerRatio', 'stiffnessFactor', 'angleOffsetAverageDeg')
+TORQUE_FIELDS = ('latAccelFactor', 'latAccelOffset', 'frictionCoefficient')
+
+
+def llk_dt(t: float, t_prev: Optional[float]) -> float:
+  """Time since the previous liveLocationKalman, rlogs have all of them and qlogs only some"""
+  if t_prev is None:
+    return 0.
+  return min(max(t - t_prev, 0.), MAX_LLK_DT)
+
+
+class RunningStats:
+  """Weighted mean and variance that can be merged without the samples"""
+  def __init__(self, weight: float = 0., mean: float = 0., m2: float = 0.,
+               minimum: float = math.inf, maximum: float = -math.inf, count: int = 0):
+    self.weight = weight
+    self.mean = mean
+    self.m2 = m2
+    self.min = minimum
+    self.max = maximum
+    self.count = count
+
+  def add(self, x: float, weight: float = 1.) -> None:
+    self.merge(RunningStats(weight, x, 0., x, x, 1))
+
+  def merge(self, other: 'RunningStats') -> None:
+    if other.weight <= 0:
+      return
+    weight = self.weight + other.weight
+    delta = other.mean - self.mean
+    self.mean += delta * other.weight / weight
+    self.m2 += other.m2 + delta**2 * self.weight * other.weight / weight
+    self.weight = weight
+    self.min = min(self.min, other.min)
+    self.max = max(self.max, other.max)
+    self.count += other.count
+
+  @property
+  def std(self) -> float:
+    return math.sqrt(self.m2 / self.weight) if self.weight > 0 else math.nan
+
+  def to_dict(self) -> Dict[str, float]:
+    return {'weight': self.weight, 'mean': self.mean, 'm2': self.m2, 'std': self.std,
+            'min': self.min, 'max': self.max, 'count': self.count}
+
+  @classmethod
+  def from_dict(cls, d: Dict[str, float]) -> 'RunningStats':
+    return cls(d['weight'], d['mean'], d['m2'], d['min'], d['max'], int(d['count']))
+
+
+def route_messages(route: str, qlog: bool = False) -> Iterable:
+  """Only the needed services, one segment in memory at a time"""
+  r = Route(route)
+  paths = r.qlog_paths() if qlog else r.log_paths()
+  for path in paths:
+    if path is None:
+      continue
+    try:
+      msgs = [m for m in LogReader(path) if m.which() in SERVICES]
+    except Exception:
+      print(f"failed to read {path}")
+      continue
+    yield from sorted(msgs, key=lambda m: m.logMonoTime)
+
+
+def estimate_route(route: str, qlog: bool = False) -> Optional[Dict[str, Any]]:
+  CP = None
+  learner: Optional[ParamsLearner] = None
+  estimator: Optional[TorqueEstimator] = None
+  active_time = 0.
+  llk_t: Optional[float] = None
+  params_samples: List[List[float]] = []
+  llk_count = 0
+
+  for msg in route_messages(route, qlog):
+    which = msg.which()
+    if which == 'carParams':
+      if CP is None:
+        CP = msg.carParams
+        learner = ParamsLearner(CP, CP.steerRatio, 1.0, 0.0)
+        estimator = TorqueEstimator(CP, decimated=qlog, restore=False)
+      continue
+    if CP is None or learner is None or estimator is None:
+      continue
+
+    t = msg.logMonoTime * 1e-9
+    if which in TORQUE_SERVICES:
+      estimator.handle_log(t, which, getattr(msg, which))
+    if which in PARAMS_SERVICES:
+      learner.handle_log(t, which, getattr(msg, which))
+
+    if which == 'liveLocationKalman':
+      llk_count += 1
+      dt = llk_dt(t, llk_t)
+      llk_t = t
+      x = learner.kf.x
+      if not all(map(math.isfinite, x)):
+        # same as paramsd
+        learner = ParamsLearner(CP, CP.steerRatio, 1.0, 0.0)
+        active_time = 0.
+        continue
+
+      if learner.active:
+        active_time += dt
+        if active_time > MIN_ACTIVE_TIME:
+          params_samples.append([float(x[States.STEER_RATIO]), float(x[States.STIFFNESS]), math.degrees(x[States.ANGLE_OFFSET])])
+
+  if CP is None or estimator is None:
+    return None
+
+  result: Dict[str, Any] = {'route': route, 'carFingerprint': CP.carFingerprint, 'llk_count': llk_count,
+                            'params': None, 'torque': None}
+  if len(params_samples):
+    samples = np.array(params_samples)
+    result['params'] = {f: float(np.median(samples[:, i])) for i, f in enumerate(PARAMS_FIELDS)}
+    result['params']['samples'] = len(samples)
+
+  if estimator.filtered_points.is_valid():
+    fit = estimator.estimate_params()
+    if all(map(math.isfinite, fit)):
+      result['torque'] = {f: float(v) for f, v in zip(TORQUE_FIELDS, fit)}
+      result['torque']['samples'] = len(estimator.filtered_points)
+
+  return result
+
+
+def estimate_route_worker(args) -> Dict[str, Any]:
+  route, qlog = args
+  try:
+    return {'route': route, 'result': estimate_route(route, qlog)}
+  except Exception:
+    return {'route': route, 'error': traceback.format_exc()}
+
+
+class FleetParams:
+  """Per-fingerprint statistics of the per-route estimates, weighted by their number of samples"""
+  def __init__(self):
+    self.routes: Dict[str, Optional[str]] = {}
+    self.stats: Dict[str, Dict[str, RunningStats]] = {}
+
+  def merge(self, result: Dict[str, Any]) -> None:
+    fingerprint = result['carFingerprint']
+    stats = self.stats.setdefault(fingerprint, {})
+    for group in ('params', 'torque'):
+      if result[group] is None:
+        continue
+      weight = result[group]['samples']
+      for field, value in result[group].items():
+        if field != 'samples':
+          stats.setdefault(field, RunningStats()).add(value, weight)
+
+    self.routes[result['route']] = fingerprint
+
+  def to_dict(self) -> Dict[str, Any]:
+    return {
+      'routes': self.routes,
+      'fingerprints': {fp: {field: s.to_dict() for field, s in stats.items()} for fp, stats in self.stats.items()},
+    }
+
+  @classmethod
+  def from_dict(cls, d: Dict[str, Any]) -> 'FleetParams':
+    ret = cls()
+    ret.routes = d['routes']
+    ret.stats = {fp: {field: RunningStats.from_dict(s) for field, s in stats.items()} for fp, stats in d['fingerprints'].items()}
+    return ret
+
+  def save(self, fn: str) -> None:
+    tmp = fn + '.tmp'
+    with open(tmp, 'w') as f:
+      json.dump(self.to_dict(), f, indent=2)
+    os.replace(tmp, fn)
+
+  @classmethod
+  def load(cls, fn: str) -> 'FleetParams':
+    if not os.path.exists(fn):
+      return cls()
+    with open(fn) as f:
+      return cls.from_dict(json.load(f))
+
+
+def run(routes: List[str], fleet: FleetParams, state: Optional[str] = None, qlog: bool = False,
+        processes: Optional[int] = None) -> FleetParams:
+  todo = [r for r in dict.fromkeys(routes) if r not in fleet.routes]
+  print(f"{len(routes) - len(todo)} routes already processed, {len(todo)} to go")
+
+  with multiprocessing.Pool(processes) as pool:
+    for i, r in enumerate(pool.imap_unordered(estimate_route_worker, [(route, qlog) for route in todo])):
+      if 'error' in r:
+        print(f"[{i + 1}/{len(todo)}] {r['route']} failed:\n{r['error']}")
+        continue
+
+      if r['result'] is None:
+        # no carParams, don't try again
+        fleet.routes[r['route']] = None
+      else:
+        fleet.merge(r['result'])
+      print(f"[{i + 1}/{len(todo)}] {r['route']} {fleet.routes[r['route']]}")
+
+      if state is not None:
+        fleet.save(state)
+
+  return fleet
+
+
+def print_fleet(fleet: FleetParams) -> None:
+  for fp, stats in sorted(fleet.stats.items()):
+    routes = sum(f == fp for f in fleet.routes.values())
+    print(f"{fp} ({routes} routes)")
+    for field in PARAMS_FIELDS + TORQUE_FIELDS:
+      if field in stats:
+        s = stats[field]
+        print(f"  {field:24s} {s.mean:8.3f} ± {s.std:.3f}  [{s.min:.3f}, {s.max:.3f}]  {s.count} routes")
+
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser(description="Learn paramsd and torqued parameters on many routes and aggregate them per car",
+                                   formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+  parser.add_argument("routes", nargs='+', help="route names, or files with one route per line")
+  parser.add_argument("--state", help="JSON state file, merged into and updated after every route")
+  parser.add_argument("--qlog", action="store_true", help="use qlogs instead of rlogs")
+  parser.add_argument("-j", "--jobs", type=int, default=None, help="worker processes, defaults to the number of cores")
+  args = parser.parse_args()
+
+  routes = []
+  for r in args.routes:
+    if os.path.isfile(r):
+      with open(r) as f:
+        routes += [l.strip() for l in f if l.strip()]
+    else:
+      routes.append(r)
+
+  fleet = FleetParams.load(args.state) if args.state else FleetParams()
+  run(routes, fleet, args.state, args.qlog, args.jobs)
+  print()
+  print_fleet(fleet)
@@ -0,0 +1,238 @@
+#!/usr/bin/env python3
+"""
+Evaluates the longitudinal and lateral planners with many tuning configurations
+on the same route, in parallel.
+
+The planner inputs are extracted from the logs once. Every configuration then runs
+a fresh LongitudinalPlanner and LateralPlanner (each with its own solver instances)
+over all of them, open loop, in a pool of worker processes.
+
+  ./mpc_sweep.py <route> -p T_FOLLOW=1.25,1.45,1.8 -p J_EGO_COST=3,5 -p STEERING_RATE_COST=400,800
+
+Costs are only comparable between configurations with the same cost weights.
+"""
+import argparse
+import itertools
+import json
+import multiprocessing
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from cereal import car, log
+import selfdrive.controls.lib.lateral_planner as lateral_planner
+import selfdrive.controls.lib.longitudinal_mpc_lib.long_mpc as long_mpc
+from selfdrive.controls.lib.lateral_planner import LateralPlanner
+from selfdrive.controls.lib.longitudinal_planner import LongitudinalPlanner
+from tools.lib.logreader import logreader_from_route_or_segment
+
+PLANNER_SERVICES = ['carControl', 'carState', 'controlsState', 'radarState', 'modelV2']
+
+# tunable module constants, read at runtime by the planners
+TUNABLE = {
+  'T_FOLLOW': long_mpc,
+  'X_EGO_OBSTACLE_COST': long_mpc,
+  'X_EGO_COST': long_mpc,
+  'V_EGO_COST': long_mpc,
+  'A_EGO_COST': long_mpc,
+  'J_EGO_COST': long_mpc,
+  'A_CHANGE_COST': long_mpc,
+  'DANGER_ZONE_COST': long_mpc,
+  'LEAD_DANGER_FACTOR': long_mpc,
+  'PATH_COST': lateral_planner,
+  'LATERAL_MOTION_COST': lateral_planner,
+  'LATERAL_ACCEL_COST': lateral_planner,
+  'LATERAL_JERK_COST': lateral_planner,
+  'STEERING_RATE_COST': lateral_planner,
+}
+
+VIOLATION_TOL = 1e-3
+PERCENTILES = (50, 90, 99)
+
+Inputs = List[Dict[str, bytes]]
+
+
+def extract_inputs(lr: Iterable) -> Tuple[bytes, Inputs]:
+  """Returns the CarParams and one snapshot of the planner inputs per modelV2, like plannerd sees them"""
+  CP = None
+  latest: Dict[str, bytes] = {}
+  inputs: Inputs = []
+  for msg in lr:
+    which = msg.which()
+    if which == 'carParams':
+      CP = msg.carParams.as_builder().to_bytes()
+    elif which in PLANNER_SERVICES:
+      latest[which] = msg.as_builder().to_bytes()
+      if which == 'modelV2' and len(latest) == len(PLANNER_SERVICES):
+        inputs.append(dict(latest))
+
+  if CP is None:
+    raise ValueError("no carParams in log")
+  return CP, inputs
+
+
+@contextmanager
+def tuned(config: Dict[str, float]):
+  old = {}
+  try:
+    for name, value in config.items():
+      old[name] = getattr(TUNABLE[name], name)
+      setattr(TUNABLE[name], name, value)
+    yield
+  finally:
+    for name, value in old.items():
+      setattr(TUNABLE[name], name, value)
+
+
+def long_violation(x_sol: np.ndarray, params: np.ndarray) -> float:
+  # same constraints as the long ocp, with the soft lead constraint as a hard one
+  x, v, a = x_sol[:, 0], x_sol[:, 1], x_sol[:, 2]
+  a_min, a_max, x_obstacle, t_follow, danger_factor = params[:, 0], params[:, 1], params[:, 2], params[:, 4], params[:, 5]
+  safe_dist = long_mpc.get_safe_obstacle_distance(v, t_follow)
+  h = np.concatenate([v, a - a_min, a_max - a, ((x_obstacle - x) - danger_factor * safe_dist) / (v + 10.)])
+  return float(max(0., -np.min(h)))
+
+
+def lat_violation(x_sol: np.ndarray) -> float:
+  # bounds on psi and psi_rate from the lat ocp
+  h = np.concatenate([np.radians(90) - np.abs(x_sol[:, 2]), np.radians(50) - np.abs(x_sol[:, 3])])
+  return float(max(0., -np.min(h)))
+
+
+def distribution(x: List[float]) -> Dict[str, float]:
+  if not len(x):
+    return {}
+  ret = {f'p{p}': float(np.percentile(x, p)) for p in PERCENTILES}
+  ret['max'] = float(np.max(x))
+  ret['mean'] = float(np.mean(x))
+  return ret
+
+
+def summarize(stats: Dict[str, List[float]]) -> Dict[str, Any]:
+  violations = np.array(stats['violation'])
+  return {
+    'cost': float(np.sum(stats['cost'])),
+    'cost_dist': distribution(stats['cost']),
+    'violations': int(np.sum(violations > VIOLATION_TOL)),
+    'max_violation': float(np.max(violations, initial=0.)),
+    'failures': int(np.sum(stats['failure'])),
+    'solve_time': distribution(stats['solve_time']),
+    'update_time': distribution(stats['update_time']),
+  }
+
+
+def evaluate(CP_bytes: bytes, inputs: Inputs, config: Dict[str, float]) -> Dict[str, Any]:
+  CP = car.CarParams.from_bytes(CP_bytes)
+  long_stats: Dict[str, List[float]] = defaultdict(list)
+  lat_stats: Dict[str, List[float]] = defaultdict(list)
+
+  with tuned(config):
+    long_planner = LongitudinalPlanner(CP)
+    lat_planner = LateralPlanner(CP)
+
+    for snapshot in inputs:
+      sm = {s: getattr(log.Event.from_bytes(dat), s) for s, dat in snapshot.items()}
+
+      t = time.monotonic()
+      lat_planner.update(sm)
+      lat_stats['update_time'].append(time.monotonic() - t)
+      lat_mpc = lat_planner.lat_mpc
+      lat_stats['cost'].append(float(lat_mpc.cost))
+      lat_stats['violation'].append(lat_violation(lat_mpc.x_sol))
+      lat_stats['failure'].append(lat_mpc.solution_status != 0 or bool(np.isnan(lat_mpc.x_sol).any()))
+      lat_stats['solve_time'].append(lat_mpc.solve_time)
+
+      t = time.monotonic()
+      long_planner.update(sm)
+      long_stats['update_time'].append(time.monotonic() - t)
+      long_mpc_ = long_planner.mpc
+      long_stats['cost'].append(float(long_mpc_.solver.get_cost()))
+      long_stats['violation'].append(long_violation(long_mpc_.x_sol, long_mpc_.params))
+      long_stats['failure'].append(long_mpc_.solution_status != 0)
+      long_stats['solve_time'].append(long_mpc_.solve_time)
+
+  return {
+    'config': config,
+    'long': summarize(long_stats),
+    'lat': summarize(lat_stats),
+  }
+
+
+# inputs are sent once to every worker, not with every config
+_worker_args: Optional[Tuple[bytes, Inputs]] = None
+
+def init_worker(CP_bytes: bytes, inputs: Inputs) -> None:
+  global _worker_args
+  _worker_args = (CP_bytes, inputs)
+
+
+def evaluate_worker(config: Dict[str, float]) -> Dict[str, Any]:
+  assert _worker_args is not None
+  return evaluate(*_worker_args, config)
+
+
+def sweep(CP_bytes: bytes, inputs: Inputs, configs: List[Dict[str, float]], processes: Optional[int] = None) -> List[Dict[str, Any]]:
+  for config in configs:
+    unknown = set(config) - set(TUNABLE)
+    if unknown:
+      raise ValueError(f"unknown tuning parameters: {', '.join(sorted(unknown))}")
+
+  # every worker builds its own planners and solvers per config
+  with multiprocessing.Pool(processes, initializer=init_worker, initargs=(CP_bytes, inputs)) as pool:
+    return pool.map(evaluate_worker, configs, chunksize=1)
+
+
+def grid(params: List[str]) -> List[Dict[str, float]]:
+  axes = []
+  for p in params:
+    name, values = p.split('=', 1)
+    axes.append([(name, float(v)) for v in values.split(',')])
+  return [dict(c) for c in itertools.product(*axes)]
+
+
+def load_configs(fn: str) -> List[Dict[str, float]]:
+  with open(fn) as f:
+    configs = json.load(f)
+  if not isinstance(configs, list) or not all(isinstance(c, dict) for c in configs):
+    raise ValueError(f"{fn}: expected a list of {{NAME: value}} configs")
+  return [{name: float(value) for name, value in c.items()} for c in configs]
+
+
+def print_results(results: List[Dict[str, Any]]) -> None:
+  results = sorted(results, key=lambda r: (r['long']['violations'] + r['lat']['violations'], r['long']['cost'] + r['lat']['cost']))
+  for r in results:
+    config = ' '.join(f"{k}={v:g}" for k, v in r['config'].items()) or 'default'
+    print(config)
+    for name in ('long', 'lat'):
+      s = r[name]
+      print(f"  {name:4s} cost {s['cost']:12.2f}  violations {s['violations']:5d} (max {s['max_violation']:.3f})  failures {s['failures']:5d}  "
+            f"solve p50 {s['solve_time'].get('p50', 0) * 1e3:.2f} ms  p99 {s['solve_time'].get('p99', 0) * 1e3:.2f} ms")
+
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser(description="Run the planners on a route with many tuning configurations",
+                                   formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+  parser.add_argument("route", help="route or segment name")
+  parser.add_argument("-p", "--param", action="append", default=[], help="NAME=v1,v2,... (grid over all params)")
+  parser.add_argument("--configs", help="JSON file with a list of {NAME: value} configs, instead of a grid")
+  parser.add_argument("-j", "--jobs", type=int, default=None, help="worker processes, defaults to the number of cores")
+  parser.add_argument("--json", help="write the results to this file")
+  args = parser.parse_args()
+
+  configs = load_configs(args.configs) if args.configs else grid(args.param)
+
+  t = time.monotonic()
+  CP_bytes, inputs = extract_inputs(logreader_from_route_or_segment(args.route, sort_by_time=True))
+  print(f"extracted {len(inputs)} planner cycles in {time.monotonic() - t:.1f} s, evaluating {len(configs)} configs")
+
+  t = time.monotonic()
+  results = sweep(CP_bytes, inputs, configs, args.jobs)
+  print(f"done in {time.monotonic() - t:.1f} s\n")
+  print_results(results)
+
+  if args.json:
+    with open(args.json, 'w') as f:
+      json.dump(results, f, indent=2)
@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+import math
+import random
+import unittest
+
+import numpy as np
+
+from tools.tuning.fleet_params import MAX_LLK_DT, FleetParams, RunningStats, llk_dt
+
+
+class TestFleetParams(unittest.TestCase):
+  def test_running_stats_merge(self):
+    rng = random.Random(0)
+    samples = [(rng.gauss(15., 2.), rng.uniform(0.1, 100.)) for _ in range(1000)]
+
+    single = RunningStats()
+    for x, w in samples:
+      single.add(x, w)
+
+    # stats of random chunks merged in order, like routes merged into the fleet state
+    merged = RunningStats()
+    i = 0
+    while i < len(samples):
+      n = rng.randint(0, 50)
+      chunk = RunningStats()
+      for x, w in samples[i:i + n]:
+        chunk.add(x, w)
+      merged.merge(RunningStats.from_dict(chunk.to_dict()))
+      i += n
+
+    x, w = np.array(samples).T
+    mean = np.average(x, weights=w)
+    for s in (single, merged):
+      self.assertAlmostEqual(s.weight, w.sum(), places=6)
+      self.assertAlmostEqual(s.mean, mean, places=9)
+      self.assertAlmostEqual(s.std, math.sqrt(np.average((x - mean)**2, weights=w)), places=9)
+      self.assertEqual((s.min, s.max, s.count), (x.min(), x.max(), len(x)))
+
+  def test_fleet_merge(self):
+    fleet = FleetParams()
+    for i, ratio in enumerate([14., 16.]):
+      fleet.merge({'route': f'route{i}', 'carFingerprint': 'CAR', 'torque': None,
+                   'params': {'steerRatio': ratio, 'stiffnessFactor': 1., 'angleOffsetAverageDeg': 0., 'samples': 100 * (i + 1)}})
+    fleet = FleetParams.from_dict(fleet.to_dict())
+
+    stats = fleet.stats['CAR']['steerRatio']
+    self.assertAlmostEqual(stats.mean, (14. * 100 + 16. * 200) / 300)
+    self.assertEqual(stats.count, 2)
+    self.assertEqual(fleet.routes, {'route0': 'CAR', 'route1': 'CAR'})
+
+  def test_llk_dt(self):
+    # 20 Hz in rlogs, every fifth in qlogs, with a missing segment in the middle
+    rlog = [i * 0.05 for i in range(2000)] + [200. + i * 0.05 for i in range(2000)]
+    qlog = rlog[::5]
+    for times in (rlog, qlog):
+      active_time, t_prev = 0., None
+      for t in times:
+        active_time += llk_dt(t, t_prev)
+        t_prev = t
+      first, second = times[:len(times) // 2], times[len(times) // 2:]
+      self.assertAlmostEqual(active_time, (first[-1] - first[0]) + MAX_LLK_DT + (second[-1] - second[0]))
+
+    self.assertEqual(llk_dt(1., 2.), 0.)
+
+
+if __name__ == "__main__":
+  unittest.main()
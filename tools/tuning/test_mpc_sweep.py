@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+import json
+import os
+import tempfile
+import unittest
+
+import numpy as np
+
+import cereal.messaging as messaging
+import selfdrive.controls.lib.lateral_planner as lateral_planner
+import selfdrive.controls.lib.longitudinal_mpc_lib.long_mpc as long_mpc
+from tools.tuning import mpc_sweep
+
+
+def synthetic_log():
+  msgs = []
+  for i in range(5):
+    # modelV2 comes first, before the other planner inputs are there
+    for s in ['modelV2', 'carState', 'controlsState', 'radarState', 'carControl']:
+      msg = messaging.new_message(s)
+      if s == 'carState':
+        msg.carState.vEgo = float(i)
+      msgs.append(msg)
+    if i == 1:
+      msgs.append(messaging.new_message('carParams'))
+  return [m.as_reader() for m in msgs]
+
+
+def long_solution(v_ego, a_ego):
+  t = long_mpc.T_IDXS
+  v = v_ego + a_ego * t
+  x = np.column_stack([v_ego * t + a_ego * t**2 / 2, v, np.full_like(t, a_ego)])
+  params = np.zeros((len(t), long_mpc.PARAM_DIM))
+  params[:, 0] = -3.5  # a_min
+  params[:, 1] = 2.0  # a_max
+  params[:, 2] = 1e3  # x_obstacle
+  params[:, 4] = long_mpc.T_FOLLOW
+  params[:, 5] = long_mpc.LEAD_DANGER_FACTOR
+  return x, params
+
+
+class TestMpcSweep(unittest.TestCase):
+  def test_grid(self):
+    configs = mpc_sweep.grid(['T_FOLLOW=1.25,1.45', 'J_EGO_COST=3,5,10'])
+    self.assertEqual(len(configs), 6)
+    self.assertEqual(configs[0], {'T_FOLLOW': 1.25, 'J_EGO_COST': 3.})
+    self.assertEqual(configs[-1], {'T_FOLLOW': 1.45, 'J_EGO_COST': 10.})
+
+    # no params is a single run with the defaults
+    self.assertEqual(mpc_sweep.grid([]), [{}])
+
+    with self.assertRaises(ValueError):
+      mpc_sweep.grid(['T_FOLLOW'])
+    with self.assertRaises(ValueError):
+      mpc_sweep.grid(['T_FOLLOW=fast'])
+
+  def test_load_configs(self):
+    with tempfile.TemporaryDirectory() as tmp:
+      fn = os.path.join(tmp, 'configs.json')
+      with open(fn, 'w') as f:
+        json.dump([{'T_FOLLOW': 1, 'STEERING_RATE_COST': 400.5}, {}], f)
+      self.assertEqual(mpc_sweep.load_configs(fn), [{'T_FOLLOW': 1., 'STEERING_RATE_COST': 400.5}, {}])
+
+      for bad in ({'T_FOLLOW': 1.}, [1.], [{'T_FOLLOW': 'fast'}]):
+        with open(fn, 'w') as f:
+          json.dump(bad, f)
+        with self.assertRaises(ValueError):
+          mpc_sweep.load_configs(fn)
+
+  def test_unknown_param(self):
+    with self.assertRaises(ValueError):
+      mpc_sweep.sweep(b'', [], [{'T_FOLLOW': 1.}, {'NOT_A_PARAM': 1.}])
+
+  def test_extract_inputs(self):
+    CP, inputs = mpc_sweep.extract_inputs(synthetic_log())
+    self.assertIsInstance(CP, bytes)
+
+    # the first modelV2 is missing the other inputs
+    self.assertEqual(len(inputs), 4)
+    for i, snapshot in enumerate(inputs):
+      self.assertEqual(set(snapshot), set(mpc_sweep.PLANNER_SERVICES))
+      # carState is from the cycle before the modelV2
+      event = messaging.log_from_bytes(snapshot['carState'])
+      self.assertEqual(event.carState.vEgo, i)
+
+    with self.assertRaises(ValueError):
+      mpc_sweep.extract_inputs([m for m in synthetic_log() if m.which() != 'carParams'])
+
+  def test_tuned(self):
+    defaults = {name: getattr(module, name) for name, module in mpc_sweep.TUNABLE.items()}
+    config = {'T_FOLLOW': 2.5, 'STEERING_RATE_COST': 123.}
+    with mpc_sweep.tuned(config):
+      self.assertEqual(long_mpc.T_FOLLOW, 2.5)
+      self.assertEqual(lateral_planner.STEERING_RATE_COST, 123.)
+      self.assertEqual(long_mpc.J_EGO_COST, defaults['J_EGO_COST'])
+    self.assertEqual({name: getattr(module, name) for name, module in mpc_sweep.TUNABLE.items()}, defaults)
+
+    # restored on errors, also when only some of the params were set
+    with self.assertRaises(KeyError), mpc_sweep.tuned({'T_FOLLOW': 2.5, 'NOT_A_PARAM': 1.}):
+      pass
+    with self.assertRaises(RuntimeError), mpc_sweep.tuned(config):
+      raise RuntimeError
+    self.assertEqual({name: getattr(module, name) for name, module in mpc_sweep.TUNABLE.items()}, defaults)
+
+  def test_long_violation(self):
+    x, params = long_solution(20., 1.)
+    self.assertEqual(mpc_sweep.long_violation(x, params), 0.)
+
+    # over the accel limit
+    x, params = long_solution(20., 2.5)
+    self.assertAlmostEqual(mpc_sweep.long_violation(x, params), 0.5)
+
+    # going backwards
+    x, params = long_solution(1., -0.5)
+    self.assertAlmostEqual(mpc_sweep.long_violation(x, params), -(1. - 0.5 * long_mpc.T_IDXS[-1]))
+
+    # closer to the obstacle than the safe distance, scaled like the soft constraint
+    x, params = long_solution(20., 0.)
+    params[:, 2] = x[:, 0] + 10.
+    safe_dist = long_mpc.get_safe_obstacle_distance(20., long_mpc.T_FOLLOW)
+    expected = (long_mpc.LEAD_DANGER_FACTOR * safe_dist - 10.) / 30.
+    self.assertAlmostEqual(mpc_sweep.long_violation(x, params), expected)
+
+  def test_summarize(self):
+    stats = {
+      'cost': list(np.arange(1., 101.)),
+      'violation': [0., 1e-4, 0.5, 2.],
+      'failure': [False, True, True],
+      'solve_time': [1e-3] * 10,
+      'update_time': [],
+    }
+    summary = mpc_sweep.summarize(stats)
+    self.assertEqual(summary['cost'], 5050.)
+    for k, v in {'p50': 50.5, 'p90': 90.1, 'p99': 99.01, 'max': 100., 'mean': 50.5}.items():
+      self.assertAlmostEqual(summary['cost_dist'][k], v)
+    self.assertEqual(summary['violations'], 2)
+    self.assertEqual(summary['max_violation'], 2.)
+    self.assertEqual(summary['failures'], 2)
+    self.assertAlmostEqual(summary['solve_time']['p99'], 1e-3)
+    self.assertEqual(summary['update_time'], {})
+
+    empty = mpc_sweep.summarize({k: [] for k in stats})
+    self.assertEqual((empty['cost'], empty['violations'], empty['max_violation'], empty['failures']), (0., 0, 0., 0))
+
+
+if __name__ == "__main__":
+  unittest.main()